@@ -0,0 +1,220 @@
+"""
+Assignment Engine for RenoveJá+
+Distribuição ótima de solicitações pendentes entre médicos, em lote
+
+Cada lote é resolvido como um emparelhamento ponderado (fluxo de custo
+mínimo): o número de atribuições é máximo e, entre as soluções com esse
+número, escolhe-se a de menor custo total, considerando:
+
+- especialidade: consultas com especialidade só vão para médicos dela;
+  os demais pedidos preferem clínicos gerais (OFF_SPECIALTY)
+- carga: cada vaga ocupada custa mais que a anterior, proporcional a
+  active_cases / max_concurrent_cases (LOAD)
+- avaliação: médicos com nota menor custam mais (RATING)
+- espera: pedidos mais antigos têm prioridade (WAIT por hora, até MAX_WAIT_HOURS)
+
+Como pedidos da mesma classe (mesma especialidade exigida) são
+intercambiáveis e o custo de cada médico depende só das suas vagas, o grafo
+tem um nó por classe e um por médico: o custo por augmentação é pequeno
+mesmo com milhares de pedidos (ver benchmark_assignment.py).
+
+Os lotes rodam periodicamente em segundo plano (AUTO_ASSIGN_INTERVAL_SECONDS,
+ver scheduler.py e run_auto_assign em server.py).
+"""
+
+import heapq
+import os
+from collections import defaultdict
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+
+AUTO_ASSIGN_INTERVAL_SECONDS = float(os.getenv("AUTO_ASSIGN_INTERVAL_SECONDS", "10"))
+AUTO_ASSIGN_BATCH_SIZE = int(os.getenv("AUTO_ASSIGN_BATCH_SIZE", "500"))
+
+GENERALIST_SPECIALTIES = {"Clínico Geral"}
+
+DEFAULT_WEIGHTS = {
+    "wait": 1.0,            # por hora de espera
+    "max_wait_hours": 48.0,
+    "load": 4.0,            # vaga que completa a capacidade do médico
+    "rating": 2.0,          # por estrela abaixo de 5
+    "off_specialty": 1.0,   # pedido sem especialidade atendido por especialista
+}
+
+_INF = float("inf")
+_EPS = 1e-9
+
+SOURCE, SINK = 0, 1
+
+
+def _hours_waiting(request: Dict[str, Any], now: datetime) -> float:
+    try:
+        created = datetime.fromisoformat(str(request.get("created_at")).replace("Z", "+00:00"))
+    except ValueError:
+        return 0.0
+    if created.tzinfo is not None:
+        created = (created - created.utcoffset()).replace(tzinfo=None)
+    return max(0.0, (now - created).total_seconds() / 3600)
+
+
+def request_class(request: Dict[str, Any]) -> Optional[str]:
+    """Specialty a request requires (None: any doctor can take it)"""
+    if request.get("request_type") == "consultation":
+        return request.get("specialty") or None
+    return None
+
+
+def plan_assignments(
+    requests: List[Dict[str, Any]],
+    doctors: List[Dict[str, Any]],
+    now: datetime = None,
+    weights: Dict[str, float] = None
+) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    """
+    Solve one batch: returns (request, doctor) pairs.
+
+    `doctors` are load index snapshots (user_id, specialty, rating,
+    active_cases, max_concurrent_cases, available). Pure function, no I/O.
+    """
+    w = {**DEFAULT_WEIGHTS, **(weights or {})}
+    now = now or datetime.utcnow()
+
+    doctors = [
+        d for d in doctors
+        if d.get("available", True) and d["active_cases"] < d["max_concurrent_cases"]
+    ]
+    specialties = {d.get("specialty") for d in doctors}
+
+    # Classes de pedidos, mais antigos (maior bônus de espera) primeiro
+    classes: Dict[Optional[str], List[Tuple[float, Dict[str, Any]]]] = defaultdict(list)
+    for r in requests:
+        key = request_class(r)
+        if key is None or key in specialties:
+            bonus = w["wait"] * min(_hours_waiting(r, now), w["max_wait_hours"])
+            classes[key].append((bonus, r))
+    class_keys = list(classes)
+    for key in class_keys:
+        classes[key].sort(key=lambda item: (-item[0], str(item[1].get("created_at"))))
+    bonuses = [[b for b, _ in classes[key]] for key in class_keys]
+
+    # Nós: 0 = origem, 1 = destino, depois classes e médicos
+    n_classes = len(class_keys)
+    class_node = {key: 2 + i for i, key in enumerate(class_keys)}
+    doctor_base = 2 + n_classes
+    n_nodes = doctor_base + len(doctors)
+
+    slots = [d["max_concurrent_cases"] - d["active_cases"] for d in doctors]
+
+    def slot_cost(j: int, k: int) -> float:
+        d = doctors[j]
+        load = w["load"] * (d["active_cases"] + k + 1) / d["max_concurrent_cases"]
+        rating = w["rating"] * max(0.0, 5.0 - float(d.get("rating") or 5.0))
+        return load + rating
+
+    # Arcos explícitos classe → médico (com arco reverso em e ^ 1)
+    arc_to: List[int] = []
+    arc_cost: List[float] = []
+    arc_cap: List[int] = []
+    arc_flow: List[int] = []
+    adjacency: List[List[int]] = [[] for _ in range(n_nodes)]
+
+    def add_arc(u: int, v: int, cost: float, cap: int):
+        for a, b, c, k in ((u, v, cost, cap), (v, u, -cost, 0)):
+            adjacency[a].append(len(arc_to))
+            arc_to.append(b)
+            arc_cost.append(c)
+            arc_cap.append(k)
+            arc_flow.append(0)
+
+    for j, d in enumerate(doctors):
+        generalist = d.get("specialty") in GENERALIST_SPECIALTIES
+        for key in class_keys:
+            if key is None:
+                add_arc(class_node[key], doctor_base + j, 0.0 if generalist else w["off_specialty"], slots[j])
+            elif key == d.get("specialty"):
+                add_arc(class_node[key], doctor_base + j, 0.0, slots[j])
+
+    used_source = [0] * n_classes   # pedidos já enviados por classe
+    used_sink = [0] * len(doctors)  # vagas já ocupadas por médico
+
+    # Potenciais iniciais (grafo inicial é acíclico: origem → classe → médico → destino)
+    potential = [_INF] * n_nodes
+    potential[SOURCE] = 0.0
+    for i in range(n_classes):
+        potential[2 + i] = -bonuses[i][0]
+    for i in range(n_classes):
+        for e in adjacency[2 + i]:
+            if arc_cap[e] > 0:
+                v = arc_to[e]
+                potential[v] = min(potential[v], potential[2 + i] + arc_cost[e])
+    for j in range(len(doctors)):
+        if potential[doctor_base + j] < _INF:
+            potential[SINK] = min(potential[SINK], potential[doctor_base + j] + slot_cost(j, 0))
+    potential = [p if p < _INF else 0.0 for p in potential]
+
+    while True:
+        dist = [_INF] * n_nodes
+        parent: List[Optional[Tuple[str, int]]] = [None] * n_nodes
+        dist[SOURCE] = 0.0
+        heap = [(0.0, SOURCE)]
+        done = [False] * n_nodes
+
+        def relax(u: int, v: int, cost: float, via: Tuple[str, int]):
+            nd = dist[u] + max(0.0, cost + potential[u] - potential[v])
+            if nd < dist[v] - _EPS:
+                dist[v] = nd
+                parent[v] = via
+                heapq.heappush(heap, (nd, v))
+
+        while heap:
+            d_u, u = heapq.heappop(heap)
+            if done[u]:
+                continue
+            done[u] = True
+            if u == SINK:
+                break
+            if u == SOURCE:
+                for i in range(n_classes):
+                    if used_source[i] < len(bonuses[i]):
+                        relax(u, 2 + i, -bonuses[i][used_source[i]], ("source", i))
+                continue
+            for e in adjacency[u]:
+                if arc_cap[e] - arc_flow[e] > 0:
+                    relax(u, arc_to[e], arc_cost[e], ("arc", e))
+            j = u - doctor_base
+            if j >= 0 and used_sink[j] < slots[j]:
+                relax(u, SINK, slot_cost(j, used_sink[j]), ("sink", j))
+
+        if dist[SINK] == _INF:
+            break
+
+        limit = dist[SINK]
+        for v in range(n_nodes):
+            potential[v] += min(dist[v], limit)
+
+        # Aumenta uma unidade de fluxo pelo caminho encontrado
+        v = SINK
+        while v != SOURCE:
+            kind, index = parent[v]
+            if kind == "sink":
+                used_sink[index] += 1
+                v = doctor_base + index
+            elif kind == "source":
+                used_source[index] += 1
+                v = SOURCE
+            else:
+                arc_flow[index] += 1
+                arc_flow[index ^ 1] -= 1
+                v = arc_to[index ^ 1]
+
+    # Os pedidos servidos de cada classe são os mais antigos; a divisão
+    # entre os médicos segue o fluxo nos arcos classe → médico
+    plan: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []
+    for i, key in enumerate(class_keys):
+        served = iter(r for _, r in classes[key][:used_source[i]])
+        for e in adjacency[2 + i]:
+            if e % 2 == 0:
+                for _ in range(arc_flow[e]):
+                    plan.append((next(served), doctors[arc_to[e] - doctor_base]))
+    return plan
+
@@ -0,0 +1,122 @@
+"""
+Backup Catalog for RenoveJá+
+Registro dos backups completos e incrementais (backup_catalog.json)
+
+Cada backup bem-sucedido vira uma entrada:
+
+    {"id", "kind": "full" | "incremental" | "differential", "file",
+     "snapshot", "since", "parent", "base", "complete", "rows", "created_at"}
+
+- full: todas as linhas com created_at <= snapshot.
+- incremental: linhas com updated_at em (since, snapshot], onde since é o
+  snapshot do backup anterior da cadeia (parent).
+- differential: o mesmo, mas desde o último full (parent = base).
+
+Para restaurar um ponto basta seguir `parent` até o full e reaplicar os
+arquivos nessa ordem (chain()). Backups incompletos (alguma tabela falhou)
+ficam registrados, mas nunca servem de base para o próximo.
+"""
+
+import json
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+FULL = "full"
+INCREMENTAL = "incremental"
+DIFFERENTIAL = "differential"
+KINDS = (FULL, INCREMENTAL, DIFFERENTIAL)
+
+
+class BackupCatalog:
+    """JSON catalogue of the backups in a directory"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def entries(self) -> List[Dict[str, Any]]:
+        if not self.path.exists():
+            return []
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f).get("backups", [])
+
+    def _save(self, entries: List[Dict[str, Any]]):
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"backups": entries}, f, indent=2, ensure_ascii=False)
+        tmp.replace(self.path)
+
+    def add(self, entry: Dict[str, Any]):
+        self._save(self.entries() + [entry])
+
+    def remove(self, ids: List[str]):
+        self._save([e for e in self.entries() if e["id"] not in ids])
+
+    def get(self, backup_id: str) -> Optional[Dict[str, Any]]:
+        return next((e for e in self.entries() if e["id"] == backup_id), None)
+
+    def latest(self, kind: str = None) -> Optional[Dict[str, Any]]:
+        """Newest complete backup (of `kind` when given)"""
+        usable = [e for e in self.entries() if e.get("complete") and (kind is None or e["kind"] == kind)]
+        return max(usable, key=lambda e: e["snapshot"], default=None)
+
+    def next_window(self, kind: str) -> Optional[Dict[str, Any]]:
+        """
+        {since, parent, base} for a new backup of `kind`; None when it has
+        to be a full backup (nothing to build on yet).
+        """
+        if kind == FULL:
+            return None
+        base = self.latest(FULL)
+        if base is None:
+            return None
+        if kind == DIFFERENTIAL:
+            parent = base
+        else:
+            parent = self.latest()
+            if parent["snapshot"] < base["snapshot"]:
+                parent = base
+        return {"since": parent["snapshot"], "parent": parent["id"], "base": base["id"]}
+
+    def due_full(self, interval_hours: float, now: datetime = None) -> bool:
+        """True when there is no full backup or the last one is older than interval_hours"""
+        base = self.latest(FULL)
+        if base is None:
+            return True
+        created = datetime.fromisoformat(base["created_at"])
+        return (now or datetime.now()) - created >= timedelta(hours=interval_hours)
+
+    def chain(self, backup_id: str = None) -> List[Dict[str, Any]]:
+        """Backups to replay, full first, to restore `backup_id` (default: the newest)"""
+        target = self.get(backup_id) if backup_id else self.latest()
+        if target is None:
+            raise ValueError(f"Backup not found in catalogue: {backup_id or 'latest'}")
+        by_id = {e["id"]: e for e in self.entries()}
+        chain = [target]
+        while chain[-1]["kind"] != FULL:
+            parent = by_id.get(chain[-1].get("parent"))
+            if parent is None:
+                raise ValueError(f"Broken backup chain: {chain[-1]['id']} has no parent in the catalogue")
+            chain.append(parent)
+        return list(reversed(chain))
+
+    def expired_chains(self, retention_days: int, now: datetime = None) -> List[str]:
+        """
+        Ids of backups that can be deleted: whole chains (a full and everything
+        built on it) whose newest backup is older than retention_days. The chain
+        of the newest full backup is always kept.
+        """
+        cutoff = (now or datetime.now()) - timedelta(days=retention_days)
+        entries = self.entries()
+        newest_full = self.latest(FULL)
+        chains: Dict[str, List[Dict[str, Any]]] = {}
+        for e in entries:
+            chains.setdefault(e["id"] if e["kind"] == FULL else e.get("base"), []).append(e)
+
+        expired = []
+        for base_id, members in chains.items():
+            if newest_full and base_id == newest_full["id"]:
+                continue
+            if max(datetime.fromisoformat(m["created_at"]) for m in members) < cutoff:
+                expired.extend(m["id"] for m in members)
+        return expired
@@ -0,0 +1,167 @@
+"""
+Backup Container Format for RenoveJá+
+Arquivo .rjb: blocos comprimidos de forma independente + índice no final
+
+    ┌──────────────┬──────────────┬─────┬──────────────┬───────────┬─────────────────────┐
+    │ users #0     │ users #1     │ ... │ requests #0  │ índice    │ tamanho do índice + │
+    │ (zstd/gzip)  │ (zstd/gzip)  │     │              │ (JSON)    │ "RJBKIDX1" (16 B)   │
+    └──────────────┴──────────────┴─────┴──────────────┴───────────┴─────────────────────┘
+
+- Cada tabela vira um ou mais blocos de até BACKUP_CHUNK_MB de NDJSON
+  (um registro por linha), cada bloco comprimido sozinho.
+- O índice lista, por tabela, offset/length/linhas/sha256 de cada bloco.
+  Lendo os 16 bytes finais chega-se ao índice; daí a qualquer tabela sem
+  descomprimir as outras (restore ou inspeção de uma tabela só).
+- Codec: zstd quando o pacote `zstandard` está instalado (bem mais rápido
+  que gzip no mesmo nível de compressão), senão gzip. O codec vai no índice.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import struct
+from typing import List, Dict, Any, Iterator, BinaryIO
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+CONTAINER_FORMAT = "renoveja-chunked"
+CONTAINER_VERSION = "4.0.0"
+CONTAINER_EXTENSION = ".rjb"
+INDEX_MAGIC = b"RJBKIDX1"
+TRAILER = struct.Struct(">Q8s")  # tamanho do índice + magic
+
+CODECS = ("zstd", "gzip")
+DEFAULT_CODEC = "zstd" if zstandard is not None else "gzip"
+DEFAULT_LEVELS = {"zstd": 3, "gzip": 6}
+BACKUP_CHUNK_BYTES = int(float(os.getenv("BACKUP_CHUNK_MB", "8")) * 1024 * 1024)
+
+
+def resolve_codec(codec: str = None) -> str:
+    """Requested codec, falling back to gzip when zstandard is not installed"""
+    codec = (codec or DEFAULT_CODEC).lower()
+    if codec not in CODECS:
+        raise ValueError(f"Unknown backup codec: {codec}")
+    if codec == "zstd" and zstandard is None:
+        logger.warning("zstandard not installed, using gzip for backups")
+        return "gzip"
+    return codec
+
+
+def compress(data: bytes, codec: str, level: int = None) -> bytes:
+    level = level or DEFAULT_LEVELS[codec]
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("This backup uses zstd: install the zstandard package to read it")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def encode_record(record: Dict[str, Any]) -> bytes:
+    return (json.dumps(record, ensure_ascii=False, separators=(",", ":"), default=str) + "\n").encode("utf-8")
+
+
+def decode_records(data: bytes) -> Iterator[Dict[str, Any]]:
+    for line in data.split(b"\n"):
+        if line.strip():
+            yield json.loads(line)
+
+
+class ChunkWriter:
+    """Writes one table as independently compressed NDJSON chunks; offsets are relative to `out`"""
+
+    def __init__(self, out: BinaryIO, codec: str, level: int = None, chunk_bytes: int = BACKUP_CHUNK_BYTES):
+        self.out = out
+        self.codec = codec
+        self.level = level
+        self.chunk_bytes = chunk_bytes
+        self.chunks: List[Dict[str, Any]] = []
+        self.rows = 0
+        self._offset = 0
+        self._buffer: List[bytes] = []
+        self._buffered = 0
+        self._buffered_rows = 0
+
+    def write(self, records: List[Dict[str, Any]]):
+        for record in records:
+            line = encode_record(record)
+            self._buffer.append(line)
+            self._buffered += len(line)
+            self._buffered_rows += 1
+            if self._buffered >= self.chunk_bytes:
+                self._flush()
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        data = compress(b"".join(self._buffer), self.codec, self.level)
+        self.out.write(data)
+        self.chunks.append({
+            "offset": self._offset,
+            "length": len(data),
+            "rows": self._buffered_rows,
+            "sha256": hashlib.sha256(data).hexdigest()
+        })
+        self._offset += len(data)
+        self.rows += self._buffered_rows
+        self._buffer, self._buffered, self._buffered_rows = [], 0, 0
+
+    def close(self):
+        self._flush()
+
+
+def index_bytes(index: Dict[str, Any]) -> bytes:
+    """Serialized index followed by the fixed-size trailer that locates it"""
+    data = json.dumps(index, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return data + TRAILER.pack(len(data), INDEX_MAGIC)
+
+
+def is_container(path) -> bool:
+    return str(path).endswith(CONTAINER_EXTENSION)
+
+
+def read_index(path) -> Dict[str, Any]:
+    """Read the index from the end of a .rjb file"""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size < TRAILER.size:
+            raise ValueError(f"Not a backup container: {path}")
+        f.seek(size - TRAILER.size)
+        length, magic = TRAILER.unpack(f.read(TRAILER.size))
+        if magic != INDEX_MAGIC or length > size - TRAILER.size:
+            raise ValueError(f"Backup container index not found: {path}")
+        f.seek(size - TRAILER.size - length)
+        return json.loads(f.read(length))
+
+
+def read_chunks(path, entry: Dict[str, Any], codec: str, verify: bool = False) -> Iterator[Dict[str, Any]]:
+    """Records of one table entry, one chunk in memory at a time"""
+    with open(path, "rb") as f:
+        for chunk in entry["chunks"]:
+            f.seek(chunk["offset"])
+            data = f.read(chunk["length"])
+            if verify and hashlib.sha256(data).hexdigest() != chunk["sha256"]:
+                raise ValueError(f"Checksum mismatch in table {entry['name']} at offset {chunk['offset']}")
+            yield from decode_records(decompress(data, codec))
+
+
+def read_table(path, table: str) -> Iterator[Dict[str, Any]]:
+    """Seek straight to one table of a .rjb file and stream its records"""
+    index = read_index(path)
+    entry = next((e for e in index["tables"] if e["name"] == table), None)
+    if entry is None:
+        raise KeyError(f"Table {table} is not in {path}")
+    return read_chunks(path, entry, index["codec"], verify=True)
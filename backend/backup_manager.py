@@ -2,21 +2,82 @@
 """
 Backup Manager for RenoveJá+
 Automated database backup with Supabase integration
+
+Formato do backup (renoveja_backup_<timestamp>.rjb, ver backup_format.py):
+
+- Cada tabela vira blocos NDJSON comprimidos de forma independente (zstd
+  quando disponível, senão gzip; BACKUP_CODEC), na ordem de BACKUP_TABLES.
+- No fim do arquivo fica o índice (offset/length/linhas/sha256 de cada
+  bloco): restaurar ou inspecionar uma tabela vai direto aos blocos dela.
+- Ao lado fica renoveja_backup_<timestamp>.manifest.json com o mesmo índice,
+  o sha256 do arquivo e os dados do snapshot.
+
+    python backup_manager.py inspect <arquivo.rjb> [tabela]
+
+Backups .ndjson.gz (um membro gzip por tabela, versão 3) continuam legíveis.
+
+As tabelas são exportadas em paralelo (BACKUP_CONCURRENCY) por um único
+httpx.Client com pool de conexões; cada página é comprimida assim que chega,
+então a memória usada não depende do tamanho do banco. As páginas seguem
+(created_at, id) via keyset.py, até o mesmo marcador de snapshot em todas
+as tabelas.
+
+Backups incrementais (backup_catalog.py):
+
+    python backup_manager.py full           # tudo até o snapshot
+    python backup_manager.py incremental    # alterado desde o backup anterior
+    python backup_manager.py differential   # alterado desde o último full
+    python backup_manager.py                # full a cada BACKUP_FULL_INTERVAL_HOURS,
+                                            # BACKUP_DEFAULT_KIND nos demais
+
+Incrementais leem (updated_at, id) na janela (since - BACKUP_OVERLAP_SECONDS,
+snapshot]; o updated_at é mantido por trigger (supabase/backup-change-tracking.sql).
+Exclusões só aparecem no próximo full. restore_chain() reaplica o full e os
+incrementais em ordem; como o restore é upsert, a sobreposição não duplica nada.
+
+Restore: cada tabela é lida direto dos seus blocos (offsets do índice), na
+ordem de dependência de BACKUP_TABLES, e enviada em lotes de
+RESTORE_BATCH_SIZE com até BACKUP_CONCURRENCY POSTs simultâneos (upsert).
+O progresso vai para renoveja_backup_<ts>.restore.json; se o restore parar
+no meio, rodar de novo continua do último lote confirmado.
+
+S3 (ou compatível, via BACKUP_S3_ENDPOINT_URL): o envio é multipart e
+paralelo (s3_multipart.py). Com BACKUP_KEEP_LOCAL=false o backup é escrito
+direto no bucket enquanto é montado, sem cópia local do arquivo inteiro;
+só o manifesto e o catálogo ficam no disco.
+
+A tabela da vez no arquivo escreve os blocos direto na saída; as que são
+exportadas em paralelo à frente dela guardam os blocos em arquivos .part
+locais, no máximo BACKUP_SPOOL_MB no total (acima disso a exportação delas
+espera a vez). O disco usado fica limitado, com ou sem cópia local.
 """
 
 import os
 import json
+import hashlib
 import logging
+import threading
+import time
+import sys
+import zlib
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from itertools import groupby, islice
 from datetime import datetime, timedelta
 from pathlib import Path
 import subprocess
 import boto3
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Iterator, Tuple, Any
 from dotenv import load_dotenv
 import httpx
 import gzip
 import shutil
 
+import keyset
+import backup_format
+from backup_format import ChunkWriter, encode_record, is_container, read_index, read_chunks, read_table
+from s3_multipart import S3MultipartWriter, S3_PART_SIZE, S3_UPLOAD_CONCURRENCY
+from backup_catalog import BackupCatalog, FULL, INCREMENTAL, KINDS
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / ".env", encoding="utf-8")
 
@@ -27,132 +88,579 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+BACKUP_TABLES = [
+    "users", "doctor_profiles", "nurse_profiles",
+    "requests", "payments", "messages", "notifications",
+    "ratings", "prescriptions", "exams", "consultations"
+]
+BACKUP_CODEC = os.getenv("BACKUP_CODEC", backup_format.DEFAULT_CODEC)
+BACKUP_CONCURRENCY = int(os.getenv("BACKUP_CONCURRENCY", "4"))
+BACKUP_PAGE_SIZE = int(os.getenv("BACKUP_PAGE_SIZE", "1000"))
+# Máximo em arquivos .part das tabelas que ainda esperam a vez na saída
+BACKUP_SPOOL_MB = int(os.getenv("BACKUP_SPOOL_MB", "256"))
+BACKUP_COMPRESS_LEVEL = int(os.getenv("BACKUP_COMPRESS_LEVEL", "0")) or None  # 0: padrão do codec
+# Full a cada N horas; entre eles, BACKUP_DEFAULT_KIND
+BACKUP_FULL_INTERVAL_HOURS = float(os.getenv("BACKUP_FULL_INTERVAL_HOURS", "24"))
+BACKUP_DEFAULT_KIND = os.getenv("BACKUP_DEFAULT_KIND", INCREMENTAL)
+# Janela incremental começa um pouco antes do snapshot anterior (relógios)
+BACKUP_OVERLAP_SECONDS = int(os.getenv("BACKUP_OVERLAP_SECONDS", "60"))
+# Infrequent Access for cost savings
+BACKUP_S3_OBJECT_ARGS = {'ServerSideEncryption': 'AES256', 'StorageClass': 'STANDARD_IA'}
+RESTORE_BATCH_SIZE = int(os.getenv("RESTORE_BATCH_SIZE", "500"))
+RESTORE_RETRIES = int(os.getenv("RESTORE_RETRIES", "3"))
+RESTORE_BACKOFF_SECONDS = float(os.getenv("RESTORE_BACKOFF_SECONDS", "1"))
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def checkpoint_path(backup_path) -> Path:
+    """renoveja_backup_<ts>.rjb -> renoveja_backup_<ts>.restore.json"""
+    backup_path = Path(backup_path)
+    return backup_path.with_name(backup_path.name.split(".")[0] + ".restore.json")
+
+
+def manifest_path(backup_path) -> Path:
+    """renoveja_backup_<ts>.rjb -> renoveja_backup_<ts>.manifest.json"""
+    backup_path = Path(backup_path)
+    return backup_path.with_name(backup_path.name.split(".")[0] + ".manifest.json")
+
+
+def shift_marker(marker: str, seconds: float) -> str:
+    """Move a snapshot marker (keyset.snapshot_marker format) by `seconds`"""
+    return keyset.snapshot_marker(datetime.strptime(marker, "%Y-%m-%dT%H:%M:%S.%fZ") + timedelta(seconds=seconds))
+
+
+def read_backup(backup_path) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Stream (table, record) pairs from a backup (.rjb chunk by chunk, .ndjson.gz line by line)"""
+    if is_container(backup_path):
+        index = read_index(backup_path)
+        for entry in index["tables"]:
+            for record in read_chunks(backup_path, entry, index["codec"]):
+                yield entry["name"], record
+        return
+    
+    table = None
+    with gzip.open(backup_path, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "__table__" in record:
+                # Cabeçalho do membro: começa a próxima tabela
+                table = record["__table__"]
+                continue
+            yield table, record
+
+
+def read_entry(backup_path, entry: Dict[str, Any], codec: str = "gzip", verify: bool = False) -> Iterator[Dict[str, Any]]:
+    """
+    Records of one table entry from the index/manifest: its chunks, or a version 3 gzip member.
+    With `verify`, each chunk is checked as it is read (a member is hashed up front).
+    """
+    if "chunks" in entry:
+        return read_chunks(backup_path, entry, codec, verify=verify)
+    if verify:
+        digest = hashlib.sha256()
+        with open(backup_path, "rb") as f:
+            f.seek(entry["offset"])
+            remaining = entry["length"]
+            while remaining > 0:
+                chunk = f.read(min(COPY_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                digest.update(chunk)
+        if remaining or digest.hexdigest() != entry["sha256"]:
+            raise ValueError(f"Checksum mismatch for table {entry['name']} in {backup_path}")
+    return read_member(backup_path, entry)
+
+
+def read_member(backup_path, entry: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Stream the records of one table member, seeking straight to its manifest offset"""
+    decompressor = zlib.decompressobj(wbits=31)
+    pending = b""
+    with open(backup_path, "rb") as f:
+        f.seek(entry["offset"])
+        remaining = entry["length"]
+        while remaining > 0:
+            chunk = f.read(min(COPY_CHUNK_SIZE, remaining))
+            if not chunk:
+                raise ValueError(f"Backup truncated inside table {entry['name']}")
+            remaining -= len(chunk)
+            pending += decompressor.decompress(chunk)
+            *lines, pending = pending.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    record = json.loads(line)
+                    if "__table__" not in record:
+                        yield record
+        pending += decompressor.flush()
+        if pending.strip():
+            yield json.loads(pending)
+
+
+def batched(records: Iterator[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    records = iter(records)
+    while True:
+        batch = list(islice(records, size))
+        if not batch:
+            return
+        yield batch
+
+
+class SpoolBudget:
+    """Bytes held in .part files across all tables of one backup"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self.aborted = False
+        self._cond = threading.Condition()
+
+    def reserve(self, size: int, attached) -> bool:
+        """
+        Wait until `size` more bytes fit (one chunk always fits when nothing
+        is spooled). False, without reserving, once `attached()` turns true.
+        Raises once the backup has been aborted.
+        """
+        with self._cond:
+            while not self.aborted and not attached() and self.used > 0 and self.used + size > self.limit:
+                self._cond.wait()
+            self.check()
+            if attached():
+                return False
+            self.used += size
+            return True
+
+    def release(self, size: int):
+        with self._cond:
+            self.used -= size
+            self._cond.notify_all()
+
+    def abort(self):
+        """The output failed: wake every waiting exporter so it gives up"""
+        with self._cond:
+            self.aborted = True
+            self._cond.notify_all()
+
+    def check(self):
+        if self.aborted:
+            raise RuntimeError("Backup aborted")
+
+
+class TableSpool:
+    """
+    File-like sink for one table's chunks: spooled to a .part file until the
+    assembler attaches it to the output, written straight through after that
+    """
+
+    def __init__(self, path: Path, budget: SpoolBudget):
+        self.path = path
+        self.budget = budget
+        self.spooled = 0
+        self._emit = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def write(self, data: bytes) -> int:
+        reserved = self.budget.reserve(len(data), lambda: self._emit is not None)
+        with self._lock:
+            if self._emit is None:
+                if self._file is None:
+                    self._file = open(self.path, "wb")
+                self._file.write(data)
+                self.spooled += len(data)
+                return len(data)
+        if reserved:
+            self.budget.release(len(data))
+        self.budget.check()
+        self._emit(data)
+        return len(data)
+
+    def attach(self, emit):
+        """Copy what was spooled to `emit`, then send every later write straight to it"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                with open(self.path, "rb") as part:
+                    while True:
+                        chunk = part.read(COPY_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        emit(chunk)
+            self._emit = emit
+            self.close()
+        # Frees the budget and wakes this table's exporter if it was waiting for room
+        self.budget.release(self.spooled)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        self.path.unlink(missing_ok=True)
+
+
+class RestoreCheckpoint:
+    """
+    Progress of a restore, saved after every confirmed batch:
+    {"sha256", "tables": {table: {"done": bool, "batches": n}}} where the
+    first `n` batches of the table are known to be in the database.
+    """
+    
+    def __init__(self, backup_path, sha256: str = None):
+        self.path = checkpoint_path(backup_path)
+        self.sha256 = sha256
+        self._lock = threading.Lock()
+        self._completed: Dict[str, set] = {}
+        self.state = {"sha256": sha256, "tables": {}}
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            # Um checkpoint de outro arquivo com o mesmo nome não vale
+            if saved.get("sha256") == sha256:
+                self.state = saved
+    
+    def _table(self, table: str) -> Dict[str, Any]:
+        return self.state["tables"].setdefault(table, {"done": False, "batches": 0})
+    
+    def done(self, table: str) -> bool:
+        return self._table(table)["done"]
+    
+    def resume_from(self, table: str) -> int:
+        """Index of the first batch that still has to be sent"""
+        return self._table(table)["batches"]
+    
+    def batch_done(self, table: str, index: int):
+        with self._lock:
+            progress = self._table(table)
+            completed = self._completed.setdefault(table, set())
+            completed.add(index)
+            # Só avança sobre lotes contíguos: com envios paralelos, o lote 7 pode terminar antes do 5
+            while progress["batches"] in completed:
+                completed.discard(progress["batches"])
+                progress["batches"] += 1
+            self._save()
+    
+    def table_done(self, table: str):
+        with self._lock:
+            self._table(table)["done"] = True
+            self._save()
+    
+    def _save(self):
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f)
+        tmp.replace(self.path)
+    
+    def clear(self):
+        if self.path.exists():
+            self.path.unlink()
+
+
 class BackupManager:
     """Manages automated database backups"""
     
-    def __init__(self):
+    def __init__(self, transport: Optional[httpx.BaseTransport] = None):
         self.supabase_url = os.getenv("SUPABASE_URL")
         self.supabase_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
         self.backup_dir = Path(os.getenv("BACKUP_DIR", "./backups"))
         self.backup_dir.mkdir(exist_ok=True)
+        self.catalog = BackupCatalog(self.backup_dir / "backup_catalog.json")
         
         # S3 configuration (optional)
         self.s3_bucket = os.getenv("BACKUP_S3_BUCKET")
         self.aws_access_key = os.getenv("AWS_ACCESS_KEY_ID")
         self.aws_secret_key = os.getenv("AWS_SECRET_ACCESS_KEY")
         self.aws_region = os.getenv("AWS_DEFAULT_REGION", "us-east-1")
+        self.s3_endpoint_url = os.getenv("BACKUP_S3_ENDPOINT_URL") or None  # MinIO, R2...
+        self.s3_part_size = S3_PART_SIZE
+        self.s3_concurrency = S3_UPLOAD_CONCURRENCY
+        # false: stream backups straight to S3 without a local copy
+        self.keep_local = os.getenv("BACKUP_KEEP_LOCAL", "true").lower() != "false"
         
         # Backup retention
         self.local_retention_days = int(os.getenv("BACKUP_LOCAL_RETENTION_DAYS", "7"))
         self.remote_retention_days = int(os.getenv("BACKUP_REMOTE_RETENTION_DAYS", "30"))
         
-    def backup_database(self) -> Optional[str]:
+        # Export
+        self.tables = list(BACKUP_TABLES)
+        self.concurrency = BACKUP_CONCURRENCY
+        self.page_size = BACKUP_PAGE_SIZE
+        self.restore_batch_size = RESTORE_BATCH_SIZE
+        self.codec = backup_format.resolve_codec(BACKUP_CODEC)
+        self.chunk_bytes = backup_format.BACKUP_CHUNK_BYTES
+        self.spool_bytes = BACKUP_SPOOL_MB * 1024 * 1024
+        self.keys = keyset.DEFAULT_KEYS
+        self.transport = transport
+        self._client: Optional[httpx.Client] = None
+    
+    def _get_client(self) -> httpx.Client:
+        """One pooled client shared by every export/restore thread"""
+        if self._client is None:
+            self._client = httpx.Client(
+                headers={
+                    "apikey": self.supabase_key or "",
+                    "Authorization": f"Bearer {self.supabase_key}",
+                    "Accept": "application/json",
+                    "Content-Type": "application/json"
+                },
+                limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+                timeout=httpx.Timeout(60.0, connect=10.0),
+                transport=self.transport
+            )
+        return self._client
+    
+    @property
+    def s3_configured(self) -> bool:
+        return all([self.s3_bucket, self.aws_access_key, self.aws_secret_key])
+    
+    def _s3_client(self):
+        return boto3.client(
+            's3',
+            aws_access_key_id=self.aws_access_key,
+            aws_secret_access_key=self.aws_secret_key,
+            region_name=self.aws_region,
+            endpoint_url=self.s3_endpoint_url
+        )
+    
+    @staticmethod
+    def _s3_key(file_name: str) -> str:
+        return f"renoveja-backups/{file_name}"
+    
+    def _s3_writer(self, s3_client, file_name: str) -> S3MultipartWriter:
+        return S3MultipartWriter(
+            s3_client, self.s3_bucket, self._s3_key(file_name),
+            part_size=self.s3_part_size, concurrency=self.s3_concurrency,
+            extra_args=BACKUP_S3_OBJECT_ARGS
+        )
+    
+    def _upload_manifest(self, s3_client, backup_path: Path):
+        with open(manifest_path(backup_path), 'rb') as f:
+            s3_client.put_object(
+                Bucket=self.s3_bucket, Key=self._s3_key(manifest_path(backup_path).name),
+                Body=f.read(), **BACKUP_S3_OBJECT_ARGS
+            )
+    
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+    
+    def backup_database(self, kind: str = FULL) -> Optional[str]:
         """
         Create a database backup
         
+        Args:
+            kind: "full", "incremental" or "differential" (falls back to
+                  full when the catalogue has no full backup to build on)
+        
         Returns:
             Path to the backup file or None if failed
         """
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_name = f"renoveja_backup_{timestamp}.json"
+        if kind not in KINDS:
+            raise ValueError(f"Unknown backup kind: {kind}")
+        window = self.catalog.next_window(kind)
+        if window is None and kind != FULL:
+            logger.info(f"No complete full backup in the catalogue, running a full backup instead of {kind}")
+            kind = FULL
+        
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        suffix = "" if kind == FULL else f"_{kind}"
+        backup_name = f"renoveja_backup_{timestamp}{suffix}{backup_format.CONTAINER_EXTENSION}"
         backup_path = self.backup_dir / backup_name
+        budget = SpoolBudget(self.spool_bytes)
+        parts = {table: TableSpool(self.backup_dir / f".{backup_name}.{table}.part", budget) for table in self.tables}
+        stream_to_s3 = not self.keep_local and self.s3_configured
         
         try:
             logger.info(f"Starting database backup: {backup_name}")
             
-            # Export all tables
-            tables = [
-                "users", "doctor_profiles", "nurse_profiles",
-                "requests", "payments", "messages", "notifications",
-                "ratings", "prescriptions", "exams", "consultations"
-            ]
+            # Every table is read up to the same instant, so the tables agree with each other
+            snapshot = keyset.snapshot_marker()
+            since = shift_marker(window["since"], -BACKUP_OVERLAP_SECONDS) if window else None
             
-            backup_data = {
+            meta = {
                 "timestamp": datetime.now().isoformat(),
-                "version": "2.0.0",
-                "tables": {}
+                "kind": kind,
+                "snapshot": snapshot,
+                "since": since,
+                "parent": window["parent"] if window else None,
+                "base": window["base"] if window else None
             }
             
-            # Backup each table
-            for table in tables:
-                logger.info(f"Backing up table: {table}")
-                data = self._export_table(table)
-                if data is not None:
-                    backup_data["tables"][table] = data
-                    logger.info(f"Backed up {len(data)} records from {table}")
+            # Export tables concurrently, each into its own compressed chunks, and
+            # append each table to the output (local file or S3) as soon as its turn comes
+            s3_client = self._s3_client() if stream_to_s3 else None
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                futures = {table: pool.submit(self._export_table, table, parts[table], snapshot, since) for table in self.tables}
+                try:
+                    with (self._s3_writer(s3_client, backup_name) if stream_to_s3 else open(backup_path, "wb")) as out:
+                        manifest = self._assemble(out, backup_name, parts, futures, meta)
+                except BaseException:
+                    # Exporters still waiting for spool room would never be attached: stop them
+                    # before the pool waits for its threads
+                    budget.abort()
+                    for future in futures.values():
+                        future.cancel()
+                    raise
             
-            # Write backup file
-            with open(backup_path, 'w', encoding='utf-8') as f:
-                json.dump(backup_data, f, indent=2, ensure_ascii=False)
+            self._write_manifest(backup_path, manifest)
+            if stream_to_s3:
+                self._upload_manifest(s3_client, backup_path)
             
-            # Compress backup
-            compressed_path = self._compress_backup(backup_path)
+            self.catalog.add({
+                "id": backup_path.name.split(".")[0],
+                "kind": kind,
+                "file": backup_path.name,
+                "snapshot": snapshot,
+                "since": since,
+                "parent": manifest["parent"],
+                "base": manifest["base"],
+                "complete": not manifest["failed"],
+                "rows": sum(t["rows"] for t in manifest["tables"]),
+                "remote": self._s3_key(backup_name) if stream_to_s3 else None,
+                "created_at": manifest["timestamp"]
+            })
             
-            logger.info(f"Database backup completed: {compressed_path}")
-            return str(compressed_path)
+            location = f"s3://{self.s3_bucket}/{self._s3_key(backup_name)}" if stream_to_s3 else str(backup_path)
+            if manifest["failed"]:
+                # Kept (and catalogued as incomplete) for what it has, but never used as a chain base
+                logger.error(f"Database backup incomplete: {location} (failed tables: {', '.join(manifest['failed'])})")
+            else:
+                logger.info(f"Database backup completed: {location} ({kind}, {manifest['size']} bytes)")
+            return location
             
         except Exception as e:
             logger.error(f"Backup failed: {str(e)}")
-            if backup_path.exists():
-                backup_path.unlink()
+            for path in (backup_path, manifest_path(backup_path)):
+                if path.exists():
+                    path.unlink()
             return None
+        finally:
+            for part in parts.values():
+                part.close()
     
-    def _export_table(self, table_name: str) -> Optional[List[Dict]]:
-        """Export a single table from Supabase"""
+    def _iter_table(self, table_name: str, snapshot: Optional[str] = None, since: Optional[str] = None) -> Iterator[List[Dict]]:
+        """
+        Yield a table from Supabase one keyset page at a time, up to the
+        snapshot marker; with `since`, only rows updated after it.
+        """
+        client = self._get_client()
+        url = f"{self.supabase_url}/rest/v1/{table_name}"
+        if since:
+            keys = ("updated_at", "id")
+            base = [("select", "*"), ("updated_at", f"gt.{since}")] + keyset.snapshot_params(snapshot, "updated_at")
+        else:
+            keys = self.keys
+            base = [("select", "*")] + keyset.snapshot_params(snapshot)
+        
+        def fetch(after):
+            response = client.get(url, params=base + keyset.page_params(keys, after, self.page_size))
+            response.raise_for_status()
+            return response.json()
+        
+        yield from keyset.iter_keyset(fetch, keys, self.page_size)
+    
+    def _export_table(self, table_name: str, sink: TableSpool, snapshot: Optional[str] = None, since: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Stream one table into compressed chunks written to `sink`.
+        Returns {"rows": n, "chunks": [...]}, or {"error": ...} ("missing" when the table does not exist).
+        """
         try:
-            url = f"{self.supabase_url}/rest/v1/{table_name}"
-            headers = {
-                "apikey": self.supabase_key,
-                "Authorization": f"Bearer {self.supabase_key}",
-                "Accept": "application/json",
-                "Content-Type": "application/json"
-            }
-            
-            # Paginate through all records
-            all_records = []
-            offset = 0
-            limit = 1000
-            
-            while True:
-                params = {
-                    "select": "*",
-                    "offset": offset,
-                    "limit": limit
-                }
-                
-                with httpx.Client() as client:
-                    response = client.get(url, headers=headers, params=params)
-                    response.raise_for_status()
-                    
-                    records = response.json()
-                    if not records:
-                        break
-                    
-                    all_records.extend(records)
-                    
-                    if len(records) < limit:
-                        break
-                    
-                    offset += limit
-            
-            return all_records
+            logger.info(f"Backing up table: {table_name}")
+            writer = ChunkWriter(sink, self.codec, BACKUP_COMPRESS_LEVEL, self.chunk_bytes)
+            for page in self._iter_table(table_name, snapshot, since):
+                writer.write(page)
+            writer.close()
+            logger.info(f"Backed up {writer.rows} records from {table_name} ({len(writer.chunks)} chunks)")
+            return {"rows": writer.rows, "chunks": writer.chunks}
             
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 404:
+                logger.warning(f"Table {table_name} does not exist, skipping")
+                return {"error": "missing"}
+            logger.error(f"Failed to export table {table_name}: {str(e)}")
+            return {"error": str(e)}
         except Exception as e:
             logger.error(f"Failed to export table {table_name}: {str(e)}")
-            return None
+            return {"error": str(e)}
     
-    def _compress_backup(self, backup_path: Path) -> Path:
-        """Compress backup file using gzip"""
-        compressed_path = backup_path.with_suffix('.json.gz')
+    def _assemble(self, out, file_name: str, parts: Dict[str, TableSpool], futures: Dict[str, Any], meta: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Append each table's chunks to `out` in table order, then the index.
+        When a table's turn comes, its spooled part is copied (and deleted) and
+        its exporter writes the rest straight to `out`. Returns the manifest.
+        """
+        file_hash = hashlib.sha256()
+        tables = []
+        results = {}
+        offset = 0
         
-        with open(backup_path, 'rb') as f_in:
-            with gzip.open(compressed_path, 'wb') as f_out:
-                shutil.copyfileobj(f_in, f_out)
+        def emit(data: bytes):
+            nonlocal offset
+            out.write(data)
+            file_hash.update(data)
+            offset += len(data)
         
-        # Remove uncompressed file
-        backup_path.unlink()
+        for table in self.tables:
+            # Only this table's exporter writes to `out` until its future is done
+            start = offset
+            parts[table].attach(emit)
+            results[table] = futures[table].result()
+            if "rows" not in results[table]:
+                # Chunks it wrote before failing stay in the file, outside the index
+                continue
+            tables.append({
+                "name": table,
+                "rows": results[table]["rows"],
+                "offset": start,
+                "length": offset - start,
+                "chunks": [{**c, "offset": c["offset"] + start} for c in results[table]["chunks"]]
+            })
         
-        return compressed_path
+        index = {
+            "format": backup_format.CONTAINER_FORMAT,
+            "version": backup_format.CONTAINER_VERSION,
+            "codec": self.codec,
+            **meta,
+            "tables": tables,
+            "failed": [t for t in self.tables if results[t].get("error") not in (None, "missing")],
+            "missing": [t for t in self.tables if results[t].get("error") == "missing"]
+        }
+        emit(backup_format.index_bytes(index))
+        return {**index, "file": file_name, "size": offset, "sha256": file_hash.hexdigest()}
+    
+    def _write_manifest(self, backup_path: Path, manifest: Dict[str, Any]):
+        path = manifest_path(backup_path)
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+        tmp.replace(path)
+    
+    def verify_backup(self, backup_file: str) -> bool:
+        """
+        Check a backup against its checksums: every chunk of a .rjb file (from
+        the manifest, or the index embedded in the file), every member of a .ndjson.gz
+        """
+        try:
+            if manifest_path(backup_file).exists():
+                with open(manifest_path(backup_file), "r", encoding="utf-8") as f:
+                    manifest = json.load(f)
+            elif is_container(backup_file):
+                manifest = read_index(backup_file)
+            else:
+                raise FileNotFoundError(f"No manifest for {backup_file}")
+            
+            with open(backup_file, "rb") as f:
+                for entry in manifest["tables"]:
+                    for piece in entry.get("chunks", [entry]):
+                        f.seek(piece["offset"])
+                        data = f.read(piece["length"])
+                        if len(data) != piece["length"] or hashlib.sha256(data).hexdigest() != piece["sha256"]:
+                            logger.error(f"Checksum mismatch for table {entry['name']} in {backup_file}")
+                            return False
+            return True
+        except Exception as e:
+            logger.error(f"Backup verification failed: {str(e)}")
+            return False
     
     def upload_to_s3(self, backup_path: str) -> bool:
         """
@@ -164,33 +672,27 @@ class BackupManager:
         Returns:
             True if successful, False otherwise
         """
-        if not all([self.s3_bucket, self.aws_access_key, self.aws_secret_key]):
+        if not self.s3_configured:
             logger.warning("S3 not configured, skipping remote backup")
             return False
         
         try:
-            s3_client = boto3.client(
-                's3',
-                aws_access_key_id=self.aws_access_key,
-                aws_secret_access_key=self.aws_secret_key,
-                region_name=self.aws_region
-            )
+            s3_client = self._s3_client()
+            backup_path = Path(backup_path)
             
-            file_name = Path(backup_path).name
-            s3_key = f"renoveja-backups/{file_name}"
+            logger.info(f"Uploading backup to S3: {self._s3_key(backup_path.name)}")
             
-            logger.info(f"Uploading backup to S3: {s3_key}")
+            # Multipart, with parts uploaded in parallel and checked with Content-MD5
+            with open(backup_path, 'rb') as f, self._s3_writer(s3_client, backup_path.name) as out:
+                while True:
+                    chunk = f.read(self.s3_part_size)
+                    if not chunk:
+                        break
+                    out.write(chunk)
             
-            with open(backup_path, 'rb') as f:
-                s3_client.upload_fileobj(
-                    f, 
-                    self.s3_bucket, 
-                    s3_key,
-                    ExtraArgs={
-                        'ServerSideEncryption': 'AES256',
-                        'StorageClass': 'STANDARD_IA'  # Infrequent Access for cost savings
-                    }
-                )
+            # The manifest travels with the backup so it can be verified after download
+            if manifest_path(backup_path).exists():
+                self._upload_manifest(s3_client, backup_path)
             
             logger.info(f"Backup uploaded successfully to S3")
             return True
@@ -203,8 +705,23 @@ class BackupManager:
         """Remove old backup files based on retention policy"""
         now = datetime.now()
         
+        # Catalogued backups go away a whole chain at a time (a full and its increments)
+        expired = self.catalog.expired_chains(self.local_retention_days, now)
+        files = {e["id"]: e["file"] for e in self.catalog.entries()}
+        for backup_id in expired:
+            logger.info(f"Removing expired backup chain member: {backup_id}")
+            backup_path = self.backup_dir / files[backup_id]
+            for path in (backup_path, manifest_path(backup_path)):
+                if path.exists():
+                    path.unlink()
+        if expired:
+            self.catalog.remove(expired)
+        catalogued = {e["id"] for e in self.catalog.entries()}
+        
         # Clean local backups
-        for backup_file in self.backup_dir.glob("renoveja_backup_*.json.gz"):
+        for backup_file in self.backup_dir.glob("renoveja_backup_*"):
+            if backup_file.name.split(".")[0] in catalogued:
+                continue
             file_time = datetime.fromtimestamp(backup_file.stat().st_mtime)
             age_days = (now - file_time).days
             
@@ -213,7 +730,7 @@ class BackupManager:
                 backup_file.unlink()
         
         # Clean S3 backups (if configured)
-        if all([self.s3_bucket, self.aws_access_key, self.aws_secret_key]):
+        if self.s3_configured:
             try:
                 self._cleanup_s3_backups()
             except Exception as e:
@@ -221,12 +738,7 @@ class BackupManager:
     
     def _cleanup_s3_backups(self):
         """Remove old backups from S3"""
-        s3_client = boto3.client(
-            's3',
-            aws_access_key_id=self.aws_access_key,
-            aws_secret_access_key=self.aws_secret_key,
-            region_name=self.aws_region
-        )
+        s3_client = self._s3_client()
         
         # List objects in backup prefix
         response = s3_client.list_objects_v2(
@@ -253,12 +765,13 @@ class BackupManager:
             )
             logger.info(f"Deleted {len(objects_to_delete)} old backups from S3")
     
-    def restore_from_backup(self, backup_file: str) -> bool:
+    def restore_from_backup(self, backup_file: str, tables: Optional[List[str]] = None) -> bool:
         """
         Restore database from backup file
         
         Args:
             backup_file: Path to the backup file
+            tables: Restore only these tables (default: all of them)
             
         Returns:
             True if successful, False otherwise
@@ -266,6 +779,14 @@ class BackupManager:
         try:
             logger.warning(f"Starting database restore from: {backup_file}")
             
+            if is_container(backup_file) or backup_file.endswith('.ndjson.gz'):
+                if not self._restore_file(backup_file, tables):
+                    return False
+                checkpoint_path(backup_file).unlink(missing_ok=True)
+                logger.info("Database restore completed successfully")
+                return True
+            
+            # Legacy single-document JSON backups (version 2.0.0)
             # Decompress if needed
             if backup_file.endswith('.gz'):
                 with gzip.open(backup_file, 'rt', encoding='utf-8') as f:
@@ -284,6 +805,8 @@ class BackupManager:
             
             # Restore each table
             for table_name, records in backup_data['tables'].items():
+                if tables is not None and table_name not in tables:
+                    continue
                 logger.info(f"Restoring table {table_name}: {len(records)} records")
                 success = self._restore_table(table_name, records)
                 if not success:
@@ -297,52 +820,234 @@ class BackupManager:
             logger.error(f"Restore failed: {str(e)}")
             return False
     
-    def _restore_table(self, table_name: str, records: List[Dict]) -> bool:
-        """Restore a single table to Supabase"""
+    def restore_chain(self, backup_id: str = None) -> bool:
+        """
+        Restore a catalogued backup point (default: the newest): its full
+        backup first, then every increment up to it, in order
+        """
         try:
-            url = f"{self.supabase_url}/rest/v1/{table_name}"
-            headers = {
-                "apikey": self.supabase_key,
-                "Authorization": f"Bearer {self.supabase_key}",
-                "Accept": "application/json",
-                "Content-Type": "application/json",
-                "Prefer": "resolution=merge-duplicates"  # Upsert behavior
-            }
+            chain = self.catalog.chain(backup_id)
+        except ValueError as e:
+            logger.error(str(e))
+            return False
+        
+        logger.warning(f"Restoring backup chain: {' -> '.join(e['id'] for e in chain)}")
+        files = [str(self.backup_dir / entry["file"]) for entry in chain]
+        
+        # Members streamed to S3 (BACKUP_KEEP_LOCAL=false) are downloaded first
+        downloaded = []
+        try:
+            s3_client = None
+            for entry, backup_file in zip(chain, files):
+                if Path(backup_file).exists():
+                    continue
+                if not entry.get("remote") or not self.s3_configured:
+                    logger.error(f"Backup {entry['id']} is neither local nor in S3")
+                    return False
+                s3_client = s3_client or self._s3_client()
+                downloaded += self._download_from_s3(s3_client, entry)
+        except Exception as e:
+            logger.error(f"Failed to download backup from S3: {str(e)}")
+            return False
+        
+        for entry, backup_file in zip(chain, files):
+            # Checkpoints (and downloads) are kept until the whole chain is in, so a rerun skips finished files
+            if not self._restore_file(backup_file):
+                logger.error(f"Chain restore stopped at {entry['id']}")
+                return False
+        for backup_file in files:
+            checkpoint_path(backup_file).unlink(missing_ok=True)
+        for path in downloaded:
+            path.unlink(missing_ok=True)
+        logger.info("Database restore completed successfully")
+        return True
+    
+    def _download_from_s3(self, s3_client, entry: Dict[str, Any]) -> List[Path]:
+        """Fetch a catalogued backup and its manifest from S3 into backup_dir; returns the files written"""
+        backup_path = self.backup_dir / entry["file"]
+        logger.info(f"Downloading backup from S3: {entry['remote']}")
+        written = []
+        objects = [(entry["remote"], backup_path), (self._s3_key(manifest_path(backup_path).name), manifest_path(backup_path))]
+        for key, path in objects:
+            try:
+                body = s3_client.get_object(Bucket=self.s3_bucket, Key=key)["Body"]
+            except Exception as e:
+                if path == backup_path:
+                    raise
+                # The index embedded in the .rjb is enough to verify and restore
+                logger.warning(f"No manifest in S3 for {entry['id']}: {str(e)}")
+                continue
+            tmp = path.with_name(path.name + ".download")
+            with open(tmp, "wb") as f:
+                while True:
+                    chunk = body.read(COPY_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+            tmp.replace(path)
+            written.append(path)
+        return written
+    
+    def _restore_file(self, backup_file: str, only: Optional[List[str]] = None) -> bool:
+        """
+        Restore one .rjb (or .ndjson.gz) backup table by table in dependency
+        order, resuming from its checkpoint. `only` limits it to some tables,
+        and then only their chunks are verified, as they are read.
+        """
+        try:
+            manifest = None
+            if only is None and (manifest_path(backup_file).exists() or is_container(backup_file)):
+                if not self.verify_backup(backup_file):
+                    return False
+            if manifest_path(backup_file).exists():
+                with open(manifest_path(backup_file), "r", encoding="utf-8") as f:
+                    manifest = json.load(f)
+            elif is_container(backup_file):
+                manifest = read_index(backup_file)
+            checkpoint = RestoreCheckpoint(backup_file, manifest.get("sha256") if manifest else None)
             
-            # Restore in batches
-            batch_size = 100
-            for i in range(0, len(records), batch_size):
-                batch = records[i:i + batch_size]
-                
-                with httpx.Client() as client:
-                    response = client.post(url, headers=headers, json=batch)
-                    response.raise_for_status()
+            if manifest:
+                # Each table is read on its own, so the order can follow the foreign keys
+                order = {name: i for i, name in enumerate(BACKUP_TABLES)}
+                entries = sorted(manifest["tables"], key=lambda e: order.get(e["name"], len(order)))
+                codec = manifest.get("codec", "gzip")
+                tables = ((e["name"], read_entry(backup_file, e, codec, verify=only is not None)) for e in entries)
+            else:
+                # No manifest: one sequential pass in file order (already parents first)
+                tables = ((name, (record for _, record in group)) for name, group in groupby(read_backup(backup_file), key=lambda pair: pair[0]))
             
+            for table, records in tables:
+                if only is not None and table not in only:
+                    continue
+                if checkpoint.done(table):
+                    logger.info(f"Table {table} already restored, skipping")
+                    continue
+                restored = self._restore_records(table, records, checkpoint)
+                if restored is None:
+                    logger.error(f"Failed to restore table: {table}")
+                    return False
+                checkpoint.table_done(table)
+                logger.info(f"Restored table {table}: {restored} records")
             return True
             
         except Exception as e:
-            logger.error(f"Failed to restore table {table_name}: {str(e)}")
+            logger.error(f"Restore failed: {str(e)}")
             return False
+    
+    def _restore_records(self, table_name: str, records: Iterator[Dict[str, Any]], checkpoint: RestoreCheckpoint) -> Optional[int]:
+        """
+        Upsert a stream of records in batches, up to `concurrency` batches in
+        flight. Returns how many records were sent, None if a batch failed.
+        """
+        skip = checkpoint.resume_from(table_name)
+        sent = 0
+        failed = False
+        pending = {}
+        
+        def collect(futures):
+            nonlocal sent, failed
+            for future in futures:
+                index, size = pending.pop(future)
+                if future.result():
+                    checkpoint.batch_done(table_name, index)
+                    sent += size
+                else:
+                    failed = True
+        
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            for index, batch in enumerate(batched(records, self.restore_batch_size)):
+                if index < skip:
+                    continue  # already confirmed by a previous run
+                pending[pool.submit(self._post_batch, table_name, batch)] = (index, len(batch))
+                # Bounded read-ahead keeps memory at ~2 x concurrency batches
+                if len(pending) >= self.concurrency * 2:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                if failed:
+                    break
+            done, _ = wait(pending)
+            collect(done)
+        return None if failed else sent
+    
+    def _post_batch(self, table_name: str, batch: List[Dict]) -> bool:
+        """Upsert one batch, retrying network errors and 5xx with backoff"""
+        url = f"{self.supabase_url}/rest/v1/{table_name}"
+        headers = {"Prefer": "resolution=merge-duplicates"}  # Upsert behavior
+        client = self._get_client()
+        
+        for attempt in range(RESTORE_RETRIES + 1):
+            try:
+                response = client.post(url, headers=headers, json=batch)
+                if response.status_code < 300:
+                    return True
+                logger.error(f"Restore batch for {table_name} failed: {response.status_code} - {response.text[:200]}")
+                if response.status_code < 500 and response.status_code != 429:
+                    return False
+            except httpx.TransportError as e:
+                logger.error(f"Restore batch for {table_name} failed: {str(e)}")
+            if attempt < RESTORE_RETRIES:
+                time.sleep(RESTORE_BACKOFF_SECONDS * (2 ** attempt))
+        return False
+    
+    def _restore_table(self, table_name: str, records: List[Dict]) -> bool:
+        """Restore a single table to Supabase (legacy JSON backups)"""
+        for i in range(0, len(records), self.restore_batch_size):
+            if not self._post_batch(table_name, records[i:i + self.restore_batch_size]):
+                logger.error(f"Failed to restore table {table_name}")
+                return False
+        return True
 
-def run_backup():
+def run_backup(kind: str = None):
     """Run automated backup process"""
     manager = BackupManager()
     
+    # Full backup when one is due, otherwise the cheaper default kind
+    if kind is None:
+        kind = FULL if manager.catalog.due_full(BACKUP_FULL_INTERVAL_HOURS) else BACKUP_DEFAULT_KIND
+    
     # Create backup
-    backup_path = manager.backup_database()
+    backup_path = manager.backup_database(kind)
     if not backup_path:
         logger.error("Backup creation failed")
+        manager.close()
         return False
     
-    # Upload to S3 (if configured)
-    manager.upload_to_s3(backup_path)
+    # Upload to S3 (if configured and not already streamed there)
+    if not backup_path.startswith("s3://"):
+        manager.upload_to_s3(backup_path)
     
     # Cleanup old backups
     manager.cleanup_old_backups()
     
+    # Some tables failed: the file is kept, but the run is not a success
+    entry = manager.catalog.get(os.path.basename(backup_path).split(".")[0])
+    manager.close()
+    if entry is not None and not entry.get("complete"):
+        logger.error("Backup finished with failed tables")
+        return False
+    
     return True
 
+def inspect_backup(backup_file: str, table: str = None, out=None):
+    """Print a .rjb backup's index, or one table's records as NDJSON (only its chunks are read)"""
+    out = out or sys.stdout
+    if table:
+        for record in read_table(backup_file, table):
+            out.write(encode_record(record).decode("utf-8"))
+        return
+    index = read_index(backup_file)
+    out.write(f"{backup_file}: {index['kind']} backup, codec {index['codec']}, snapshot {index['snapshot']}\n")
+    for entry in index["tables"]:
+        out.write(f"  {entry['name']}: {entry['rows']} rows, {len(entry['chunks'])} chunks, {entry['length']} bytes\n")
+    for name in index.get("failed", []):
+        out.write(f"  {name}: FAILED\n")
+
 if __name__ == "__main__":
-    # Run backup when executed directly
-    success = run_backup()
-    exit(0 if success else 1)
\ No newline at end of file
+    # python backup_manager.py inspect <arquivo.rjb> [tabela]
+    if len(sys.argv) > 2 and sys.argv[1] == "inspect":
+        inspect_backup(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+        exit(0)
+    
+    # Run backup when executed directly: python backup_manager.py [full|incremental|differential]
+    success = run_backup(sys.argv[1] if len(sys.argv) > 1 else None)
+    exit(0 if success else 1)
@@ -0,0 +1,111 @@
+"""
+Benchmark - Distribuição em lote (assignment_engine)
+
+Gera uma fila sintética e compara o plano ótimo com a distribuição gulosa
+(um pedido por vez, médico menos carregado):
+
+    python benchmark_assignment.py --requests 5000 --doctors 300
+"""
+
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Tuple
+
+from assignment_engine import DEFAULT_WEIGHTS, GENERALIST_SPECIALTIES, plan_assignments, request_class, _hours_waiting
+from queue_manager import DoctorLoadIndex
+
+SPECIALTIES = [
+    "Clínico Geral", "Cardiologia", "Dermatologia", "Endocrinologia", "Ginecologia",
+    "Neurologia", "Ortopedia", "Pediatria", "Psiquiatria", "Urologia",
+]
+
+
+def generate(n_requests: int, n_doctors: int, now: datetime, seed: int = 42) -> Tuple[List[Dict], List[Dict]]:
+    rng = random.Random(seed)
+    doctors = []
+    for i in range(n_doctors):
+        max_cases = rng.randint(3, 8)
+        doctors.append({
+            "user_id": f"doctor-{i}",
+            "name": f"Dr(a). {i}",
+            "specialty": "Clínico Geral" if rng.random() < 0.3 else rng.choice(SPECIALTIES),
+            "rating": round(rng.uniform(3.5, 5.0), 1),
+            "total_consultations": rng.randint(0, 500),
+            "active_cases": rng.randint(0, max_cases),
+            "max_concurrent_cases": max_cases,
+            "available": rng.random() < 0.9,
+        })
+    requests = []
+    for i in range(n_requests):
+        request_type = rng.choice(["prescription", "prescription", "consultation"])
+        requests.append({
+            "id": f"request-{i}",
+            "request_type": request_type,
+            "specialty": rng.choice(SPECIALTIES) if request_type == "consultation" else None,
+            "status": "submitted",
+            "created_at": (now - timedelta(minutes=rng.randint(0, 72 * 60))).isoformat(),
+        })
+    return requests, doctors
+
+
+def greedy(requests: List[Dict], doctors: List[Dict]) -> List[Tuple[Dict, Dict]]:
+    """Baseline: oldest request first, least loaded doctor from the load index"""
+    index = DoctorLoadIndex()
+    index.load(
+        [{**d, "user_id": d["user_id"]} for d in doctors],
+        {d["user_id"]: d["name"] for d in doctors},
+        {d["user_id"]: d["active_cases"] for d in doctors},
+    )
+    plan = []
+    for r in sorted(requests, key=lambda r: r["created_at"]):
+        doctor = index.find_best(request_class(r))
+        if doctor:
+            plan.append((r, doctor))
+            index.on_assigned(doctor["user_id"])
+    return plan
+
+
+def score(plan: List[Tuple[Dict, Dict]], doctors: List[Dict], now: datetime) -> Dict[str, Any]:
+    w = DEFAULT_WEIGHTS
+    active = {d["user_id"]: d["active_cases"] for d in doctors}
+    cost = 0.0
+    waited = []
+    for r, d in plan:
+        cost += w["load"] * (active[d["user_id"]] + 1) / d["max_concurrent_cases"]
+        cost += w["rating"] * max(0.0, 5.0 - d["rating"])
+        if request_class(r) is None and d["specialty"] not in GENERALIST_SPECIALTIES:
+            cost += w["off_specialty"]
+        hours = _hours_waiting(r, now)
+        cost -= w["wait"] * min(hours, w["max_wait_hours"])
+        waited.append(hours)
+        active[d["user_id"]] += 1
+    return {
+        "assigned": len(plan),
+        "cost": round(cost, 1),
+        "avg_wait_hours": round(sum(waited) / len(waited), 1) if waited else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--doctors", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    now = datetime.utcnow()
+    requests, doctors = generate(args.requests, args.doctors, now, args.seed)
+    capacity = sum(max(0, d["max_concurrent_cases"] - d["active_cases"]) for d in doctors if d["available"])
+    print(f"{len(requests)} pedidos, {len(doctors)} médicos, {capacity} vagas livres")
+
+    for name, solve in (("guloso", lambda: greedy(requests, doctors)), ("ótimo", lambda: plan_assignments(requests, doctors, now))):
+        started = time.perf_counter()
+        plan = solve()
+        elapsed = time.perf_counter() - started
+        print(f"  {name:7s} {elapsed * 1000:8.1f} ms  {score(plan, doctors, now)}")
+
+
+if __name__ == "__main__":
+    main()
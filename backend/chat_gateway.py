@@ -0,0 +1,183 @@
+"""
+Chat Gateway for RenoveJá+
+Chat em tempo real via WebSocket, com presença e "digitando..."
+
+    ws://.../api/ws/chat/{request_id}?token=...&after=<cursor>
+
+Cliente -> servidor:
+    {"type": "message", "client_id": "tmp-1", "message": "Olá"}
+    {"type": "typing", "typing": true}
+    {"type": "ping"}
+
+Servidor -> cliente:
+    {"type": "ack", "client_id": "tmp-1", "message": {...}}   mensagem gravada
+    {"type": "message", "message": {...}}                     mensagem da sala
+    {"type": "presence", "users": [{"user_id", "name"}, ...]} quem está na sala
+    {"type": "typing", "user_id", "name", "typing": true}
+    {"type": "error", "client_id", "detail"}
+
+As mensagens são gravadas pelo mesmo caminho de POST /api/chat e
+distribuídas pelo event_bus, então chegam a todas as conexões da sala em
+qualquer worker (inclusive as enviadas por HTTP). Com `after`, a conexão
+começa por todas as mensagens perdidas desde esse cursor, página por página
+(ver chat_history.py).
+
+Cada conexão tem um buffer de saída limitado: presença e digitação são
+descartadas quando ele enche; se nem as mensagens couberem, a conexão é
+fechada (código 4408) e o cliente reconecta com `after`.
+"""
+
+import asyncio
+import os
+from collections import defaultdict
+from typing import Dict, Any, Optional, Set, Callable, Awaitable
+
+from fastapi import HTTPException, WebSocketDisconnect
+
+import chat_history
+
+CHAT_SEND_BUFFER = int(os.getenv("CHAT_SEND_BUFFER", "256"))
+SLOW_CONSUMER_CLOSE_CODE = 4408
+
+Publish = Callable[[str, str, Dict[str, Any]], Awaitable[Any]]
+PostMessage = Callable[[Dict[str, Any], str, str], Awaitable[Dict[str, Any]]]
+
+
+class ChatConnection:
+    """One WebSocket and its bounded outbox, drained by `run_writer`"""
+
+    def __init__(self, websocket, user: Dict[str, Any], max_buffer: int = CHAT_SEND_BUFFER):
+        self.websocket = websocket
+        self.user = user
+        self.outbox: asyncio.Queue = asyncio.Queue(maxsize=max_buffer)
+        self.closed = False
+
+    def send(self, message: Dict[str, Any], droppable: bool = False) -> bool:
+        if self.closed:
+            return False
+        try:
+            self.outbox.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            if droppable:
+                return False
+            # Consumidor lento: fecha e deixa o cliente ressincronizar com `after`
+            self.closed = True
+            while not self.outbox.empty():
+                self.outbox.get_nowait()
+            self.outbox.put_nowait(None)
+            return False
+
+    async def send_backlog(self, message: Dict[str, Any]):
+        """Queue a resync message, waiting for room instead of closing the connection"""
+        if not self.closed:
+            await self.outbox.put(message)
+
+    async def run_writer(self):
+        while True:
+            message = await self.outbox.get()
+            if message is None:
+                await self.websocket.close(code=SLOW_CONSUMER_CLOSE_CODE)
+                return
+            await self.websocket.send_json(message)
+
+
+class ChatGateway:
+    """Rooms of this worker; cross-worker traffic goes through the event bus"""
+
+    def __init__(self, publish: Publish):
+        self.publish = publish
+        self.rooms: Dict[str, Set[ChatConnection]] = defaultdict(set)
+        # sala -> usuário -> conexões abertas por worker
+        self.presence: Dict[str, Dict[str, Dict[str, int]]] = defaultdict(lambda: defaultdict(dict))
+        self.names: Dict[str, str] = {}
+
+    def online_users(self, request_id: str):
+        return [
+            {"user_id": user_id, "name": self.names.get(user_id)}
+            for user_id, nodes in self.presence.get(request_id, {}).items()
+            if any(nodes.values())
+        ]
+
+    def broadcast(self, request_id: str, message: Dict[str, Any], droppable: bool = False, exclude_user: str = None):
+        for connection in list(self.rooms.get(request_id, ())):
+            if exclude_user and connection.user["id"] == exclude_user:
+                continue
+            connection.send(message, droppable=droppable)
+
+    async def on_event(self, event: Dict[str, Any]):
+        """Event bus handler for chat.* events"""
+        request_id, payload = event["key"], event["payload"]
+
+        if event["type"] == "chat.message":
+            self.broadcast(request_id, {"type": "message", "message": payload["message"]})
+
+        elif event["type"] == "chat.typing":
+            self.broadcast(request_id, {
+                "type": "typing", "user_id": payload["user_id"],
+                "name": payload.get("name"), "typing": payload["typing"],
+            }, droppable=True, exclude_user=payload["user_id"])
+
+        elif event["type"] == "chat.presence":
+            nodes = self.presence[request_id][payload["user_id"]]
+            count = nodes.get(event["node"], 0) + (1 if payload["online"] else -1)
+            if count > 0:
+                nodes[event["node"]] = count
+            else:
+                nodes.pop(event["node"], None)
+                if not nodes:
+                    del self.presence[request_id][payload["user_id"]]
+                    if not self.presence[request_id]:
+                        del self.presence[request_id]
+            self.names[payload["user_id"]] = payload.get("name")
+            self.broadcast(request_id, {"type": "presence", "users": self.online_users(request_id)}, droppable=True)
+
+    async def handle(
+        self,
+        websocket,
+        user: Dict[str, Any],
+        request_id: str,
+        post_message: PostMessage,
+        after: Optional[str] = None
+    ):
+        """Serve an accepted, authorized WebSocket until it disconnects"""
+        connection = ChatConnection(websocket, user)
+        self.rooms[request_id].add(connection)
+        writer = asyncio.ensure_future(connection.run_writer())
+        presence = {"user_id": user["id"], "name": user.get("name")}
+        await self.publish("chat.presence", request_id, {**presence, "online": True})
+
+        try:
+            has_more = bool(after)
+            while has_more and not connection.closed:
+                missed, has_more = await chat_history.get_messages_page(request_id, after=after, limit=chat_history.CHAT_MAX_PAGE_SIZE)
+                for message in missed:
+                    await connection.send_backlog({"type": "message", "message": message})
+                if missed:
+                    after = chat_history.encode_cursor(missed[-1])
+
+            while not connection.closed:
+                data = await websocket.receive_json()
+                kind = data.get("type")
+
+                if kind == "message":
+                    try:
+                        message = await post_message(user, request_id, data.get("message"))
+                        connection.send({"type": "ack", "client_id": data.get("client_id"), "message": message})
+                    except HTTPException as e:
+                        connection.send({"type": "error", "client_id": data.get("client_id"), "detail": e.detail})
+
+                elif kind == "typing":
+                    await self.publish("chat.typing", request_id, {**presence, "typing": bool(data.get("typing"))})
+
+                elif kind == "ping":
+                    connection.send({"type": "pong"}, droppable=True)
+        except (WebSocketDisconnect, RuntimeError, ValueError):
+            pass
+        finally:
+            self.rooms[request_id].discard(connection)
+            if not self.rooms[request_id]:
+                del self.rooms[request_id]
+            writer.cancel()
+            await asyncio.gather(writer, return_exceptions=True)
+            await self.publish("chat.presence", request_id, {**presence, "online": False})
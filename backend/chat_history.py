@@ -0,0 +1,78 @@
+"""
+Chat History for RenoveJá+
+Histórico do chat paginado por cursor, com sincronização incremental
+
+Cada mensagem devolvida leva um `cursor` opaco (created_at + id). O cliente
+carrega a página mais recente e, a partir dela:
+
+    GET /api/chat/{request_id}?after=<cursor da última>    mensagens novas
+    GET /api/chat/{request_id}?before=<cursor da primeira> histórico anterior
+    GET /api/chat/{request_id}?since=<ISO timestamp>       novas desde um horário
+
+Toda consulta é um range scan em (request_id, created_at, id)
+(supabase/chat-history.sql); uma conversa parada custa uma resposta vazia.
+"""
+
+import base64
+import json
+import os
+from typing import List, Dict, Any, Optional, Tuple
+
+from database import find_page
+
+CHAT_PAGE_SIZE = int(os.getenv("CHAT_PAGE_SIZE", "50"))
+CHAT_MAX_PAGE_SIZE = 200
+
+KEYS = ("created_at", "id")
+
+
+def encode_cursor(message: Dict[str, Any]) -> str:
+    raw = json.dumps([message.get("created_at"), message.get("id")], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, message_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError("Cursor inválido")
+    if not isinstance(created_at, str) or not isinstance(message_id, str):
+        raise ValueError("Cursor inválido")
+    return created_at, message_id
+
+
+async def get_messages_page(
+    request_id: str,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    since: Optional[str] = None,
+    limit: int = CHAT_PAGE_SIZE
+) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    One page of a conversation, oldest first. Returns (messages, has_more):
+    has_more means newer messages remain for `after`/`since` and older ones
+    otherwise. Raises ValueError for an invalid cursor or combination.
+    """
+    if sum(p is not None for p in (before, after, since)) > 1:
+        raise ValueError("Use apenas um de before, after ou since")
+    limit = max(1, min(limit, CHAT_MAX_PAGE_SIZE))
+    filters = {"request_id": request_id}
+
+    if after is not None or since is not None:
+        if since is not None:
+            filters["created_at"] = {"gt": since}
+        page = await find_page(
+            "chat_messages", filters=filters, keys=KEYS,
+            after=decode_cursor(after) if after is not None else None, limit=limit + 1
+        )
+        messages = page[:limit]
+    else:
+        # Página mais recente (ou anterior ao cursor), lida do fim para o início
+        page = await find_page(
+            "chat_messages", filters=filters, keys=KEYS,
+            after=decode_cursor(before) if before is not None else None, limit=limit + 1, descending=True
+        )
+        messages = list(reversed(page[:limit]))
+
+    return [{**m, "cursor": encode_cursor(m)} for m in messages], len(page) > limit
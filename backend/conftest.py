@@ -0,0 +1,26 @@
+"""
+Fixtures compartilhadas dos testes do backend
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import database
+import reports
+import unread_counters
+
+
+@pytest.fixture
+def mock_db(monkeypatch):
+    """Fresh in-memory MockDatabase behind the storage helpers, with empty module caches"""
+    mock = database.MockDatabase()
+    monkeypatch.setattr(database, "db", mock)
+    reports.clear_cache()
+    unread_counters.clear_cache()
+    yield mock
+    reports.clear_cache()
+    unread_counters.clear_cache()
@@ -5,15 +5,18 @@ Includes in-memory mock database for development/testing
 """
 
 import os
+import asyncio
 from pathlib import Path
-from typing import Optional, List, Dict, Any, Union
+from typing import Optional, List, Dict, Any, Union, Tuple, AsyncIterator, Awaitable, Iterator, Sequence
 from dotenv import load_dotenv
 import httpx
 import json
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 import bcrypt
 
+import keyset
+
 # Carregar .env do diretório do backend (UTF-8 no Windows)
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / ".env", encoding="utf-8")
@@ -21,6 +24,12 @@ load_dotenv(ROOT_DIR / ".env", encoding="utf-8")
 SUPABASE_URL = os.getenv("SUPABASE_URL", "")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY", "")  # Use service role for backend
 
+# Maximum number of queries a single handler runs at the same time (see gather_queries)
+MAX_PARALLEL_QUERIES = int(os.getenv("DB_MAX_PARALLEL_QUERIES", "8"))
+
+# Most values in one `in.(...)` filter: it travels in the URL (~37 bytes per UUID)
+MAX_IN_FILTER_VALUES = 100
+
 # Check if we should use mock database
 USE_MOCK_DB = not SUPABASE_URL or SUPABASE_URL == "" or "xxxxx" in SUPABASE_URL
 
@@ -122,17 +131,38 @@ class MockDatabase:
                     elif op == "is":
                         if val == "null" and record.get(key) is not None:
                             return False
+                    elif op == "not.is":
+                        if val == "null" and record.get(key) is None:
+                            return False
                     elif op == "gte":
                         if record.get(key) < val:
                             return False
                     elif op == "lte":
                         if record.get(key) > val:
                             return False
+                    elif op == "gt":
+                        if record.get(key) is None or record.get(key) <= val:
+                            return False
+                    elif op == "lt":
+                        if record.get(key) is None or record.get(key) >= val:
+                            return False
             else:
                 if record.get(key) != value:
                     return False
         return True
     
+    def _sort_records(self, records: List[Dict], order: str) -> List[Dict]:
+        """Sort records using a PostgREST-style order ("a.asc,b.desc")"""
+        records = list(records)
+        for part in reversed(order.split(",")):
+            field = part.replace(".desc", "").replace(".asc", "")
+            reverse = part.endswith(".desc")
+            records.sort(
+                key=lambda x: (x.get(field) is not None, x.get(field) if x.get(field) is not None else ""),
+                reverse=reverse
+            )
+        return records
+    
     async def insert(self, table: str, data: Dict[str, Any]) -> Optional[Dict]:
         """Insert a record"""
         if table not in self.tables:
@@ -170,9 +200,7 @@ class MockDatabase:
         
         # Apply ordering
         if order:
-            field = order.replace(".desc", "").replace(".asc", "")
-            reverse = ".desc" in order
-            records = sorted(records, key=lambda x: x.get(field, ""), reverse=reverse)
+            records = self._sort_records(records, order)
         
         # Apply limit
         if limit:
@@ -182,6 +210,46 @@ class MockDatabase:
             return records[0] if records else None
         return records
     
+    async def select_page(
+        self,
+        table: str,
+        columns: str = "*",
+        filters: Optional[Dict[str, Any]] = None,
+        keys: Tuple[str, ...] = ("created_at", "id"),
+        after: Optional[Tuple] = None,
+        limit: int = 1000,
+        descending: bool = False
+    ) -> List[Dict]:
+        """Select one keyset page ordered by `keys`, strictly after the `after` tuple"""
+        records = self.tables.get(table, [])
+        if filters:
+            records = [r for r in records if self._match_filters(r, filters)]
+        if after is not None:
+            bound = tuple(a or "" for a in after)
+            if descending:
+                records = [r for r in records if tuple(r.get(k) or "" for k in keys) < bound]
+            else:
+                records = [r for r in records if tuple(r.get(k) or "" for k in keys) > bound]
+        direction = "desc" if descending else "asc"
+        records = self._sort_records(records, ",".join(f"{k}.{direction}" for k in keys))
+        return records[:limit]
+    
+    async def upsert(self, table: str, rows: List[Dict[str, Any]], on_conflict: str = "id") -> List[Dict]:
+        """Insert rows, replacing existing ones with the same `on_conflict` value"""
+        if table not in self.tables:
+            self.tables[table] = []
+        
+        existing = {r.get(on_conflict): r for r in self.tables[table]}
+        for row in rows:
+            current = existing.get(row.get(on_conflict))
+            if current is not None:
+                current.update(row)
+            else:
+                row = dict(row)
+                self.tables[table].append(row)
+                existing[row.get(on_conflict)] = row
+        return rows
+    
     async def update(
         self,
         table: str,
@@ -201,6 +269,14 @@ class MockDatabase:
         
         return updated if updated else None
     
+    async def update_where(self, table: str, data: Dict[str, Any], filters: Dict[str, Any]) -> List[Dict]:
+        """Conditional update: returns the records that matched (empty when none did)"""
+        return await self.update(table, data, filters) or []
+    
+    async def update_many(self, table: str, data: Dict[str, Any], filters: Dict[str, Any]) -> int:
+        """Bulk update: returns how many records matched"""
+        return len(await self.update(table, data, filters) or [])
+    
     async def delete(self, table: str, filters: Dict[str, Any]) -> bool:
         """Delete records"""
         if table not in self.tables:
@@ -210,6 +286,14 @@ class MockDatabase:
         self.tables[table] = [r for r in self.tables[table] if not self._match_filters(r, filters)]
         return len(self.tables[table]) < initial_len
     
+    async def delete_many(self, table: str, filters: Dict[str, Any]) -> int:
+        """Bulk delete: returns how many records were removed"""
+        if table not in self.tables:
+            return 0
+        initial_len = len(self.tables[table])
+        await self.delete(table, filters)
+        return initial_len - len(self.tables[table])
+    
     async def count(self, table: str, filters: Optional[Dict[str, Any]] = None) -> int:
         """Count records"""
         if table not in self.tables:
@@ -221,8 +305,418 @@ class MockDatabase:
         return len(records)
     
     async def rpc(self, function_name: str, params: Dict[str, Any] = None) -> Any:
-        """Mock RPC - returns empty result"""
-        return None
+        """Mock RPC - runs the local equivalent of the SQL function when there is one"""
+        handler = getattr(self, f"_rpc_{function_name}", None)
+        if handler is None:
+            return None
+        return handler(**(params or {}))
+    
+    # ----- Equivalentes locais das funções SQL (supabase/*.sql) -----
+    
+    def _rpc_apply_stats_deltas(self, p_deltas: List[Dict]) -> None:
+        """Equivalent of apply_stats_deltas() in supabase/stats-rollups.sql"""
+        rows = {r["id"]: r for r in self.tables.setdefault("stats_rollups", [])}
+        for delta in p_deltas:
+            row_id = f"{delta['day']}|{delta['dimension']}|{delta['bucket']}"
+            row = rows.get(row_id)
+            if row is None:
+                row = {
+                    "id": row_id,
+                    "day": delta["day"],
+                    "dimension": delta["dimension"],
+                    "bucket": delta["bucket"],
+                    "label": None,
+                    "count": 0,
+                    "amount": 0.0,
+                }
+                self.tables["stats_rollups"].append(row)
+                rows[row_id] = row
+            row["count"] += delta.get("count", 0)
+            row["amount"] = round(row["amount"] + delta.get("amount", 0.0), 2)
+            if delta.get("label"):
+                row["label"] = delta["label"]
+            row["updated_at"] = datetime.now().isoformat()
+    
+    def _rpc_replace_stats_rollups(self, p_rows: List[Dict]) -> None:
+        """Equivalent of replace_stats_rollups() in supabase/stats-rollups.sql"""
+        self.tables["stats_rollups"] = []
+        self._rpc_apply_stats_deltas(p_rows)
+    
+    def _rpc_apply_doctor_review(self, p_review: Dict[str, Any]) -> Dict[str, Any]:
+        """Equivalent of apply_doctor_review() in supabase/doctor-ratings.sql"""
+        now = datetime.now().isoformat()
+        reviews = self.tables.setdefault("reviews", [])
+        previous = next((r for r in reviews if r["id"] == p_review["id"]), None)
+        previous_copy = dict(previous) if previous else None
+        
+        if previous:
+            previous.update({k: p_review.get(k) for k in ("rating", "tags", "comment")})
+            previous["updated_at"] = now
+        else:
+            reviews.append({**p_review, "tags": p_review.get("tags") or [],
+                            "created_at": p_review.get("created_at") or now, "updated_at": now})
+        
+        for request in self.tables.get("requests", []):
+            if request["id"] == p_review["id"]:
+                request["review"] = {
+                    "rating": p_review["rating"],
+                    "tags": p_review.get("tags") or [],
+                    "comment": p_review.get("comment"),
+                    "reviewed_at": p_review.get("created_at") or now,
+                }
+        
+        doctor_id = p_review.get("doctor_id")
+        for profile in self.tables.get("doctor_profiles", []):
+            if not doctor_id or profile.get("user_id") != doctor_id:
+                continue
+            profile["rating_sum"] = profile.get("rating_sum", 0) + p_review["rating"] - (previous_copy or {}).get("rating", 0)
+            profile["rating_count"] = profile.get("rating_count", 0) + (0 if previous_copy else 1)
+            tag_counts = dict(profile.get("tag_counts") or {})
+            for tag in p_review.get("tags") or []:
+                tag_counts[tag] = tag_counts.get(tag, 0) + 1
+            for tag in (previous_copy or {}).get("tags") or []:
+                tag_counts[tag] = tag_counts.get(tag, 0) - 1
+            profile["tag_counts"] = {tag: n for tag, n in tag_counts.items() if n > 0}
+            if profile["rating_count"] > 0:
+                profile["rating"] = round(profile["rating_sum"] / profile["rating_count"], 2)
+            profile["updated_at"] = now
+        
+        return {"previous_rating": (previous_copy or {}).get("rating")}
+    
+    def _rpc_replace_doctor_ratings(self, p_rows: List[Dict]) -> None:
+        """Equivalent of replace_doctor_ratings() in supabase/doctor-ratings.sql"""
+        rows = {r["doctor_id"]: r for r in p_rows}
+        for profile in self.tables.get("doctor_profiles", []):
+            row = rows.get(profile.get("user_id")) or {}
+            profile["rating_sum"] = row.get("rating_sum", 0)
+            profile["rating_count"] = row.get("rating_count", 0)
+            profile["tag_counts"] = row.get("tag_counts") or {}
+            profile["rating"] = round(profile["rating_sum"] / profile["rating_count"], 2) if profile["rating_count"] > 0 else None
+            profile["updated_at"] = datetime.now().isoformat()
+    
+    def _rpc_assign_requests_bulk(self, p_assignments: List[Dict], p_from_statuses: List[str], p_active_statuses: List[str]) -> List[Dict]:
+        """Equivalent of assign_requests_bulk() in supabase/queue-assignment.sql"""
+        now = datetime.now().isoformat()
+        requests = {r["id"]: r for r in self.tables.get("requests", [])}
+        profiles = {p["user_id"]: p for p in self.tables.get("doctor_profiles", [])}
+        active: Dict[str, int] = {}
+        for r in requests.values():
+            if r.get("doctor_id") and r.get("status") in p_active_statuses:
+                active[r["doctor_id"]] = active.get(r["doctor_id"], 0) + 1
+        applied = []
+        for a in p_assignments:
+            request = requests.get(a["request_id"])
+            if request is None or request.get("doctor_id") is not None or request.get("status") not in p_from_statuses:
+                continue
+            profile = profiles.get(a["doctor_id"])
+            if profile is None or not profile.get("available", True) or active.get(a["doctor_id"], 0) >= (profile.get("max_concurrent_cases") or 5):
+                continue
+            active[a["doctor_id"]] = active.get(a["doctor_id"], 0) + 1
+            previous_status = request.get("status")
+            request.update({
+                "doctor_id": a["doctor_id"],
+                "doctor_name": a["doctor_name"],
+                "status": "analyzing",
+                "assigned_at": now,
+                "updated_at": now,
+            })
+            applied.append({"request_id": request["id"], "doctor_id": a["doctor_id"], "previous_status": previous_status})
+        return applied
+    
+    def _rpc_transition_request(
+        self,
+        p_request_id: str,
+        p_to_status: str,
+        p_from_statuses: Optional[List[str]] = None,
+        p_patch: Optional[Dict[str, Any]] = None,
+        p_owner_field: Optional[str] = None,
+        p_owner_id: Optional[str] = None,
+        p_allow_unassigned: bool = False
+    ) -> Dict[str, Any]:
+        """Equivalent of transition_request() in supabase/request-transitions.sql"""
+        request = next((r for r in self.tables.get("requests", []) if r["id"] == p_request_id), None)
+        if request is None:
+            return {"matched": False, "reason": "not_found"}
+        if p_from_statuses is not None and request.get("status") not in p_from_statuses:
+            return {"matched": False, "reason": "status", "current_status": request.get("status")}
+        if p_owner_field:
+            owner = request.get(p_owner_field)
+            if owner != p_owner_id and not (p_allow_unassigned and owner is None):
+                return {"matched": False, "reason": "owner", "current_status": request.get("status")}
+        
+        previous = {"status": request.get("status"), "doctor_id": request.get("doctor_id")}
+        request.update(p_patch or {})
+        request["status"] = p_to_status
+        request["updated_at"] = datetime.now().isoformat()
+        started_at = self._timestamp(request.get("consultation_started_at"))
+        ended_at = self._timestamp((p_patch or {}).get("consultation_ended_at"))
+        if started_at and ended_at:
+            request["consultation_duration_minutes"] = max(0, int((ended_at - started_at).total_seconds() // 60))
+        return {
+            "matched": True,
+            "previous_status": previous["status"],
+            "previous_doctor_id": previous["doctor_id"],
+            "request": dict(request),
+        }
+    
+    def _rpc_increment_doctor_consultations(self, p_doctor_id: str) -> Optional[int]:
+        """Equivalent of increment_doctor_consultations() in supabase/request-transitions.sql"""
+        profile = next((p for p in self.tables.get("doctor_profiles", []) if p.get("user_id") == p_doctor_id), None)
+        if profile is None:
+            return None
+        profile["total_consultations"] = (profile.get("total_consultations") or 0) + 1
+        profile["updated_at"] = datetime.now().isoformat()
+        return profile["total_consultations"]
+    
+    def _rpc_bump_unread_counters(self, p_deltas: List[Dict]) -> None:
+        """Equivalent of bump_unread_counters() in supabase/unread-counters.sql"""
+        rows = {(r["user_id"], r["scope"], r["key"]): r for r in self.tables.setdefault("unread_counters", [])}
+        for delta in p_deltas:
+            counter = (delta["user_id"], delta["scope"], delta.get("key", ""))
+            row = rows.get(counter)
+            if row is None:
+                row = {"user_id": counter[0], "scope": counter[1], "key": counter[2], "count": 0}
+                self.tables["unread_counters"].append(row)
+                rows[counter] = row
+            row["count"] = max(0, row["count"] + delta.get("delta", 1))
+            row["updated_at"] = datetime.now().isoformat()
+    
+    def _rpc_notification_overflow(self, p_max_per_user: int, p_limit: int = 1000) -> List[Dict]:
+        """Equivalent of notification_overflow() in supabase/notification-retention.sql"""
+        by_user: Dict[str, List[Dict]] = {}
+        for n in self.tables.get("notifications", []):
+            by_user.setdefault(n["user_id"], []).append(n)
+        overflow = []
+        for rows in by_user.values():
+            rows = self._sort_records(rows, "created_at.desc,id.desc")
+            overflow.extend(rows[p_max_per_user:])
+        return [dict(n) for n in self._sort_records(overflow, "created_at.asc,id.asc")[:p_limit]]
+    
+    def _rpc_try_acquire_job_lock(self, p_name: str, p_holder: str, p_ttl_seconds: int) -> bool:
+        """Equivalent of try_acquire_job_lock() in supabase/job-locks.sql"""
+        now = datetime.utcnow()
+        locks = self.tables.setdefault("job_locks", [])
+        lock = next((l for l in locks if l["name"] == p_name), None)
+        if lock is not None and lock["expires_at"] >= now.isoformat() and lock["holder"] != p_holder:
+            return False
+        if lock is None:
+            lock = {"name": p_name}
+            locks.append(lock)
+        lock.update({
+            "holder": p_holder, "acquired_at": now.isoformat(),
+            "expires_at": (now + timedelta(seconds=p_ttl_seconds)).isoformat(),
+        })
+        return True
+    
+    def _rpc_release_job_lock(self, p_name: str, p_holder: str) -> bool:
+        """Equivalent of release_job_lock() in supabase/job-locks.sql"""
+        locks = self.tables.get("job_locks", [])
+        remaining = [l for l in locks if not (l["name"] == p_name and l["holder"] == p_holder)]
+        self.tables["job_locks"] = remaining
+        return len(remaining) < len(locks)
+    
+    def _rpc_enqueue_webhook_event(self, p_event: Dict[str, Any]) -> bool:
+        """Equivalent of enqueue_webhook_event() in supabase/webhook-inbox.sql"""
+        inbox = self.tables.setdefault("webhook_inbox", [])
+        if any(e["id"] == p_event["id"] for e in inbox):
+            return False
+        now = datetime.utcnow().isoformat()
+        inbox.append({
+            **p_event, "status": "pending", "attempts": 0, "last_error": None,
+            "received_at": now, "available_at": now, "locked_until": None, "claim_token": None, "processed_at": None,
+        })
+        return True
+    
+    def _rpc_claim_webhook_events(self, p_provider: str, p_token: str, p_limit: int = 10, p_lease_seconds: int = 60) -> List[Dict]:
+        """Equivalent of claim_webhook_events() in supabase/webhook-inbox.sql"""
+        now = datetime.utcnow().isoformat()
+        available = [
+            e for e in self.tables.get("webhook_inbox", [])
+            if e["provider"] == p_provider and (
+                (e["status"] == "pending" and e["available_at"] <= now)
+                or (e["status"] == "processing" and (e["locked_until"] or "") < now)
+            )
+        ]
+        resources: List[str] = []
+        for e in self._sort_records(available, "received_at.asc"):
+            if e["resource_id"] not in resources and len(resources) < p_limit:
+                resources.append(e["resource_id"])
+        
+        locked_until = (datetime.utcnow() + timedelta(seconds=p_lease_seconds)).isoformat()
+        claimed = []
+        for e in available:
+            if e["resource_id"] in resources:
+                e.update({
+                    "status": "processing", "locked_until": locked_until,
+                    "claim_token": p_token, "attempts": e["attempts"] + 1,
+                })
+                claimed.append(dict(e))
+        return claimed
+    
+    def _rpc_complete_payments(self, p_payments: List[Dict], p_payable_statuses: List[str]) -> List[Dict]:
+        """Equivalent of complete_payments() in supabase/payment-completion.sql"""
+        now = datetime.utcnow().isoformat()
+        payments = {p["id"]: p for p in self.tables.get("payments", [])}
+        requests = {r["id"]: r for r in self.tables.get("requests", [])}
+        completed = []
+        for item in sorted(p_payments, key=lambda i: i["payment_id"]):
+            payment = payments.get(item["payment_id"])
+            if payment is None or payment.get("status") == "completed":
+                continue
+            payment.update({
+                "status": "completed",
+                "paid_at": item.get("paid_at") or now,
+                "mp_status": item.get("mp_status") or payment.get("mp_status"),
+                "mp_status_detail": item.get("mp_status_detail") or payment.get("mp_status_detail"),
+            })
+            request = requests.get(payment.get("request_id"))
+            previous = dict(request) if request else None
+            if request and request.get("status") in p_payable_statuses:
+                request.update({"status": "paid", "paid_at": now, "updated_at": now})
+            else:
+                previous = None
+            entry = {
+                "payment": dict(payment),
+                "request": dict(request) if request else None,
+                "previous_request": previous,
+            }
+            outbox = self.tables.setdefault("payment_outbox", [])
+            outbox.append({
+                "id": max((o["id"] for o in outbox), default=0) + 1,
+                "payment_id": payment["id"], "event": entry,
+                "status": "pending", "attempts": 0, "last_error": None,
+                "available_at": now, "locked_until": None, "claim_token": None,
+                "created_at": now, "processed_at": None,
+            })
+            completed.append(entry)
+        return completed
+    
+    def _rpc_claim_payment_outbox(self, p_token: str, p_limit: int = 20, p_lease_seconds: int = 120) -> List[Dict]:
+        """Equivalent of claim_payment_outbox() in supabase/payment-completion.sql"""
+        now = datetime.utcnow().isoformat()
+        available = [
+            o for o in self.tables.get("payment_outbox", [])
+            if (o["status"] == "pending" and o["available_at"] <= now)
+            or (o["status"] == "processing" and (o["locked_until"] or "") < now)
+        ]
+        locked_until = (datetime.utcnow() + timedelta(seconds=p_lease_seconds)).isoformat()
+        claimed = []
+        for o in sorted(available, key=lambda o: o["id"])[:p_limit]:
+            o.update({
+                "status": "processing", "locked_until": locked_until,
+                "claim_token": p_token, "attempts": o["attempts"] + 1,
+            })
+            claimed.append(dict(o))
+        return claimed
+    
+    def _rpc_finish_payment_outbox(
+        self, p_id: int, p_token: str, p_notifications: List[Dict], p_stats_deltas: List[Dict], p_unread_deltas: List[Dict]
+    ) -> bool:
+        """Equivalent of finish_payment_outbox() in supabase/payment-completion.sql"""
+        entry = next((o for o in self.tables.get("payment_outbox", []) if o["id"] == p_id), None)
+        if entry is None or entry["claim_token"] != p_token or entry["status"] != "processing":
+            return False
+        entry.update({
+            "status": "done", "processed_at": datetime.utcnow().isoformat(),
+            "locked_until": None, "last_error": None,
+        })
+        notifications = self.tables.setdefault("notifications", [])
+        existing = {n["id"] for n in notifications}
+        notifications.extend(dict(n) for n in p_notifications if n["id"] not in existing)
+        self._rpc_apply_stats_deltas(p_stats_deltas)
+        self._rpc_bump_unread_counters(p_unread_deltas)
+        return True
+
+    @staticmethod
+    def _timestamp(value: Any) -> Optional[datetime]:
+        """Parse an ISO timestamp as naive UTC (None when missing/invalid)"""
+        if not value:
+            return None
+        try:
+            parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        except ValueError:
+            return None
+        if parsed.tzinfo is not None:
+            parsed = (parsed - parsed.utcoffset()).replace(tzinfo=None)
+        return parsed
+    
+    def _rpc_admin_report(
+        self,
+        p_start: str,
+        p_end: str,
+        p_month_start: str,
+        p_month_end: str,
+        p_top_doctors: int = 5
+    ) -> Dict[str, Any]:
+        """Equivalent of admin_report() in supabase/admin-reports.sql"""
+        start, end = self._timestamp(p_start), self._timestamp(p_end)
+        month_start, month_end = self._timestamp(p_month_start), self._timestamp(p_month_end)
+        
+        def within(value: Any, lower: datetime, upper: datetime) -> bool:
+            ts = self._timestamp(value)
+            return ts is not None and lower <= ts < upper
+        
+        requests = [r for r in self.tables.get("requests", []) if within(r.get("created_at"), start, end)]
+        payments = [p for p in self.tables.get("payments", []) if p.get("status") == "completed"]
+        
+        by_type: Dict[str, int] = {}
+        by_status: Dict[str, int] = {}
+        daily: Dict[str, Dict[str, Any]] = {}
+        doctors: Dict[str, Dict[str, Any]] = {}
+        rating_count, rating_sum = 0, 0.0
+        
+        for r in requests:
+            by_type[r.get("request_type")] = by_type.get(r.get("request_type"), 0) + 1
+            by_status[r.get("status")] = by_status.get(r.get("status"), 0) + 1
+            day = self._timestamp(r["created_at"]).strftime("%Y-%m-%d")
+            daily.setdefault(day, {"date": day, "count": 0, "revenue": 0.0})["count"] += 1
+            
+            rating = (r.get("review") or {}).get("rating")
+            if rating:
+                rating_count += 1
+                rating_sum += rating
+            
+            if r.get("status") == "completed" and r.get("doctor_id"):
+                doctor = doctors.setdefault(r["doctor_id"], {
+                    "doctor_id": r["doctor_id"], "name": None, "consultations": 0, "ratings": []
+                })
+                doctor["name"] = max(filter(None, [doctor["name"], r.get("doctor_name")]), default=None)
+                doctor["consultations"] += 1
+                if rating:
+                    doctor["ratings"].append(rating)
+        
+        revenue_count, revenue_amount, month_revenue = 0, 0.0, 0.0
+        for p in payments:
+            paid_at = p.get("paid_at") or p.get("created_at")
+            amount = float(p.get("amount") or 0)
+            if within(paid_at, start, end):
+                revenue_count += 1
+                revenue_amount += amount
+                day = self._timestamp(paid_at).strftime("%Y-%m-%d")
+                daily.setdefault(day, {"date": day, "count": 0, "revenue": 0.0})["revenue"] += amount
+            if within(paid_at, month_start, month_end):
+                month_revenue += amount
+        
+        top_doctors = sorted(doctors.values(), key=lambda d: d["consultations"], reverse=True)[:p_top_doctors]
+        return {
+            "requests": {"total": len(requests), "by_type": by_type, "by_status": by_status},
+            "revenue": {"count": revenue_count, "amount": round(revenue_amount, 2)},
+            "month_revenue": round(month_revenue, 2),
+            "rating": {"count": rating_count, "sum": rating_sum},
+            "top_doctors": [
+                {
+                    "doctor_id": d["doctor_id"],
+                    "name": d["name"],
+                    "consultations": d["consultations"],
+                    "rating": round(sum(d["ratings"]) / len(d["ratings"]), 1) if d["ratings"] else 0,
+                }
+                for d in top_doctors
+            ],
+            "daily": [
+                {**d, "revenue": round(d["revenue"], 2)}
+                for _, d in sorted(daily.items())
+            ],
+        }
 
 
 class SupabaseDB:
@@ -241,6 +735,20 @@ class SupabaseDB:
     def _get_url(self, table: str) -> str:
         return f"{self.url}/rest/v1/{table}"
     
+    def _filter_params(self, filters: Optional[Dict[str, Any]]) -> List[Tuple[str, str]]:
+        """Build PostgREST filter query params (one param per filter, URL-encoded by httpx)"""
+        params = []
+        for key, value in (filters or {}).items():
+            if isinstance(value, dict):
+                for op, val in value.items():
+                    if op == "in":
+                        params.append((key, f"in.({','.join(str(v) for v in val)})"))
+                    elif op in ("neq", "is", "not.is", "gte", "lte", "gt", "lt"):
+                        params.append((key, f"{op}.{val}"))
+            else:
+                params.append((key, f"eq.{value}"))
+        return params
+    
     async def insert(self, table: str, data: Dict[str, Any]) -> Optional[Dict]:
         """Insert a single record"""
         async with httpx.AsyncClient() as client:
@@ -266,38 +774,20 @@ class SupabaseDB:
         single: bool = False
     ) -> Optional[Union[List[Dict], Dict]]:
         """Select records from table"""
-        url = f"{self._get_url(table)}?select={columns}"
-        
-        if filters:
-            for key, value in filters.items():
-                if isinstance(value, dict):
-                    # Handle operators like {"in": [...], "neq": ..., etc}
-                    for op, val in value.items():
-                        if op == "in":
-                            url += f"&{key}=in.({','.join(val)})"
-                        elif op == "neq":
-                            url += f"&{key}=neq.{val}"
-                        elif op == "is":
-                            url += f"&{key}=is.{val}"
-                        elif op == "gte":
-                            url += f"&{key}=gte.{val}"
-                        elif op == "lte":
-                            url += f"&{key}=lte.{val}"
-                else:
-                    url += f"&{key}=eq.{value}"
+        params = [("select", columns)] + self._filter_params(filters)
         
         if order:
-            url += f"&order={order}"
+            params.append(("order", order))
         
         if limit:
-            url += f"&limit={limit}"
+            params.append(("limit", str(limit)))
         
         headers = self.headers.copy()
         if single:
             headers["Accept"] = "application/vnd.pgrst.object+json"
         
         async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=headers)
+            response = await client.get(self._get_url(table), headers=headers, params=params)
             if response.status_code == 200:
                 return response.json()
             elif response.status_code == 406 and single:
@@ -306,6 +796,47 @@ class SupabaseDB:
                 print(f"Select error: {response.status_code} - {response.text}")
                 return [] if not single else None
     
+    async def select_page(
+        self,
+        table: str,
+        columns: str = "*",
+        filters: Optional[Dict[str, Any]] = None,
+        keys: Tuple[str, ...] = ("created_at", "id"),
+        after: Optional[Tuple] = None,
+        limit: int = 1000,
+        descending: bool = False
+    ) -> List[Dict]:
+        """
+        Select one keyset page ordered by `keys`, strictly after the `after` tuple
+        (strictly before it when `descending`).
+        Unlike offset pagination every page is an index range scan.
+        """
+        params = [("select", columns)] + self._filter_params(filters) + keyset.page_params(keys, after, limit, descending)
+        
+        async with httpx.AsyncClient() as client:
+            response = await client.get(self._get_url(table), headers=self.headers, params=params)
+            if response.status_code == 200:
+                return response.json()
+            print(f"Select page error: {response.status_code} - {response.text}")
+            return []
+    
+    async def upsert(self, table: str, rows: List[Dict[str, Any]], on_conflict: str = "id") -> List[Dict]:
+        """Insert rows, replacing existing ones with the same `on_conflict` value"""
+        headers = self.headers.copy()
+        headers["Prefer"] = "resolution=merge-duplicates,return=representation"
+        
+        async with httpx.AsyncClient() as client:
+            response = await client.post(
+                self._get_url(table),
+                headers=headers,
+                params={"on_conflict": on_conflict},
+                json=rows
+            )
+            if response.status_code in [200, 201]:
+                return response.json()
+            print(f"Upsert error: {response.status_code} - {response.text}")
+            return []
+    
     async def update(
         self, 
         table: str, 
@@ -313,15 +844,11 @@ class SupabaseDB:
         filters: Dict[str, Any]
     ) -> Optional[List[Dict]]:
         """Update records matching filters"""
-        url = self._get_url(table)
-        
-        for key, value in filters.items():
-            url += f"?{key}=eq.{value}"
-        
         async with httpx.AsyncClient() as client:
             response = await client.patch(
-                url,
+                self._get_url(table),
                 headers=self.headers,
+                params=self._filter_params(filters),
                 json=data
             )
             if response.status_code == 200:
@@ -330,42 +857,83 @@ class SupabaseDB:
                 print(f"Update error: {response.status_code} - {response.text}")
                 return None
     
+    async def update_where(self, table: str, data: Dict[str, Any], filters: Dict[str, Any]) -> List[Dict]:
+        """
+        Conditional update (all filters must match, e.g. status=in.(...)).
+        Returns the updated rows; an empty list means no row matched.
+        """
+        async with httpx.AsyncClient() as client:
+            response = await client.patch(
+                self._get_url(table),
+                headers=self.headers,
+                params=self._filter_params(filters),
+                json=data
+            )
+            if response.status_code == 200:
+                return response.json()
+            print(f"Update error: {response.status_code} - {response.text}")
+            return []
+    
+    async def update_many(self, table: str, data: Dict[str, Any], filters: Dict[str, Any]) -> int:
+        """
+        Bulk update in one PATCH. The rows are not sent back (return=minimal);
+        the affected count comes from the Content-Range header (count=exact).
+        """
+        headers = {**self.headers, "Prefer": "return=minimal,count=exact"}
+        async with httpx.AsyncClient() as client:
+            response = await client.patch(
+                self._get_url(table),
+                headers=headers,
+                params=self._filter_params(filters),
+                json=data
+            )
+            if response.status_code in [200, 204]:
+                return self._range_total(response.headers.get("content-range", ""))
+            print(f"Update error: {response.status_code} - {response.text}")
+            return 0
+    
     async def delete(self, table: str, filters: Dict[str, Any]) -> bool:
         """Delete records matching filters"""
-        url = self._get_url(table)
-        
-        for key, value in filters.items():
-            url += f"?{key}=eq.{value}"
-        
         async with httpx.AsyncClient() as client:
-            response = await client.delete(url, headers=self.headers)
+            response = await client.delete(
+                self._get_url(table),
+                headers=self.headers,
+                params=self._filter_params(filters)
+            )
             return response.status_code in [200, 204]
     
+    async def delete_many(self, table: str, filters: Dict[str, Any]) -> int:
+        """Bulk delete in one request; the count comes from Content-Range (count=exact)"""
+        headers = {**self.headers, "Prefer": "return=minimal,count=exact"}
+        async with httpx.AsyncClient() as client:
+            response = await client.delete(
+                self._get_url(table),
+                headers=headers,
+                params=self._filter_params(filters)
+            )
+            if response.status_code in [200, 204]:
+                return self._range_total(response.headers.get("content-range", ""))
+            print(f"Delete error: {response.status_code} - {response.text}")
+            return 0
+    
     async def count(self, table: str, filters: Optional[Dict[str, Any]] = None) -> int:
         """Count records matching filters"""
-        url = f"{self._get_url(table)}?select=count"
-        
-        if filters:
-            for key, value in filters.items():
-                if isinstance(value, dict):
-                    for op, val in value.items():
-                        if op == "in":
-                            url += f"&{key}=in.({','.join(val)})"
-                        elif op == "neq":
-                            url += f"&{key}=neq.{val}"
-                else:
-                    url += f"&{key}=eq.{value}"
-        
         headers = self.headers.copy()
         headers["Prefer"] = "count=exact"
         
         async with httpx.AsyncClient() as client:
-            response = await client.head(url, headers=headers)
-            count_header = response.headers.get("content-range", "0")
-            # Format is "0-X/total" or "*/total"
-            if "/" in count_header:
-                return int(count_header.split("/")[1])
-            return 0
+            response = await client.head(
+                self._get_url(table),
+                headers=headers,
+                params=[("select", "count")] + self._filter_params(filters)
+            )
+            return self._range_total(response.headers.get("content-range", ""))
+    
+    @staticmethod
+    def _range_total(content_range: str) -> int:
+        """Total from a Content-Range header ("0-X/total" or "*/total")"""
+        total = content_range.rpartition("/")[2]
+        return int(total) if total.isdigit() else 0
     
     async def rpc(self, function_name: str, params: Dict[str, Any] = None) -> Any:
         """Call a Supabase RPC function"""
@@ -415,11 +983,159 @@ async def update_one(table: str, filters: Dict[str, Any], data: Dict[str, Any])
     return result is not None
 
 
+async def update_where(table: str, filters: Dict[str, Any], data: Dict[str, Any]) -> List[Dict]:
+    """
+    Update records only if they still match filters (compare-and-swap).
+    Returns the updated records; empty if nothing matched.
+    
+        claimed = await update_where("requests", {"id": rid, "status": {"in": ["submitted"]}}, {...})
+    """
+    return await db.update_where(table, data, filters)
+
+
+async def update_many(table: str, filters: Dict[str, Any], data: Dict[str, Any]) -> int:
+    """
+    Update every record matching filters in a single statement.
+    Returns how many records were updated.
+    
+        count = await update_many("notifications", {"user_id": uid, "read": False}, {"read": True})
+    """
+    if not filters:
+        raise ValueError("update_many requires at least one filter")
+    return await db.update_many(table, data, filters)
+
+
 async def delete_one(table: str, filters: Dict[str, Any]) -> bool:
     """Delete a single record"""
     return await db.delete(table, filters)
 
 
+async def delete_many(table: str, filters: Dict[str, Any]) -> int:
+    """Delete every record matching filters in one statement; returns how many"""
+    if not filters:
+        raise ValueError("delete_many requires at least one filter")
+    return await db.delete_many(table, filters)
+
+
 async def count_docs(table: str, filters: Optional[Dict[str, Any]] = None) -> int:
     """Count documents matching filters"""
     return await db.count(table, filters)
+
+
+async def upsert_many(table: str, rows: List[Dict[str, Any]], on_conflict: str = "id") -> List[Dict]:
+    """Insert or replace several records in one request"""
+    if not rows:
+        return []
+    return await db.upsert(table, rows, on_conflict=on_conflict)
+
+
+async def call_rpc(function_name: str, params: Optional[Dict[str, Any]] = None) -> Any:
+    """Call a database function (PostgREST RPC, or its local equivalent in the mock)"""
+    return await db.rpc(function_name, params or {})
+
+
+def in_chunks(values: Sequence[Any], size: Optional[int] = None) -> Iterator[List[Any]]:
+    """
+    Split the values of an `in` filter so each query's URL stays short:
+
+        for ids in in_chunks(request_ids):
+            rows += await find_many("requests", {"id": {"in": ids}}, limit=len(ids))
+    """
+    size = size or MAX_IN_FILTER_VALUES
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+async def find_page(
+    table: str,
+    filters: Optional[Dict[str, Any]] = None,
+    keys: Tuple[str, ...] = ("created_at", "id"),
+    after: Optional[Tuple] = None,
+    limit: int = 100,
+    descending: bool = False,
+    columns: str = "*"
+) -> List[Dict]:
+    """
+    One keyset page: records ordered by `keys` strictly after the `after`
+    tuple (before it, newest first, when `descending`).
+    """
+    return await db.select_page(table, columns=columns, filters=filters, keys=keys, after=after, limit=limit, descending=descending)
+
+
+async def iter_pages(
+    table: str,
+    columns: str = "*",
+    filters: Optional[Dict[str, Any]] = None,
+    keys: Tuple[str, ...] = ("created_at", "id"),
+    page_size: int = 1000
+) -> AsyncIterator[List[Dict]]:
+    """
+    Iterate over every record matching filters, one keyset page at a time.
+    Memory stays bounded by page_size regardless of table size.
+    """
+    columns = keyset.with_key_columns(columns, keys)
+    
+    after = None
+    while True:
+        page = await db.select_page(table, columns=columns, filters=filters, keys=keys, after=after, limit=page_size)
+        if not page:
+            break
+        yield page
+        after = keyset.next_after(page, keys, page_size)
+        if after is None:
+            break
+
+
+async def gather_queries(
+    queries: Dict[str, Awaitable],
+    defaults: Optional[Dict[str, Any]] = None,
+    max_parallel: int = MAX_PARALLEL_QUERIES
+) -> Dict[str, Any]:
+    """
+    Run a set of independent reads concurrently and return their results by name.
+    
+    N round-trips cost roughly the latency of the slowest one instead of the sum.
+    At most `max_parallel` queries are in flight at once.
+    
+    Errors behave like sequential awaits: the first exception cancels the
+    queries still running and is re-raised (e.g. an HTTPException from an auth
+    check). Queries listed in `defaults` are optional instead: their failure is
+    logged and the default is returned in their place.
+    
+        results = await gather_queries({
+            "user": find_one("users", {"id": user_id}),
+            "profile": find_one("doctor_profiles", {"user_id": user_id}),
+        }, defaults={"profile": None})
+    """
+    defaults = defaults or {}
+    semaphore = asyncio.Semaphore(max(1, max_parallel))
+    
+    async def run(name: str, query: Awaitable) -> Any:
+        async with semaphore:
+            try:
+                return await query
+            except Exception as e:
+                if name not in defaults:
+                    raise
+                print(f"Query error ({name}): {e}")
+                return defaults[name]
+    
+    tasks = {name: asyncio.ensure_future(run(name, query)) for name, query in queries.items()}
+    if not tasks:
+        return {}
+    
+    done, pending = await asyncio.wait(tasks.values(), return_when=asyncio.FIRST_EXCEPTION)
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+        for query in queries.values():
+            if asyncio.iscoroutine(query):
+                query.close()  # never started: avoid "was never awaited" warnings
+    
+    for task in tasks.values():
+        if task in done and task.exception() is not None:
+            raise task.exception()
+    
+    return {name: task.result() for name, task in tasks.items()}
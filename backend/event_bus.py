@@ -0,0 +1,458 @@
+"""
+Event Bus for RenoveJá+
+Eventos entre workers/nós: pedidos, transições, chat e pagamentos
+
+Cada worker publica no barramento e recebe os eventos de todos os workers
+(inclusive os próprios), então uma fila ou chat em tempo real conectado a
+qualquer worker vê as mudanças feitas em qualquer outro.
+
+Adaptadores (EVENT_BUS_URL):
+    memory://                       - em processo (padrão, um único worker)
+    unix:///tmp/renoveja-bus.sock   - broker local por Unix socket (dev/testes)
+    redis://host:6379/0             - Redis Streams (pacote `redis`, opcional)
+    postgresql://...                - tabela event_log + LISTEN/NOTIFY (pacote
+                                      `asyncpg`, opcional; supabase/event-bus.sql)
+
+Garantias:
+- pelo menos uma vez: os adaptadores retomam a partir do último offset
+  recebido após uma reconexão; eventos repetidos são descartados pelo id.
+  Um broker reiniciado tem outra época: os clientes recebem todo o backlog
+  novo em vez de pular offsets que recomeçaram do zero. No Postgres, ids
+  pulados (transação ainda não commitada) são relidos até aparecerem ou
+  até EVENT_BUS_GAP_SECONDS (rollback); o event_log é podado pelos próprios
+  workers a cada EVENT_BUS_PRUNE_SECONDS
+- ordem: todos os eventos passam por um log único (broker, stream ou
+  tabela) e são entregues aos handlers em sequência, então os eventos de
+  uma mesma solicitação (`key`) chegam na ordem em que foram publicados
+
+Broker local:
+    python event_bus.py broker --path /tmp/renoveja-bus.sock
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple, Callable, Awaitable
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+EVENT_BUS_URL = os.getenv("EVENT_BUS_URL", "memory://")
+EVENT_BUS_BACKLOG = int(os.getenv("EVENT_BUS_BACKLOG", "10000"))
+EVENT_BUS_RECONNECT_SECONDS = float(os.getenv("EVENT_BUS_RECONNECT_SECONDS", "1"))
+EVENT_BUS_CHANNEL = os.getenv("EVENT_BUS_CHANNEL", "renoveja_events")
+# Postgres: quanto esperar por um id pulado e de quanto em quanto tempo podar o event_log
+EVENT_BUS_GAP_SECONDS = float(os.getenv("EVENT_BUS_GAP_SECONDS", "60"))
+EVENT_BUS_PRUNE_SECONDS = float(os.getenv("EVENT_BUS_PRUNE_SECONDS", "3600"))
+EVENT_BUS_RETENTION = os.getenv("EVENT_BUS_RETENTION", "1 day")
+
+# Identifica este worker nos eventos que publica
+NODE_ID = f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+Handler = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+def make_event(event_type: str, key: str, payload: Dict[str, Any], event_id: str = None) -> Dict[str, Any]:
+    return {
+        "id": event_id or uuid.uuid4().hex,
+        "type": event_type,
+        "key": key,
+        "payload": payload,
+        "node": NODE_ID,
+        "created_at": datetime.utcnow().isoformat(),
+    }
+
+
+class EventBus:
+    """
+    Base class / in-process adapter. Subclasses implement `_send` and,
+    when they receive from a shared log, call `_deliver` in log order.
+    """
+
+    def __init__(self, dedupe_size: int = EVENT_BUS_BACKLOG):
+        self._handlers: List[Tuple[str, Handler]] = []
+        self._seen: "OrderedDict[str, None]" = OrderedDict()
+        self._dedupe_size = dedupe_size
+        self._lock = asyncio.Lock()
+
+    def subscribe(self, prefix: str, handler: Handler):
+        """Call `handler(event)` for every event whose type starts with `prefix`"""
+        self._handlers.append((prefix, handler))
+
+    async def publish(self, event_type: str, key: str, payload: Dict[str, Any], event_id: str = None) -> Dict[str, Any]:
+        """`event_id` makes a republished event (e.g. an outbox retry) a duplicate the subscribers skip"""
+        event = make_event(event_type, key, payload, event_id)
+        await self._send(event)
+        return event
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def _send(self, event: Dict[str, Any]):
+        await self._deliver(event)
+
+    async def _deliver(self, event: Dict[str, Any]):
+        # Um evento por vez: preserva a ordem do log para os handlers
+        async with self._lock:
+            if event["id"] in self._seen:
+                return
+            self._seen[event["id"]] = None
+            if len(self._seen) > self._dedupe_size:
+                self._seen.popitem(last=False)
+
+            for prefix, handler in self._handlers:
+                if event["type"].startswith(prefix):
+                    try:
+                        await handler(event)
+                    except Exception as e:
+                        print(f"Event handler error ({event['type']}): {e}")
+
+
+# ============== BROKER LOCAL (UNIX SOCKET) ==============
+
+class LocalBroker:
+    """
+    Minimal broker: numbers every published event, keeps the last
+    `backlog` in memory and broadcasts them (newline-delimited JSON).
+    A client that reconnects with {"op": "sub", "after": offset, "epoch": e}
+    gets everything it missed that is still in the backlog. Offsets restart
+    at zero with the broker, so an offset from another epoch means "all of it".
+    """
+
+    def __init__(self, path: str, backlog: int = EVENT_BUS_BACKLOG):
+        self.path = path
+        self.log: deque = deque(maxlen=backlog)
+        self.offset = 0
+        self.epoch = uuid.uuid4().hex
+        self._clients: Dict[asyncio.StreamWriter, Optional[int]] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._handle, path=self.path)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        for writer in list(self._clients):
+            writer.close()
+        self._clients.clear()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                if message["op"] == "sub":
+                    after = message.get("after")
+                    if after is None:
+                        after = self.offset
+                    elif message.get("epoch") != self.epoch:
+                        after = 0  # broker reiniciado: tudo no backlog é novo para o cliente
+                    for offset, event in self.log:
+                        if offset > after:
+                            writer.write(_frame({"epoch": self.epoch, "offset": offset, "event": event}))
+                    self._clients[writer] = after
+                    await writer.drain()
+                elif message["op"] == "pub":
+                    self.offset += 1
+                    entry = (self.offset, message["event"])
+                    self.log.append(entry)
+                    frame = _frame({"epoch": self.epoch, "offset": entry[0], "event": entry[1]})
+                    for client in list(self._clients):
+                        try:
+                            client.write(frame)
+                            await client.drain()
+                        except (ConnectionError, RuntimeError):
+                            self._clients.pop(client, None)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._clients.pop(writer, None)
+            writer.close()
+
+
+def _frame(message: Dict[str, Any]) -> bytes:
+    return (json.dumps(message, default=str) + "\n").encode()
+
+
+class SocketBus(EventBus):
+    """Client of LocalBroker; reconnects and resumes from the last offset"""
+
+    def __init__(self, path: str, reconnect_seconds: float = EVENT_BUS_RECONNECT_SECONDS):
+        super().__init__()
+        self.path = path
+        self.reconnect_seconds = reconnect_seconds
+        self.last_offset: Optional[int] = None
+        self.epoch: Optional[str] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._pending: List[Dict[str, Any]] = []
+        self._task: Optional[asyncio.Task] = None
+        self._connected = asyncio.Event()
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+            await asyncio.wait_for(self._connected.wait(), timeout=5)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def _send(self, event: Dict[str, Any]):
+        if self._writer is None:
+            # Desconectado: reenviado ao reconectar
+            self._pending.append(event)
+            return
+        try:
+            self._writer.write(_frame({"op": "pub", "event": event}))
+            await self._writer.drain()
+        except (ConnectionError, RuntimeError):
+            self._pending.append(event)
+
+    async def _run(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+                writer.write(_frame({"op": "sub", "after": self.last_offset, "epoch": self.epoch}))
+                pending, self._pending = self._pending, []
+                for event in pending:
+                    writer.write(_frame({"op": "pub", "event": event}))
+                await writer.drain()
+                self._writer = writer
+                self._connected.set()
+
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    message = json.loads(line)
+                    self.epoch = message["epoch"]
+                    self.last_offset = message["offset"]
+                    await self._deliver(message["event"])
+            except (ConnectionError, FileNotFoundError, OSError) as e:
+                print(f"Event bus connection error: {e}")
+            self._writer = None
+            self._connected.clear()
+            await asyncio.sleep(self.reconnect_seconds)
+
+
+# ============== REDIS STREAMS ==============
+
+class RedisStreamBus(EventBus):
+    """Single Redis stream (XADD/XREAD); resumes from the last entry id"""
+
+    def __init__(self, url: str, stream: str = EVENT_BUS_CHANNEL, maxlen: int = EVENT_BUS_BACKLOG):
+        if aioredis is None:
+            raise RuntimeError("Pacote redis não instalado (pip install redis)")
+        super().__init__()
+        self.client = aioredis.from_url(url)
+        self.stream = stream
+        self.maxlen = maxlen
+        self.last_id = "$"
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.client.close()
+
+    async def _send(self, event: Dict[str, Any]):
+        await self.client.xadd(self.stream, {"event": json.dumps(event, default=str)}, maxlen=self.maxlen, approximate=True)
+
+    async def _run(self):
+        while True:
+            try:
+                entries = await self.client.xread({self.stream: self.last_id}, block=5000, count=500)
+                for _, messages in entries or []:
+                    for entry_id, fields in messages:
+                        self.last_id = entry_id
+                        await self._deliver(json.loads(fields[b"event"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Event bus (redis) error: {e}")
+                await asyncio.sleep(EVENT_BUS_RECONNECT_SECONDS)
+
+
+# ============== POSTGRES (LISTEN/NOTIFY) ==============
+
+class LogCursor:
+    """
+    Read position in event_log. Ids come from a sequence and are taken before
+    commit, so a reader can see id 12 while id 11 is still uncommitted: 11 is
+    kept as a gap and looked up again until it shows up or gap_seconds pass
+    (the transaction rolled back and the id will never exist).
+    """
+
+    def __init__(self, last_id: int, gap_seconds: float = EVENT_BUS_GAP_SECONDS, max_gaps: int = EVENT_BUS_BACKLOG):
+        self.last_id = last_id
+        self.gap_seconds = gap_seconds
+        self.max_gaps = max_gaps
+        self.gaps: "OrderedDict[int, float]" = OrderedDict()  # id -> quando foi pulado
+
+    def pending_gaps(self, now: float = None) -> List[int]:
+        """Gap ids still worth looking up (expired ones are dropped)"""
+        now = time.monotonic() if now is None else now
+        while self.gaps and next(iter(self.gaps.values())) <= now - self.gap_seconds:
+            self.gaps.popitem(last=False)
+        return list(self.gaps)
+
+    def seen(self, row_id: int, now: float = None) -> bool:
+        """Record a row read from the log; False when it was already delivered"""
+        if self.gaps.pop(row_id, None) is not None:
+            return True
+        if row_id <= self.last_id:
+            return False
+        now = time.monotonic() if now is None else now
+        for missing in range(max(self.last_id + 1, row_id - self.max_gaps), row_id):
+            self.gaps[missing] = now
+        while len(self.gaps) > self.max_gaps:
+            self.gaps.popitem(last=False)
+        self.last_id = row_id
+        return True
+
+
+class PostgresBus(EventBus):
+    """
+    Events are rows of event_log (supabase/event-bus.sql); NOTIFY only
+    carries the new id, listeners read every row after the last one seen,
+    plus the skipped ids that may still commit (LogCursor).
+    """
+
+    def __init__(self, dsn: str, channel: str = EVENT_BUS_CHANNEL):
+        if asyncpg is None:
+            raise RuntimeError("Pacote asyncpg não instalado (pip install asyncpg)")
+        super().__init__()
+        self.dsn = dsn
+        self.channel = channel
+        self.cursor: Optional[LogCursor] = None
+        self._pool = None
+        self._listener = None
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._next_prune = 0.0
+
+    async def start(self):
+        self._pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=4)
+        if self.cursor is None:
+            self.cursor = LogCursor(await self._pool.fetchval("SELECT COALESCE(MAX(id), 0) FROM event_log"))
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._listener is not None:
+            await self._listener.close()
+        if self._pool is not None:
+            await self._pool.close()
+
+    async def _send(self, event: Dict[str, Any]):
+        await self._pool.execute("SELECT publish_event($1::jsonb, $2)", json.dumps(event, default=str), self.channel)
+
+    async def _read(self) -> int:
+        """Deliver late commits and new rows; returns how many new rows were read"""
+        rows = []
+        gaps = self.cursor.pending_gaps()
+        if gaps:
+            rows = await self._pool.fetch("SELECT id, event FROM event_log WHERE id = ANY($1::bigint[]) ORDER BY id", gaps)
+        new_rows = await self._pool.fetch(
+            "SELECT id, event FROM event_log WHERE id > $1 ORDER BY id LIMIT 500", self.cursor.last_id
+        )
+        for row in list(rows) + list(new_rows):
+            if self.cursor.seen(row["id"]):
+                await self._deliver(json.loads(row["event"]))
+        return len(new_rows)
+
+    async def _prune(self):
+        # prune_event_log usa um advisory lock: um worker poda, os outros seguem
+        if time.monotonic() < self._next_prune:
+            return
+        self._next_prune = time.monotonic() + EVENT_BUS_PRUNE_SECONDS
+        deleted = await self._pool.fetchval("SELECT prune_event_log($1::interval)", EVENT_BUS_RETENTION)
+        if deleted:
+            print(f"Event bus: {deleted} eventos antigos removidos do event_log")
+
+    async def _run(self):
+        while True:
+            try:
+                self._listener = await asyncpg.connect(self.dsn)
+                await self._listener.add_listener(self.channel, lambda *args: self._wakeup.set())
+                while True:
+                    # Também relê após reconectar: nada publicado no intervalo se perde
+                    read = await self._read()
+                    await self._prune()
+                    if read < 500:
+                        self._wakeup.clear()
+                        try:
+                            # O NOTIFY de um id atrasado também acorda a leitura
+                            await asyncio.wait_for(self._wakeup.wait(), timeout=5 if self.cursor.gaps else 30)
+                        except asyncio.TimeoutError:
+                            pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Event bus (postgres) error: {e}")
+                await asyncio.sleep(EVENT_BUS_RECONNECT_SECONDS)
+
+
+def create_bus(url: str = None) -> EventBus:
+    """Pick the adapter for EVENT_BUS_URL"""
+    url = url or EVENT_BUS_URL
+    if url.startswith("memory://"):
+        return EventBus()
+    if url.startswith("unix://"):
+        return SocketBus(url[len("unix://"):])
+    if url.startswith(("redis://", "rediss://")):
+        return RedisStreamBus(url)
+    if url.startswith(("postgres://", "postgresql://")):
+        return PostgresBus(url)
+    raise ValueError(f"EVENT_BUS_URL não suportada: {url}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Broker local do barramento de eventos")
+    parser.add_argument("command", choices=["broker"])
+    parser.add_argument("--path", default="/tmp/renoveja-bus.sock")
+    args = parser.parse_args()
+
+    async def serve():
+        broker = LocalBroker(args.path)
+        await broker.start()
+        print(f"✅ Broker ouvindo em unix://{args.path}")
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
@@ -0,0 +1,39 @@
+"""
+Job Locks for RenoveJá+
+Garante que um job em segundo plano rode em um worker por vez
+
+Cada worker do uvicorn tem seus próprios agendadores; sem trava, o mesmo
+job rodaria N vezes ao mesmo tempo. A trava é uma linha em `job_locks`
+(supabase/job-locks.sql) com prazo: quem não consegue pegá-la pula a
+execução, e se o worker morrer a trava expira sozinha depois de ttl.
+
+    async with job_lock("notification_retention", ttl_seconds=3600) as acquired:
+        if acquired:
+            ...
+
+O ttl deve ser maior que a duração esperada do job.
+"""
+
+import os
+import uuid
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from database import call_rpc
+
+NODE_ID = f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+@asynccontextmanager
+async def job_lock(name: str, ttl_seconds: float) -> AsyncIterator[bool]:
+    """Try to take the lock `name` for up to `ttl_seconds`; yields whether it was taken"""
+    # Um holder por execução: uma execução antiga do mesmo processo não "herda" a trava
+    holder = f"{NODE_ID}:{uuid.uuid4().hex[:8]}"
+    acquired = bool(await call_rpc("try_acquire_job_lock", {
+        "p_name": name, "p_holder": holder, "p_ttl_seconds": int(ttl_seconds)
+    }))
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            await call_rpc("release_job_lock", {"p_name": name, "p_holder": holder})
@@ -0,0 +1,113 @@
+"""
+Keyset Pagination for RenoveJá+
+Paginação por chave (created_at, id) para leituras em massa no PostgREST
+
+Com offset/limit o Postgres precisa percorrer e descartar todas as linhas
+anteriores a cada página (O(n²) no total) e linhas inseridas durante a
+leitura deslocam as páginas seguintes. Com keyset cada página continua do
+último registro lido:
+
+    WHERE (created_at, id) > (último_created_at, último_id)
+    ORDER BY created_at, id LIMIT n
+
+que é uma busca no índice, e nenhuma linha é pulada ou repetida.
+
+Usado por database.py (SupabaseDB.select_page / iter_pages) e pelo
+backup_manager.py. O marcador de snapshot (snapshot_marker) fixa o fim da
+leitura: linhas criadas depois dele ficam para o próximo backup.
+"""
+
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple, Iterator, Callable
+
+DEFAULT_KEYS = ("created_at", "id")
+
+Params = List[Tuple[str, str]]
+
+
+def _quote(value: Any) -> str:
+    """Quote a value for a PostgREST logic tree (or=(...), and(...))"""
+    text = str(value).replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{text}"'
+
+
+def order_param(keys: Tuple[str, ...] = DEFAULT_KEYS, descending: bool = False) -> str:
+    direction = "desc" if descending else "asc"
+    return ",".join(f"{k}.{direction}" for k in keys)
+
+
+def after_filter(keys: Tuple[str, ...], after: Tuple, descending: bool = False) -> str:
+    """
+    PostgREST `or` value for the row-value comparison (k1, k2) > (v1, v2):
+    k1 > v1 OR (k1 = v1 AND k2 > v2); `<` when descending.
+    """
+    operator = "lt" if descending else "gt"
+    clauses = []
+    for i, key in enumerate(keys):
+        equal = [f"{k}.eq.{_quote(v)}" for k, v in zip(keys[:i], after[:i])]
+        beyond = f"{key}.{operator}.{_quote(after[i])}"
+        clauses.append(f"and({','.join(equal + [beyond])})" if equal else beyond)
+    return f"({','.join(clauses)})"
+
+
+def page_params(
+    keys: Tuple[str, ...] = DEFAULT_KEYS,
+    after: Optional[Tuple] = None,
+    limit: int = 1000,
+    descending: bool = False
+) -> Params:
+    """Query parameters for one keyset page (to append to select/filters)"""
+    params: Params = []
+    if after is not None:
+        params.append(("or", after_filter(keys, after, descending)))
+    params.append(("order", order_param(keys, descending)))
+    params.append(("limit", str(limit)))
+    return params
+
+
+def key_of(record: Dict[str, Any], keys: Tuple[str, ...] = DEFAULT_KEYS) -> Tuple:
+    return tuple(record.get(k) for k in keys)
+
+
+def next_after(page: List[Dict[str, Any]], keys: Tuple[str, ...] = DEFAULT_KEYS, limit: int = None) -> Optional[Tuple]:
+    """Cursor for the page after `page`; None when this was the last one"""
+    if not page or (limit is not None and len(page) < limit):
+        return None
+    return key_of(page[-1], keys)
+
+
+def with_key_columns(columns: str, keys: Tuple[str, ...] = DEFAULT_KEYS) -> str:
+    """Make sure the key columns are selected (the cursor is built from them)"""
+    if columns == "*":
+        return columns
+    selected = columns.split(",")
+    return ",".join(selected + [k for k in keys if k not in selected])
+
+
+def snapshot_marker(now: datetime = None) -> str:
+    """UTC timestamp that bounds a multi-page read (created_at <= marker)"""
+    return (now or datetime.utcnow()).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def snapshot_params(snapshot: Optional[str], column: str = "created_at") -> Params:
+    return [(column, f"lte.{snapshot}")] if snapshot else []
+
+
+def iter_keyset(
+    fetch: Callable[[Optional[Tuple]], List[Dict[str, Any]]],
+    keys: Tuple[str, ...] = DEFAULT_KEYS,
+    page_size: int = 1000
+) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Drive a synchronous page fetcher: fetch(after) returns the page that
+    follows `after` (None for the first page). Yields non-empty pages.
+    """
+    after = None
+    while True:
+        page = fetch(after)
+        if not page:
+            return
+        yield page
+        after = next_after(page, keys, page_size)
+        if after is None:
+            return
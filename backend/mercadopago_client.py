@@ -0,0 +1,231 @@
+"""
+MercadoPago Client for RenoveJá+
+Cliente HTTP compartilhado para a API do MercadoPago (PIX)
+
+- Um único httpx.AsyncClient com keep-alive para todo o processo, em vez de
+  abrir uma conexão TLS nova a cada chamada.
+- Novas tentativas com backoff exponencial (e Retry-After, limitado a
+  MP_MAX_BACKOFF_SECONDS) para falhas de rede, 429 e 5xx. A criação do PIX reaproveita a mesma X-Idempotency-Key
+  em todas as tentativas, então repetir não gera cobrança duplicada.
+- Cache curto do status de cada pagamento, com single-flight: enquanto um
+  PIX está pendente, várias consultas (polling do app) do mesmo pagamento
+  viram uma única chamada ao MercadoPago. Status finais ficam mais tempo;
+  o cache é um LRU de até MP_STATUS_CACHE_MAX_ENTRIES pagamentos.
+
+    status = await mercadopago.get_payment_status(mp_payment_id)
+    status = await mercadopago.get_payment_status(mp_payment_id, fresh=True)  # webhook
+"""
+
+import asyncio
+import os
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, Optional
+
+import httpx
+
+from ttl_cache import TTLCache
+
+MERCADOPAGO_API_URL = os.getenv("MERCADOPAGO_API_URL", "https://api.mercadopago.com")
+
+MP_MAX_RETRIES = int(os.getenv("MP_MAX_RETRIES", "3"))
+MP_BACKOFF_SECONDS = float(os.getenv("MP_BACKOFF_SECONDS", "0.5"))
+# Espera máxima entre tentativas, mesmo que o Retry-After peça mais
+MP_MAX_BACKOFF_SECONDS = float(os.getenv("MP_MAX_BACKOFF_SECONDS", "10"))
+MP_MAX_CONNECTIONS = int(os.getenv("MP_MAX_CONNECTIONS", "20"))
+# Status pendente: curto, para o paciente ver a aprovação logo
+MP_STATUS_CACHE_SECONDS = float(os.getenv("MP_STATUS_CACHE_SECONDS", "5"))
+# Status final (aprovado, recusado...): não muda mais
+MP_FINAL_STATUS_CACHE_SECONDS = float(os.getenv("MP_FINAL_STATUS_CACHE_SECONDS", "3600"))
+MP_STATUS_CACHE_MAX_ENTRIES = int(os.getenv("MP_STATUS_CACHE_MAX_ENTRIES", "10000"))
+# Validade do código PIX (o app também desiste de aguardar após 30 minutos)
+MP_PIX_EXPIRATION_MINUTES = int(os.getenv("MP_PIX_EXPIRATION_MINUTES", "30"))
+
+FINAL_STATUSES = {"approved", "rejected", "cancelled", "refunded", "charged_back"}
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class MercadoPagoClient:
+    """Pooled, retrying MercadoPago API client with a per-payment status cache"""
+
+    def __init__(
+        self,
+        access_token: str,
+        base_url: str = MERCADOPAGO_API_URL,
+        max_retries: int = MP_MAX_RETRIES,
+        backoff: float = MP_BACKOFF_SECONDS,
+        status_ttl: float = MP_STATUS_CACHE_SECONDS,
+        final_status_ttl: float = MP_FINAL_STATUS_CACHE_SECONDS,
+        transport: Optional[httpx.AsyncBaseTransport] = None
+    ):
+        self.access_token = access_token
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.status_ttl = status_ttl
+        self.final_status_ttl = final_status_ttl
+        self.transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        # mp_payment_id -> status
+        self._status_cache = TTLCache(maxsize=MP_STATUS_CACHE_MAX_ENTRIES, ttl=status_ttl)
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.access_token)
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"Authorization": f"Bearer {self.access_token}"},
+                limits=httpx.Limits(max_connections=MP_MAX_CONNECTIONS, max_keepalive_connections=MP_MAX_CONNECTIONS),
+                timeout=httpx.Timeout(15.0, connect=5.0),
+                transport=self.transport
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _retry_delay(self, attempt: int, response: Optional[httpx.Response]) -> float:
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), MP_MAX_BACKOFF_SECONDS)
+        return min(self.backoff * (2 ** attempt) * (0.5 + random.random() / 2), MP_MAX_BACKOFF_SECONDS)
+
+    async def _request(self, method: str, path: str, **kwargs) -> Optional[httpx.Response]:
+        """Send with retries; returns the last response (None if the network kept failing)"""
+        client = self._get_client()
+        response = None
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await client.request(method, path, **kwargs)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    return response
+            except httpx.TransportError as e:
+                print(f"MercadoPago network error ({attempt + 1}/{self.max_retries + 1}): {e}")
+                response = None
+            if attempt < self.max_retries:
+                await asyncio.sleep(self._retry_delay(attempt, response))
+        return response
+
+    @staticmethod
+    def _json(response: httpx.Response) -> Optional[Dict[str, Any]]:
+        """Body of a 2xx response; None when it is not a JSON object (e.g. a proxy error page)"""
+        try:
+            data = response.json()
+        except ValueError:
+            print(f"MercadoPago invalid JSON: {response.status_code} - {response.text[:200]}")
+            return None
+        return data if isinstance(data, dict) else None
+
+    # ============== PAGAMENTOS ==============
+
+    async def create_pix(self, amount: float, description: str, payer_email: str, external_reference: str) -> Optional[Dict[str, Any]]:
+        """Create a PIX payment; None when not configured or on failure"""
+        if not self.configured:
+            return None
+
+        response = await self._request(
+            "POST", "/v1/payments",
+            headers={"X-Idempotency-Key": str(uuid.uuid4())},  # a mesma em todas as tentativas
+            json={
+                "transaction_amount": float(amount),
+                "description": description,
+                "payment_method_id": "pix",
+                "payer": {"email": payer_email},
+                "external_reference": external_reference,
+                "date_of_expiration": (
+                    datetime.now(timezone.utc) + timedelta(minutes=MP_PIX_EXPIRATION_MINUTES)
+                ).strftime("%Y-%m-%dT%H:%M:%S.000+00:00")
+            },
+            timeout=30.0
+        )
+        if response is None or response.status_code not in [200, 201]:
+            if response is not None:
+                print(f"MercadoPago error: {response.status_code} - {response.text}")
+            return None
+
+        data = self._json(response)
+        if data is None:
+            return None
+        transaction = data.get("point_of_interaction", {}).get("transaction_data", {})
+        self._cache_status(str(data.get("id")), {"status": data.get("status"), "status_detail": data.get("status_detail"), "date_approved": None})
+        return {
+            "mp_payment_id": str(data.get("id")),
+            "status": data.get("status"),
+            "pix_code": transaction.get("qr_code"),
+            "pix_qr_base64": transaction.get("qr_code_base64"),
+            "ticket_url": transaction.get("ticket_url")
+        }
+
+    async def get_payment_status(self, mp_payment_id: str, fresh: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        {status, status_detail, date_approved} of a payment, or None on failure.
+        Concurrent calls for the same payment share one upstream request;
+        `fresh` skips the cache (e.g. a webhook said the payment changed).
+        """
+        if not self.configured or not mp_payment_id:
+            return None
+        mp_payment_id = str(mp_payment_id)
+
+        if not fresh:
+            cached = self._status_cache.get(mp_payment_id)
+            if cached is not None:
+                return cached
+
+        inflight = self._inflight.get(mp_payment_id)
+        if inflight is None:
+            inflight = asyncio.ensure_future(self._fetch_status(mp_payment_id))
+            self._inflight[mp_payment_id] = inflight
+            inflight.add_done_callback(lambda _: self._inflight.pop(mp_payment_id, None))
+        return await asyncio.shield(inflight)
+
+    async def _fetch_status(self, mp_payment_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            response = await self._request("GET", f"/v1/payments/{mp_payment_id}")
+        except Exception as e:
+            print(f"MercadoPago check error: {e}")
+            return None
+        if response is None or response.status_code != 200:
+            return None
+
+        data = self._json(response)
+        if data is None:
+            return None
+        status = {
+            "status": data.get("status"),
+            "status_detail": data.get("status_detail"),
+            "date_approved": data.get("date_approved")
+        }
+        self._cache_status(mp_payment_id, status)
+        return status
+
+    async def cancel_payment(self, mp_payment_id: str) -> bool:
+        """Cancel a pending payment so an expired PIX code can no longer be paid"""
+        if not self.configured or not mp_payment_id:
+            return False
+        response = await self._request("PUT", f"/v1/payments/{mp_payment_id}", json={"status": "cancelled"})
+        if response is None or response.status_code != 200:
+            return False
+        data = self._json(response)
+        if data is None:
+            self.invalidate(mp_payment_id)
+            return True
+        self._cache_status(str(mp_payment_id), {
+            "status": data.get("status"),
+            "status_detail": data.get("status_detail"),
+            "date_approved": data.get("date_approved")
+        })
+        return True
+
+    def _cache_status(self, mp_payment_id: str, status: Dict[str, Any]):
+        ttl = self.final_status_ttl if status.get("status") in FINAL_STATUSES else self.status_ttl
+        self._status_cache.set(mp_payment_id, status, ttl)
+
+    def invalidate(self, mp_payment_id: str):
+        self._status_cache.pop(str(mp_payment_id))
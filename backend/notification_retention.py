@@ -0,0 +1,208 @@
+"""
+Notification Retention for RenoveJá+
+Mantém a tabela `notifications` pequena, arquivando o histórico (S3 ou disco)
+
+Toda solicitação gera notificações para o paciente, médicos e admins, e a
+tabela só crescia. A cada execução (NOTIFICATION_RETENTION_INTERVAL_SECONDS,
+ou `python notification_retention.py`):
+
+1. Notificações lidas com mais de NOTIFICATION_RETENTION_DAYS dias são
+   arquivadas e apagadas, em lotes de NOTIFICATION_RETENTION_BATCH.
+2. Cada usuário fica com no máximo NOTIFICATION_MAX_PER_USER notificações;
+   as mais antigas além disso são arquivadas e apagadas (as não lidas
+   também são descontadas do badge, ver unread_counters.py).
+
+O arquivo frio é JSON Lines com gzip. Com NOTIFICATION_ARCHIVE_S3_BUCKET
+(padrão: BACKUP_S3_BUCKET) configurado, cada lote vira um objeto no bucket,
+enviado pelo S3MultipartWriter (Content-MD5 e reenvio, ver s3_multipart.py):
+
+    s3://<bucket>/renoveja-notifications/2024/05/notifications-20240501T030000-00001.jsonl.gz
+
+Sem bucket (dev/testes), os lotes são membros gzip de um arquivo local por
+execução (o disco do container não sobrevive a um novo deploy):
+
+    NOTIFICATION_ARCHIVE_DIR/2024/05/notifications-20240501T030000.jsonl.gz
+
+Cada lote é gravado (fora do event loop, em uma thread) antes de apagar as
+linhas, então uma falha no meio no máximo repete linhas no arquivo, nunca
+as perde. Uma execução por vez em todo o cluster: quem não pega a trava
+`notification_retention` (job_locks.py) pula a rodada.
+Os índices usados pela varredura estão em supabase/notification-retention.sql.
+"""
+
+import asyncio
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Dict, Any
+
+try:
+    import boto3
+except ImportError:
+    boto3 = None
+
+from database import iter_pages, delete_many, call_rpc, in_chunks
+from job_locks import job_lock
+from s3_multipart import S3MultipartWriter
+import unread_counters
+
+NOTIFICATION_RETENTION_DAYS = int(os.getenv("NOTIFICATION_RETENTION_DAYS", "30"))
+NOTIFICATION_MAX_PER_USER = int(os.getenv("NOTIFICATION_MAX_PER_USER", "200"))
+NOTIFICATION_RETENTION_BATCH = int(os.getenv("NOTIFICATION_RETENTION_BATCH", "500"))
+NOTIFICATION_ARCHIVE_DIR = os.getenv("NOTIFICATION_ARCHIVE_DIR", "./archive/notifications")
+NOTIFICATION_ARCHIVE_S3_BUCKET = os.getenv("NOTIFICATION_ARCHIVE_S3_BUCKET") or os.getenv("BACKUP_S3_BUCKET")
+NOTIFICATION_ARCHIVE_S3_PREFIX = "renoveja-notifications/"
+NOTIFICATION_ARCHIVE_S3_OBJECT_ARGS = {'ServerSideEncryption': 'AES256', 'StorageClass': 'STANDARD_IA'}
+# Prazo da trava do job; maior que a duração de uma execução
+NOTIFICATION_RETENTION_LOCK_SECONDS = int(os.getenv("NOTIFICATION_RETENTION_LOCK_SECONDS", "3600"))
+# Intervalo do job em segundo plano (0 desativa; padrão: a cada 6 horas)
+NOTIFICATION_RETENTION_INTERVAL_SECONDS = float(os.getenv("NOTIFICATION_RETENTION_INTERVAL_SECONDS", "21600"))
+
+
+class NotificationArchive:
+    """gzip JSONL archive; each batch is a gzip member (local file) or its own S3 object"""
+
+    def __init__(self, archive_dir: str = None, now: datetime = None, s3_client=None, bucket: str = None):
+        now = now or datetime.utcnow()
+        self.prefix = f"{now.strftime('%Y')}/{now.strftime('%m')}"
+        self.name = f"notifications-{now.strftime('%Y%m%dT%H%M%S')}"
+        self.path = Path(archive_dir or NOTIFICATION_ARCHIVE_DIR) / self.prefix / f"{self.name}.jsonl.gz"
+        self.s3 = s3_client
+        self.bucket = bucket or NOTIFICATION_ARCHIVE_S3_BUCKET
+        self.keys: List[str] = []
+        self.rows = 0
+
+    @property
+    def location(self) -> str:
+        if self.s3 is not None:
+            return f"s3://{self.bucket}/{NOTIFICATION_ARCHIVE_S3_PREFIX}{self.prefix}/{self.name}-*.jsonl.gz"
+        return str(self.path)
+
+    def write(self, rows: List[Dict[str, Any]]):
+        """Store one batch durably (blocking: call it through `append`)"""
+        data = gzip.compress("".join(
+            json.dumps(row, ensure_ascii=False, default=str) + "\n" for row in rows
+        ).encode("utf-8"))
+        if self.s3 is not None:
+            key = f"{NOTIFICATION_ARCHIVE_S3_PREFIX}{self.prefix}/{self.name}-{len(self.keys) + 1:05d}.jsonl.gz"
+            with S3MultipartWriter(
+                self.s3, self.bucket, key, concurrency=1, extra_args=NOTIFICATION_ARCHIVE_S3_OBJECT_ARGS
+            ) as out:
+                out.write(data)
+            self.keys.append(key)
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "ab") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+        self.rows += len(rows)
+
+    async def append(self, rows: List[Dict[str, Any]]):
+        await asyncio.to_thread(self.write, rows)
+
+
+def archive_s3_client():
+    """S3 client for the archive bucket, or None when it is not configured"""
+    if boto3 is None or not NOTIFICATION_ARCHIVE_S3_BUCKET or not os.getenv("AWS_ACCESS_KEY_ID"):
+        return None
+    return boto3.client(
+        's3',
+        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+        region_name=os.getenv("AWS_DEFAULT_REGION", "us-east-1"),
+        endpoint_url=os.getenv("BACKUP_S3_ENDPOINT_URL") or None
+    )
+
+
+def read_archive(path) -> List[Dict[str, Any]]:
+    """Load a local archive file (or a downloaded S3 segment) back, e.g. to restore notifications"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+async def _archive_and_delete(archive: NotificationArchive, rows: List[Dict[str, Any]]) -> int:
+    await archive.append(rows)
+    deleted = 0
+    for ids in in_chunks([r["id"] for r in rows]):
+        deleted += await delete_many("notifications", {"id": {"in": ids}})
+    return deleted
+
+
+async def expire_read(archive: NotificationArchive, cutoff: str, batch_size: int = None) -> int:
+    """Archive and delete read notifications created before `cutoff`"""
+    batch_size = batch_size or NOTIFICATION_RETENTION_BATCH
+    deleted = 0
+    async for page in iter_pages(
+        "notifications",
+        filters={"read": True, "created_at": {"lt": cutoff}},
+        page_size=batch_size
+    ):
+        deleted += await _archive_and_delete(archive, page)
+    return deleted
+
+
+async def enforce_user_caps(archive: NotificationArchive, max_per_user: int = NOTIFICATION_MAX_PER_USER, batch_size: int = None) -> int:
+    """Archive and delete each user's oldest notifications beyond `max_per_user`"""
+    batch_size = batch_size or NOTIFICATION_RETENTION_BATCH
+    deleted = 0
+    while True:
+        rows = await call_rpc("notification_overflow", {"p_max_per_user": max_per_user, "p_limit": batch_size}) or []
+        if not rows:
+            return deleted
+        removed = await _archive_and_delete(archive, rows)
+        if removed == 0:
+            # Nada foi apagado: evita repetir o mesmo lote para sempre
+            return deleted
+        deleted += removed
+
+        unread: Dict[str, int] = {}
+        for row in rows:
+            if not row.get("read"):
+                unread[row["user_id"]] = unread.get(row["user_id"], 0) + 1
+        await unread_counters.bump([
+            {"user_id": user_id, "scope": unread_counters.NOTIFICATIONS, "key": "", "delta": -count}
+            for user_id, count in unread.items()
+        ])
+
+
+async def run_retention(
+    now: datetime = None,
+    retention_days: int = NOTIFICATION_RETENTION_DAYS,
+    max_per_user: int = NOTIFICATION_MAX_PER_USER,
+    archive_dir: str = None,
+    s3_client=None
+) -> Dict[str, Any]:
+    """One retention pass. Returns what was archived and where (skipped: another worker is running it)."""
+    async with job_lock("notification_retention", NOTIFICATION_RETENTION_LOCK_SECONDS) as acquired:
+        if not acquired:
+            return {"skipped": True, "expired": 0, "capped": 0, "archived": 0, "archive": None}
+
+        now = now or datetime.utcnow()
+        if s3_client is None and archive_dir is None:
+            s3_client = archive_s3_client()
+        archive = NotificationArchive(archive_dir, now, s3_client)
+        cutoff = (now - timedelta(days=retention_days)).isoformat()
+
+        expired = await expire_read(archive, cutoff)
+        capped = await enforce_user_caps(archive, max_per_user) if max_per_user > 0 else 0
+
+        return {
+            "skipped": False,
+            "expired": expired,
+            "capped": capped,
+            "archived": archive.rows,
+            "archive": archive.location if archive.rows else None,
+        }
+
+
+if __name__ == "__main__":
+    result = asyncio.run(run_retention())
+    if result["skipped"]:
+        print("⏭️  Retenção já em execução em outro worker")
+    else:
+        print(f"✅ {result['archived']} notificações arquivadas ({result['expired']} expiradas, {result['capped']} acima do limite)")
+    if result["archive"]:
+        print(f"   Arquivo: {result['archive']}")
@@ -45,6 +45,8 @@ import asyncio
 from datetime import datetime
 from typing import Optional, List, Dict, Any
 
+import unread_counters
+
 # Notification types
 NOTIFICATION_TYPES = {
     "info": "info",
@@ -202,6 +204,18 @@ TEMPLATES = {
         "type": "error"
     },
     
+    # ===== FILA =====
+    "doctor_assigned_patient": {
+        "title": "👨‍⚕️ Médico Atribuído!",
+        "message": "Dr(a). {doctor_name} irá analisar sua solicitação.",
+        "type": "success"
+    },
+    "doctor_assigned_doctor": {
+        "title": "📋 Nova Solicitação!",
+        "message": "Você recebeu uma nova solicitação de {patient_name}.",
+        "type": "info"
+    },
+
     # ===== ADMIN =====
     "admin_new_user": {
         "title": "👤 Novo Usuário",
@@ -280,6 +294,7 @@ async def notify_user(db_insert_func, user_id: str, template_key: str, data: Dic
     """Send notification to a single user"""
     notification = create_notification(user_id, template_key, data, request_id=request_id)
     await db_insert_func("notifications", notification)
+    await unread_counters.record_notifications([notification])
     return notification
 
 
@@ -290,6 +305,7 @@ async def notify_users(db_insert_func, user_ids: List[str], template_key: str, d
         notification = create_notification(user_id, template_key, data, request_id=request_id)
         await db_insert_func("notifications", notification)
         notifications.append(notification)
+    await unread_counters.record_notifications(notifications)
     return notifications
 
 
@@ -0,0 +1,241 @@
+"""
+Payment Completion for RenoveJá+
+Caminho único para concluir pagamentos (webhook, conciliação e confirmação manual)
+
+    pagamento -> completed  ┐ uma transação: complete_payments()
+    solicitação -> paid     │ (supabase/payment-completion.sql)
+    payment_outbox          ┘
+    estatísticas + notificações + badges — PaymentOutbox, uma transação por linha
+
+A função SQL só conclui pagamentos que ainda não estavam `completed` e devolve
+apenas esses. Se o webhook e a conciliação chegam juntos no mesmo pagamento,
+só um deles recebe a linha de volta, então estatísticas e notificações saem
+uma única vez. Só solicitações que aguardam pagamento (origens da transição
+`pay` em request_state.py) vão para `paid`: uma aprovação tardia não revive
+uma solicitação rejeitada ou cancelada, nem volta uma já assinada.
+
+Os efeitos não rodam no caminho de quem concluiu: cada pagamento concluído
+grava uma linha em `payment_outbox` na mesma transação, e os workers do
+PaymentOutbox a aplicam depois (finish_payment_outbox grava notificações,
+estatísticas e badges e marca a linha como done, atomicamente). Se o processo
+cair depois do COMMIT, outro worker reivindica a linha quando o lease expira;
+nada se perde e nada é aplicado duas vezes. Os eventos do barramento levam um
+id fixo por linha, então uma nova tentativa não duplica o evento.
+
+    await complete_payments([{"payment_id": pid, "mp_status": "approved"}])
+    outbox.wake()  # os workers aplicam os efeitos
+"""
+
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional, Callable, Awaitable
+
+from database import call_rpc, find_many, update_many, delete_many
+from notifications_helper import create_notification
+from request_state import TRANSITIONS
+import stats_rollup
+import unread_counters
+
+# Status da solicitação que podem ir para `paid`
+PAYABLE_STATUSES = list(TRANSITIONS["pay"].from_statuses)
+
+PAYMENT_OUTBOX_WORKERS = int(os.getenv("PAYMENT_OUTBOX_WORKERS", "1"))
+PAYMENT_OUTBOX_POLL_SECONDS = float(os.getenv("PAYMENT_OUTBOX_POLL_SECONDS", "2"))
+PAYMENT_OUTBOX_BATCH_SIZE = int(os.getenv("PAYMENT_OUTBOX_BATCH_SIZE", "20"))
+PAYMENT_OUTBOX_LEASE_SECONDS = int(os.getenv("PAYMENT_OUTBOX_LEASE_SECONDS", "120"))
+PAYMENT_OUTBOX_MAX_ATTEMPTS = int(os.getenv("PAYMENT_OUTBOX_MAX_ATTEMPTS", "10"))
+PAYMENT_OUTBOX_RETENTION_DAYS = int(os.getenv("PAYMENT_OUTBOX_RETENTION_DAYS", "7"))
+
+# Publica os eventos de uma linha do outbox ({id, event}) no barramento
+Publish = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+async def complete_payments(completions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Complete a batch of payments in one transaction.
+    Each item: {payment_id, paid_at?, mp_status?, mp_status_detail?}.
+    Returns one {payment, request, previous_request} per payment this call
+    completed; `previous_request` is None when the request did not move.
+    The same rows are queued in payment_outbox for PaymentOutbox.
+    """
+    if not completions:
+        return []
+    return await call_rpc("complete_payments", {
+        "p_payments": [
+            {
+                "payment_id": c["payment_id"],
+                "paid_at": c.get("paid_at"),
+                "mp_status": c.get("mp_status"),
+                "mp_status_detail": c.get("mp_status_detail"),
+            }
+            for c in completions
+        ],
+        "p_payable_statuses": PAYABLE_STATUSES,
+    }) or []
+
+
+def completion_notifications(payment: Dict[str, Any], request: Optional[Dict[str, Any]], admin_ids: List[str]) -> List[Dict[str, Any]]:
+    """Patient, assigned doctor (or nurse) and admins for one completed payment"""
+    if not request:
+        return []
+    request_id = payment.get("request_id")
+    amount = payment.get("amount", 0)
+    patient_name = request.get("patient_name", "Paciente")
+
+    notifications = [
+        create_notification(request["patient_id"], "payment_confirmed", {"amount": amount}, request_id=request_id)
+    ]
+    if request.get("doctor_id"):
+        notifications.append(create_notification(
+            request["doctor_id"], "prescription_paid_doctor", {"patient_name": patient_name}, request_id=request_id
+        ))
+    elif request.get("nurse_id"):
+        notifications.append(create_notification(
+            request["nurse_id"], "exam_paid", {"patient_name": patient_name}, request_id=request_id
+        ))
+    for admin_id in admin_ids:
+        notifications.append(create_notification(
+            admin_id, "admin_payment_received", {"amount": amount, "patient_name": patient_name}, request_id=request_id
+        ))
+    return notifications
+
+
+def completion_effects(entry: Dict[str, Any], admin_ids: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+    """Notifications, stats deltas and badge increments for one outbox entry"""
+    payment, request, previous = entry["payment"], entry.get("request"), entry.get("previous_request")
+    notifications = completion_notifications(payment, request, admin_ids)
+    stats = stats_rollup.payment_deltas(
+        float(payment.get("amount") or 0), request.get("request_type") if request else None, payment.get("paid_at")
+    )
+    if previous:
+        stats += stats_rollup.transition_deltas(previous, "paid")
+    return {
+        "notifications": notifications,
+        "stats": stats,
+        "unread": unread_counters.notification_deltas(notifications),
+    }
+
+
+def retry_delay(attempts: int) -> int:
+    """Seconds before the next attempt: 5s, 10s, 20s... capped at 15 minutes"""
+    return min(5 * 2 ** max(attempts - 1, 0), 900)
+
+
+class PaymentOutbox:
+    """Workers that apply the effects of completed payments from payment_outbox"""
+
+    def __init__(
+        self,
+        publish: Optional[Publish] = None,
+        workers: int = PAYMENT_OUTBOX_WORKERS,
+        poll_interval: float = PAYMENT_OUTBOX_POLL_SECONDS,
+        batch_size: int = PAYMENT_OUTBOX_BATCH_SIZE
+    ):
+        self.publish = publish
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._last_prune = 0.0
+
+    def wake(self):
+        """New rows were committed by this process: don't wait for the next poll"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def claim(self) -> List[Dict[str, Any]]:
+        return await call_rpc("claim_payment_outbox", {
+            "p_token": str(uuid.uuid4()),
+            "p_limit": self.batch_size,
+            "p_lease_seconds": PAYMENT_OUTBOX_LEASE_SECONDS,
+        }) or []
+
+    async def process_claimed(self, entries: List[Dict[str, Any]]) -> int:
+        """Apply each claimed entry; returns how many were finished"""
+        if not entries:
+            return 0
+        admins = await find_many("users", filters={"role": "admin", "active": True}, limit=50)
+        admin_ids = [a["id"] for a in admins]
+
+        finished = 0
+        for entry in entries:
+            if int(entry.get("attempts") or 0) > PAYMENT_OUTBOX_MAX_ATTEMPTS:
+                # Leases expiraram em todas as tentativas (worker caindo no meio)
+                await update_many("payment_outbox", {"id": entry["id"], "claim_token": entry["claim_token"]}, {
+                    "status": "failed", "last_error": "lease expired on every attempt", "locked_until": None,
+                })
+                continue
+            try:
+                effects = completion_effects(entry["event"], admin_ids)
+                if self.publish is not None:
+                    await self.publish(entry)
+                done = await call_rpc("finish_payment_outbox", {
+                    "p_id": entry["id"],
+                    "p_token": entry["claim_token"],
+                    "p_notifications": effects["notifications"],
+                    "p_stats_deltas": effects["stats"],
+                    "p_unread_deltas": effects["unread"],
+                })
+            except Exception as e:
+                attempts = int(entry.get("attempts") or 0)
+                print(f"Payment outbox {entry['id']} failed (attempt {attempts}): {e}")
+                await update_many("payment_outbox", {"id": entry["id"], "claim_token": entry["claim_token"]}, {
+                    "status": "failed" if attempts >= PAYMENT_OUTBOX_MAX_ATTEMPTS else "pending",
+                    "last_error": str(e)[:1000],
+                    "available_at": (datetime.utcnow() + timedelta(seconds=retry_delay(attempts))).isoformat(),
+                    "locked_until": None,
+                })
+                continue
+            if done:
+                unread_counters.record_bumped(effects["unread"])
+                finished += 1
+            else:
+                print(f"Payment outbox {entry['id']}: lease lost, another worker applies it")
+        return finished
+
+    async def drain(self) -> int:
+        """Apply claimable entries until none is left (used by workers and tests)"""
+        finished = 0
+        while True:
+            entries = await self.claim()
+            if not entries:
+                return finished
+            finished += await self.process_claimed(entries)
+
+    async def prune(self, days: int = PAYMENT_OUTBOX_RETENTION_DAYS) -> int:
+        """Delete applied entries older than `days` (failed ones are kept)"""
+        cutoff = (datetime.utcnow() - timedelta(days=days)).isoformat()
+        return await delete_many("payment_outbox", {"status": "done", "created_at": {"lt": cutoff}})
+
+    # ============== WORKERS ==============
+
+    def start(self):
+        if self.workers > 0 and not self._tasks:
+            self._wakeup = asyncio.Event()
+            self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._wakeup = None
+
+    async def _worker(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            self._wakeup.clear()
+            try:
+                await self.drain()
+                if loop.time() - self._last_prune > 3600:
+                    self._last_prune = loop.time()
+                    await self.prune()
+            except Exception as e:
+                print(f"Payment outbox worker error: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,138 @@
+"""
+Payment Reconciliation for RenoveJá+
+Confere periodicamente os pagamentos PIX pendentes com o MercadoPago
+
+Webhooks podem se perder; sem esta rotina, um pagamento aprovado só virava
+`completed` quando alguém abria a tela do pagamento. A cada
+PAYMENT_RECONCILE_INTERVAL_SECONDS:
+
+1. Os pagamentos reais pendentes são lidos em páginas (keyset).
+2. Cada página é consultada no MercadoPago com no máximo
+   PAYMENT_RECONCILE_CONCURRENCY chamadas simultâneas.
+3. Os aprovados da página são concluídos juntos, em uma única transação
+   (payment_completion.py); recusados/cancelados são atualizados em lote,
+   com um UPDATE por status.
+4. Códigos PIX vencidos (MP_PIX_EXPIRATION_MINUTES + tolerância) que
+   continuam pendentes são cancelados no MercadoPago e aqui.
+
+Assim GET /api/payments/{id} e /status só leem o banco. Só um worker do
+cluster concilia por vez (trava `payment_reconciliation`, ver scheduler.py).
+"""
+
+import asyncio
+import os
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Callable, Awaitable, Tuple
+
+from database import iter_pages, update_many
+from mercadopago_client import MercadoPagoClient, MP_PIX_EXPIRATION_MINUTES
+
+PAYMENT_RECONCILE_INTERVAL_SECONDS = float(os.getenv("PAYMENT_RECONCILE_INTERVAL_SECONDS", "20"))
+PAYMENT_RECONCILE_CONCURRENCY = int(os.getenv("PAYMENT_RECONCILE_CONCURRENCY", "8"))
+PAYMENT_RECONCILE_PAGE_SIZE = int(os.getenv("PAYMENT_RECONCILE_PAGE_SIZE", "200"))
+# Prazo da trava do job (um worker por vez, ver scheduler.py); maior que uma execução
+PAYMENT_RECONCILE_LOCK_SECONDS = int(os.getenv("PAYMENT_RECONCILE_LOCK_SECONDS", "300"))
+# Tolerância depois do vencimento do PIX antes de cancelar (relógios, compensação)
+PAYMENT_EXPIRATION_GRACE_MINUTES = int(os.getenv("PAYMENT_EXPIRATION_GRACE_MINUTES", "5"))
+
+# Status do MercadoPago -> status local (os demais continuam pendentes)
+FINAL_STATUS_MAP = {
+    "rejected": "failed",
+    "cancelled": "cancelled",
+    "refunded": "cancelled",
+    "charged_back": "cancelled",
+}
+
+# Recebe [(pagamento, status MP)] aprovados; conclui todos de uma vez
+Complete = Callable[[List[Tuple[Dict[str, Any], Dict[str, Any]]]], Awaitable[Any]]
+
+
+class PaymentReconciler:
+    """Brings pending MercadoPago payments in line with the provider"""
+
+    def __init__(
+        self,
+        client: MercadoPagoClient,
+        complete: Complete,
+        concurrency: int = PAYMENT_RECONCILE_CONCURRENCY,
+        page_size: int = PAYMENT_RECONCILE_PAGE_SIZE,
+        expiration_minutes: int = MP_PIX_EXPIRATION_MINUTES + PAYMENT_EXPIRATION_GRACE_MINUTES
+    ):
+        self.client = client
+        self.complete = complete
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.expiration_minutes = expiration_minutes
+
+    async def _bounded(self, calls: List[Awaitable[Any]]) -> List[Any]:
+        """Await the calls with at most `concurrency` running at once, results in order"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(call):
+            async with semaphore:
+                return await call
+
+        return await asyncio.gather(*[run(c) for c in calls])
+
+    async def reconcile_page(self, payments: List[Dict[str, Any]], expires_before: str) -> Dict[str, int]:
+        result = {"checked": 0, "completed": 0, "failed": 0, "cancelled": 0, "expired": 0}
+        payments = [p for p in payments if p.get("external_id")]
+        approved = []
+        # (status local, status MP, detalhe) -> ids
+        finals: Dict[Tuple[str, str, str], List[str]] = {}
+        expired = []
+
+        statuses = await self._bounded([self.client.get_payment_status(p["external_id"]) for p in payments])
+        for payment, mp_status in zip(payments, statuses):
+            if mp_status is None:
+                continue  # MercadoPago indisponível: tenta na próxima execução
+            result["checked"] += 1
+            status = mp_status.get("status")
+            if status == "approved":
+                approved.append((payment, mp_status))
+            elif status in FINAL_STATUS_MAP:
+                key = (FINAL_STATUS_MAP[status], status, mp_status.get("status_detail"))
+                finals.setdefault(key, []).append(payment["id"])
+            elif (payment.get("created_at") or "") < expires_before:
+                expired.append(payment)
+
+        # Concluídos: um lote só move pagamentos, solicitações e notifica
+        if approved:
+            await self.complete(approved)
+        result["completed"] = len(approved)
+
+        # Recusados/cancelados: um UPDATE por combinação de status
+        for (local_status, mp_status, detail), ids in finals.items():
+            result[local_status] += await update_many(
+                "payments", {"id": {"in": ids}, "status": "pending"},
+                {"status": local_status, "mp_status": mp_status, "mp_status_detail": detail}
+            )
+
+        # PIX vencido: cancela no MercadoPago para não poder mais ser pago
+        if expired:
+            cancelled = await self._bounded([self.client.cancel_payment(p["external_id"]) for p in expired])
+            ids = [p["id"] for p, ok in zip(expired, cancelled) if ok]
+            if ids:
+                result["expired"] = await update_many(
+                    "payments", {"id": {"in": ids}, "status": "pending"},
+                    {"status": "cancelled", "mp_status": "cancelled", "mp_status_detail": "expired"}
+                )
+        return result
+
+    async def run(self, now: datetime = None) -> Dict[str, int]:
+        """One reconciliation pass over every pending real payment"""
+        totals = {"checked": 0, "completed": 0, "failed": 0, "cancelled": 0, "expired": 0}
+        if not self.client.configured:
+            return totals
+
+        now = now or datetime.utcnow()
+        expires_before = (now - timedelta(minutes=self.expiration_minutes)).isoformat()
+        async for page in iter_pages(
+            "payments",
+            columns="id,request_id,patient_id,amount,status,external_id,created_at",
+            filters={"status": "pending", "is_real_payment": True},
+            page_size=self.page_size
+        ):
+            for key, value in (await self.reconcile_page(page, expires_before)).items():
+                totals[key] += value
+        return totals
@@ -7,9 +7,164 @@ This module handles:
 - Load balancing between doctors
 """
 
+import heapq
+import itertools
+import os
+import time
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
-import random
+from typing import List, Dict, Any, Optional, Tuple
+
+from database import find_many, insert_one, update_where, count_docs, iter_pages, upsert_many, call_rpc
+from notifications_helper import notify_user, create_notification
+from assignment_engine import plan_assignments, AUTO_ASSIGN_BATCH_SIZE
+import unread_counters
+
+# Statuses in which a request occupies one of the doctor's concurrent slots
+ACTIVE_STATUSES = ["analyzing", "in_review", "in_progress", "in_consultation"]
+PENDING_STATUSES = ["pending", "submitted"]
+
+# The index is rebuilt from storage at most this often (absorbs changes made by other nodes)
+INDEX_REFRESH_SECONDS = int(os.getenv("QUEUE_INDEX_REFRESH_SECONDS", "300"))
+
+ANY_SPECIALTY = None
+
+
+class DoctorLoadIndex:
+    """
+    In-memory index of doctors and their active case counts.
+    
+    One min-heap per specialty (plus one for all doctors) ordered by
+    (active_cases, -rating, -total_consultations). Heaps use lazy deletion:
+    every change pushes a fresh entry and entries that no longer match the
+    doctor's current state are discarded when they reach the top, so updates
+    and lookups are O(log n). Doctors that are unavailable or at capacity
+    have no valid entry and are skipped without being examined.
+    """
+    
+    def __init__(self):
+        self.doctors: Dict[str, Dict[str, Any]] = {}
+        self._heaps: Dict[Optional[str], List[Tuple]] = {}
+        self._seq = itertools.count()
+        self.loaded_at: Optional[float] = None
+    
+    # ----- estado -----
+    
+    @staticmethod
+    def _rank(doctor: Dict[str, Any]) -> Tuple:
+        return (doctor["active_cases"], -doctor["rating"], -doctor["total_consultations"])
+    
+    @staticmethod
+    def _eligible(doctor: Dict[str, Any]) -> bool:
+        return doctor["available"] and doctor["active_cases"] < doctor["max_concurrent_cases"]
+    
+    def _push(self, doctor: Dict[str, Any]):
+        if not self._eligible(doctor):
+            return
+        entry = (*self._rank(doctor), next(self._seq), doctor["user_id"])
+        for key in (ANY_SPECIALTY, doctor["specialty"]):
+            heap = self._heaps.setdefault(key, [])
+            heapq.heappush(heap, entry)
+            if len(heap) > 2 * len(self.doctors) + 64:
+                self._compact(key)
+    
+    def _compact(self, key: Optional[str]):
+        """Drop stale entries (keeps heaps proportional to the number of doctors)"""
+        self._heaps[key] = [e for e in self._heaps[key] if self._is_current(e)]
+        heapq.heapify(self._heaps[key])
+    
+    def _is_current(self, entry: Tuple) -> bool:
+        doctor = self.doctors.get(entry[-1])
+        return doctor is not None and self._eligible(doctor) and entry[:3] == self._rank(doctor)
+    
+    def load(self, profiles: List[Dict], names: Dict[str, str], active_counts: Dict[str, int]):
+        """Replace the whole index (profiles of doctors whose user is active)"""
+        self.doctors = {}
+        self._heaps = {}
+        for profile in profiles:
+            if profile["user_id"] in names:
+                self.upsert_doctor(profile, names[profile["user_id"]], active_counts.get(profile["user_id"], 0))
+        self.loaded_at = time.monotonic()
+    
+    def upsert_doctor(self, profile: Dict[str, Any], name: str, active_cases: Optional[int] = None):
+        current = self.doctors.get(profile["user_id"], {})
+        doctor = {
+            "user_id": profile["user_id"],
+            "name": name,
+            "specialty": profile.get("specialty"),
+            "crm": profile.get("crm"),
+            "crm_state": profile.get("crm_state"),
+            "rating": float(profile.get("rating") or 5.0),
+            "total_consultations": profile.get("total_consultations") or 0,
+            "active_cases": active_cases if active_cases is not None else current.get("active_cases", 0),
+            "available": profile.get("available", True),
+            "max_concurrent_cases": profile.get("max_concurrent_cases") or 5,
+        }
+        self.doctors[doctor["user_id"]] = doctor
+        self._push(doctor)
+    
+    def remove_doctor(self, doctor_id: str):
+        self.doctors.pop(doctor_id, None)
+    
+    def _adjust(self, doctor_id: str, **changes):
+        doctor = self.doctors.get(doctor_id)
+        if doctor is None:
+            return
+        doctor.update(changes)
+        self._push(doctor)
+    
+    # ----- eventos -----
+    
+    def on_assigned(self, doctor_id: str):
+        doctor = self.doctors.get(doctor_id)
+        if doctor:
+            self._adjust(doctor_id, active_cases=doctor["active_cases"] + 1)
+    
+    def on_released(self, doctor_id: str):
+        doctor = self.doctors.get(doctor_id)
+        if doctor:
+            self._adjust(doctor_id, active_cases=max(0, doctor["active_cases"] - 1))
+    
+    def on_transition(self, previous_status: Optional[str], new_status: str, previous_doctor_id: Optional[str], new_doctor_id: Optional[str]):
+        """Keep active case counts in sync with a request status change"""
+        if previous_status in ACTIVE_STATUSES and previous_doctor_id:
+            self.on_released(previous_doctor_id)
+        if new_status in ACTIVE_STATUSES and new_doctor_id:
+            self.on_assigned(new_doctor_id)
+    
+    def on_request_event(self, event: Dict[str, Any]):
+        """
+        Apply a request.* event from the bus. Every worker's index is fed
+        from the bus, including for changes this worker made itself.
+        """
+        request = event["payload"]["request"]
+        previous = event["payload"].get("previous") or {}
+        self.on_transition(previous.get("status"), request.get("status"), previous.get("doctor_id"), request.get("doctor_id"))
+    
+    def set_available(self, doctor_id: str, available: bool):
+        self._adjust(doctor_id, available=available)
+    
+    def on_doctor_event(self, event: Dict[str, Any]):
+        """Apply a doctor.availability event from the bus (published by any worker)"""
+        payload = event["payload"]
+        self.set_available(payload["doctor_id"], payload["available"])
+    
+    # ----- consultas -----
+    
+    def find_best(self, specialty: Optional[str] = ANY_SPECIALTY) -> Optional[Dict[str, Any]]:
+        """Least loaded eligible doctor (ties: higher rating, more experience); no I/O"""
+        heap = self._heaps.get(specialty)
+        while heap:
+            if self._is_current(heap[0]):
+                return dict(self.doctors[heap[0][-1]])
+            heapq.heappop(heap)
+        return None
+    
+    def available_doctors(self, specialty: Optional[str] = ANY_SPECIALTY) -> List[Dict[str, Any]]:
+        return sorted(
+            (dict(d) for d in self.doctors.values()
+             if d["available"] and (specialty is None or d["specialty"] == specialty)),
+            key=self._rank
+        )
 
 
 class QueueManager:
@@ -20,201 +175,196 @@ class QueueManager:
     1. Match by specialty (if applicable)
     2. Prioritize doctors with fewer active cases
     3. Consider doctor availability status
-    4. Round-robin for equal load distribution
-    5. Urgent cases go to the front of queue
+    4. Ties go to higher rating, then more experience
+    
+    Doctor selection uses the in-memory DoctorLoadIndex, which is loaded from
+    storage on first use, refreshed every INDEX_REFRESH_SECONDS and kept current
+    through the request.* and doctor.* events of the bus (on_request_event()/on_doctor_event()).
     """
     
-    def __init__(self, db):
-        self.db = db
+    def __init__(self, index: Optional[DoctorLoadIndex] = None):
+        self.index = index or DoctorLoadIndex()
+    
+    async def refresh(self, page_size: int = 1000):
+        """Rebuild the doctor load index from storage (three paged scans)"""
+        names: Dict[str, str] = {}
+        async for page in iter_pages("users", columns="id,name,active", filters={"role": "doctor"}, page_size=page_size):
+            names.update({u["id"]: u["name"] for u in page if u.get("active", True)})
+        
+        profiles: List[Dict] = []
+        async for page in iter_pages(
+            "doctor_profiles",
+            columns="user_id,specialty,crm,crm_state,rating,total_consultations,available,max_concurrent_cases",
+            page_size=page_size
+        ):
+            profiles.extend(page)
+        
+        active_counts: Dict[str, int] = {}
+        async for page in iter_pages(
+            "requests",
+            columns="doctor_id",
+            filters={"status": {"in": ACTIVE_STATUSES}, "doctor_id": {"not.is": "null"}},
+            page_size=page_size
+        ):
+            for r in page:
+                active_counts[r["doctor_id"]] = active_counts.get(r["doctor_id"], 0) + 1
+        
+        self.index.load(profiles, names, active_counts)
+    
+    async def ensure_loaded(self):
+        loaded_at = self.index.loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at > INDEX_REFRESH_SECONDS:
+            await self.refresh()
     
     async def get_available_doctors(self, specialty: Optional[str] = None) -> List[Dict]:
         """
         Get list of available doctors, optionally filtered by specialty.
         """
-        query = {"available": True}
-        if specialty:
-            query["specialty"] = specialty
-        
-        doctor_profiles = await self.db.doctor_profiles.find(query).to_list(100)
-        
-        doctors = []
-        for dp in doctor_profiles:
-            user = await self.db.users.find_one({"id": dp["user_id"]})
-            if user:
-                # Count active cases for this doctor
-                active_cases = await self.db.requests.count_documents({
-                    "doctor_id": dp["user_id"],
-                    "status": {"$in": ["analyzing", "in_progress"]}
-                })
-                
-                doctors.append({
-                    "user_id": dp["user_id"],
-                    "name": user["name"],
-                    "specialty": dp["specialty"],
-                    "crm": dp["crm"],
-                    "crm_state": dp["crm_state"],
-                    "rating": dp.get("rating", 5.0),
-                    "total_consultations": dp.get("total_consultations", 0),
-                    "active_cases": active_cases,
-                    "available": dp.get("available", True),
-                    "max_concurrent_cases": dp.get("max_concurrent_cases", 5)
-                })
-        
-        return doctors
+        await self.ensure_loaded()
+        return self.index.available_doctors(specialty)
     
-    async def find_best_doctor(self, request: Dict) -> Optional[Dict]:
+    def find_best_doctor(self, request: Dict) -> Optional[Dict]:
         """
-        Find the best available doctor for a request.
+        Find the best available doctor for a request (no queries).
         
-        Algorithm:
-        1. Filter by specialty (for consultations)
-        2. Exclude doctors at max capacity
-        3. Sort by: active_cases (asc), rating (desc), total_consultations (desc)
-        4. Return the best match
+        Consultations are matched by specialty; other requests can go to any
+        doctor. Doctors at max capacity are never returned.
         """
-        specialty = None
+        specialty = ANY_SPECIALTY
         if request.get("request_type") == "consultation":
-            specialty = request.get("specialty")
-        
-        doctors = await self.get_available_doctors(specialty)
-        
-        # Filter doctors who have capacity
-        available_doctors = [
-            d for d in doctors 
-            if d["active_cases"] < d["max_concurrent_cases"]
-        ]
-        
-        if not available_doctors:
-            return None
-        
-        # Sort by best match
-        # Priority: fewer active cases, higher rating, more experience
-        sorted_doctors = sorted(
-            available_doctors,
-            key=lambda d: (
-                d["active_cases"],  # Lower is better
-                -d["rating"],       # Higher is better (negative for ascending sort)
-                -d["total_consultations"]  # More experience is better
-            )
-        )
-        
-        return sorted_doctors[0] if sorted_doctors else None
+            specialty = request.get("specialty") or ANY_SPECIALTY
+        return self.index.find_best(specialty)
     
-    async def assign_doctor_to_request(self, request_id: str, doctor_id: str, doctor_name: str) -> bool:
+    async def assign_doctor_to_request(self, request: Dict, doctor: Dict) -> bool:
         """
         Assign a doctor to a request and notify both parties.
+        Conditional update: returns False if the request was taken meanwhile.
         """
-        # Update the request
-        result = await self.db.requests.update_one(
-            {"id": request_id},
-            {"$set": {
-                "doctor_id": doctor_id,
-                "doctor_name": doctor_name,
+        now = datetime.utcnow().isoformat()
+        claimed = await update_where(
+            "requests",
+            {"id": request["id"], "status": {"in": PENDING_STATUSES}, "doctor_id": {"is": "null"}},
+            {
+                "doctor_id": doctor["user_id"],
+                "doctor_name": doctor["name"],
                 "status": "analyzing",
-                "assigned_at": datetime.utcnow(),
-                "updated_at": datetime.utcnow()
-            }}
+                "assigned_at": now,
+                "updated_at": now
+            }
         )
-        
-        if result.modified_count == 0:
+        if not claimed:
             return False
         
-        # Get request details for notifications
-        request = await self.db.requests.find_one({"id": request_id})
-        
-        # Notify the patient
-        await self.db.notifications.insert_one({
-            "id": str(datetime.utcnow().timestamp()),
-            "user_id": request["patient_id"],
-            "title": "Médico Atribuído!",
-            "message": f"Dr(a). {doctor_name} irá analisar sua solicitação.",
-            "notification_type": "success",
-            "read": False,
-            "created_at": datetime.utcnow(),
-            "data": {"request_id": request_id}
-        })
-        
-        # Notify the doctor
-        await self.db.notifications.insert_one({
-            "id": str(datetime.utcnow().timestamp() + 1),
-            "user_id": doctor_id,
-            "title": "Nova Solicitação!",
-            "message": f"Você recebeu uma nova solicitação de {request['patient_name']}.",
-            "notification_type": "info",
-            "read": False,
-            "created_at": datetime.utcnow(),
-            "data": {"request_id": request_id}
-        })
+        self.index.on_transition(request.get("status"), "analyzing", request.get("doctor_id"), doctor["user_id"])
         
+        await notify_user(
+            insert_one, request["patient_id"], "doctor_assigned_patient",
+            {"doctor_name": doctor["name"]}, request_id=request["id"]
+        )
+        await notify_user(
+            insert_one, doctor["user_id"], "doctor_assigned_doctor",
+            {"patient_name": request.get("patient_name", "Paciente")}, request_id=request["id"]
+        )
         return True
     
-    async def auto_assign_pending_requests(self) -> Dict[str, int]:
+    async def auto_assign_pending_requests(self, limit: int = AUTO_ASSIGN_BATCH_SIZE) -> Dict[str, Any]:
         """
-        Automatically assign pending requests to available doctors.
-        Returns count of assigned requests.
+        Assign a batch of pending requests to available doctors.
+        
+        The batch is planned by assignment_engine (weighted matching over
+        specialty, load, rating and wait time) and applied with a single
+        conditional bulk update, so requests taken meanwhile by a doctor or
+        by another node are skipped. The update also enforces each doctor's
+        capacity against the database, since this worker's index may lag.
+        Returns the assigned requests and counts; the caller publishes the
+        transitions, which is what updates the load index.
         """
-        # Get all pending/submitted requests without a doctor
-        pending_requests = await self.db.requests.find({
-            "status": {"$in": ["pending", "submitted"]},
-            "doctor_id": None,
-            "request_type": {"$ne": "exam"}  # Exams go to nursing first
-        }).sort("created_at", 1).to_list(100)
-        
-        assigned = 0
-        failed = 0
-        
-        for request in pending_requests:
-            doctor = await self.find_best_doctor(request)
-            if doctor:
-                success = await self.assign_doctor_to_request(
-                    request["id"],
-                    doctor["user_id"],
-                    doctor["name"]
-                )
-                if success:
-                    assigned += 1
-                else:
-                    failed += 1
-            else:
-                failed += 1
-        
-        return {"assigned": assigned, "failed": failed, "total_pending": len(pending_requests)}
+        await self.ensure_loaded()
+        
+        # Exams go to nursing first
+        pending_requests = await find_many(
+            "requests",
+            filters={"status": {"in": PENDING_STATUSES}, "doctor_id": {"is": "null"}, "request_type": {"neq": "exam"}},
+            order="created_at.asc",
+            limit=limit
+        )
+        plan = plan_assignments(pending_requests, list(self.index.doctors.values()))
+        
+        applied: Dict[str, Dict] = {}
+        if plan:
+            rows = await call_rpc("assign_requests_bulk", {
+                "p_assignments": [
+                    {"request_id": r["id"], "doctor_id": d["user_id"], "doctor_name": d["name"]}
+                    for r, d in plan
+                ],
+                "p_from_statuses": PENDING_STATUSES,
+                "p_active_statuses": ACTIVE_STATUSES,
+            })
+            applied = {row["request_id"]: row for row in rows or []}
+        
+        assignments = []
+        notifications = []
+        for request, doctor in plan:
+            row = applied.get(request["id"])
+            if row is None:
+                continue
+            request = {**request, "status": row.get("previous_status", request.get("status"))}
+            assignments.append({"request": request, "doctor": doctor})
+            notifications.append(create_notification(
+                request["patient_id"], "doctor_assigned_patient",
+                {"doctor_name": doctor["name"]}, request_id=request["id"]
+            ))
+            notifications.append(create_notification(
+                doctor["user_id"], "doctor_assigned_doctor",
+                {"patient_name": request.get("patient_name", "Paciente")}, request_id=request["id"]
+            ))
+        
+        if notifications:
+            await upsert_many("notifications", notifications)
+            await unread_counters.record_notifications(notifications)
+        
+        return {
+            "assigned": len(assignments),
+            "failed": len(pending_requests) - len(assignments),
+            "total_pending": len(pending_requests),
+            "assignments": assignments
+        }
     
     async def get_queue_stats(self) -> Dict[str, Any]:
         """
         Get overall queue statistics.
         """
-        total_pending = await self.db.requests.count_documents({"status": {"$in": ["pending", "submitted"]}})
-        total_analyzing = await self.db.requests.count_documents({"status": {"$in": ["analyzing", "in_review"]}})
-        total_completed_today = await self.db.requests.count_documents({
-            "status": "completed",
-            "completed_at": {"$gte": datetime.utcnow().replace(hour=0, minute=0, second=0)}
-        })
+        await self.ensure_loaded()
+        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0).isoformat()
+        yesterday = (datetime.utcnow() - timedelta(days=1)).isoformat()
         
-        available_doctors = await self.db.doctor_profiles.count_documents({"available": True})
+        total_pending = await count_docs("requests", {"status": {"in": PENDING_STATUSES}})
+        total_analyzing = await count_docs("requests", {"status": {"in": ["analyzing", "in_review"]}})
+        total_completed_today = await count_docs("requests", {"status": "completed", "completed_at": {"gte": today}})
         
         # Average wait time (for requests assigned in last 24h)
-        yesterday = datetime.utcnow() - timedelta(days=1)
-        recent_assigned = await self.db.requests.find({
-            "assigned_at": {"$gte": yesterday},
-            "status": {"$in": ["analyzing", "completed"]}
-        }).to_list(100)
-        
-        avg_wait_minutes = 0
-        if recent_assigned:
-            wait_times = []
-            for r in recent_assigned:
-                if r.get("assigned_at") and r.get("created_at"):
-                    wait = (r["assigned_at"] - r["created_at"]).total_seconds() / 60
-                    wait_times.append(wait)
-            if wait_times:
-                avg_wait_minutes = sum(wait_times) / len(wait_times)
+        recent_assigned = await find_many(
+            "requests",
+            filters={"assigned_at": {"gte": yesterday}},
+            order="assigned_at.desc",
+            limit=100
+        )
+        
+        wait_times = []
+        for r in recent_assigned:
+            try:
+                assigned_at = datetime.fromisoformat(str(r["assigned_at"]).replace("Z", "+00:00")).replace(tzinfo=None)
+                created_at = datetime.fromisoformat(str(r["created_at"]).replace("Z", "+00:00")).replace(tzinfo=None)
+                wait_times.append((assigned_at - created_at).total_seconds() / 60)
+            except (KeyError, TypeError, ValueError):
+                continue
+        avg_wait_minutes = sum(wait_times) / len(wait_times) if wait_times else 0
         
         return {
             "pending": total_pending,
             "analyzing": total_analyzing,
             "completed_today": total_completed_today,
-            "available_doctors": available_doctors,
+            "available_doctors": len(self.index.available_doctors()),
             "average_wait_minutes": round(avg_wait_minutes, 1)
         }
     
@@ -223,17 +373,20 @@ class QueueManager:
         Get the queue for a specific doctor.
         """
         # Requests assigned to this doctor
-        my_requests = await self.db.requests.find({
-            "doctor_id": doctor_id,
-            "status": {"$in": ["analyzing", "in_review", "in_progress"]}
-        }).sort("assigned_at", 1).to_list(50)
+        my_requests = await find_many(
+            "requests",
+            filters={"doctor_id": doctor_id, "status": {"in": ACTIVE_STATUSES}},
+            order="assigned_at.asc",
+            limit=50
+        )
         
         # Unassigned requests this doctor could take (excluding exams which go to nursing)
-        available_requests = await self.db.requests.find({
-            "status": {"$in": ["pending", "submitted"]},
-            "doctor_id": None,
-            "request_type": {"$ne": "exam"}
-        }).sort("created_at", 1).to_list(50)
+        available_requests = await find_many(
+            "requests",
+            filters={"status": {"in": PENDING_STATUSES}, "doctor_id": {"is": "null"}, "request_type": {"neq": "exam"}},
+            order="created_at.asc",
+            limit=50
+        )
         
         return {
             "my_requests": my_requests,
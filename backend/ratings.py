@@ -0,0 +1,118 @@
+"""
+Doctor Ratings for RenoveJá+
+Avaliações de pacientes e médias incrementais dos médicos
+
+Cada avaliação é gravada na projeção `reviews` (id = request_id) e ajusta
+`rating_sum`, `rating_count` e `tag_counts` em `doctor_profiles` na mesma
+transação, pela função SQL `apply_doctor_review` (supabase/doctor-ratings.sql).
+Uma nova avaliação da mesma solicitação substitui a anterior.
+
+`recompute()` reconstrói a projeção e os agregados a partir de
+`requests.review` para corrigir divergências:
+
+    python ratings.py
+"""
+
+import asyncio
+from datetime import datetime
+from typing import Optional, List, Dict, Any
+
+from database import find_many, call_rpc, iter_pages, upsert_many
+
+REVIEWS_TABLE = "reviews"
+
+
+def review_record(request: Dict[str, Any], rating: int, tags: Optional[List[str]], comment: Optional[str], reviewed_at: str = None) -> Dict[str, Any]:
+    return {
+        "id": request["id"],
+        "doctor_id": request.get("doctor_id"),
+        "patient_id": request.get("patient_id"),
+        "patient_name": request.get("patient_name"),
+        "request_type": request.get("request_type"),
+        "rating": rating,
+        "tags": tags or [],
+        "comment": comment,
+        "created_at": reviewed_at or datetime.utcnow().isoformat(),
+    }
+
+
+async def submit_review(
+    request: Dict[str, Any],
+    rating: int,
+    tags: Optional[List[str]] = None,
+    comment: Optional[str] = None,
+    reviewed_at: str = None
+) -> Dict[str, Any]:
+    """
+    Store a review and update the doctor's aggregates atomically.
+    Returns {"previous_rating": int | None}.
+    """
+    result = await call_rpc("apply_doctor_review", {"p_review": review_record(request, rating, tags, comment, reviewed_at)})
+    if result is None:
+        raise RuntimeError("apply_doctor_review indisponível")
+    return result
+
+
+async def get_doctor_reviews(doctor_id: str, limit: int = 20) -> List[Dict[str, Any]]:
+    """Latest reviews of a doctor, read from the projection (index on doctor_id, created_at)"""
+    reviews = await find_many(
+        REVIEWS_TABLE,
+        filters={"doctor_id": doctor_id},
+        order="created_at.desc",
+        limit=limit
+    )
+    return [
+        {
+            "id": r["id"],
+            "patient_name": r.get("patient_name") or "Paciente",
+            "rating": r.get("rating"),
+            "tags": r.get("tags") or [],
+            "comment": r.get("comment"),
+            "date": r.get("created_at"),
+            "request_type": r.get("request_type"),
+        }
+        for r in reviews
+    ]
+
+
+async def recompute(page_size: int = 1000) -> int:
+    """
+    Rebuild the reviews projection and every doctor's rating aggregates
+    from requests.review. Returns the number of reviews processed.
+    """
+    aggregates: Dict[str, Dict[str, Any]] = {}
+    total = 0
+
+    async for page in iter_pages(
+        "requests",
+        columns="id,doctor_id,patient_id,patient_name,request_type,review",
+        filters={"review": {"not.is": "null"}},
+        page_size=page_size
+    ):
+        records = []
+        for r in page:
+            review = r.get("review") or {}
+            if not review.get("rating"):
+                continue
+            records.append(review_record(r, review["rating"], review.get("tags"), review.get("comment"), review.get("reviewed_at")))
+
+            if r.get("doctor_id"):
+                agg = aggregates.setdefault(r["doctor_id"], {
+                    "doctor_id": r["doctor_id"], "rating_sum": 0, "rating_count": 0, "tag_counts": {}
+                })
+                agg["rating_sum"] += review["rating"]
+                agg["rating_count"] += 1
+                for tag in review.get("tags") or []:
+                    agg["tag_counts"][tag] = agg["tag_counts"].get(tag, 0) + 1
+
+        if records:
+            await upsert_many(REVIEWS_TABLE, records)
+        total += len(records)
+
+    await call_rpc("replace_doctor_ratings", {"p_rows": list(aggregates.values())})
+    return total
+
+
+if __name__ == "__main__":
+    count = asyncio.run(recompute())
+    print(f"✅ {count} avaliações reprocessadas")
@@ -0,0 +1,280 @@
+"""
+Realtime Queues for RenoveJá+
+Filas de médicos e enfermagem em tempo real via WebSocket
+
+As telas de fila recebem um snapshot na conexão e, depois, só os deltas
+(pedido criado, assumido, mudança de status) publicados pelos endpoints de
+transição no hub em memória:
+
+    ws://.../api/ws/queue?token=...&queue=doctor | consultation | nursing
+
+    <- {"type": "snapshot", "seq": 41, "queue": {"pending": [...], ...}}
+    <- {"type": "delta", "seq": 42, "event": "claimed", "bucket": null, "request": {...}}
+    <- {"type": "ping"}
+
+O cliente remove o pedido de todas as listas e, se `bucket` não for nulo,
+o insere nela. Deltas são idempotentes (o snapshot pode já conter um delta
+recebido logo em seguida). Se o cliente não acompanhar o ritmo, o buffer
+é descartado e um novo snapshot é enviado.
+
+Tópicos: "doctor", "nursing", "consultation", "consultation:<especialidade>"
+e "user:<id>" (pedidos de que o usuário é responsável).
+"""
+
+import asyncio
+import itertools
+import os
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Set, Callable, Iterable
+
+from database import find_many
+
+QUEUE_STREAM_BUFFER = int(os.getenv("QUEUE_STREAM_BUFFER", "500"))
+QUEUE_STREAM_PING_SECONDS = float(os.getenv("QUEUE_STREAM_PING_SECONDS", "25"))
+
+OWNER_FIELDS = ("doctor_id", "nurse_id")
+
+
+# ============== TÓPICOS ==============
+
+def request_topics(request: Dict[str, Any]) -> Set[str]:
+    """Topics an event about this request is published to"""
+    request_type = request.get("request_type")
+    topics = set()
+    if request_type == "exam":
+        topics.add("nursing")
+    if request_type != "exam" or request.get("status") == "in_medical_review":
+        topics.add("doctor")
+    if request_type == "consultation":
+        topics.add("consultation")
+        if request.get("specialty"):
+            topics.add(f"consultation:{request['specialty']}")
+    for field in OWNER_FIELDS:
+        if request.get(field):
+            topics.add(f"user:{request[field]}")
+    return topics
+
+
+# ============== VISÕES DAS FILAS ==============
+
+def _doctor_bucket(r: Dict[str, Any], ctx: Dict[str, Any]) -> Optional[str]:
+    status = r.get("status")
+    mine = r.get("doctor_id") == ctx["user_id"]
+    if status in ("submitted", "pending") and r.get("request_type") != "exam" and not r.get("doctor_id"):
+        return "pending"
+    if mine and status in ("in_review", "analyzing"):
+        return "analyzing"
+    if status == "in_medical_review":
+        return "forwarded_from_nursing"
+    if mine and status == "approved_pending_payment":
+        return "awaiting_payment"
+    if mine and status == "paid":
+        return "awaiting_signature"
+    return None
+
+
+def _nursing_bucket(r: Dict[str, Any], ctx: Dict[str, Any]) -> Optional[str]:
+    status = r.get("status")
+    mine = r.get("nurse_id") == ctx["user_id"]
+    if r.get("request_type") == "exam" and status == "submitted" and not r.get("nurse_id"):
+        return "pending"
+    if r.get("request_type") == "exam" and mine and status == "in_nursing_review":
+        return "in_review"
+    if mine and status == "approved_by_nursing_pending_payment":
+        return "awaiting_payment"
+    return None
+
+
+def _consultation_bucket(r: Dict[str, Any], ctx: Dict[str, Any]) -> Optional[str]:
+    if r.get("request_type") != "consultation":
+        return None
+    status = r.get("status")
+    mine = r.get("doctor_id") == ctx["user_id"]
+    specialties = ctx.get("specialties") or []
+    if status == "paid" and (not specialties or r.get("specialty") in specialties):
+        return "waiting"
+    if mine and status == "in_consultation":
+        return "in_progress"
+    if mine and status == "completed" and (r.get("completed_at") or "").startswith(datetime.utcnow().strftime("%Y-%m-%d")):
+        return "completed"
+    return None
+
+
+def _consultation_topics(ctx: Dict[str, Any]) -> Set[str]:
+    specialties = ctx.get("specialties") or []
+    if not specialties:
+        return {"consultation"}
+    return {f"consultation:{s}" for s in specialties}
+
+
+@dataclass(frozen=True)
+class QueueView:
+    """One dashboard queue: how its rows are loaded, bucketed and subscribed to"""
+    name: str
+    roles: tuple
+    buckets: tuple
+    classify: Callable[[Dict[str, Any], Dict[str, Any]], Optional[str]]
+    topics: Callable[[Dict[str, Any]], Set[str]]
+    filters: Optional[Dict[str, Any]] = None
+    limit: int = 200
+    sort: Optional[Dict[str, Callable[[Dict[str, Any]], Any]]] = None
+
+
+QUEUE_VIEWS: Dict[str, QueueView] = {
+    "doctor": QueueView(
+        "doctor", ("doctor",),
+        ("pending", "analyzing", "forwarded_from_nursing", "awaiting_payment", "awaiting_signature"),
+        _doctor_bucket, lambda ctx: {"doctor"},
+    ),
+    "nursing": QueueView(
+        "nursing", ("nurse",),
+        ("pending", "in_review", "awaiting_payment"),
+        _nursing_bucket, lambda ctx: {"nursing"},
+        filters={"request_type": "exam"},
+    ),
+    "consultation": QueueView(
+        "consultation", ("doctor", "admin"),
+        ("waiting", "in_progress", "completed"),
+        _consultation_bucket, _consultation_topics,
+        filters={"request_type": "consultation"}, limit=100,
+        # Imediatas primeiro, depois por tempo de espera
+        sort={"waiting": lambda x: (0 if x.get("schedule_type") == "immediate" else 1, x.get("paid_at", x.get("created_at", "")))},
+    ),
+}
+
+
+def bucket_rows(view: QueueView, rows: Iterable[Dict[str, Any]], ctx: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    queue: Dict[str, List[Dict[str, Any]]] = {bucket: [] for bucket in view.buckets}
+    for r in rows:
+        bucket = view.classify(r, ctx)
+        if bucket:
+            queue[bucket].append(r)
+    for bucket, key in (view.sort or {}).items():
+        queue[bucket].sort(key=key)
+    return queue
+
+
+async def load_queue(view: QueueView, ctx: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    """Current contents of a queue (GET endpoints and WebSocket snapshots)"""
+    rows = await find_many("requests", filters=view.filters, order="created_at.asc", limit=view.limit)
+    return bucket_rows(view, rows, ctx)
+
+
+# ============== HUB ==============
+
+class Subscription:
+    """Bounded event buffer of one connection; overflow triggers a resync"""
+
+    def __init__(self, topics: Set[str], max_buffer: int = QUEUE_STREAM_BUFFER):
+        self.topics = topics
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_buffer)
+        self.overflowed = False
+
+    def push(self, event: Dict[str, Any]):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    async def get(self, timeout: float = None) -> Optional[Dict[str, Any]]:
+        """Next event; None means the buffer overflowed (send a new snapshot)"""
+        event = await asyncio.wait_for(self.queue.get(), timeout)
+        if event is None:
+            self.overflowed = False
+        return event
+
+
+class QueueHub:
+    """In-process pub/sub of request changes"""
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[Subscription]] = defaultdict(set)
+        self._seq = itertools.count(1)
+        self.seq = 0
+
+    def subscribe(self, topics: Set[str]) -> Subscription:
+        subscription = Subscription(set(topics))
+        for topic in subscription.topics:
+            self._subscribers[topic].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        for topic in subscription.topics:
+            subscribers = self._subscribers.get(topic)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[topic]
+
+    def publish(self, request: Dict[str, Any], previous: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Fan out a change of `request` (the updated row). `previous` is the
+        row before the change (None when the request was just created).
+        """
+        if previous is None:
+            kind = "added"
+        elif any(request.get(f) and not previous.get(f) for f in OWNER_FIELDS):
+            kind = "claimed"
+        else:
+            kind = "status_changed"
+
+        self.seq = next(self._seq)
+        event = {
+            "seq": self.seq,
+            "event": kind,
+            "request": request,
+            "previous": {k: previous.get(k) for k in ("status",) + OWNER_FIELDS} if previous else None,
+        }
+
+        topics = request_topics(request) | (request_topics({**request, **event["previous"]}) if previous else set())
+        delivered: Set[int] = set()
+        for topic in topics:
+            for subscription in list(self._subscribers.get(topic, ())):
+                if id(subscription) not in delivered:
+                    delivered.add(id(subscription))
+                    subscription.push(event)
+        return event
+
+
+hub = QueueHub()
+
+
+def delta_message(view: QueueView, event: Dict[str, Any], ctx: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Delta for one connection, or None when the change does not touch its queue"""
+    request = event["request"]
+    bucket = view.classify(request, ctx)
+    previous_bucket = view.classify({**request, **event["previous"]}, ctx) if event["previous"] else None
+    if bucket is None and previous_bucket is None:
+        return None
+    return {"type": "delta", "seq": event["seq"], "event": event["event"], "bucket": bucket, "request": request}
+
+
+async def stream_queue(websocket, view: QueueView, ctx: Dict[str, Any], ping_interval: float = QUEUE_STREAM_PING_SECONDS):
+    """
+    Snapshot-plus-delta loop of an accepted WebSocket. Subscribes before
+    loading the snapshot, so no change between the two is lost.
+    """
+    subscription = hub.subscribe(view.topics(ctx) | {f"user:{ctx['user_id']}"})
+    try:
+        await websocket.send_json({"type": "snapshot", "seq": hub.seq, "queue": await load_queue(view, ctx)})
+        while True:
+            try:
+                event = await subscription.get(timeout=ping_interval)
+            except asyncio.TimeoutError:
+                await websocket.send_json({"type": "ping"})
+                continue
+            if event is None:
+                await websocket.send_json({"type": "snapshot", "seq": hub.seq, "queue": await load_queue(view, ctx)})
+                continue
+            message = delta_message(view, event, ctx)
+            if message:
+                await websocket.send_json(message)
+    finally:
+        hub.unsubscribe(subscription)
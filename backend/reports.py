@@ -0,0 +1,183 @@
+"""
+Admin Reports for RenoveJá+
+Relatórios por período calculados no banco de dados
+
+Todo o agrupamento/soma é feito pela função SQL `admin_report`
+(supabase/admin-reports.sql), ou pelo equivalente local no MockDatabase:
+um relatório custa uma única consulta agregada, qualquer que seja o volume.
+
+Períodos suportados (sempre em UTC, janela [início, fim)):
+- day    → hoje (alias: today)
+- week   → semana atual, a partir de segunda-feira
+- month  → mês atual
+- year   → ano atual
+- custom → start/end (YYYY-MM-DD, fim inclusivo)
+
+Relatórios prontos ficam em cache por REPORT_CACHE_TTL_SECONDS, por janela,
+até REPORT_CACHE_MAX_ENTRIES janelas (as menos usadas saem primeiro).
+"""
+
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, Tuple
+
+from database import call_rpc
+from ttl_cache import TTLCache
+
+REPORT_CACHE_TTL_SECONDS = int(os.getenv("REPORT_CACHE_TTL_SECONDS", "60"))
+# Janelas custom geram chaves à vontade: o cache tem tamanho fixo
+REPORT_CACHE_MAX_ENTRIES = int(os.getenv("REPORT_CACHE_MAX_ENTRIES", "128"))
+MAX_CUSTOM_DAYS = 366
+TOP_DOCTORS = 5
+
+PERIOD_ALIASES = {"today": "day"}
+PERIODS = ["day", "week", "month", "year", "custom"]
+
+REQUEST_TYPE_LABELS = [
+    ("prescription", "Receitas"),
+    ("consultation", "Consultas"),
+    ("exam", "Exames"),
+]
+
+
+@dataclass(frozen=True)
+class ReportWindow:
+    period: str
+    start: datetime
+    end: datetime
+
+    @property
+    def cache_key(self) -> Tuple[str, str, str]:
+        return (self.period, self.start.isoformat(), self.end.isoformat())
+
+
+def _month_bounds(moment: datetime) -> Tuple[datetime, datetime]:
+    start = moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    if start.month == 12:
+        return start, start.replace(year=start.year + 1, month=1)
+    return start, start.replace(month=start.month + 1)
+
+
+def _parse_date(value: Optional[str], name: str) -> datetime:
+    if not value:
+        raise ValueError(f"Parâmetro '{name}' é obrigatório para o período custom")
+    try:
+        return datetime.strptime(value[:10], "%Y-%m-%d")
+    except ValueError:
+        raise ValueError(f"Data inválida em '{name}': use YYYY-MM-DD")
+
+
+def resolve_window(period: str = "month", start: str = None, end: str = None, now: datetime = None) -> ReportWindow:
+    """Turn a period name (or custom start/end dates) into a [start, end) window"""
+    period = PERIOD_ALIASES.get(period, period)
+    now = now or datetime.utcnow()
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    if period == "day":
+        return ReportWindow(period, today, today + timedelta(days=1))
+    if period == "week":
+        monday = today - timedelta(days=today.weekday())
+        return ReportWindow(period, monday, monday + timedelta(days=7))
+    if period == "month":
+        return ReportWindow(period, *_month_bounds(now))
+    if period == "year":
+        first = today.replace(month=1, day=1)
+        return ReportWindow(period, first, first.replace(year=first.year + 1))
+    if period == "custom":
+        window_start = _parse_date(start, "start")
+        window_end = _parse_date(end, "end") + timedelta(days=1)
+        if window_end <= window_start:
+            raise ValueError("A data final deve ser igual ou posterior à inicial")
+        if (window_end - window_start).days > MAX_CUSTOM_DAYS:
+            raise ValueError(f"Período máximo: {MAX_CUSTOM_DAYS} dias")
+        return ReportWindow(period, window_start, window_end)
+
+    raise ValueError(f"Período inválido: use {', '.join(PERIODS)}")
+
+
+# ============== CACHE ==============
+
+_cache = TTLCache(REPORT_CACHE_MAX_ENTRIES, REPORT_CACHE_TTL_SECONDS)
+
+
+def clear_cache():
+    _cache.clear()
+
+
+# ============== RELATÓRIO ==============
+
+def format_report(window: ReportWindow, data: Dict[str, Any]) -> Dict[str, Any]:
+    """Shape the aggregate returned by admin_report() for the admin panel"""
+    requests = data.get("requests") or {}
+    by_type = requests.get("by_type") or {}
+    by_status = requests.get("by_status") or {}
+    total_requests = int(requests.get("total") or 0)
+    completed_count = int(by_status.get("completed", 0))
+
+    revenue = data.get("revenue") or {}
+    total_revenue = round(float(revenue.get("amount") or 0), 2)
+    monthly_revenue = round(float(data.get("month_revenue") or 0), 2)
+
+    rating = data.get("rating") or {}
+    avg_rating = round(float(rating.get("sum") or 0) / rating["count"], 1) if rating.get("count") else 0
+
+    total_count = total_requests or 1
+    return {
+        "period": window.period,
+        "start": window.start.isoformat(),
+        "end": window.end.isoformat(),
+        "totalRevenue": total_revenue,
+        "monthlyRevenue": monthly_revenue,
+        "totalRequests": total_requests,
+        "completedRequests": completed_count,
+        "pendingRequests": total_requests - completed_count,
+        "averageRating": avg_rating,
+        "topDoctors": [
+            {
+                "name": d.get("name") or "N/A",
+                "consultations": int(d.get("consultations") or 0),
+                "rating": round(float(d.get("rating") or 0), 1),
+            }
+            for d in data.get("top_doctors") or []
+        ],
+        "requestsByType": [
+            {
+                "type": label,
+                "count": int(by_type.get(request_type, 0)),
+                "percentage": round(int(by_type.get(request_type, 0)) / total_count * 100),
+            }
+            for request_type, label in REQUEST_TYPE_LABELS
+        ],
+        "requests": {"total": total_requests, "by_type": by_type, "by_status": by_status},
+        "revenue": {"total": total_revenue, "count": int(revenue.get("count") or 0), "month": monthly_revenue},
+        "daily_data": data.get("daily") or [],
+    }
+
+
+async def build_report(window: ReportWindow, now: datetime = None) -> Dict[str, Any]:
+    """Run the aggregate query for a window (uncached)"""
+    month_start, month_end = _month_bounds(now or datetime.utcnow())
+    data = await call_rpc("admin_report", {
+        "p_start": window.start.isoformat(),
+        "p_end": window.end.isoformat(),
+        "p_month_start": month_start.isoformat(),
+        "p_month_end": month_end.isoformat(),
+        "p_top_doctors": TOP_DOCTORS,
+    })
+    if data is None:
+        raise RuntimeError("admin_report indisponível")
+    return format_report(window, data)
+
+
+async def get_report(period: str = "month", start: str = None, end: str = None) -> Dict[str, Any]:
+    """
+    Report for a period, served from the TTL cache when fresh.
+    Raises ValueError for an invalid period or custom window.
+    """
+    window = resolve_window(period, start, end)
+    report = _cache.get(window.cache_key)
+    if report is None:
+        report = await build_report(window)
+        _cache.set(window.cache_key, report)
+    return report
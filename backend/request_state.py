@@ -0,0 +1,177 @@
+"""
+Request State Machine for RenoveJá+
+Transições de status das solicitações com concorrência otimista
+
+Cada transição é um único compare-and-swap no banco (função SQL
+`transition_request`, supabase/request-transitions.sql): a linha é travada,
+o status atual e o responsável são conferidos e o patch é aplicado na mesma
+instrução. Dois médicos aceitando a mesma solicitação ao mesmo tempo: um
+vence, o outro recebe 409 - e os endpoints não precisam mais ler a
+solicitação antes de gravar.
+
+    result = await transition(request_id, "doctor_accept", actor_id=user["id"], patch={...})
+    result.request   # linha já atualizada
+    result.previous  # status/doctor_id anteriores (para rollups e índice de carga)
+"""
+
+from dataclasses import dataclass, field
+from typing import Optional, Dict, Any, Tuple
+
+from database import call_rpc
+
+DOCTOR_PENDING = ("submitted", "pending", "forwarded_to_doctor")
+DOCTOR_REVIEWING = ("in_review", "analyzing")
+NURSING_PENDING = ("submitted", "pending", "in_nursing_review")
+# Aguardando pagamento; consultas são pagas ao agendar, antes do aceite do médico
+PAYABLE = ("approved_pending_payment", "approved_by_nursing_pending_payment", "pending_payment", "submitted", "pending")
+
+NOT_FOUND_ERROR = "Solicitação não encontrada"
+
+
+@dataclass(frozen=True)
+class Transition:
+    """
+    to_status: status final (None: vem do patch, ver "update")
+    from_statuses: status de origem aceitos (None: qualquer um)
+    owner_field: coluna que precisa conter o ator (doctor_id / nurse_id)
+    allow_unassigned: aceita também owner_field vazio (o ator assume o pedido)
+    """
+    to_status: Optional[str]
+    from_statuses: Optional[Tuple[str, ...]] = None
+    owner_field: Optional[str] = None
+    allow_unassigned: bool = False
+    status_error: str = "Solicitação não está disponível para esta ação"
+    owner_error: str = "Você não está atribuído a esta solicitação"
+
+
+TRANSITIONS: Dict[str, Transition] = {
+    # Médico
+    "doctor_accept": Transition(
+        "in_review", DOCTOR_PENDING, "doctor_id", allow_unassigned=True,
+        status_error="Solicitação não está disponível para análise",
+        owner_error="Solicitação já foi aceita por outro médico",
+    ),
+    "doctor_approve": Transition(
+        "approved_pending_payment", DOCTOR_REVIEWING, "doctor_id",
+        status_error="Solicitação não está em análise",
+    ),
+    "doctor_reject": Transition(
+        "rejected", DOCTOR_PENDING + DOCTOR_REVIEWING + ("approved_pending_payment",), "doctor_id",
+        status_error="Solicitação não pode mais ser rejeitada",
+    ),
+    "doctor_sign": Transition(
+        "signed", ("paid",),
+        status_error="Pagamento ainda não foi confirmado",
+    ),
+    # Enfermagem
+    "nursing_accept": Transition(
+        "in_nursing_review", NURSING_PENDING, "nurse_id", allow_unassigned=True,
+        status_error="Solicitação não está disponível para triagem",
+        owner_error="Solicitação já está em triagem com outro profissional",
+    ),
+    "nursing_approve": Transition(
+        "approved_by_nursing_pending_payment", NURSING_PENDING, "nurse_id", allow_unassigned=True,
+        status_error="Solicitação não está em triagem",
+    ),
+    "nursing_forward": Transition(
+        "forwarded_to_doctor", NURSING_PENDING, "nurse_id", allow_unassigned=True,
+        status_error="Solicitação não está em triagem",
+    ),
+    "nursing_reject": Transition(
+        "rejected", NURSING_PENDING, "nurse_id", allow_unassigned=True,
+        status_error="Solicitação não está em triagem",
+    ),
+    # Fila
+    "queue_assign": Transition(
+        "analyzing", DOCTOR_PENDING, "doctor_id", allow_unassigned=True,
+        status_error="Solicitação não está mais na fila",
+        owner_error="Solicitação já foi atribuída a outro médico",
+    ),
+    # Pagamento (aplicada em lote por complete_payments, supabase/payment-completion.sql)
+    "pay": Transition(
+        "paid", PAYABLE,
+        status_error="Solicitação não está aguardando pagamento",
+    ),
+    # Consulta
+    "start_consultation": Transition(
+        "in_consultation", ("paid", "in_review", "analyzing", "approved"),
+        status_error="Consulta não pode ser iniciada neste status",
+    ),
+    "end_consultation": Transition(
+        "completed", ("in_consultation",),
+        status_error="Consulta não está em andamento",
+    ),
+    # Atualização genérica (PUT /requests/{id}): sem restrição de origem
+    "update": Transition(None),
+}
+
+
+class TransitionError(Exception):
+    """Transition refused; status_code/detail map directly to an HTTP error"""
+
+    def __init__(self, status_code: int, detail: str, reason: str = None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.reason = reason
+
+
+@dataclass
+class TransitionResult:
+    request: Dict[str, Any]
+    previous_status: Optional[str]
+    previous_doctor_id: Optional[str]
+    previous: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def status(self) -> str:
+        return self.request.get("status")
+
+
+async def transition(
+    request_id: str,
+    action: str,
+    actor_id: Optional[str] = None,
+    patch: Optional[Dict[str, Any]] = None,
+    to_status: Optional[str] = None
+) -> TransitionResult:
+    """
+    Apply `action` to a request in one conditional update.
+    Raises TransitionError (404 not found, 409 wrong status, 403 not the owner).
+    """
+    rule = TRANSITIONS[action]
+    to_status = to_status or rule.to_status
+    if not to_status:
+        raise ValueError(f"Transição '{action}' exige to_status")
+
+    result = await call_rpc("transition_request", {
+        "p_request_id": request_id,
+        "p_to_status": to_status,
+        "p_from_statuses": list(rule.from_statuses) if rule.from_statuses is not None else None,
+        "p_patch": patch or {},
+        "p_owner_field": rule.owner_field,
+        "p_owner_id": actor_id,
+        "p_allow_unassigned": rule.allow_unassigned,
+    })
+    if not result:
+        raise TransitionError(500, "Não foi possível atualizar a solicitação", "unavailable")
+    if not result.get("matched"):
+        reason = result.get("reason")
+        if reason == "not_found":
+            raise TransitionError(404, NOT_FOUND_ERROR, reason)
+        if reason == "owner":
+            raise TransitionError(403, rule.owner_error, reason)
+        raise TransitionError(409, rule.status_error, reason)
+
+    request = result["request"]
+    previous = {
+        **request,
+        "status": result.get("previous_status"),
+        "doctor_id": result.get("previous_doctor_id"),
+    }
+    return TransitionResult(
+        request=request,
+        previous_status=result.get("previous_status"),
+        previous_doctor_id=result.get("previous_doctor_id"),
+        previous=previous,
+    )
@@ -0,0 +1,157 @@
+"""
+S3 Multipart Upload for RenoveJá+
+Envio de backups em partes, em paralelo, para S3 ou compatível (MinIO, R2...)
+
+S3MultipartWriter é um arquivo só de escrita: os bytes escritos viram partes
+de S3_PART_SIZE enviadas por até S3_UPLOAD_CONCURRENCY threads. Assim o
+backup pode ir direto do compressor para o bucket, sem arquivo local do
+tamanho do backup, e a memória fica em ~(concorrência + 1) x tamanho da parte.
+
+- Cada parte leva Content-MD5; o S3 rejeita a parte se os bytes chegarem
+  diferentes, e o ETag devolvido é conferido antes de concluir o upload.
+- Cada parte é reenviada até S3_PART_RETRIES vezes com backoff.
+- Qualquer falha aborta o multipart upload (sem partes órfãs cobrando espaço).
+
+    with S3MultipartWriter(s3, bucket, key) as out:
+        out.write(chunk)
+"""
+
+import base64
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import List, Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# O S3 exige partes de pelo menos 5 MiB (exceto a última)
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+S3_PART_SIZE = max(int(os.getenv("S3_PART_SIZE_MB", "16")) * 1024 * 1024, S3_MIN_PART_SIZE)
+S3_UPLOAD_CONCURRENCY = int(os.getenv("S3_UPLOAD_CONCURRENCY", "4"))
+S3_PART_RETRIES = int(os.getenv("S3_PART_RETRIES", "3"))
+S3_RETRY_BACKOFF_SECONDS = float(os.getenv("S3_RETRY_BACKOFF_SECONDS", "1"))
+
+
+class S3UploadError(Exception):
+    pass
+
+
+class S3MultipartWriter:
+    """Write-only file object that uploads what it receives as a multipart upload"""
+
+    def __init__(
+        self,
+        s3_client,
+        bucket: str,
+        key: str,
+        part_size: int = S3_PART_SIZE,
+        concurrency: int = S3_UPLOAD_CONCURRENCY,
+        extra_args: Optional[Dict[str, Any]] = None
+    ):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.concurrency = concurrency
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+        self._buffer = bytearray()
+        self._parts: List[Future] = []
+        self._pool = ThreadPoolExecutor(max_workers=concurrency)
+        # Limita partes em memória: as em envio + a que está sendo preenchida
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._closed = False
+        response = self.s3.create_multipart_upload(Bucket=bucket, Key=key, **(extra_args or {}))
+        self.upload_id = response["UploadId"]
+
+    # ============== ESCRITA ==============
+
+    def write(self, data: bytes) -> int:
+        if self._closed:
+            raise ValueError("write to a closed S3MultipartWriter")
+        self._buffer += data
+        self.size += len(data)
+        self.sha256.update(data)
+        while len(self._buffer) >= self.part_size:
+            part = bytes(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+            self._submit(part)
+        return len(data)
+
+    def _submit(self, body: bytes):
+        self._check_failed()
+        self._slots.acquire()
+        part_number = len(self._parts) + 1
+        future = self._pool.submit(self._upload_part, part_number, body)
+        future.add_done_callback(lambda _: self._slots.release())
+        self._parts.append(future)
+
+    def _check_failed(self):
+        for future in self._parts:
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+
+    def _upload_part(self, part_number: int, body: bytes) -> Dict[str, Any]:
+        digest = hashlib.md5(body).digest()
+        content_md5 = base64.b64encode(digest).decode()
+        for attempt in range(S3_PART_RETRIES + 1):
+            try:
+                response = self.s3.upload_part(
+                    Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                    PartNumber=part_number, Body=body, ContentMD5=content_md5
+                )
+                etag = response["ETag"].strip('"')
+                if etag != digest.hex():
+                    raise S3UploadError(f"ETag mismatch on part {part_number}: {etag}")
+                return {"PartNumber": part_number, "ETag": response["ETag"]}
+            except Exception as e:
+                if attempt >= S3_PART_RETRIES:
+                    raise S3UploadError(f"Part {part_number} of {self.key} failed: {e}") from e
+                logger.warning(f"Retrying part {part_number} of {self.key} ({attempt + 1}/{S3_PART_RETRIES}): {e}")
+                time.sleep(S3_RETRY_BACKOFF_SECONDS * (2 ** attempt))
+
+    # ============== CONCLUSÃO ==============
+
+    def close(self):
+        """Upload the last part and complete the upload (aborts it on failure)"""
+        if self._closed:
+            return
+        try:
+            if self._buffer or not self._parts:
+                self._submit(bytes(self._buffer))
+                self._buffer = bytearray()
+            parts = [future.result() for future in self._parts]
+            self.s3.complete_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                MultipartUpload={"Parts": parts}
+            )
+            self._closed = True
+            logger.info(f"Uploaded s3://{self.bucket}/{self.key}: {self.size} bytes in {len(parts)} parts")
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self._pool.shutdown(wait=True)
+
+    def abort(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._pool.shutdown(wait=True)
+        try:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        except Exception as e:
+            logger.error(f"Failed to abort multipart upload of {self.key}: {e}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
@@ -0,0 +1,66 @@
+"""
+Scheduler for RenoveJá+
+Jobs periódicos em segundo plano (atribuição automática, conciliação de
+pagamentos, retenção de notificações)
+
+    task = PeriodicTask(run, interval=20, name="Payment reconciliation", lock="payment_reconciliation")
+    task.start()   # no lifespan do FastAPI
+    await task.stop()
+
+Cada worker do uvicorn roda seus próprios PeriodicTask. Com `lock`, cada
+execução primeiro pega a trava do job (job_locks.py): só um worker do
+cluster roda por vez, os outros pulam a rodada. Sem `lock`, o job precisa
+ser seguro para rodar em paralelo (ex.: a atribuição usa compare-and-swap).
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Optional
+
+from job_locks import job_lock
+
+
+class PeriodicTask:
+    """Runs `run` every `interval` seconds in the background (0 disables)"""
+
+    def __init__(
+        self,
+        run: Callable[[], Awaitable[Any]],
+        interval: float,
+        name: str,
+        lock: Optional[str] = None,
+        lock_ttl: Optional[float] = None
+    ):
+        self.run = run
+        self.interval = interval
+        self.name = name
+        self.lock = lock
+        # A trava expira sozinha se o worker morrer no meio da execução
+        self.lock_ttl = lock_ttl or max(interval * 5, 300)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.ensure_future(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def run_once(self) -> Optional[Any]:
+        """One execution; None when another worker holds the job lock"""
+        if self.lock is None:
+            return await self.run()
+        async with job_lock(self.lock, self.lock_ttl) as acquired:
+            if not acquired:
+                return None
+            return await self.run()
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                print(f"{self.name} error: {e}")
+            await asyncio.sleep(self.interval)
@@ -3,8 +3,10 @@ RenoveJá+ API - Supabase Version
 FastAPI backend with Supabase/PostgreSQL database
 """
 
-from fastapi import FastAPI, APIRouter, HTTPException, Request
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 import hmac
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 import os
@@ -15,6 +17,7 @@ from typing import List, Optional, Literal
 import uuid
 from datetime import datetime, timedelta
 import hashlib
+import json
 import secrets
 import httpx
 import bcrypt
@@ -23,7 +26,7 @@ from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 
 # Import Supabase database module
-from database import db, find_one, find_many, insert_one, update_one, delete_one, count_docs
+from database import db, find_one, find_many, insert_one, update_one, update_where, update_many, delete_one, count_docs, gather_queries, call_rpc
 
 # Import notifications helper
 from notifications_helper import (
@@ -41,6 +44,26 @@ from notifications_helper import (
 # Import AI Medical Analyzer
 from ai_medical_analyzer import analyze_medical_document, MedicalDocumentAnalyzer
 
+# Import statistics rollups (admin dashboard)
+import stats_rollup
+import reports
+import admin_export
+import ratings
+import realtime
+import event_bus
+import chat_history
+import unread_counters
+import notification_retention
+import webhook_inbox
+import payment_completion
+from chat_gateway import ChatGateway
+from mercadopago_client import MercadoPagoClient
+from payment_reconciliation import PaymentReconciler, PAYMENT_RECONCILE_INTERVAL_SECONDS, PAYMENT_RECONCILE_LOCK_SECONDS
+from queue_manager import QueueManager
+from assignment_engine import AUTO_ASSIGN_INTERVAL_SECONDS
+from scheduler import PeriodicTask
+from request_state import transition, TransitionError
+
 ROOT_DIR = Path(__file__).parent
 # UTF-8 para evitar UnicodeDecodeError no Windows ao ler .env
 load_dotenv(ROOT_DIR / '.env', encoding='utf-8')
@@ -66,8 +89,27 @@ API REST do backend RenoveJá+, com autenticação JWT, pedidos de consulta, pre
 - **OpenAPI JSON:** [GET /openapi.json](/openapi.json) – especificação OpenAPI 3.0
 """
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start and stop the event bus and the background jobs"""
+    await bus.start()
+    assignment_scheduler.start()
+    retention_scheduler.start()
+    mercadopago_inbox.start()
+    payment_outbox.start()
+    reconciliation_scheduler.start()
+    yield
+    await reconciliation_scheduler.stop()
+    await payment_outbox.stop()
+    await mercadopago_inbox.stop()
+    await retention_scheduler.stop()
+    await assignment_scheduler.stop()
+    await mercadopago.close()
+    await bus.stop()
+
 # Create the main app
 app = FastAPI(
+    lifespan=lifespan,
     title="RenoveJá+ API",
     version="2.0.0 - Supabase",
     description=OPENAPI_DESCRIPTION,
@@ -446,9 +488,9 @@ def extract_token(request: Request = None, token: str = None) -> str:
     
     return None
 
-async def get_current_user(token: str = None, request: Request = None):
+async def get_token_record(token: str = None, request: Request = None) -> dict:
     """
-    Get current user from token.
+    Validate a token and return its active_tokens record.
     Token can be provided via:
     - Authorization: Bearer <token> header
     - ?token=<token> query parameter
@@ -474,7 +516,10 @@ async def get_current_user(token: str = None, request: Request = None):
         except ValueError:
             pass  # If expiry parsing fails, continue (backward compatibility)
     
-    user = await find_one("users", {"id": token_record["user_id"]})
+    return token_record
+
+def ensure_active_user(user: Optional[dict]) -> dict:
+    """Reject missing or deactivated users"""
     if not user:
         raise HTTPException(status_code=401, detail="Usuário não encontrado")
     
@@ -484,6 +529,75 @@ async def get_current_user(token: str = None, request: Request = None):
     
     return user
 
+async def get_current_user(token: str = None, request: Request = None):
+    """
+    Get current user from token.
+    Token can be provided via:
+    - Authorization: Bearer <token> header
+    - ?token=<token> query parameter
+    """
+    token_record = await get_token_record(token, request)
+    user = await find_one("users", {"id": token_record["user_id"]})
+    return ensure_active_user(user)
+
+# Doctor load index used for queue distribution (see queue_manager.py)
+queue_manager = QueueManager()
+
+# Events shared by every worker (see event_bus.py, EVENT_BUS_URL)
+bus = event_bus.create_bus()
+
+async def on_request_event(event: dict):
+    """Feed request changes from any worker (this one included) into the load index and realtime queues"""
+    queue_manager.index.on_request_event(event)
+    realtime.hub.publish(event["payload"]["request"], previous=event["payload"].get("previous"))
+
+bus.subscribe("request.", on_request_event)
+
+async def on_doctor_event(event: dict):
+    """Feed availability changes from any worker (this one included) into the load index"""
+    queue_manager.index.on_doctor_event(event)
+
+bus.subscribe("doctor.", on_doctor_event)
+
+# WebSocket chat rooms of this worker (see chat_gateway.py)
+chat_gateway = ChatGateway(bus.publish)
+bus.subscribe("chat.", chat_gateway.on_event)
+
+async def record_transition(request: dict, new_status: str, doctor_id: str = None, doctor_name: str = None, updated: dict = None):
+    """
+    Propagate a request status change to the stats rollups and, through the
+    bus (on_request_event), to every worker's doctor load index and realtime
+    queues. `request` still holds the previous status; `updated` is the new
+    row when the caller has it.
+    """
+    await stats_rollup.record_transition(request, new_status)
+    if updated is None:
+        updated = {**request, "status": new_status}
+        if doctor_id:
+            updated.update(doctor_id=doctor_id, doctor_name=doctor_name or request.get("doctor_name"))
+    await bus.publish("request.transition", updated["id"], {"request": updated, "previous": request})
+
+async def transition_request(request_id: str, action: str, actor: dict = None, patch: dict = None, to_status: str = None, doctor_id: str = None, doctor_name: str = None) -> dict:
+    """
+    Apply a state-machine transition (request_state.py) and propagate it.
+    Returns the updated request; refused transitions become HTTP errors.
+    """
+    try:
+        result = await transition(request_id, action, actor_id=actor["id"] if actor else None, patch=patch, to_status=to_status)
+    except TransitionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    await record_transition(result.previous, result.status, doctor_id=doctor_id, doctor_name=doctor_name, updated=result.request)
+    return result.request
+
+async def get_professional_profiles(user: dict) -> dict:
+    """Fetch the doctor/nurse profile matching the user's role"""
+    queries = {}
+    if user.get("role") == "doctor":
+        queries["doctor_profile"] = find_one("doctor_profiles", {"user_id": user["id"]})
+    if user.get("role") == "nurse":
+        queries["nurse_profile"] = find_one("nurse_profiles", {"user_id": user["id"]})
+    return await gather_queries(queries)
+
 # ============== AUTH ROUTES ==============
 
 @api_router.post("/auth/register", response_model=Token, tags=["Auth"])
@@ -586,6 +700,7 @@ async def register_doctor(request: Request, data: DoctorRegister):
         "created_at": datetime.utcnow().isoformat()
     }
     await insert_one("doctor_profiles", doctor_profile)
+    queue_manager.index.upsert_doctor(doctor_profile, user_data["name"], active_cases=0)
     
     token = generate_token()
     token_expiry = (datetime.utcnow() + timedelta(hours=TOKEN_EXPIRATION_HOURS)).isoformat()
@@ -684,15 +799,14 @@ async def login(request: Request, data: UserLogin):
     
     token = generate_token()
     token_expiry = (datetime.utcnow() + timedelta(hours=TOKEN_EXPIRATION_HOURS)).isoformat()
-    await insert_one("active_tokens", {"token": token, "user_id": user["id"], "expires_at": token_expiry, "created_at": datetime.utcnow().isoformat()})
     
-    doctor_profile = None
-    if user.get("role") == "doctor":
-        doctor_profile = await find_one("doctor_profiles", {"user_id": user["id"]})
-    
-    nurse_profile = None
-    if user.get("role") == "nurse":
-        nurse_profile = await find_one("nurse_profiles", {"user_id": user["id"]})
+    # Token insert and profile lookup are independent: run them together
+    results = await gather_queries({
+        "token": insert_one("active_tokens", {"token": token, "user_id": user["id"], "expires_at": token_expiry, "created_at": datetime.utcnow().isoformat()}),
+        "profiles": get_professional_profiles(user),
+    })
+    doctor_profile = results["profiles"].get("doctor_profile")
+    nurse_profile = results["profiles"].get("nurse_profile")
     
     return Token(
         access_token=token,
@@ -768,18 +882,14 @@ async def google_auth(data: GoogleAuthRequest):
                 await insert_one("users", user_data)
                 user = user_data
             
-            # Generate token
+            # Generate token and get profiles if doctor/nurse (independent queries)
             token = generate_token()
-            await insert_one("active_tokens", {"token": token, "user_id": user["id"]})
-            
-            # Get profiles if doctor/nurse
-            doctor_profile = None
-            if user.get("role") == "doctor":
-                doctor_profile = await find_one("doctor_profiles", {"user_id": user["id"]})
-            
-            nurse_profile = None
-            if user.get("role") == "nurse":
-                nurse_profile = await find_one("nurse_profiles", {"user_id": user["id"]})
+            results = await gather_queries({
+                "token": insert_one("active_tokens", {"token": token, "user_id": user["id"]}),
+                "profiles": get_professional_profiles(user),
+            })
+            doctor_profile = results["profiles"].get("doctor_profile")
+            nurse_profile = results["profiles"].get("nurse_profile")
             
             return Token(
                 access_token=token,
@@ -812,15 +922,20 @@ async def logout(token: str):
 
 @api_router.get("/auth/me", tags=["Auth"])
 async def get_me(token: str):
-    user = await get_current_user(token)
-    
-    doctor_profile = None
-    if user.get("role") == "doctor":
-        doctor_profile = await find_one("doctor_profiles", {"user_id": user["id"]})
+    token_record = await get_token_record(token)
+    user_id = token_record["user_id"]
+    
+    # The role is only known once the user is loaded, so fetch the user and
+    # both possible profiles in one round-trip and keep the matching one
+    results = await gather_queries({
+        "user": find_one("users", {"id": user_id}),
+        "doctor_profile": find_one("doctor_profiles", {"user_id": user_id}),
+        "nurse_profile": find_one("nurse_profiles", {"user_id": user_id}),
+    })
+    user = ensure_active_user(results["user"])
     
-    nurse_profile = None
-    if user.get("role") == "nurse":
-        nurse_profile = await find_one("nurse_profiles", {"user_id": user["id"]})
+    doctor_profile = results["doctor_profile"] if user.get("role") == "doctor" else None
+    nurse_profile = results["nurse_profile"] if user.get("role") == "nurse" else None
     
     return {
         "id": user["id"],
@@ -925,6 +1040,8 @@ async def create_prescription_request(request: Request, token: str, data: Prescr
     }
     
     await insert_one("requests", request_data)
+    await stats_rollup.record_request_created(request_data)
+    await bus.publish("request.created", request_id, {"request": request_data})
     
     # Notificar paciente
     await notify_user(insert_one, user["id"], "prescription_created_patient", request_id=request_id)
@@ -973,6 +1090,8 @@ async def create_exam_request(request: Request, token: str, data: ExamRequestCre
     }
     
     await insert_one("requests", request_data)
+    await stats_rollup.record_request_created(request_data)
+    await bus.publish("request.created", request_id, {"request": request_data})
     
     # Notificar paciente
     await notify_user(insert_one, user["id"], "exam_created_patient", request_id=request_id)
@@ -1018,6 +1137,8 @@ async def create_consultation_request(request: Request, token: str, data: Consul
     }
     
     await insert_one("requests", request_data)
+    await stats_rollup.record_request_created(request_data)
+    await bus.publish("request.created", request_id, {"request": request_data})
     
     # Adicionar schedule_type ao retorno (não salvo no banco ainda)
     request_data["schedule_type"] = data.schedule_type
@@ -1126,17 +1247,23 @@ async def get_request(request_id: str, token: str):
 async def update_request(request_id: str, token: str, data: RequestUpdate):
     user = await get_current_user(token)
     
-    request = await find_one("requests", {"id": request_id})
-    if not request:
-        raise HTTPException(status_code=404, detail="Solicitação não encontrada")
-    
     update_data = {k: v for k, v in data.dict().items() if v is not None}
     
+    if "status" in update_data:
+        return await transition_request(
+            request_id, "update", patch=update_data,
+            to_status=update_data["status"], doctor_id=update_data.get("doctor_id")
+        )
+    
     if update_data:
-        await update_one("requests", {"id": request_id}, update_data)
+        updated = await update_where("requests", {"id": request_id}, update_data)
+        if updated:
+            return updated[0]
     
-    updated_request = await find_one("requests", {"id": request_id})
-    return updated_request
+    request = await find_one("requests", {"id": request_id})
+    if not request:
+        raise HTTPException(status_code=404, detail="Solicitação não encontrada")
+    return request
 
 # ============== DOCTOR WORKFLOW ROUTES ==============
 
@@ -1146,19 +1273,11 @@ async def doctor_accept_request(request_id: str, token: str):
     if user.get("role") != "doctor":
         raise HTTPException(status_code=403, detail="Apenas médicos podem aceitar solicitações")
     
-    request = await find_one("requests", {"id": request_id})
-    if not request:
-        raise HTTPException(status_code=404, detail="Solicitação não encontrada")
-    
-    if request.get("status") not in ["submitted", "pending", "forwarded_to_doctor"]:
-        raise HTTPException(status_code=400, detail="Solicitação não está disponível para análise")
-    
-    await update_one("requests", {"id": request_id}, {
-        "status": "in_review",
+    request = await transition_request(request_id, "doctor_accept", user, {
         "doctor_id": user["id"],
         "doctor_name": user["name"],
         "assigned_at": datetime.utcnow().isoformat()
-    })
+    }, doctor_id=user["id"], doctor_name=user["name"])
     
     # Notificar paciente (in-app)
     await notify_user(
@@ -1179,29 +1298,17 @@ async def doctor_approve_request(request_id: str, token: str, data: DoctorApprov
     if user.get("role") != "doctor":
         raise HTTPException(status_code=403, detail="Apenas médicos podem aprovar solicitações")
     
-    request = await find_one("requests", {"id": request_id})
-    if not request:
-        raise HTTPException(status_code=404, detail="Solicitação não encontrada")
-    
-    if request.get("doctor_id") != user["id"]:
-        raise HTTPException(status_code=403, detail="Você não está atribuído a esta solicitação")
-    
-    if request.get("status") not in ["in_review", "analyzing"]:
-        raise HTTPException(status_code=400, detail="Solicitação não está em análise")
-    
-    price = (data.price if data and data.price else request.get("price", 49.90))
-    
     update_data = {
-        "status": "approved_pending_payment",
         "approved_at": datetime.utcnow().isoformat(),
-        "approved_by": "doctor",
-        "price": price
+        "approved_by": "doctor"
     }
-    
+    if data and data.price:
+        update_data["price"] = data.price
     if data and data.notes:
         update_data["notes"] = data.notes
     
-    await update_one("requests", {"id": request_id}, update_data)
+    request = await transition_request(request_id, "doctor_approve", user, update_data)
+    price = request.get("price") or 49.90
     
     # Notificar paciente - aprovado, aguardando pagamento
     await notify_user(
@@ -1221,15 +1328,7 @@ async def doctor_reject_request(request_id: str, token: str, data: DoctorRejecti
     if user.get("role") != "doctor":
         raise HTTPException(status_code=403, detail="Apenas médicos podem rejeitar solicitações")
     
-    request = await find_one("requests", {"id": request_id})
-    if not request:
-        raise HTTPException(status_code=404, detail="Solicitação não encontrada")
-    
-    if request.get("doctor_id") != user["id"]:
-        raise HTTPException(status_code=403, detail="Você não está atribuído a esta solicitação")
-    
-    await update_one("requests", {"id": request_id}, {
-        "status": "rejected",
+    request = await transition_request(request_id, "doctor_reject", user, {
         "rejection_reason": data.reason
     })
     
@@ -1247,13 +1346,6 @@ async def sign_prescription(request_id: str, token: str):
     if user.get("role") != "doctor":
         raise HTTPException(status_code=403, detail="Apenas médicos podem assinar receitas")
     
-    request = await find_one("requests", {"id": request_id})
-    if not request:
-        raise HTTPException(status_code=404, detail="Solicitação não encontrada")
-    
-    if request.get("status") != "paid":
-        raise HTTPException(status_code=400, detail="Pagamento ainda não foi confirmado")
-    
     doctor_profile = await find_one("doctor_profiles", {"user_id": user["id"]})
     crm = f"{doctor_profile.get('crm', '')}/{doctor_profile.get('crm_state', '')}" if doctor_profile else ""
     
@@ -1265,8 +1357,7 @@ async def sign_prescription(request_id: str, token: str):
         "document_hash": hashlib.sha256(f"{request_id}{user['id']}{datetime.utcnow()}".encode()).hexdigest()
     }
     
-    await update_one("requests", {"id": request_id}, {
-        "status": "signed",
+    request = await transition_request(request_id, "doctor_sign", user, {
         "signed_at": datetime.utcnow().isoformat(),
         "signature_data": signature_data,
         "completed_at": datetime.utcnow().isoformat()
@@ -1288,6 +1379,34 @@ async def sign_prescription(request_id: str, token: str):
 
 # ============== DOCTOR ROUTES ==============
 
+async def queue_context(user: dict) -> dict:
+    """Who is looking at a queue (see realtime.QUEUE_VIEWS)"""
+    ctx = {"user_id": user["id"], "specialties": []}
+    if user.get("role") == "doctor":
+        doctor_profile = await find_one("doctor_profiles", {"user_id": user["id"]})
+        ctx["specialties"] = doctor_profile.get("specialties", []) if doctor_profile else []
+    return ctx
+
+@api_router.websocket("/ws/queue")
+async def queue_stream(websocket: WebSocket, token: str, queue: str = "doctor"):
+    """Fila em tempo real: snapshot na conexão e depois apenas deltas (ver realtime.py)"""
+    try:
+        user = await get_current_user(token)
+    except HTTPException:
+        await websocket.close(code=4401)
+        return
+    
+    view = realtime.QUEUE_VIEWS.get(queue)
+    if view is None or user.get("role") not in view.roles:
+        await websocket.close(code=4403)
+        return
+    
+    await websocket.accept()
+    try:
+        await realtime.stream_queue(websocket, view, await queue_context(user))
+    except WebSocketDisconnect:
+        pass
+
 @api_router.get("/doctors/queue", tags=["Médicos"])
 async def get_doctor_queue(token: str):
     user = await get_current_user(token)
@@ -1295,30 +1414,7 @@ async def get_doctor_queue(token: str):
     if user.get("role") != "doctor":
         raise HTTPException(status_code=403, detail="Acesso negado")
     
-    # Pending requests (prescriptions and consultations, not exams)
-    all_requests = await find_many("requests", order="created_at.asc", limit=200)
-    
-    pending = [r for r in all_requests if r.get("status") in ["submitted", "pending"] 
-               and r.get("request_type") != "exam" and not r.get("doctor_id")]
-    
-    analyzing = [r for r in all_requests if r.get("doctor_id") == user["id"] 
-                 and r.get("status") in ["in_review", "analyzing"]]
-    
-    forwarded_from_nursing = [r for r in all_requests if r.get("status") == "in_medical_review"]
-    
-    awaiting_payment = [r for r in all_requests if r.get("doctor_id") == user["id"] 
-                        and r.get("status") == "approved_pending_payment"]
-    
-    awaiting_signature = [r for r in all_requests if r.get("doctor_id") == user["id"] 
-                          and r.get("status") == "paid"]
-    
-    return {
-        "pending": pending,
-        "analyzing": analyzing,
-        "forwarded_from_nursing": forwarded_from_nursing,
-        "awaiting_payment": awaiting_payment,
-        "awaiting_signature": awaiting_signature
-    }
+    return await realtime.load_queue(realtime.QUEUE_VIEWS["doctor"], await queue_context(user))
 
 @api_router.get("/doctors", tags=["Médicos"])
 async def get_doctors(specialty: Optional[str] = None):
@@ -1351,50 +1447,7 @@ async def get_doctor_consultation_queue(token: str):
     if user.get("role") not in ["doctor", "admin"]:
         raise HTTPException(status_code=403, detail="Acesso permitido apenas para médicos")
     
-    # Buscar todas as consultas
-    all_requests = await find_many("requests", order="created_at.asc", limit=100)
-    
-    # Filtrar apenas teleconsultas
-    consultations = [r for r in all_requests if r.get("request_type") == "consultation"]
-    
-    # Obter perfil do médico para ver especialidades
-    doctor_profile = await find_one("doctor_profiles", {"user_id": user["id"]})
-    doctor_specialties = doctor_profile.get("specialties", []) if doctor_profile else []
-    
-    # Aguardando atendimento (pagas, status paid ou submitted após pagamento)
-    # Filtra por especialidade do médico se disponível
-    waiting = []
-    for c in consultations:
-        # Consulta paga aguardando início
-        if c.get("status") == "paid":
-            # Se médico tem especialidades definidas, filtrar
-            if doctor_specialties and c.get("specialty") not in doctor_specialties:
-                continue
-            waiting.append(c)
-    
-    # Ordenar por tipo (imediatas primeiro) e depois por tempo de espera
-    waiting.sort(key=lambda x: (
-        0 if x.get("schedule_type") == "immediate" else 1,
-        x.get("paid_at", x.get("created_at", ""))
-    ))
-    
-    # Em andamento (do médico atual)
-    in_progress = [c for c in consultations 
-                   if c.get("status") == "in_consultation" 
-                   and c.get("doctor_id") == user["id"]]
-    
-    # Completadas hoje (do médico atual)
-    today = datetime.utcnow().strftime("%Y-%m-%d")
-    completed = [c for c in consultations 
-                 if c.get("status") == "completed" 
-                 and c.get("doctor_id") == user["id"]
-                 and c.get("completed_at", "").startswith(today)]
-    
-    return {
-        "waiting": waiting,
-        "in_progress": in_progress,
-        "completed": completed
-    }
+    return await realtime.load_queue(realtime.QUEUE_VIEWS["consultation"], await queue_context(user))
 
 # ============== NURSING ROUTES ==============
 
@@ -1405,22 +1458,7 @@ async def get_nursing_queue(token: str):
     if user.get("role") != "nurse":
         raise HTTPException(status_code=403, detail="Acesso permitido apenas para enfermeiros")
     
-    all_requests = await find_many("requests", order="created_at.asc", limit=200)
-    
-    pending = [r for r in all_requests if r.get("request_type") == "exam" 
-               and r.get("status") == "submitted" and not r.get("nurse_id")]
-    
-    in_review = [r for r in all_requests if r.get("request_type") == "exam" 
-                 and r.get("nurse_id") == user["id"] and r.get("status") == "in_nursing_review"]
-    
-    awaiting_payment = [r for r in all_requests if r.get("nurse_id") == user["id"] 
-                        and r.get("status") == "approved_by_nursing_pending_payment"]
-    
-    return {
-        "pending": pending,
-        "in_review": in_review,
-        "awaiting_payment": awaiting_payment
-    }
+    return await realtime.load_queue(realtime.QUEUE_VIEWS["nursing"], await queue_context(user))
 
 @api_router.post("/nursing/accept/{request_id}", tags=["Enfermagem"])
 async def nursing_accept_request(request_id: str, token: str):
@@ -1429,12 +1467,7 @@ async def nursing_accept_request(request_id: str, token: str):
     if user.get("role") != "nurse":
         raise HTTPException(status_code=403, detail="Acesso permitido apenas para enfermeiros")
     
-    request = await find_one("requests", {"id": request_id})
-    if not request:
-        raise HTTPException(status_code=404, detail="Solicitação não encontrada")
-    
-    await update_one("requests", {"id": request_id}, {
-        "status": "in_nursing_review",
+    request = await transition_request(request_id, "nursing_accept", user, {
         "nurse_id": user["id"],
         "nurse_name": user["name"]
     })
@@ -1454,12 +1487,7 @@ async def nursing_approve_request(request_id: str, token: str, data: NursingAppr
     if user.get("role") != "nurse":
         raise HTTPException(status_code=403, detail="Acesso permitido apenas para enfermeiros")
     
-    request = await find_one("requests", {"id": request_id})
-    if not request:
-        raise HTTPException(status_code=404, detail="Solicitação não encontrada")
-    
-    await update_one("requests", {"id": request_id}, {
-        "status": "approved_by_nursing_pending_payment",
+    request = await transition_request(request_id, "nursing_approve", user, {
         "price": data.price,
         "exam_type": data.exam_type,
         "exams": data.exams,
@@ -1482,12 +1510,7 @@ async def nursing_forward_to_doctor(request_id: str, token: str, data: NursingFo
     if user.get("role") != "nurse":
         raise HTTPException(status_code=403, detail="Acesso permitido apenas para enfermeiros")
     
-    request = await find_one("requests", {"id": request_id})
-    if not request:
-        raise HTTPException(status_code=404, detail="Solicitação não encontrada")
-    
-    await update_one("requests", {"id": request_id}, {
-        "status": "forwarded_to_doctor",
+    request = await transition_request(request_id, "nursing_forward", user, {
         "notes": f"Encaminhado pela enfermagem: {data.reason or 'Requer validação médica'}"
     })
     
@@ -1512,12 +1535,7 @@ async def nursing_reject_request(request_id: str, token: str, data: NursingRejec
     if user.get("role") != "nurse":
         raise HTTPException(status_code=403, detail="Acesso permitido apenas para enfermeiros")
     
-    request = await find_one("requests", {"id": request_id})
-    if not request:
-        raise HTTPException(status_code=404, detail="Solicitação não encontrada")
-    
-    await update_one("requests", {"id": request_id}, {
-        "status": "rejected",
+    request = await transition_request(request_id, "nursing_reject", user, {
         "rejection_reason": data.reason,
         "approved_by": "nurse"
     })
@@ -1562,72 +1580,40 @@ def verify_mercadopago_signature(x_signature: str, x_request_id: str, data_id: s
         print(f"Webhook signature verification error: {e}")
         return False
 
+# Shared, pooled client (keep-alive, retries, per-payment status cache)
+mercadopago = MercadoPagoClient(MERCADOPAGO_ACCESS_TOKEN)
+
 async def create_mercadopago_pix(amount: float, description: str, payer_email: str, external_reference: str):
     """Create a PIX payment using MercadoPago API"""
-    if not MERCADOPAGO_ACCESS_TOKEN:
-        return None
-    
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://api.mercadopago.com/v1/payments",
-                headers={
-                    "Authorization": f"Bearer {MERCADOPAGO_ACCESS_TOKEN}",
-                    "Content-Type": "application/json",
-                    "X-Idempotency-Key": str(uuid.uuid4())
-                },
-                json={
-                    "transaction_amount": float(amount),
-                    "description": description,
-                    "payment_method_id": "pix",
-                    "payer": {
-                        "email": payer_email
-                    },
-                    "external_reference": external_reference
-                },
-                timeout=30.0
-            )
-            
-            if response.status_code in [200, 201]:
-                data = response.json()
-                return {
-                    "mp_payment_id": str(data.get("id")),
-                    "status": data.get("status"),
-                    "pix_code": data.get("point_of_interaction", {}).get("transaction_data", {}).get("qr_code"),
-                    "pix_qr_base64": data.get("point_of_interaction", {}).get("transaction_data", {}).get("qr_code_base64"),
-                    "ticket_url": data.get("point_of_interaction", {}).get("transaction_data", {}).get("ticket_url")
-                }
-            else:
-                print(f"MercadoPago error: {response.status_code} - {response.text}")
-                return None
-    except Exception as e:
-        print(f"MercadoPago exception: {e}")
-        return None
+    return await mercadopago.create_pix(amount, description, payer_email, external_reference)
 
-async def check_mercadopago_payment(mp_payment_id: str):
-    """Check payment status on MercadoPago"""
-    if not MERCADOPAGO_ACCESS_TOKEN or not mp_payment_id:
-        return None
-    
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"https://api.mercadopago.com/v1/payments/{mp_payment_id}",
-                headers={"Authorization": f"Bearer {MERCADOPAGO_ACCESS_TOKEN}"},
-                timeout=15.0
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                return {
-                    "status": data.get("status"),
-                    "status_detail": data.get("status_detail"),
-                    "date_approved": data.get("date_approved")
-                }
-            return None
-    except Exception as e:
-        print(f"MercadoPago check error: {e}")
-        return None
+async def check_mercadopago_payment(mp_payment_id: str, fresh: bool = False):
+    """Check payment status on MercadoPago (cached briefly; fresh=True bypasses the cache)"""
+    return await mercadopago.get_payment_status(mp_payment_id, fresh=fresh)
+
+async def complete_payments(completions: List[dict]) -> List[dict]:
+    """
+    Complete payments through payment_completion.py: one transaction moves the
+    payments and their requests and queues each completion in payment_outbox.
+    Stats, notifications and bus events are applied from the outbox by
+    payment_outbox's workers. Safe to call concurrently for the same payment.
+    """
+    completed = await payment_completion.complete_payments(completions)
+    if completed:
+        payment_outbox.wake()
+    return completed
+
+async def publish_payment_completion(entry: dict):
+    """Bus events of one payment_outbox row; the fixed id makes retries duplicates"""
+    event = entry["event"]
+    if event.get("previous_request") and event.get("request"):
+        await bus.publish(
+            "request.transition", event["request"]["id"],
+            {"request": event["request"], "previous": event["previous_request"]},
+            event_id=f"payment-outbox-{entry['id']}"
+        )
+
+payment_outbox = payment_completion.PaymentOutbox(publish_payment_completion)
 
 # ============== PAYMENT ROUTES ==============
 
@@ -1674,8 +1660,12 @@ async def create_payment(request: Request, token: str, data: PaymentCreate):
 
 @api_router.get("/payments/{payment_id}", tags=["Pagamentos"])
 async def get_payment(payment_id: str, token: str):
-    user = await get_current_user(token)
-    payment = await find_one("payments", {"id": payment_id})
+    results = await gather_queries({
+        "user": get_current_user(token),
+        "payment": find_one("payments", {"id": payment_id}),
+    })
+    user = results["user"]
+    payment = results["payment"]
     
     if not payment:
         raise HTTPException(status_code=404, detail="Pagamento não encontrado")
@@ -1701,30 +1691,20 @@ async def get_payment(payment_id: str, token: str):
     
     # Admins can see all (no additional check needed)
     
-    # Check real payment status if applicable
-    if payment.get("is_real_payment") and payment.get("external_id") and payment.get("status") == "pending":
-        mp_status = await check_mercadopago_payment(payment["external_id"])
-        if mp_status and mp_status.get("status") == "approved":
-            # Update payment and request status
-            await update_one("payments", {"id": payment_id}, {
-                "status": "completed",
-                "paid_at": mp_status.get("date_approved") or datetime.utcnow().isoformat()
-            })
-            await update_one("requests", {"id": payment["request_id"]}, {
-                "status": "paid",
-                "paid_at": datetime.utcnow().isoformat()
-            })
-            payment["status"] = "completed"
-    
+    # Pure read: MercadoPago status is refreshed by webhooks and payment_reconciliation.py
     return payment
 
 @api_router.get("/payments/{payment_id}/status", tags=["Pagamentos"])
 async def check_payment_status(payment_id: str, token: str):
-    user = await get_current_user(token)
+    results = await gather_queries({
+        "user": get_current_user(token),
+        "payment": find_one("payments", {"id": payment_id}),
+    })
+    user = results["user"]
     user_role = user.get("role", "patient")
     user_id = user["id"]
     
-    payment = await find_one("payments", {"id": payment_id})
+    payment = results["payment"]
     
     if not payment:
         raise HTTPException(status_code=404, detail="Pagamento não encontrado")
@@ -1742,21 +1722,10 @@ async def check_payment_status(payment_id: str, token: str):
         else:
             raise HTTPException(status_code=403, detail="Acesso negado a este pagamento")
     
-    # Check real payment status
+    # Pure read: the last MercadoPago status seen by the webhook or the reconciliation job
     mp_status = None
-    if payment.get("is_real_payment") and payment.get("external_id"):
-        mp_status = await check_mercadopago_payment(payment["external_id"])
-        
-        if mp_status and mp_status.get("status") == "approved" and payment.get("status") != "completed":
-            await update_one("payments", {"id": payment_id}, {
-                "status": "completed",
-                "paid_at": mp_status.get("date_approved") or datetime.utcnow().isoformat()
-            })
-            await update_one("requests", {"id": payment["request_id"]}, {
-                "status": "paid",
-                "paid_at": datetime.utcnow().isoformat()
-            })
-            payment["status"] = "completed"
+    if payment.get("mp_status"):
+        mp_status = {"status": payment.get("mp_status"), "status_detail": payment.get("mp_status_detail")}
     
     return {
         "payment_id": payment_id,
@@ -1786,44 +1755,7 @@ async def confirm_payment(payment_id: str, token: str):
     if user_role in ["doctor", "nurse"]:
         raise HTTPException(status_code=403, detail="Apenas o paciente ou administrador pode confirmar pagamentos")
     
-    await update_one("payments", {"id": payment_id}, {
-        "status": "completed",
-        "paid_at": datetime.utcnow().isoformat()
-    })
-    
-    await update_one("requests", {"id": payment["request_id"]}, {
-        "status": "paid",
-        "paid_at": datetime.utcnow().isoformat()
-    })
-    
-    request = await find_one("requests", {"id": payment["request_id"]})
-    
-    # Notificar paciente - pagamento confirmado
-    if request:
-        await notify_user(
-            insert_one, request["patient_id"], "payment_confirmed",
-            {"amount": payment.get("amount", 0)}, request_id=payment["request_id"]
-        )
-    
-    # Notificar médico ou enfermeiro para assinar
-    if request and request.get("doctor_id"):
-        await notify_user(
-            insert_one, request["doctor_id"], "prescription_paid_doctor",
-            {"patient_name": request.get("patient_name", "Paciente")}, request_id=payment["request_id"]
-        )
-    elif request and request.get("nurse_id"):
-        await notify_user(
-            insert_one, request["nurse_id"], "exam_paid",
-            {"patient_name": request.get("patient_name", "Paciente")}, request_id=payment["request_id"]
-        )
-    
-    # Notificar admin
-    if request:
-        await notify_admins(
-            insert_one, find_many, "admin_payment_received",
-            {"amount": payment.get("amount", 0), "patient_name": request.get("patient_name", "Paciente")},
-            request_id=payment["request_id"]
-        )
+    await complete_payments([{"payment_id": payment_id, "paid_at": datetime.utcnow().isoformat()}])
     
     return {"message": "Pagamento confirmado com sucesso", "status": "paid"}
 
@@ -1837,14 +1769,27 @@ class WebhookData(BaseModel):
     type: Optional[str] = None
     user_id: Optional[str] = None
 
+def mercadopago_completion(payment: dict, mp_status: dict) -> dict:
+    """complete_payments() item for a payment MercadoPago reports as approved"""
+    return {
+        "payment_id": payment["id"],
+        "paid_at": mp_status.get("date_approved") or datetime.utcnow().isoformat(),
+        "mp_status": mp_status.get("status"),
+        "mp_status_detail": mp_status.get("status_detail")
+    }
+
+async def complete_mercadopago_payments(approved: List[tuple]) -> List[dict]:
+    """Complete (payment, mp_status) pairs approved on MercadoPago in one batch"""
+    return await complete_payments([mercadopago_completion(p, s) for p, s in approved])
+
 async def process_mercadopago_webhook(mp_payment_id: str):
-    """Process MercadoPago payment approval"""
+    """Process MercadoPago payment approval (run by the webhook inbox workers)"""
     # Check payment status on MercadoPago
-    mp_status = await check_mercadopago_payment(str(mp_payment_id))
+    mp_status = await check_mercadopago_payment(str(mp_payment_id), fresh=True)
     
     if not mp_status:
-        print(f"⚠️ Could not fetch payment status from MercadoPago: {mp_payment_id}")
-        return False
+        # Raise so the inbox retries later with backoff
+        raise RuntimeError(f"Could not fetch payment status from MercadoPago: {mp_payment_id}")
     
     print(f"📥 MercadoPago payment {mp_payment_id} status: {mp_status.get('status')}")
     
@@ -1862,57 +1807,39 @@ async def process_mercadopago_webhook(mp_payment_id: str):
             print(f"ℹ️ Payment {mp_payment_id} already processed")
             return True
         
-        # Update payment
-        await update_one("payments", {"id": payment["id"]}, {
-            "status": "completed",
-            "paid_at": mp_status.get("date_approved") or datetime.utcnow().isoformat(),
-            "mp_status": mp_status.get("status"),
-            "mp_status_detail": mp_status.get("status_detail")
-        })
-        
-        # Update request
-        await update_one("requests", {"id": payment["request_id"]}, {
-            "status": "paid",
-            "paid_at": datetime.utcnow().isoformat()
-        })
-        
-        # Get request for notifications
-        req = await find_one("requests", {"id": payment["request_id"]})
-        
-        # Notify patient
-        if req:
-            await notify_user(
-                insert_one, req["patient_id"], "payment_confirmed",
-                {"amount": payment.get("amount", 0)}, request_id=payment["request_id"]
-            )
-        
-        # Notify doctor or nurse
-        if req and req.get("doctor_id"):
-            await notify_user(
-                insert_one, req["doctor_id"], "prescription_paid_doctor",
-                {"patient_name": req.get("patient_name", "Paciente")},
-                request_id=payment["request_id"]
-            )
-        elif req and req.get("nurse_id"):
-            await notify_user(
-                insert_one, req["nurse_id"], "exam_paid",
-                {"patient_name": req.get("patient_name", "Paciente")},
-                request_id=payment["request_id"]
-            )
-        
-        # Notify admins
-        if req:
-            await notify_admins(
-                insert_one, find_many, "admin_payment_received",
-                {"amount": payment.get("amount", 0), "patient_name": req.get("patient_name", "Paciente")},
-                request_id=payment["request_id"]
-            )
-        
+        await complete_mercadopago_payments([(payment, mp_status)])
         print(f"✅ Webhook: Payment {mp_payment_id} approved and processed")
         return True
     
     return False
 
+# Webhooks are stored in a durable inbox and processed by background workers
+mercadopago_inbox = webhook_inbox.WebhookInbox(process_mercadopago_webhook)
+
+# Periodic check of pending PIX payments (PAYMENT_RECONCILE_INTERVAL_SECONDS; 0 disables),
+# one worker of the cluster at a time
+payment_reconciler = PaymentReconciler(mercadopago, complete_mercadopago_payments)
+reconciliation_scheduler = PeriodicTask(
+    payment_reconciler.run,
+    interval=PAYMENT_RECONCILE_INTERVAL_SECONDS if mercadopago.configured else 0,
+    name="Payment reconciliation",
+    lock="payment_reconciliation",
+    lock_ttl=PAYMENT_RECONCILE_LOCK_SECONDS
+)
+
+def parse_mercadopago_webhook(query_params, body_json: dict):
+    """(mp_payment_id, topic) from any of the webhook formats; (None, None) if not a payment event"""
+    # Format 1: IPN (Instant Payment Notification) - older format
+    if query_params.get("topic", "") == "payment" and query_params.get("id"):
+        return str(query_params["id"]), "payment"
+    
+    data = body_json.get("data") if isinstance(body_json.get("data"), dict) else {}
+    # Format 2: Webhook v2 - newer format / Format 3: action-based
+    if data.get("id") and (body_json.get("type") == "payment" or body_json.get("action") in ["payment.created", "payment.updated"]):
+        return str(data["id"]), body_json.get("action") or body_json.get("type")
+    
+    return None, None
+
 @api_router.post("/webhooks/mercadopago", tags=["Pagamentos"])
 async def mercadopago_webhook_handler(request: Request):
     """
@@ -1922,65 +1849,45 @@ async def mercadopago_webhook_handler(request: Request):
     https://seu-dominio.com/api/webhooks/mercadopago
     
     Events to subscribe: payment.created, payment.updated
+    
+    Only verifies and records the event (webhook_inbox.py), so it answers in
+    milliseconds; duplicates of the same (data.id, x-request-id) are ignored.
     """
+    # Get raw body for signature verification
+    body = await request.body()
     try:
-        # Get raw body for signature verification
-        body = await request.body()
+        body_json = json.loads(body) if body else {}
+    except ValueError:
         body_json = {}
-        try:
-            import json
-            body_json = json.loads(body)
-        except:
-            pass
-        
-        # Extract headers for signature verification
-        x_signature = request.headers.get("x-signature", "")
-        x_request_id = request.headers.get("x-request-id", "")
-        
-        # Get data ID from query params or body
-        data_id = request.query_params.get("data.id", "")
-        if not data_id and body_json.get("data"):
-            data_id = str(body_json["data"].get("id", ""))
-        
-        # Verify signature if webhook secret is configured
-        if MERCADOPAGO_WEBHOOK_SECRET:
-            if not verify_mercadopago_signature(x_signature, x_request_id, data_id):
-                print(f"⚠️ Webhook signature verification failed")
-                # Log but continue for debugging - in production you might want to reject
-        
-        print(f"📨 MercadoPago webhook received: type={body_json.get('type')}, action={body_json.get('action')}")
-        
-        # Handle different webhook formats
-        # Format 1: IPN (Instant Payment Notification) - older format
-        topic = request.query_params.get("topic", "")
-        if topic == "payment":
-            mp_payment_id = request.query_params.get("id", "")
-            if mp_payment_id:
-                await process_mercadopago_webhook(mp_payment_id)
-                return {"status": "ok"}
-        
-        # Format 2: Webhook v2 - newer format
-        if body_json.get("type") == "payment" and body_json.get("data"):
-            mp_payment_id = body_json["data"].get("id")
-            if mp_payment_id:
-                await process_mercadopago_webhook(str(mp_payment_id))
-                return {"status": "ok"}
-        
-        # Format 3: action-based
-        if body_json.get("action") in ["payment.created", "payment.updated"]:
-            mp_payment_id = body_json.get("data", {}).get("id")
-            if mp_payment_id:
-                await process_mercadopago_webhook(str(mp_payment_id))
-                return {"status": "ok"}
-        
+    if not isinstance(body_json, dict):
+        body_json = {}
+    
+    # Extract headers for signature verification
+    x_signature = request.headers.get("x-signature", "")
+    x_request_id = request.headers.get("x-request-id", "")
+    
+    # Get data ID from query params or body
+    data_id = request.query_params.get("data.id", "")
+    if not data_id and isinstance(body_json.get("data"), dict):
+        data_id = str(body_json["data"].get("id", ""))
+    
+    # Verify signature if webhook secret is configured
+    if MERCADOPAGO_WEBHOOK_SECRET:
+        if not x_signature or not verify_mercadopago_signature(x_signature, x_request_id, data_id):
+            print(f"⚠️ Webhook signature verification failed")
+            raise HTTPException(status_code=401, detail="Assinatura inválida")
+    
+    mp_payment_id, topic = parse_mercadopago_webhook(request.query_params, body_json)
+    if not mp_payment_id:
         return {"status": "ok", "message": "Event type not handled"}
-        
-    except Exception as e:
-        print(f"❌ Webhook error: {e}")
-        import traceback
-        traceback.print_exc()
-        # Return 200 to prevent MercadoPago from retrying
-        return {"status": "error", "message": str(e)}
+    
+    # Without x-request-id, the notification id (or the body itself) identifies the delivery
+    delivery_id = x_request_id or str(body_json.get("id") or "") or hashlib.sha256(body).hexdigest()
+    
+    # If this fails the error reaches MercadoPago, which retries the delivery later
+    queued = await mercadopago_inbox.enqueue(mp_payment_id, delivery_id, topic, body_json)
+    print(f"📨 MercadoPago webhook {'queued' if queued else 'duplicate'}: payment={mp_payment_id} topic={topic}")
+    return {"status": "ok", "queued": queued}
 
 # Legacy endpoint alias for backward compatibility
 @api_router.post("/payments/webhook/mercadopago", tags=["Pagamentos"])
@@ -1990,35 +1897,34 @@ async def mercadopago_webhook_legacy(request: Request):
 
 # ============== CHAT ROUTES ==============
 
-@api_router.post("/chat", tags=["Chat"])
-async def send_message(token: str, data: MessageCreate):
-    user = await get_current_user(token)
-    user_role = user.get("role", "patient")
-    user_id = user["id"]
-    
-    # SECURITY: Verify user has permission to send messages in this chat
-    request = await find_one("requests", {"id": data.request_id})
+async def get_chat_request(request_id: str, user: dict) -> dict:
+    """SECURITY: the request of a chat, if the user is one of its participants (or admin)"""
+    request = await find_one("requests", {"id": request_id})
     if not request:
         raise HTTPException(status_code=404, detail="Solicitação não encontrada")
     
-    # Check access permissions
-    is_patient = request.get("patient_id") == user_id
-    is_doctor = request.get("doctor_id") == user_id
-    is_nurse = request.get("nurse_id") == user_id
-    is_admin = user_role == "admin"
+    is_patient = request.get("patient_id") == user["id"]
+    is_doctor = request.get("doctor_id") == user["id"]
+    is_nurse = request.get("nurse_id") == user["id"]
+    is_admin = user.get("role", "patient") == "admin"
     
     if not (is_patient or is_doctor or is_nurse or is_admin):
         raise HTTPException(status_code=403, detail="Acesso negado a este chat")
-    
+    return request
+
+async def post_chat_message(user: dict, request_id: str, text: str, request: dict = None) -> dict:
+    """Store a chat message, count it as unread and publish it (HTTP and WebSocket share this path)"""
     # Sanitize message (basic XSS prevention - more robust sanitization recommended for production)
-    sanitized_message = data.message.strip()
+    sanitized_message = (text or "").strip()
+    if not sanitized_message:
+        raise HTTPException(status_code=400, detail="Mensagem vazia")
     if len(sanitized_message) > 5000:
         raise HTTPException(status_code=400, detail="Mensagem muito longa (máximo 5000 caracteres)")
     
     message_id = str(uuid.uuid4())
     message_data = {
         "id": message_id,
-        "request_id": data.request_id,
+        "request_id": request_id,
         "sender_id": user["id"],
         "sender_name": user["name"],
         "sender_type": user.get("role", "patient"),
@@ -2027,43 +1933,69 @@ async def send_message(token: str, data: MessageCreate):
     }
     
     await insert_one("chat_messages", message_data)
+    await unread_counters.record_chat_message(request or await find_one("requests", {"id": request_id}) or {"id": request_id}, user["id"])
+    message_data = {**message_data, "cursor": chat_history.encode_cursor(message_data)}
+    await bus.publish("chat.message", request_id, {"message": message_data})
     
     return message_data
 
-@api_router.get("/chat/{request_id}", tags=["Chat"])
-async def get_messages(request_id: str, token: str):
+@api_router.post("/chat", tags=["Chat"])
+async def send_message(token: str, data: MessageCreate):
     user = await get_current_user(token)
-    user_role = user.get("role", "patient")
-    user_id = user["id"]
-    
-    # SECURITY: Verify user has permission to access this chat
-    request = await find_one("requests", {"id": request_id})
-    if not request:
-        raise HTTPException(status_code=404, detail="Solicitação não encontrada")
-    
-    # Check access permissions
-    is_patient = request.get("patient_id") == user_id
-    is_doctor = request.get("doctor_id") == user_id
-    is_nurse = request.get("nurse_id") == user_id
-    is_admin = user_role == "admin"
-    
-    if not (is_patient or is_doctor or is_nurse or is_admin):
-        raise HTTPException(status_code=403, detail="Acesso negado a este chat")
-    
-    messages = await find_many("chat_messages", filters={"request_id": request_id}, order="created_at.asc")
-    return messages
+    request = await get_chat_request(data.request_id, user)
+    return await post_chat_message(user, data.request_id, data.message, request)
 
 @api_router.get("/chat/unread-count", tags=["Chat"])
 async def get_unread_count(token: str):
+    """Mensagens não lidas: total e por solicitação (contadores mantidos, sem varredura)"""
     user = await get_current_user(token)
-    # Simplified - return 0 for now
-    return {"unread_count": 0}
+    return await unread_counters.get_chat_unread(user["id"])
+
+@api_router.get("/chat/{request_id}", tags=["Chat"])
+async def get_messages(
+    request_id: str,
+    token: str,
+    response: Response,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    since: Optional[str] = None,
+    limit: int = chat_history.CHAT_PAGE_SIZE
+):
+    """
+    Mensagens do chat, mais antigas primeiro (ver chat_history.py).
+    Sem parâmetros: página mais recente. X-Has-More indica se há mais mensagens.
+    """
+    user = await get_current_user(token)
+    await get_chat_request(request_id, user)
+    
+    try:
+        messages, has_more = await chat_history.get_messages_page(request_id, before=before, after=after, since=since, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    response.headers["X-Has-More"] = "true" if has_more else "false"
+    return messages
+
+@api_router.websocket("/ws/chat/{request_id}")
+async def chat_stream(websocket: WebSocket, request_id: str, token: str, after: str = None):
+    """Chat em tempo real da solicitação: mensagens, confirmação, presença e digitação"""
+    try:
+        user = await get_current_user(token)
+        await get_chat_request(request_id, user)
+    except HTTPException as e:
+        await websocket.close(code=4401 if e.status_code == 401 else 4403)
+        return
+    
+    await websocket.accept()
+    await chat_gateway.handle(websocket, user, request_id, post_chat_message, after=after)
 
 @api_router.post("/chat/{request_id}/mark-read", tags=["Chat"])
 async def mark_chat_read(request_id: str, token: str):
     user = await get_current_user(token)
-    # Mark all messages as read (simplified)
-    return {"marked_read": 0}
+    await get_chat_request(request_id, user)
+    
+    unread = (await unread_counters.get_chat_unread(user["id"]))["by_request"].get(request_id, 0)
+    await unread_counters.reset(user["id"], unread_counters.CHAT, request_id)
+    return {"marked_read": unread}
 
 # ============== NOTIFICATION ROUTES ==============
 
@@ -2074,6 +2006,12 @@ async def get_notifications(token: str):
     notifications = await find_many("notifications", filters={"user_id": user["id"]}, order="created_at.desc", limit=50)
     return notifications
 
+@api_router.get("/notifications/unread-count", tags=["Notificações"])
+async def get_notifications_unread_count(token: str):
+    """Badge do app: notificações não lidas (contador mantido, sem varredura)"""
+    user = await get_current_user(token)
+    return {"unread_count": await unread_counters.get_notifications_unread(user["id"])}
+
 @api_router.put("/notifications/{notification_id}/read", tags=["Notificações"])
 async def mark_notification_read(notification_id: str, token: str):
     user = await get_current_user(token)
@@ -2086,7 +2024,9 @@ async def mark_notification_read(notification_id: str, token: str):
     if notification.get("user_id") != user["id"]:
         raise HTTPException(status_code=403, detail="Acesso negado a esta notificação")
     
-    await update_one("notifications", {"id": notification_id}, {"read": True})
+    # Só desconta do badge se ela ainda estava não lida (evita descontar duas vezes)
+    if await update_where("notifications", {"id": notification_id, "read": False}, {"read": True}):
+        await unread_counters.notification_read(user["id"])
     
     return {"message": "Notificação marcada como lida"}
 
@@ -2094,13 +2034,9 @@ async def mark_notification_read(notification_id: str, token: str):
 async def mark_all_notifications_read(token: str):
     user = await get_current_user(token)
     
-    # Get all unread notifications for this user and mark them as read
-    notifications = await find_many("notifications", filters={"user_id": user["id"], "read": False}, limit=500)
-    
-    count = 0
-    for notification in notifications:
-        await update_one("notifications", {"id": notification["id"]}, {"read": True})
-        count += 1
+    # Mark every unread notification as read in a single statement (no cap)
+    count = await update_many("notifications", {"user_id": user["id"], "read": False}, {"read": True})
+    await unread_counters.reset(user["id"], unread_counters.NOTIFICATIONS)
     
     return {"message": f"{count} notificações marcadas como lidas"}
 
@@ -2110,16 +2046,7 @@ async def mark_all_notifications_read(token: str):
 async def get_queue_stats(token: str):
     user = await get_current_user(token)
     
-    total_pending = await count_docs("requests", {"status": {"in": ["pending", "submitted"]}})
-    total_analyzing = await count_docs("requests", {"status": {"in": ["analyzing", "in_review"]}})
-    
-    return {
-        "pending": total_pending,
-        "analyzing": total_analyzing,
-        "completed_today": 0,
-        "available_doctors": 0,
-        "average_wait_minutes": 15
-    }
+    return await queue_manager.get_queue_stats()
 
 @api_router.post("/queue/assign/{request_id}", tags=["Fila"])
 async def assign_doctor_to_request(request_id: str, token: str, doctor_id: Optional[str] = None):
@@ -2130,12 +2057,11 @@ async def assign_doctor_to_request(request_id: str, token: str, doctor_id: Optio
     
     assigned_doctor_id = doctor_id or user["id"]
     
-    await update_one("requests", {"id": request_id}, {
+    await transition_request(request_id, "queue_assign", {"id": assigned_doctor_id}, {
         "doctor_id": assigned_doctor_id,
         "doctor_name": user["name"],
-        "status": "analyzing",
         "assigned_at": datetime.utcnow().isoformat()
-    })
+    }, doctor_id=assigned_doctor_id)
     
     return {"success": True, "message": "Solicitação atribuída com sucesso"}
 
@@ -2151,6 +2077,8 @@ async def update_doctor_availability(token: str, available: bool = True):
     doctor_profile = await find_one("doctor_profiles", {"user_id": user["id"]})
     if doctor_profile:
         await update_one("doctor_profiles", {"user_id": user["id"]}, {"available": available, "updated_at": datetime.utcnow().isoformat()})
+        # Every worker's load index, this one included, applies it from the bus
+        await bus.publish("doctor.availability", user["id"], {"doctor_id": user["id"], "available": available})
     
     return {"message": f"Disponibilidade atualizada para {'disponível' if available else 'indisponível'}"}
 
@@ -2203,14 +2131,8 @@ async def start_consultation(request_id: str, token: str):
     if user["role"] not in ["doctor", "admin"]:
         raise HTTPException(status_code=403, detail="Apenas médicos podem iniciar consultas")
     
-    request = await find_one("requests", {"id": request_id})
-    if not request:
-        raise HTTPException(status_code=404, detail="Solicitação não encontrada")
-    
-    await update_one("requests", {"id": request_id}, {
-        "status": "in_consultation",
-        "consultation_started_at": datetime.utcnow().isoformat(),
-        "updated_at": datetime.utcnow().isoformat()
+    request = await transition_request(request_id, "start_consultation", user, {
+        "consultation_started_at": datetime.utcnow().isoformat()
     })
     
     # Notificar paciente - consulta iniciando
@@ -2228,36 +2150,20 @@ async def end_consultation(request_id: str, token: str, notes: str = None):
     if user["role"] not in ["doctor", "admin"]:
         raise HTTPException(status_code=403, detail="Apenas médicos podem encerrar consultas")
     
-    request = await find_one("requests", {"id": request_id})
-    if not request:
-        raise HTTPException(status_code=404, detail="Solicitação não encontrada")
-    
-    started_at = request.get("consultation_started_at")
-    duration_minutes = 0
-    if started_at:
-        try:
-            start_time = datetime.fromisoformat(started_at.replace("Z", "+00:00"))
-            duration_minutes = int((datetime.utcnow() - start_time.replace(tzinfo=None)).total_seconds() / 60)
-        except:
-            pass
-    
+    ended_at = datetime.utcnow()
     update_data = {
-        "status": "completed",
-        "consultation_ended_at": datetime.utcnow().isoformat(),
-        "consultation_duration_minutes": duration_minutes,
-        "completed_at": datetime.utcnow().isoformat(),
-        "updated_at": datetime.utcnow().isoformat()
+        "consultation_ended_at": ended_at.isoformat(),
+        "completed_at": ended_at.isoformat()
     }
     if notes:
         update_data["consultation_notes"] = notes
     
-    await update_one("requests", {"id": request_id}, update_data)
+    # A duração é calculada na mesma transição, com o início gravado na linha
+    request = await transition_request(request_id, "end_consultation", user, update_data)
+    duration_minutes = request.get("consultation_duration_minutes") or 0
     
     # Update doctor stats
-    doctor_profile = await find_one("doctor_profiles", {"user_id": user["id"]})
-    if doctor_profile:
-        total = doctor_profile.get("total_consultations", 0) + 1
-        await update_one("doctor_profiles", {"user_id": user["id"]}, {"total_consultations": total})
+    await call_rpc("increment_doctor_consultations", {"p_doctor_id": user["id"]})
     
     # Notificar paciente - consulta finalizada, pedir avaliação
     await notify_user(
@@ -2273,37 +2179,43 @@ async def end_consultation(request_id: str, token: str, notes: str = None):
     
     return {"message": "Consulta encerrada", "duration_minutes": duration_minutes}
 
+async def run_auto_assign() -> dict:
+    """Assign one batch of pending requests (see assignment_engine) and record the transitions"""
+    result = await queue_manager.auto_assign_pending_requests()
+    await stats_rollup.apply_deltas([
+        delta
+        for assignment in result["assignments"]
+        for delta in stats_rollup.transition_deltas(assignment["request"], "analyzing")
+    ])
+    for assignment in result["assignments"]:
+        request, doctor = assignment["request"], assignment["doctor"]
+        await bus.publish("request.transition", request["id"], {
+            "request": {**request, "status": "analyzing", "doctor_id": doctor["user_id"], "doctor_name": doctor["name"]},
+            "previous": request
+        })
+    return result
+
+# Background auto-assignment (AUTO_ASSIGN_INTERVAL_SECONDS; 0 disables)
+assignment_scheduler = PeriodicTask(run_auto_assign, interval=AUTO_ASSIGN_INTERVAL_SECONDS, name="Auto-assign")
+
+# Background notification archival (NOTIFICATION_RETENTION_INTERVAL_SECONDS; 0 disables);
+# run_retention takes its own job lock, so the CLI is covered too
+retention_scheduler = PeriodicTask(
+    notification_retention.run_retention,
+    interval=notification_retention.NOTIFICATION_RETENTION_INTERVAL_SECONDS,
+    name="Notification retention"
+)
+
 @api_router.post("/queue/auto-assign", tags=["Fila"])
 async def auto_assign_queue(token: str):
-    """Auto-assign pending requests to available doctors"""
+    """Run one auto-assignment batch now (normally done by the background scheduler)"""
     user = await get_current_user(token)
     if user["role"] not in ["admin", "doctor"]:
         raise HTTPException(status_code=403, detail="Acesso negado")
     
-    # Get pending requests
-    pending = await find_many("requests", filters={"status": "submitted"}, order="created_at.asc", limit=10)
-    
-    # Get available doctors
-    available_doctors = await find_many("doctor_profiles", filters={"available": True}, limit=10)
-    
-    assigned_count = 0
-    for request in pending:
-        if not available_doctors:
-            break
-        
-        doctor_profile = available_doctors.pop(0)
-        doctor = await find_one("users", {"id": doctor_profile["user_id"]})
-        
-        if doctor:
-            await update_one("requests", {"id": request["id"]}, {
-                "status": "analyzing",
-                "doctor_id": doctor["id"],
-                "doctor_name": doctor["name"],
-                "assigned_at": datetime.utcnow().isoformat(),
-                "updated_at": datetime.utcnow().isoformat()
-            })
-            assigned_count += 1
+    result = await run_auto_assign()
     
+    assigned_count = result["assigned"]
     return {"message": f"{assigned_count} solicitações atribuídas automaticamente", "assigned": assigned_count}
 
 # ============== SPECIALTIES ==============
@@ -2560,7 +2472,6 @@ async def submit_review(request_id: str, token: str, data: ReviewCreate):
     if request.get("patient_id") != user["id"]:
         raise HTTPException(status_code=403, detail="Apenas o paciente pode avaliar")
     
-    # Update request with review
     review_data = {
         "rating": data.rating,
         "tags": data.tags or [],
@@ -2568,40 +2479,27 @@ async def submit_review(request_id: str, token: str, data: ReviewCreate):
         "reviewed_at": datetime.utcnow().isoformat()
     }
     
-    await update_one("requests", {"id": request_id}, {"review": review_data})
-    
-    # Update doctor's average rating if applicable
-    if request.get("doctor_id"):
-        doctor_requests = await find_many("requests", filters={"doctor_id": request["doctor_id"]}, limit=100)
-        ratings = [r.get("review", {}).get("rating") for r in doctor_requests if r.get("review", {}).get("rating")]
-        if ratings:
-            avg_rating = sum(ratings) / len(ratings)
-            await update_one("doctor_profiles", {"user_id": request["doctor_id"]}, {
-                "rating": round(avg_rating, 2),
-                "updated_at": datetime.utcnow().isoformat()
-            })
+    # Store review and update the doctor's rating aggregates in one transaction
+    await ratings.submit_review(
+        request, data.rating, data.tags, data.comment, review_data["reviewed_at"]
+    )
     
     return {"message": "Avaliação enviada com sucesso", "review": review_data}
 
 @api_router.get("/reviews/doctor/{doctor_id}", tags=["Avaliações"])
 async def get_doctor_reviews(doctor_id: str, limit: int = 20):
     """Get reviews for a specific doctor"""
-    requests = await find_many("requests", filters={"doctor_id": doctor_id}, order="created_at.desc", limit=limit)
-    
-    reviews = []
-    for r in requests:
-        if r.get("review"):
-            reviews.append({
-                "id": r["id"],
-                "patient_name": r.get("patient_name", "Paciente"),
-                "rating": r["review"].get("rating"),
-                "tags": r["review"].get("tags", []),
-                "comment": r["review"].get("comment"),
-                "date": r["review"].get("reviewed_at"),
-                "request_type": r.get("request_type")
-            })
+    return await ratings.get_doctor_reviews(doctor_id, limit)
+
+@api_router.post("/admin/ratings/recompute", tags=["Admin"])
+async def recompute_doctor_ratings(token: str):
+    """Recalcula a projeção de avaliações e as médias dos médicos (admin only)"""
+    user = await get_current_user(token)
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Acesso negado")
     
-    return reviews
+    reviews = await ratings.recompute()
+    return {"message": "Avaliações recalculadas com sucesso", "reviews": reviews}
 
 # ============== ADMIN ROUTES ==============
 
@@ -2612,22 +2510,24 @@ async def get_admin_stats(token: str):
     if user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Acesso negado. Apenas administradores.")
     
-    total_users = await count_docs("users", {})
-    total_patients = await count_docs("users", {"role": "patient"})
-    total_doctors = await count_docs("users", {"role": "doctor"})
-    
-    # Count requests by status
-    pending = await count_docs("requests", {"status": "submitted"})
-    analyzing = await count_docs("requests", {"status": {"in": ["analyzing", "in_review"]}})
+    # User counts and the precomputed request/revenue rollups are independent reads
+    results = await gather_queries({
+        "total_users": count_docs("users", {}),
+        "total_patients": count_docs("users", {"role": "patient"}),
+        "total_doctors": count_docs("users", {"role": "doctor"}),
+        "dashboard": stats_rollup.get_dashboard(),
+    })
+    total_users = results["total_users"]
+    total_patients = results["total_patients"]
+    total_doctors = results["total_doctors"]
     
-    # Get completed today
-    today = datetime.utcnow().strftime("%Y-%m-%d")
-    all_completed = await find_many("requests", filters={"status": "completed"}, limit=500)
-    completed_today = sum(1 for r in all_completed if r.get("completed_at", "").startswith(today))
+    dashboard = results["dashboard"]
+    statuses = dashboard["all"].get("status")
     
-    # Calculate revenue
-    all_payments = await find_many("payments", filters={"status": "completed"}, limit=500)
-    total_revenue = sum(float(p.get("amount", 0)) for p in all_payments)
+    pending = int(stats_rollup.total(statuses, buckets=["submitted"]))
+    analyzing = int(stats_rollup.total(statuses, buckets=stats_rollup.ANALYZING_STATUSES))
+    completed_today = int(stats_rollup.total(dashboard["today"].get("completed")))
+    total_revenue = round(stats_rollup.total(dashboard["all"].get("revenue"), "amount"), 2)
     
     return {
         "total_users": total_users,
@@ -2640,65 +2540,72 @@ async def get_admin_stats(token: str):
     }
 
 @api_router.get("/admin/reports", tags=["Admin"])
-async def get_admin_reports(token: str, period: str = "month"):
-    """Get detailed reports (admin only)"""
+async def get_admin_reports(token: str, period: str = "month", start: str = None, end: str = None):
+    """
+    Get detailed reports for a period (admin only).
+    period: day (today), week, month, year or custom (start/end = YYYY-MM-DD)
+    """
     user = await get_current_user(token)
     if user["role"] != "admin":
         raise HTTPException(status_code=403, detail="Acesso negado")
     
-    # Get all data
-    all_requests = await find_many("requests", limit=1000)
-    all_payments = await find_many("payments", filters={"status": "completed"}, limit=500)
-    all_doctors = await find_many("doctor_profiles", limit=100)
-    
-    # Calculate totals
-    total_revenue = sum(float(p.get("amount", 0)) for p in all_payments)
-    completed_requests = [r for r in all_requests if r.get("status") == "completed"]
-    
-    # Requests by type
-    prescription_count = sum(1 for r in all_requests if r.get("request_type") == "prescription")
-    consultation_count = sum(1 for r in all_requests if r.get("request_type") == "consultation")
-    exam_count = sum(1 for r in all_requests if r.get("request_type") == "exam")
-    total_count = len(all_requests) or 1
-    
-    # Top doctors
-    doctor_stats = {}
-    for r in completed_requests:
-        doc_id = r.get("doctor_id")
-        if doc_id:
-            if doc_id not in doctor_stats:
-                doctor_stats[doc_id] = {"name": r.get("doctor_name", "N/A"), "count": 0, "ratings": []}
-            doctor_stats[doc_id]["count"] += 1
-            if r.get("review", {}).get("rating"):
-                doctor_stats[doc_id]["ratings"].append(r["review"]["rating"])
-    
-    top_doctors = []
-    for doc_id, stats in sorted(doctor_stats.items(), key=lambda x: x[1]["count"], reverse=True)[:5]:
-        avg_rating = sum(stats["ratings"]) / len(stats["ratings"]) if stats["ratings"] else 0
-        top_doctors.append({
-            "name": stats["name"],
-            "consultations": stats["count"],
-            "rating": round(avg_rating, 1)
-        })
+    try:
+        return await reports.get_report(period, start, end)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@api_router.post("/admin/stats/rebuild", tags=["Admin"])
+async def rebuild_admin_stats(token: str):
+    """Recalcula os rollups de estatísticas a partir das tabelas de origem (admin only)"""
+    user = await get_current_user(token)
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Acesso negado")
     
-    # Average rating
-    all_ratings = [r.get("review", {}).get("rating") for r in all_requests if r.get("review", {}).get("rating")]
-    avg_rating = round(sum(all_ratings) / len(all_ratings), 1) if all_ratings else 0
+    rows = await stats_rollup.rebuild()
+    return {"message": "Estatísticas recalculadas com sucesso", "rows": rows}
+
+@api_router.post("/admin/payments/reconcile", tags=["Admin"])
+async def reconcile_payments(token: str):
+    """Confere agora os pagamentos PIX pendentes com o MercadoPago (normalmente feito em segundo plano; admin only)"""
+    user = await get_current_user(token)
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Acesso negado")
     
-    return {
-        "totalRevenue": total_revenue,
-        "monthlyRevenue": total_revenue * 0.3,  # Simplified
-        "totalRequests": len(all_requests),
-        "completedRequests": len(completed_requests),
-        "pendingRequests": len(all_requests) - len(completed_requests),
-        "averageRating": avg_rating,
-        "topDoctors": top_doctors,
-        "requestsByType": [
-            {"type": "Receitas", "count": prescription_count, "percentage": round(prescription_count / total_count * 100)},
-            {"type": "Consultas", "count": consultation_count, "percentage": round(consultation_count / total_count * 100)},
-            {"type": "Exames", "count": exam_count, "percentage": round(exam_count / total_count * 100)},
-        ]
-    }
+    result = await reconciliation_scheduler.run_once()
+    if result is None:
+        raise HTTPException(status_code=409, detail="Conciliação já em execução")
+    return result
+
+@api_router.post("/admin/notifications/retention", tags=["Admin"])
+async def run_notification_retention(token: str):
+    """Arquiva e remove notificações antigas agora (normalmente feito em segundo plano; admin only)"""
+    user = await get_current_user(token)
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    
+    return await notification_retention.run_retention()
+
+@api_router.get("/admin/export/{dataset}", tags=["Admin"])
+async def export_admin_data(dataset: str, token: str, format: str = "csv", since: str = None, until: str = None):
+    """
+    Export a full dataset (users, requests, payments, reviews) as CSV or NDJSON (admin only).
+    Rows are streamed page by page; since/until filter on created_at.
+    """
+    user = await get_current_user(token)
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    
+    try:
+        chunks = admin_export.stream_export(dataset, format, since, until)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    filename = f"{dataset}-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.{format}"
+    return StreamingResponse(
+        chunks,
+        media_type=admin_export.FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 @api_router.get("/admin/users", tags=["Admin"])
 async def get_admin_users(token: str, role: str = None):
@@ -2768,7 +2675,7 @@ _cors_kw = dict(
     allow_origins=ALLOWED_ORIGINS,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS", "PATCH"],
     allow_headers=["Authorization", "Content-Type", "X-Requested-With", "X-CSRF-Token"],
-    expose_headers=["X-Total-Count", "X-Request-ID"],
+    expose_headers=["X-Total-Count", "X-Request-ID", "X-Has-More"],
     max_age=3600,
 )
 if os.getenv("ENV", "development") != "production":
@@ -0,0 +1,213 @@
+"""
+Statistics Rollups for RenoveJá+
+Contadores e receita pré-agregados para o painel administrativo
+
+Em vez de contar/varrer `requests` e `payments` a cada acesso ao painel,
+cada evento relevante aplica pequenos deltas na tabela `stats_rollups`:
+
+- status    (day="all")      → quantas solicitações estão em cada status agora
+- completed (dia e "all")    → solicitações concluídas, por tipo
+- revenue   (dia e "all")    → pagamentos confirmados (count) e receita (amount), por tipo
+
+Só o que /api/admin/stats lê fica aqui; relatórios por período são agregados
+no banco (reports.py) e as médias dos médicos ficam em doctor_profiles (ratings.py).
+
+Os deltas são aplicados atomicamente pela função SQL `apply_stats_deltas`
+(supabase/stats-rollups.sql). `rebuild()` recalcula tudo a partir das tabelas
+de origem e pode ser executado periodicamente para corrigir divergências:
+
+    python stats_rollup.py
+"""
+
+import asyncio
+from datetime import datetime
+from typing import Optional, List, Dict, Any, Tuple
+
+from database import find_many, call_rpc, iter_pages, in_chunks
+
+ROLLUP_TABLE = "stats_rollups"
+ALL_TIME = "all"
+
+# Dimensões lidas pelo painel (/api/admin/stats)
+DASHBOARD_DIMENSIONS = ["status", "completed", "revenue"]
+
+ANALYZING_STATUSES = ["analyzing", "in_review"]
+
+
+def _today() -> str:
+    return datetime.utcnow().strftime("%Y-%m-%d")
+
+
+def _day(timestamp: Optional[str]) -> str:
+    """Dia (YYYY-MM-DD) de um timestamp ISO; hoje se ausente"""
+    if timestamp and len(timestamp) >= 10:
+        return timestamp[:10]
+    return _today()
+
+
+def _delta(day: str, dimension: str, bucket: str, count: int = 0, amount: float = 0.0, label: str = None) -> Dict[str, Any]:
+    return {
+        "day": day,
+        "dimension": dimension,
+        "bucket": bucket or "unknown",
+        "count": count,
+        "amount": round(float(amount), 2),
+        "label": label,
+    }
+
+
+def _merge(deltas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Combine deltas for the same row so each row is touched once per call"""
+    merged: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+    for d in deltas:
+        key = (d["day"], d["dimension"], d["bucket"])
+        if key in merged:
+            merged[key]["count"] += d["count"]
+            merged[key]["amount"] = round(merged[key]["amount"] + d["amount"], 2)
+            merged[key]["label"] = d["label"] or merged[key]["label"]
+        else:
+            merged[key] = dict(d)
+    return list(merged.values())
+
+
+# ============== DELTAS POR EVENTO ==============
+
+def request_created_deltas(request: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [_delta(ALL_TIME, "status", request.get("status", "submitted"), 1)]
+
+
+def completed_deltas(request_type: str, completed_at: str = None) -> List[Dict[str, Any]]:
+    day = _day(completed_at)
+    return [
+        _delta(day, "completed", request_type, 1),
+        _delta(ALL_TIME, "completed", request_type, 1),
+    ]
+
+
+def transition_deltas(request: Dict[str, Any], new_status: str) -> List[Dict[str, Any]]:
+    previous_status = request.get("status")
+    if previous_status == new_status:
+        return []
+
+    deltas = [_delta(ALL_TIME, "status", new_status, 1)]
+    if previous_status:
+        deltas.append(_delta(ALL_TIME, "status", previous_status, -1))
+
+    if new_status == "completed":
+        deltas.extend(completed_deltas(request.get("request_type")))
+
+    return deltas
+
+
+def payment_deltas(amount: float, request_type: str, paid_at: str = None) -> List[Dict[str, Any]]:
+    day = _day(paid_at)
+    return [
+        _delta(day, "revenue", request_type, 1, amount),
+        _delta(ALL_TIME, "revenue", request_type, 1, amount),
+    ]
+
+
+# ============== ESCRITA ==============
+
+async def apply_deltas(deltas: List[Dict[str, Any]]):
+    """Apply deltas atomically; failures are logged and repaired by rebuild()"""
+    if not deltas:
+        return
+    try:
+        await call_rpc("apply_stats_deltas", {"p_deltas": _merge(deltas)})
+    except Exception as e:
+        print(f"Stats rollup error: {e}")
+
+
+async def record_request_created(request: Dict[str, Any]):
+    await apply_deltas(request_created_deltas(request))
+
+
+async def record_transition(request: Dict[str, Any], new_status: str):
+    """Record a status change; `request` must still hold the previous status"""
+    await apply_deltas(transition_deltas(request, new_status))
+
+
+
+# ============== LEITURA ==============
+
+async def get_dashboard(day: str = None) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """
+    Read the all-time and daily rollups in a single query.
+
+    Returns {"all": {dimension: {bucket: row}}, "today": {...}}.
+    """
+    day = day or _today()
+    rows = await find_many(
+        ROLLUP_TABLE,
+        filters={"day": {"in": [ALL_TIME, day]}, "dimension": {"in": DASHBOARD_DIMENSIONS}},
+        order="id.asc",
+        limit=5000
+    )
+
+    result: Dict[str, Dict[str, Dict[str, Any]]] = {"all": {}, "today": {}}
+    for row in rows:
+        scope = "all" if row.get("day") == ALL_TIME else "today"
+        result[scope].setdefault(row["dimension"], {})[row["bucket"]] = row
+    return result
+
+
+def total(rows: Dict[str, Dict[str, Any]], field: str = "count", buckets: List[str] = None) -> float:
+    """Sum a field over the buckets of one dimension"""
+    return sum(
+        float(r.get(field) or 0)
+        for bucket, r in (rows or {}).items()
+        if buckets is None or bucket in buckets
+    )
+
+
+# ============== RECONSTRUÇÃO ==============
+
+async def rebuild(page_size: int = 1000) -> int:
+    """
+    Recompute every rollup from the source tables and replace the rollup table.
+    Pages through the data with keyset pagination, so memory stays bounded
+    by the number of rollup rows, not the number of requests.
+
+    Returns the number of rollup rows written.
+    """
+    deltas: List[Dict[str, Any]] = []
+
+    async for page in iter_pages(
+        "requests",
+        columns="id,status,request_type,completed_at",
+        page_size=page_size
+    ):
+        for r in page:
+            deltas.extend(request_created_deltas(r))
+            if r.get("status") == "completed":
+                deltas.extend(completed_deltas(r.get("request_type"), r.get("completed_at")))
+        deltas = _merge(deltas)
+
+    async for page in iter_pages(
+        "payments",
+        columns="id,request_id,amount,paid_at,created_at",
+        filters={"status": "completed"},
+        page_size=page_size
+    ):
+        # O tipo vem da solicitação: só os ids da página, em lotes que cabem na URL
+        request_ids = sorted({p["request_id"] for p in page if p.get("request_id")})
+        request_types = {}
+        for ids in in_chunks(request_ids):
+            requests = await find_many("requests", filters={"id": {"in": ids}}, order="id.asc", limit=len(ids))
+            request_types.update((r["id"], r.get("request_type")) for r in requests)
+        for p in page:
+            deltas.extend(payment_deltas(
+                float(p.get("amount") or 0),
+                request_types.get(p.get("request_id")),
+                p.get("paid_at") or p.get("created_at")
+            ))
+        deltas = _merge(deltas)
+
+    await call_rpc("replace_stats_rollups", {"p_rows": deltas})
+    return len(deltas)
+
+
+if __name__ == "__main__":
+    rows = asyncio.run(rebuild())
+    print(f"✅ {rows} linhas de estatísticas recalculadas")
@@ -0,0 +1,381 @@
+"""
+Testes - Backup (backup_manager)
+Supabase local via httpx.MockTransport, arquivos em tmp_path
+"""
+
+import io
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+import httpx
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backup_format
+import backup_manager
+import keyset
+from backup_format import read_index, read_table
+from backup_manager import BackupManager, manifest_path, read_backup
+
+
+class FakeSupabase:
+    """Stand-in for PostgREST: GET pages a table, POST upserts into it"""
+
+    def __init__(self, tables):
+        self.tables = {name: list(rows) for name, rows in tables.items()}
+        self.restored = {}
+        self.gets = 0
+        self.lock = threading.Lock()
+        self.on_page = None
+        self.post_failures = {}
+        self.post_delay = 0
+        self.posts = []
+        self.active = 0
+        self.max_active = 0
+
+    def __call__(self, request):
+        table = request.url.path.rsplit("/", 1)[-1]
+        if request.method == "POST":
+            with self.lock:
+                failures = self.post_failures.get(table, 0)
+                if failures:
+                    self.post_failures[table] = failures - 1
+                    return httpx.Response(503)
+                self.active += 1
+                self.max_active = max(self.max_active, self.active)
+            time.sleep(self.post_delay)
+            with self.lock:
+                self.active -= 1
+                self.restored.setdefault(table, []).extend(json.loads(request.content))
+                self.posts.append(table)
+            return httpx.Response(201)
+        with self.lock:
+            self.gets += 1
+        if table == "broken":
+            return httpx.Response(500)
+        params = request.url.params
+        assert "offset" not in params
+        keys = [part.rsplit(".", 1)[0] for part in params["order"].split(",")]
+        rows = sorted(self.tables.get(table, []), key=lambda r: [r.get(k, "") for k in keys])
+        for column, value in params.multi_items():
+            if column in ("select", "order", "limit", "or"):
+                continue
+            op, bound = value.split(".", 1)
+            check = {"gt": str.__gt__, "lte": str.__le__}[op]
+            rows = [r for r in rows if check(r.get(column, ""), bound)]
+        if "or" in params:
+            # A última cláusula traz o cursor completo: and(k1.eq."v1",k2.gt."v2")
+            last = params["or"].rsplit("and(", 1)[-1]
+            after = [v for _, v in re.findall(r'(\w+)\.(?:eq|gt)\."([^"]*)"', last)]
+            rows = [r for r in rows if [str(r[k]) for k in keys] > after]
+        result = rows[:int(params["limit"])]
+        if self.on_page:
+            self.on_page(table)
+        return httpx.Response(200, json=result)
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    monkeypatch.setenv("SUPABASE_URL", "https://db.test")
+    monkeypatch.setenv("SUPABASE_SERVICE_ROLE_KEY", "service-key")
+    monkeypatch.setenv("BACKUP_DIR", str(tmp_path))
+    monkeypatch.delenv("BACKUP_S3_BUCKET", raising=False)
+
+    def make(fake, tables):
+        m = BackupManager(transport=httpx.MockTransport(fake))
+        m.tables = tables
+        m.page_size = 2
+        return m
+
+    return make
+
+
+CREATED = "2024-06-01T10:00:00.000000Z"
+
+FAKE_TABLES = {
+    # mesmo created_at para todos: o id desempata o cursor
+    "users": [{"id": f"u{i}", "name": f"Usuário {i}", "created_at": CREATED, "updated_at": CREATED} for i in range(5)],
+    "requests": [{"id": f"r{i}", "status": "paid", "created_at": f"2024-06-01T1{i}:00:00.000000Z"} for i in range(3)],
+    "payments": [],
+}
+
+
+class TestBackupManager:
+
+    def test_streams_chunked_container_with_index(self, manager):
+        fake = FakeSupabase(FAKE_TABLES)
+        m = manager(fake, ["users", "requests", "payments", "broken"])
+        m.chunk_bytes = 100
+
+        path = m.backup_database()
+        m.close()
+
+        assert path.endswith(".rjb")
+        with open(manifest_path(path)) as f:
+            manifest = json.load(f)
+        index = read_index(path)
+        assert manifest["format"] == index["format"] == "renoveja-chunked"
+        assert manifest["tables"] == index["tables"] and manifest["codec"] == index["codec"]
+        assert [(t["name"], t["rows"]) for t in index["tables"]] == [("users", 5), ("requests", 3), ("payments", 0)]
+        assert len(index["tables"][0]["chunks"]) > 1
+        assert index["failed"] == ["broken"]
+        assert manifest["size"] == os.path.getsize(path)
+
+        # Uma tabela é lida sozinha, direto dos seus blocos
+        assert [r["id"] for r in read_table(path, "requests")] == ["r0", "r1", "r2"]
+
+        records = list(read_backup(path))
+        assert [r["id"] for t, r in records if t == "users"] == [f"u{i}" for i in range(5)]
+        assert m.verify_backup(path)
+        assert not list(m.backup_dir.glob(".*.part"))
+
+    def test_verify_detects_corruption_and_restore_roundtrips(self, manager):
+        fake = FakeSupabase(FAKE_TABLES)
+        m = manager(fake, ["users", "requests"])
+        path = m.backup_database()
+
+        assert m.restore_from_backup(path)
+        assert fake.restored == {"users": FAKE_TABLES["users"], "requests": FAKE_TABLES["requests"]}
+
+        with open(path, "r+b") as f:
+            f.seek(30)
+            byte = f.read(1)
+            f.seek(30)
+            f.write(bytes([byte[0] ^ 0xFF]))
+        assert not m.verify_backup(path)
+        assert not m.restore_from_backup(path)
+        m.close()
+
+    def test_failed_backup_leaves_no_files(self, manager, monkeypatch):
+        fake = FakeSupabase(FAKE_TABLES)
+        m = manager(fake, ["users"])
+        monkeypatch.setattr(backup_manager.BackupManager, "_write_manifest", lambda *a: 1 / 0)
+
+        assert m.backup_database() is None
+        assert list(m.backup_dir.iterdir()) == []
+
+    def test_tables_waiting_their_turn_spool_at_most_the_budget(self, manager, monkeypatch):
+        rows = [{"id": f"x{i:03d}", "payload": os.urandom(40).hex(), "created_at": CREATED} for i in range(60)]
+        fake = FakeSupabase({f"t{n}": rows for n in range(4)})
+        # A primeira tabela demora: as outras terminam antes e esperam a vez
+        fake.on_page = lambda table: time.sleep(0.01) if table == "t0" else None
+        m = manager(fake, ["t0", "t1", "t2", "t3"])
+        m.chunk_bytes = 500
+        m.spool_bytes = 2000
+        peak = []
+        reserve = backup_manager.SpoolBudget.reserve
+
+        def tracked(budget, size, attached):
+            reserved = reserve(budget, size, attached)
+            peak.append(budget.used)
+            return reserved
+
+        monkeypatch.setattr(backup_manager.SpoolBudget, "reserve", tracked)
+
+        path = m.backup_database()
+        m.close()
+
+        assert peak and max(peak) <= m.spool_bytes
+        for n in range(4):
+            assert [r["id"] for r in read_table(path, f"t{n}")] == [r["id"] for r in rows]
+        assert m.verify_backup(path)
+        assert not list(m.backup_dir.glob(".*.part"))
+
+    def test_output_failure_aborts_exporters_waiting_for_spool_room(self, manager, monkeypatch):
+        rows = [{"id": f"x{i:03d}", "payload": os.urandom(40).hex(), "created_at": CREATED} for i in range(60)]
+        fake = FakeSupabase({f"t{n}": rows for n in range(4)})
+        fake.on_page = lambda table: time.sleep(0.01) if table == "t0" else None
+        m = manager(fake, ["t0", "t1", "t2", "t3"])
+        m.chunk_bytes = 500
+        m.spool_bytes = 2000
+        attach = backup_manager.TableSpool.attach
+
+        def failing(spool, emit):
+            if spool.path.name.endswith(".t1.part"):
+                raise OSError("No space left on device")
+            attach(spool, emit)
+
+        monkeypatch.setattr(backup_manager.TableSpool, "attach", failing)
+        result = []
+        worker = threading.Thread(target=lambda: result.append(m.backup_database()), daemon=True)
+        worker.start()
+        worker.join(timeout=10)
+        m.close()
+
+        assert not worker.is_alive() and result == [None]
+        assert list(m.backup_dir.iterdir()) == []
+
+    def test_backup_with_failed_tables_is_reported_as_failure(self, manager, monkeypatch):
+        fake = FakeSupabase(FAKE_TABLES)
+        m = manager(fake, ["users", "broken"])
+        monkeypatch.setattr(backup_manager, "BackupManager", lambda: m)
+
+        assert backup_manager.run_backup("full") is False
+        entry = m.catalog.entries()[0]
+        assert entry["complete"] is False and entry["rows"] == 5
+
+    def test_keyset_pages_ignore_rows_inserted_during_export(self, manager):
+        fake = FakeSupabase(FAKE_TABLES)
+        m = manager(fake, ["users"])
+
+        def insert_during_export(table):
+            # inserções concorrentes não deslocam as páginas nem entram no backup
+            with fake.lock:
+                fake.tables["users"].insert(0, {"id": "a-new", "name": "Novo", "created_at": "2999-01-01T00:00:00.000000Z"})
+
+        fake.on_page = insert_during_export
+        path = m.backup_database()
+        m.close()
+
+        assert [r["id"] for _, r in read_backup(path)] == [f"u{i}" for i in range(5)]
+        with open(manifest_path(path)) as f:
+            assert json.load(f)["snapshot"] < "2999"
+
+    def test_incremental_chain_replays_changes_in_order(self, manager):
+        fake = FakeSupabase(FAKE_TABLES)
+        m = manager(fake, ["users", "requests"])
+
+        full = m.backup_database("full")
+        fake.tables["users"][1] = {**fake.tables["users"][1], "name": "Alterado", "updated_at": keyset.snapshot_marker()}
+        incremental = m.backup_database("incremental")
+        new_user = {"id": "u9", "name": "Novo", "created_at": keyset.snapshot_marker(), "updated_at": keyset.snapshot_marker()}
+        fake.tables["users"].append(new_user)
+        fake.tables["users"][1] = {**fake.tables["users"][1], "name": "Alterado de novo", "updated_at": keyset.snapshot_marker()}
+        second = m.backup_database("incremental")
+        differential = m.backup_database("differential")
+
+        assert [r["id"] for _, r in read_backup(incremental)] == ["u1"]
+        assert sorted(r["id"] for _, r in read_backup(second)) == ["u1", "u9"]
+        assert sorted(r["id"] for _, r in read_backup(differential)) == ["u1", "u9"]
+
+        entries = {e["file"]: e for e in m.catalog.entries()}
+        assert entries[os.path.basename(second)]["parent"] == entries[os.path.basename(incremental)]["id"]
+        assert entries[os.path.basename(differential)]["parent"] == entries[os.path.basename(full)]["id"]
+        chain = [e["file"] for e in m.catalog.chain(entries[os.path.basename(second)]["id"])]
+        assert chain == [os.path.basename(p) for p in (full, incremental, second)]
+
+        # Reaplicar a cadeia deixa cada linha no último estado
+        assert m.restore_chain(entries[os.path.basename(second)]["id"])
+        restored = {}
+        for row in fake.restored["users"]:
+            restored[row["id"]] = row["name"]
+        assert restored["u1"] == "Alterado de novo" and restored["u9"] == "Novo" and len(restored) == 6
+        m.close()
+
+    def test_incremental_without_full_runs_full_and_chains_expire_together(self, manager):
+        fake = FakeSupabase(FAKE_TABLES)
+        m = manager(fake, ["users"])
+
+        first = m.backup_database("incremental")
+        assert m.catalog.entries()[0]["kind"] == "full" and not first.endswith("_incremental.rjb")
+        m.backup_database("incremental")
+        m.backup_database("full")
+        assert not m.catalog.due_full(24)
+
+        old_chain = [e["id"] for e in m.catalog.entries()[:2]]
+        assert m.catalog.expired_chains(7, now=backup_manager.datetime.now() + backup_manager.timedelta(days=8)) == old_chain
+        m.local_retention_days = -1
+        m.cleanup_old_backups()
+        assert [e["kind"] for e in m.catalog.entries()] == ["full"]
+        assert len(list(m.backup_dir.glob("renoveja_backup_*.rjb"))) == 1
+        m.close()
+
+    def test_restore_is_parallel_ordered_and_resumes(self, manager, monkeypatch):
+        monkeypatch.setattr(backup_manager, "RESTORE_RETRIES", 1)
+        monkeypatch.setattr(backup_manager, "RESTORE_BACKOFF_SECONDS", 0)
+        tables = {
+            "users": [{"id": f"u{i:02d}", "created_at": CREATED} for i in range(12)],
+            "requests": [{"id": f"r{i:02d}", "created_at": CREATED} for i in range(9)],
+        }
+        fake = FakeSupabase(tables)
+        m = manager(fake, ["requests", "users"])  # arquivo com requests antes de users
+        path = m.backup_database()
+        m.restore_batch_size = 2
+        m.concurrency = 3
+        fake.post_delay = 0.01
+
+        # uma falha transitória é repetida; falhas persistentes interrompem o restore
+        fake.post_failures = {"users": 1, "requests": 10}
+        assert not m.restore_from_backup(path)
+        with open(backup_manager.checkpoint_path(path)) as f:
+            progress = json.load(f)["tables"]
+        assert progress["users"] == {"done": True, "batches": 6}
+        assert fake.posts[:6] == ["users"] * 6  # ordem de dependência, não a do arquivo
+        assert fake.max_active > 1
+
+        posted_users = len(fake.restored["users"])
+        fake.post_failures = {}
+        assert m.restore_from_backup(path)
+        assert len(fake.restored["users"]) == posted_users == 12  # users não foi reenviado
+        assert sorted(r["id"] for r in fake.restored["requests"]) == [f"r{i:02d}" for i in range(9)]
+        assert not backup_manager.checkpoint_path(path).exists()
+        m.close()
+
+    def test_single_table_restore_and_inspect_without_manifest(self, manager):
+        fake = FakeSupabase(FAKE_TABLES)
+        m = manager(fake, ["users", "requests"])
+        path = m.backup_database()
+        manifest_path(path).unlink()  # o índice no fim do arquivo basta
+
+        assert m.restore_from_backup(path, tables=["requests"])
+        assert fake.restored == {"requests": FAKE_TABLES["requests"]}
+
+        out = io.StringIO()
+        backup_manager.inspect_backup(path, out=out)
+        assert "users: 5 rows" in out.getvalue() and "requests: 3 rows" in out.getvalue()
+        out = io.StringIO()
+        backup_manager.inspect_backup(path, "users", out=out)
+        assert [json.loads(line)["id"] for line in out.getvalue().splitlines()] == [f"u{i}" for i in range(5)]
+        m.close()
+
+    def test_single_table_restore_verifies_only_that_table(self, manager, monkeypatch):
+        fake = FakeSupabase(FAKE_TABLES)
+        m = manager(fake, ["users", "requests"])
+        path = m.backup_database()
+        users = read_index(path)["tables"][0]["chunks"][0]
+        with open(path, "r+b") as f:
+            f.seek(users["offset"])
+            byte = f.read(1)
+            f.seek(users["offset"])
+            f.write(bytes([byte[0] ^ 0xFF]))
+        monkeypatch.setattr(backup_manager.BackupManager, "verify_backup", lambda *a: pytest.fail("whole file hashed"))
+
+        assert m.restore_from_backup(path, tables=["requests"])
+        assert fake.restored == {"requests": FAKE_TABLES["requests"]}
+        assert not m.restore_from_backup(path, tables=["users"])
+        assert "users" not in fake.restored
+        m.close()
+
+    def test_zstd_backup_roundtrips(self, manager, monkeypatch):
+        pytest.importorskip("zstandard")
+        monkeypatch.setattr(backup_manager, "BACKUP_CODEC", "zstd")
+        fake = FakeSupabase(FAKE_TABLES)
+        m = manager(fake, ["users", "requests"])
+        m.chunk_bytes = 100
+
+        path = m.backup_database()
+
+        assert read_index(path)["codec"] == "zstd"
+        assert m.verify_backup(path)
+        assert m.restore_from_backup(path)
+        assert fake.restored == {"users": FAKE_TABLES["users"], "requests": FAKE_TABLES["requests"]}
+        m.close()
+
+    def test_zstd_falls_back_to_gzip_without_zstandard(self, manager, monkeypatch):
+        monkeypatch.setattr(backup_format, "zstandard", None)
+        monkeypatch.setattr(backup_manager, "BACKUP_CODEC", "zstd")
+        fake = FakeSupabase(FAKE_TABLES)
+        m = manager(fake, ["users"])
+
+        path = m.backup_database()
+        m.close()
+
+        assert read_index(path)["codec"] == "gzip"
+        assert [r["id"] for _, r in read_backup(path)] == [f"u{i}" for i in range(5)]
+        with pytest.raises(ValueError):
+            backup_format.resolve_codec("lz4")
@@ -0,0 +1,136 @@
+"""
+Testes - Chat em tempo real (chat_gateway)
+WebSockets simulados sobre o barramento em processo e o MockDatabase
+"""
+
+import asyncio
+import os
+import sys
+
+from fastapi import WebSocketDisconnect
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import chat_history
+from chat_gateway import ChatGateway, ChatConnection, SLOW_CONSUMER_CLOSE_CODE
+from event_bus import EventBus
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.incoming: asyncio.Queue = asyncio.Queue()
+        self.sent: asyncio.Queue = asyncio.Queue()
+        self.close_code = None
+
+    async def receive_json(self):
+        data = await self.incoming.get()
+        if data is None:
+            raise WebSocketDisconnect()
+        return data
+
+    async def send_json(self, message):
+        await self.sent.put(message)
+
+    async def close(self, code: int = 1000):
+        self.close_code = code
+
+    async def next(self, kind: str):
+        while True:
+            message = await asyncio.wait_for(self.sent.get(), timeout=1)
+            if message["type"] == kind:
+                return message
+
+
+def _poster(bus: EventBus):
+    """Stand-in for server.post_chat_message: store, then publish on the bus"""
+    async def post_message(user, request_id, text):
+        message = {"id": f"m-{text}", "request_id": request_id, "sender_id": user["id"], "message": text, "created_at": "2024-05-01T10:00:00"}
+        await database.insert_one("chat_messages", message)
+        message = {**message, "cursor": chat_history.encode_cursor(message)}
+        await bus.publish("chat.message", request_id, {"message": message})
+        return message
+    return post_message
+
+
+class TestChatGateway:
+
+    def test_message_ack_typing_and_presence(self, mock_db):
+        bus = EventBus()
+        gateway = ChatGateway(bus.publish)
+        bus.subscribe("chat.", gateway.on_event)
+        patient, doctor = {"id": "p1", "name": "Paciente"}, {"id": "d1", "name": "Dr. Um"}
+        post_message = _poster(bus)
+
+        async def run():
+            ws_p, ws_d = FakeWebSocket(), FakeWebSocket()
+            tasks = [
+                asyncio.ensure_future(gateway.handle(ws_p, patient, "r1", post_message)),
+                asyncio.ensure_future(gateway.handle(ws_d, doctor, "r1", post_message)),
+            ]
+            presence = await ws_p.next("presence")
+            while len(presence["users"]) < 2:
+                presence = await ws_p.next("presence")
+
+            await ws_p.incoming.put({"type": "typing", "typing": True})
+            typing = await ws_d.next("typing")
+
+            await ws_p.incoming.put({"type": "message", "client_id": "tmp-1", "message": "Olá"})
+            ack = await ws_p.next("ack")
+            received = await ws_d.next("message")
+
+            await ws_d.incoming.put(None)  # médico sai
+            left = await ws_p.next("presence")
+
+            await ws_p.incoming.put(None)
+            await asyncio.gather(*tasks)
+            return presence, typing, ack, received, left
+
+        presence, typing, ack, received, left = asyncio.run(run())
+
+        assert {u["user_id"] for u in presence["users"]} == {"p1", "d1"}
+        assert typing["user_id"] == "p1" and typing["typing"] is True
+        assert ack["client_id"] == "tmp-1" and ack["message"]["id"] == "m-Olá"
+        assert received["message"]["id"] == "m-Olá"
+        assert [u["user_id"] for u in left["users"]] == ["p1"]
+        assert not gateway.rooms and not gateway.presence
+        assert mock_db.tables["chat_messages"][0]["message"] == "Olá"
+
+    def test_resync_after_cursor_reads_every_page(self, mock_db):
+        bus = EventBus()
+        gateway = ChatGateway(bus.publish)
+        mock_db.tables["chat_messages"] = [
+            {"id": f"m{i:03d}", "request_id": "r1", "message": str(i), "created_at": f"2024-05-01T1{i // 60 // 60}:{i // 60 % 60:02d}:{i % 60:02d}"}
+            for i in range(2 * chat_history.CHAT_MAX_PAGE_SIZE + 50)
+        ]
+        after = chat_history.encode_cursor(mock_db.tables["chat_messages"][0])
+
+        async def run():
+            ws = FakeWebSocket()
+            task = asyncio.ensure_future(gateway.handle(ws, {"id": "p1", "name": "Paciente"}, "r1", _poster(bus), after=after))
+            ids = []
+            while len(ids) < len(mock_db.tables["chat_messages"]) - 1:
+                ids.append((await ws.next("message"))["message"]["id"])
+            await ws.incoming.put(None)
+            await task
+            return ids
+
+        ids = asyncio.run(run())
+        assert ids == [m["id"] for m in mock_db.tables["chat_messages"][1:]]
+
+    def test_slow_consumer_is_closed(self):
+        async def run():
+            websocket = FakeWebSocket()
+            connection = ChatConnection(websocket, {"id": "u1"}, max_buffer=2)
+            connection.send({"type": "message", "n": 1})
+            connection.send({"type": "message", "n": 2})
+            assert connection.send({"type": "typing"}, droppable=True) is False
+            assert connection.closed is False
+            connection.send({"type": "message", "n": 3})
+            await connection.run_writer()
+            return websocket, connection
+
+        websocket, connection = asyncio.run(run())
+        assert connection.closed
+        assert websocket.close_code == SLOW_CONSUMER_CLOSE_CODE
+        assert websocket.sent.empty()
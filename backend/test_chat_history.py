@@ -0,0 +1,66 @@
+"""
+Testes - Histórico do chat paginado por cursor (chat_history)
+Usa o MockDatabase em memória, sem Supabase
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chat_history
+
+
+@pytest.fixture
+def mock_db(mock_db):
+    mock_db.tables["chat_messages"] = [
+        {"id": f"m{i:03d}", "request_id": "r1", "message": str(i), "created_at": f"2024-05-01T10:{i // 60:02d}:{i % 60:02d}"}
+        for i in range(120)
+    ] + [{"id": "other", "request_id": "r2", "message": "x", "created_at": "2024-05-01T10:00:00"}]
+    return mock_db
+
+
+def _ids(messages):
+    return [m["message"] for m in messages]
+
+
+class TestChatHistory:
+
+    def test_latest_page_then_older_pages(self, mock_db):
+        async def run():
+            latest, more = await chat_history.get_messages_page("r1", limit=50)
+            older, more_older = await chat_history.get_messages_page("r1", before=latest[0]["cursor"], limit=50)
+            oldest, more_oldest = await chat_history.get_messages_page("r1", before=older[0]["cursor"], limit=50)
+            return (latest, more), (older, more_older), (oldest, more_oldest)
+
+        (latest, more), (older, more_older), (oldest, more_oldest) = asyncio.run(run())
+
+        assert _ids(latest) == [str(i) for i in range(70, 120)] and more
+        assert _ids(older) == [str(i) for i in range(20, 70)] and more_older
+        assert _ids(oldest) == [str(i) for i in range(0, 20)] and not more_oldest
+
+    def test_incremental_sync(self, mock_db):
+        async def run():
+            latest, _ = await chat_history.get_messages_page("r1", limit=10)
+            idle, idle_more = await chat_history.get_messages_page("r1", after=latest[-1]["cursor"])
+            mock_db.tables["chat_messages"].append(
+                {"id": "new", "request_id": "r1", "message": "new", "created_at": "2024-05-01T11:00:00"}
+            )
+            fresh, _ = await chat_history.get_messages_page("r1", after=latest[-1]["cursor"])
+            since, _ = await chat_history.get_messages_page("r1", since="2024-05-01T10:01:58")
+            return idle, idle_more, fresh, since
+
+        idle, idle_more, fresh, since = asyncio.run(run())
+
+        assert idle == [] and not idle_more
+        assert _ids(fresh) == ["new"]
+        assert _ids(since) == ["119", "new"]
+
+    def test_invalid_cursor(self, mock_db):
+        with pytest.raises(ValueError):
+            asyncio.run(chat_history.get_messages_page("r1", after="not-a-cursor"))
+        with pytest.raises(ValueError):
+            asyncio.run(chat_history.get_messages_page("r1", after="x", since="2024-01-01"))
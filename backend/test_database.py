@@ -0,0 +1,164 @@
+"""
+Testes - Camada de acesso a dados (database.py)
+Usa o MockDatabase em memória, sem Supabase
+"""
+
+import asyncio
+import os
+import sys
+
+import httpx
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+
+class TestGatherQueries:
+    """gather_queries runs independent reads concurrently"""
+
+    def test_results_by_name_and_concurrency(self, mock_db):
+        async def slow(value, delay=0.05):
+            await asyncio.sleep(delay)
+            return value
+
+        async def scenario():
+            await database.insert_one("users", {"id": "u1", "role": "doctor"})
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            results = await database.gather_queries({
+                "user": database.find_one("users", {"id": "u1"}),
+                "a": slow(1),
+                "b": slow(2),
+                "c": slow(3),
+            })
+            return results, loop.time() - started
+
+        results, elapsed = asyncio.run(scenario())
+        assert results["user"]["role"] == "doctor"
+        assert (results["a"], results["b"], results["c"]) == (1, 2, 3)
+        assert elapsed < 0.12
+
+    def test_first_error_is_raised_and_others_cancelled(self, mock_db):
+        cancelled = []
+
+        async def fail():
+            raise ValueError("boom")
+
+        async def slow():
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        with pytest.raises(ValueError):
+            asyncio.run(database.gather_queries({"bad": fail(), "slow": slow()}))
+        assert cancelled == [True]
+
+    def test_optional_queries_fall_back_to_default(self, mock_db):
+        async def fail():
+            raise RuntimeError("down")
+
+        results = asyncio.run(database.gather_queries(
+            {"ok": database.count_docs("payments", {}), "optional": fail()},
+            defaults={"optional": []}
+        ))
+        assert results == {"ok": 0, "optional": []}
+
+
+class TestUpdateMany:
+    """update_many: one filtered statement returning the affected count"""
+
+    def test_mock_updates_all_matches(self, mock_db):
+        mock_db.tables["notifications"] = [
+            {"id": str(i), "user_id": "u1" if i < 700 else "u2", "read": i % 2 == 0}
+            for i in range(800)
+        ]
+
+        count = asyncio.run(database.update_many("notifications", {"user_id": "u1", "read": False}, {"read": True}))
+
+        assert count == 350
+        assert all(n["read"] for n in mock_db.tables["notifications"] if n["user_id"] == "u1")
+        assert sum(not n["read"] for n in mock_db.tables["notifications"]) == 50
+        with pytest.raises(ValueError):
+            asyncio.run(database.update_many("notifications", {}, {"read": True}))
+
+    def test_supabase_sends_every_filter(self, monkeypatch):
+        seen = []
+
+        def handler(request):
+            seen.append((request.method, request.headers.get("prefer"), sorted(request.url.params.multi_items())))
+            if request.method == "PATCH" and "count=exact" in request.headers.get("prefer", ""):
+                return httpx.Response(204, headers={"content-range": "0-41/42"})
+            return httpx.Response(200, json=[])
+
+        client = httpx.AsyncClient
+        monkeypatch.setattr(httpx, "AsyncClient", lambda **kw: client(transport=httpx.MockTransport(handler), **kw))
+        supabase = database.SupabaseDB()
+        supabase.url = "http://supabase.test"
+        filters = {"user_id": "u1", "read": False}
+
+        async def run():
+            count = await supabase.update_many("notifications", {"read": True}, filters)
+            await supabase.update("notifications", {"read": True}, filters)
+            await supabase.delete("notifications", filters)
+            return count
+
+        assert asyncio.run(run()) == 42
+        expected = [("read", "eq.False"), ("user_id", "eq.u1")]
+        assert [s[2] for s in seen] == [expected] * 3
+        assert seen[0][1] == "return=minimal,count=exact"
+
+    def test_supabase_select_sends_every_operator(self, monkeypatch):
+        seen = []
+
+        def handler(request):
+            seen.append(sorted(request.url.params.multi_items()))
+            return httpx.Response(200, json=[])
+
+        client = httpx.AsyncClient
+        monkeypatch.setattr(httpx, "AsyncClient", lambda **kw: client(transport=httpx.MockTransport(handler), **kw))
+        supabase = database.SupabaseDB()
+        supabase.url = "http://supabase.test"
+        filters = {"user_id": "u1", "count": {"gt": 0}, "total": {"lt": 5}, "read_at": {"not.is": "null"}, "id": {"in": ["a", "b"]}}
+
+        asyncio.run(supabase.select("unread_counters", "chat_id,count", filters, order="count.desc", limit=1000))
+
+        assert seen == [[
+            ("count", "gt.0"), ("id", "in.(a,b)"), ("limit", "1000"), ("order", "count.desc"),
+            ("read_at", "not.is.null"), ("select", "chat_id,count"), ("total", "lt.5"), ("user_id", "eq.u1"),
+        ]]
+
+
+class TestKeysetPages:
+    """keyset.py cursors shared by iter_pages and the backup export"""
+
+    def test_iter_pages_walks_ties_in_order(self, mock_db):
+        mock_db.tables["notifications"] = [
+            {"id": f"n{i}", "created_at": "2024-06-01T10:00:00" if i < 4 else f"2024-06-0{i - 2}T10:00:00"}
+            for i in range(7)
+        ]
+
+        async def run():
+            return [[n["id"] for n in page] async for page in database.iter_pages("notifications", columns="id", page_size=3)]
+
+        assert asyncio.run(run()) == [["n0", "n1", "n2"], ["n3", "n4", "n5"], ["n6"]]
+
+    def test_supabase_cursor_is_quoted(self, monkeypatch):
+        seen = []
+
+        def handler(request):
+            seen.append(dict(request.url.params.multi_items()))
+            return httpx.Response(200, json=[])
+
+        client = httpx.AsyncClient
+        monkeypatch.setattr(httpx, "AsyncClient", lambda **kw: client(transport=httpx.MockTransport(handler), **kw))
+        supabase = database.SupabaseDB()
+        supabase.url = "http://supabase.test"
+
+        asyncio.run(supabase.select_page("requests", after=('2024-06-01T10:00:00+00:00', 'a"b'), limit=50))
+
+        assert seen[0]["or"] == '(created_at.gt."2024-06-01T10:00:00+00:00",and(created_at.eq."2024-06-01T10:00:00+00:00",id.gt."a\\"b"))'
+        assert (seen[0]["order"], seen[0]["limit"]) == ("created_at.asc,id.asc", "50")
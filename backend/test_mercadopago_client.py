@@ -0,0 +1,119 @@
+"""
+Testes - Cliente MercadoPago (mercadopago_client)
+API simulada com httpx.MockTransport, sem rede
+"""
+
+import asyncio
+import os
+import sys
+
+import httpx
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mercadopago_client
+from mercadopago_client import MercadoPagoClient
+
+
+def _client(handler, **kwargs):
+    return MercadoPagoClient(
+        "TEST-token", base_url="https://mp.test", backoff=0,
+        transport=httpx.MockTransport(handler), **kwargs
+    )
+
+
+class TestMercadoPagoClient:
+
+    def test_concurrent_polls_share_one_call(self):
+        calls = []
+
+        async def handler(request):
+            calls.append(request.url.path)
+            await asyncio.sleep(0.05)
+            return httpx.Response(200, json={"id": 1, "status": "pending", "status_detail": "pending_waiting_transfer"})
+
+        async def run():
+            mp = _client(handler, status_ttl=60)
+            results = await asyncio.gather(*[mp.get_payment_status("1") for _ in range(20)])
+            cached = await mp.get_payment_status("1")
+            fresh = await mp.get_payment_status("1", fresh=True)
+            await mp.close()
+            return results, cached, fresh
+
+        results, cached, fresh = asyncio.run(run())
+
+        assert calls == ["/v1/payments/1", "/v1/payments/1"]
+        assert all(r["status"] == "pending" for r in results)
+        assert cached["status"] == fresh["status"] == "pending"
+
+    def test_retries_with_same_idempotency_key(self):
+        seen = []
+
+        def handler(request):
+            seen.append((request.headers.get("x-idempotency-key"), request.headers.get("authorization")))
+            if len(seen) < 3:
+                return httpx.Response(503)
+            return httpx.Response(201, json={
+                "id": 99, "status": "pending",
+                "point_of_interaction": {"transaction_data": {"qr_code": "000201", "qr_code_base64": "aGk="}},
+            })
+
+        async def run():
+            mp = _client(handler, max_retries=3)
+            created = await mp.create_pix(50.0, "RenoveJá+", "p@teste.com", "pay-1")
+            status = await mp.get_payment_status("99")  # preenchido pela criação
+            await mp.close()
+            return created, status
+
+        created, status = asyncio.run(run())
+
+        assert created["mp_payment_id"] == "99" and created["pix_code"] == "000201"
+        assert status["status"] == "pending"
+        assert len(seen) == 3 and len({key for key, _ in seen}) == 1
+        assert seen[0][1] == "Bearer TEST-token"
+
+    def test_client_errors_are_not_retried(self):
+        calls = []
+
+        def handler(request):
+            calls.append(1)
+            return httpx.Response(404, json={"message": "not found"})
+
+        async def run():
+            mp = _client(handler)
+            result = await mp.get_payment_status("missing")
+            await mp.close()
+            return result
+
+        assert asyncio.run(run()) is None
+        assert len(calls) == 1
+
+    def test_non_json_success_returns_none(self):
+        def handler(request):
+            return httpx.Response(201, text="<html>bad gateway page</html>")
+
+        async def run():
+            mp = _client(handler)
+            created = await mp.create_pix(50.0, "RenoveJá+", "p@teste.com", "pay-1")
+            status = await mp.get_payment_status("99")
+            await mp.close()
+            return created, status
+
+        assert asyncio.run(run()) == (None, None)
+
+    def test_retry_after_is_capped(self, monkeypatch):
+        monkeypatch.setattr(mercadopago_client, "MP_MAX_BACKOFF_SECONDS", 2.0)
+        mp = _client(lambda request: httpx.Response(200))
+
+        assert mp._retry_delay(0, httpx.Response(429, headers={"Retry-After": "3600"})) == 2.0
+        assert mp._retry_delay(0, httpx.Response(429, headers={"Retry-After": "1"})) == 1.0
+
+    def test_status_cache_is_bounded(self, monkeypatch):
+        monkeypatch.setattr(mercadopago_client, "MP_STATUS_CACHE_MAX_ENTRIES", 3)
+        mp = _client(lambda request: httpx.Response(200), status_ttl=60)
+
+        for i in range(5):
+            mp._cache_status(str(i), {"status": "pending"})
+
+        assert len(mp._status_cache) == 3
+        assert mp._status_cache.get("0") is None and mp._status_cache.get("4") == {"status": "pending"}
@@ -0,0 +1,126 @@
+"""
+Testes - Retenção de notificações (notification_retention)
+Usa o MockDatabase em memória, sem Supabase
+"""
+
+import asyncio
+import gzip
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import unread_counters
+import notification_retention
+from test_s3_multipart import LocalS3
+
+NOW = datetime(2024, 6, 1, 3, 0, 0)
+
+
+def _notification(i, user_id, days_ago, read):
+    return {
+        "id": f"n{i:03d}", "user_id": user_id, "title": "t", "message": "m", "read": read,
+        "created_at": (NOW - timedelta(days=days_ago, minutes=i)).isoformat(),
+    }
+
+
+class TestNotificationRetention:
+
+    def test_expires_old_read_notifications(self, mock_db, tmp_path):
+        mock_db.tables["notifications"] = (
+            [_notification(i, "u1", 40, read=True) for i in range(7)]     # lidas e antigas
+            + [_notification(i, "u1", 40, read=False) for i in range(10, 13)]  # antigas, não lidas
+            + [_notification(i, "u1", 5, read=True) for i in range(20, 24)]    # lidas, recentes
+        )
+
+        result = asyncio.run(notification_retention.run_retention(now=NOW, archive_dir=str(tmp_path)))
+
+        assert result["expired"] == 7 and result["capped"] == 0 and result["archived"] == 7
+        remaining = {n["id"] for n in mock_db.tables["notifications"]}
+        assert remaining == {f"n{i:03d}" for i in [10, 11, 12, 20, 21, 22, 23]}
+        archived = notification_retention.read_archive(result["archive"])
+        assert sorted(n["id"] for n in archived) == [f"n{i:03d}" for i in range(7)]
+        assert result["archive"].startswith(str(tmp_path / "2024" / "06"))
+
+    def test_deletes_each_batch_in_short_id_lists(self, mock_db, tmp_path, monkeypatch):
+        monkeypatch.setattr(database, "MAX_IN_FILTER_VALUES", 3)
+        deletes = []
+        delete_many = notification_retention.delete_many
+
+        async def recording(table, filters):
+            deletes.append(len(filters["id"]["in"]))
+            return await delete_many(table, filters)
+
+        monkeypatch.setattr(notification_retention, "delete_many", recording)
+        mock_db.tables["notifications"] = [_notification(i, "u1", 40, read=True) for i in range(7)]
+
+        result = asyncio.run(notification_retention.run_retention(now=NOW, archive_dir=str(tmp_path)))
+
+        assert result["expired"] == 7 and mock_db.tables["notifications"] == []
+        assert max(deletes) == 3 and sum(deletes) == 7
+
+    def test_per_user_cap_updates_badge(self, mock_db, tmp_path, monkeypatch):
+        monkeypatch.setattr(notification_retention, "NOTIFICATION_RETENTION_BATCH", 2)
+        mock_db.tables["notifications"] = (
+            [_notification(i, "admin", 1, read=False) for i in range(6)]
+            + [_notification(i, "u2", 1, read=False) for i in range(10, 12)]
+        )
+        mock_db.tables["unread_counters"] = [
+            {"user_id": "admin", "scope": "notifications", "key": "", "count": 6},
+            {"user_id": "u2", "scope": "notifications", "key": "", "count": 2},
+        ]
+
+        async def run():
+            archive = notification_retention.NotificationArchive(str(tmp_path), NOW)
+            capped = await notification_retention.enforce_user_caps(archive, max_per_user=3, batch_size=2)
+            return capped, archive, await unread_counters.get_notifications_unread("admin"), \
+                await unread_counters.get_notifications_unread("u2")
+
+        capped, archive, admin_badge, other_badge = asyncio.run(run())
+
+        assert capped == 3 and archive.rows == 3
+        # As 3 mais recentes do admin ficam (minutos 0..2 atrás)
+        assert {n["id"] for n in mock_db.tables["notifications"] if n["user_id"] == "admin"} == {"n000", "n001", "n002"}
+        assert (admin_badge, other_badge) == (3, 2)
+        assert sorted(n["id"] for n in notification_retention.read_archive(archive.path)) == ["n003", "n004", "n005"]
+
+    def test_archives_each_batch_to_s3(self, mock_db, monkeypatch):
+        monkeypatch.setattr(notification_retention, "NOTIFICATION_RETENTION_BATCH", 4)
+        mock_db.tables["notifications"] = [_notification(i, "u1", 40, read=True) for i in range(10)]
+        s3 = LocalS3()
+
+        result = asyncio.run(notification_retention.run_retention(now=NOW, s3_client=s3))
+
+        assert result["expired"] == 10 and mock_db.tables["notifications"] == []
+        prefix = "renoveja-notifications/2024/06/notifications-20240601T030000"
+        assert sorted(key for _, key in s3.objects) == [f"{prefix}-{n:05d}.jsonl.gz" for n in (1, 2, 3)]
+        archived = [
+            json.loads(line)["id"]
+            for body in s3.objects.values()
+            for line in gzip.decompress(body).decode("utf-8").splitlines()
+        ]
+        assert sorted(archived) == [f"n{i:03d}" for i in range(10)]
+        assert result["archive"].startswith("s3://")
+
+    def test_skips_while_another_worker_holds_the_lock(self, mock_db, tmp_path):
+        mock_db.tables["notifications"] = [_notification(i, "u1", 40, read=True) for i in range(3)]
+        mock_db.tables["job_locks"] = [{
+            "name": "notification_retention", "holder": "other-worker",
+            "expires_at": (datetime.utcnow() + timedelta(minutes=5)).isoformat(),
+        }]
+
+        result = asyncio.run(notification_retention.run_retention(now=NOW, archive_dir=str(tmp_path)))
+
+        assert result["skipped"] and result["archived"] == 0
+        assert len(mock_db.tables["notifications"]) == 3
+        assert mock_db.tables["job_locks"][0]["holder"] == "other-worker"
+
+        # Trava expirada: a próxima execução assume e libera ao terminar
+        mock_db.tables["job_locks"][0]["expires_at"] = (datetime.utcnow() - timedelta(seconds=1)).isoformat()
+        result = asyncio.run(notification_retention.run_retention(now=NOW, archive_dir=str(tmp_path)))
+        assert not result["skipped"] and result["expired"] == 3
+        assert mock_db.tables["job_locks"] == []
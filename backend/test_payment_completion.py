@@ -0,0 +1,140 @@
+"""
+Testes - Conclusão de pagamentos (payment_completion)
+Usa o MockDatabase em memória, sem Supabase
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import unread_counters
+from payment_completion import PaymentOutbox, complete_payments
+
+
+@pytest.fixture
+def mock_db(mock_db):
+    mock_db.tables["users"] = [
+        {"id": "admin1", "role": "admin", "active": True},
+        {"id": "admin2", "role": "admin", "active": False},
+    ]
+    mock_db.tables["requests"] = [
+        {"id": "req1", "patient_id": "p1", "doctor_id": "d1", "patient_name": "Ana", "status": "approved_pending_payment"},
+        {"id": "req2", "patient_id": "p2", "nurse_id": "n1", "patient_name": "Bia", "status": "signed"},
+    ]
+    mock_db.tables["payments"] = [
+        {"id": "pay1", "request_id": "req1", "amount": 50.0, "status": "pending"},
+        {"id": "pay2", "request_id": "req2", "amount": 80.0, "status": "pending"},
+    ]
+    return mock_db
+
+
+def _by_id(mock_db, table):
+    return {r["id"]: r for r in mock_db.tables[table]}
+
+
+class TestPaymentCompletion:
+
+    def test_completes_payment_and_request_once(self, mock_db):
+        async def run():
+            first = await complete_payments([
+                {"payment_id": "pay1", "paid_at": "2024-06-01T12:00:00", "mp_status": "approved"},
+                {"payment_id": "pay2"},
+            ])
+            # webhook e conciliação chegando depois para os mesmos pagamentos
+            second = await complete_payments([{"payment_id": "pay1"}, {"payment_id": "pay2"}])
+            return first, second, await PaymentOutbox().drain()
+
+        first, second, applied = asyncio.run(run())
+        notifications = mock_db.tables["notifications"]
+        payments, requests = _by_id(mock_db, "payments"), _by_id(mock_db, "requests")
+
+        assert [row["payment"]["id"] for row in first] == ["pay1", "pay2"]
+        assert second == []
+        assert (payments["pay1"]["status"], payments["pay1"]["paid_at"], payments["pay1"]["mp_status"]) == \
+            ("completed", "2024-06-01T12:00:00", "approved")
+        assert payments["pay2"]["status"] == "completed"
+        # solicitação aguardando pagamento vai para paid; a já assinada fica como está
+        assert requests["req1"]["status"] == "paid"
+        assert first[0]["previous_request"]["status"] == "approved_pending_payment"
+        assert requests["req2"]["status"] == "signed"
+        assert first[1]["previous_request"] is None
+
+        sent = sorted((n["user_id"], n["data"]["template"]) for n in notifications)
+        assert sent == [
+            ("admin1", "admin_payment_received"), ("admin1", "admin_payment_received"),
+            ("d1", "prescription_paid_doctor"), ("n1", "exam_paid"),
+            ("p1", "payment_confirmed"), ("p2", "payment_confirmed"),
+        ]
+        assert len(mock_db.tables["notifications"]) == 6
+        assert applied == 2 and {o["status"] for o in mock_db.tables["payment_outbox"]} == {"done"}
+
+    def test_concurrent_callers_complete_once(self, mock_db):
+        async def run():
+            return await asyncio.gather(*[complete_payments([{"payment_id": "pay1"}]) for _ in range(5)])
+
+        results = asyncio.run(run())
+
+        assert sum(len(r) for r in results) == 1
+        assert _by_id(mock_db, "payments")["pay1"]["status"] == "completed"
+
+    def test_late_approval_does_not_revive_closed_requests(self, mock_db):
+        mock_db.tables["requests"] += [
+            {"id": "req3", "patient_id": "p3", "status": "rejected"},
+            {"id": "req4", "patient_id": "p4", "status": "cancelled"},
+        ]
+        mock_db.tables["payments"] += [
+            {"id": "pay3", "request_id": "req3", "amount": 50.0, "status": "pending"},
+            {"id": "pay4", "request_id": "req4", "amount": 50.0, "status": "pending"},
+        ]
+
+        completed = asyncio.run(complete_payments([{"payment_id": "pay3"}, {"payment_id": "pay4"}]))
+        requests = _by_id(mock_db, "requests")
+
+        # O pagamento é registrado, mas a solicitação não volta para o fluxo
+        assert [row["payment"]["status"] for row in completed] == ["completed", "completed"]
+        assert (requests["req3"]["status"], requests["req4"]["status"]) == ("rejected", "cancelled")
+        assert all(row["previous_request"] is None for row in completed)
+
+    def test_outbox_survives_a_crash_after_commit(self, mock_db, monkeypatch):
+        published = []
+
+        async def crash(entry):
+            raise RuntimeError("worker caiu depois do COMMIT")
+
+        async def publish(entry):
+            published.append(entry["id"])
+
+        async def run():
+            await complete_payments([{"payment_id": "pay1", "paid_at": "2024-06-01T12:00:00"}])
+            # O primeiro worker falha antes de aplicar os efeitos; nada é aplicado pela metade
+            failed = await PaymentOutbox(crash).drain()
+            mock_db.tables["payment_outbox"][0]["available_at"] = "2000-01-01T00:00:00"
+            applied = await PaymentOutbox(publish).drain()
+            again = await PaymentOutbox(publish).drain()
+            return failed, applied, again, await unread_counters.get_notifications_unread("p1")
+
+        failed, applied, again, badge = asyncio.run(run())
+        entry = mock_db.tables["payment_outbox"][0]
+        revenue = {r["id"]: r for r in mock_db.tables["stats_rollups"] if r["dimension"] == "revenue"}
+
+        assert (failed, applied, again) == (0, 1, 0)
+        assert (entry["status"], entry["attempts"]) == ("done", 2)
+        assert published == [entry["id"]]
+        assert len(mock_db.tables["notifications"]) == 3 and badge == 1
+        assert revenue["all|revenue|unknown"]["count"] == 1 and revenue["all|revenue|unknown"]["amount"] == 50.0
+
+    def test_stale_outbox_worker_does_not_apply_twice(self, mock_db):
+        async def run():
+            await complete_payments([{"payment_id": "pay1"}])
+            outbox = PaymentOutbox()
+            stale = await outbox.claim()
+            mock_db.tables["payment_outbox"][0]["locked_until"] = "2000-01-01T00:00:00"
+            fresh = await outbox.claim()
+            return await outbox.process_claimed(fresh), await outbox.process_claimed(stale)
+
+        assert asyncio.run(run()) == (1, 0)
+        assert len(mock_db.tables["notifications"]) == 3
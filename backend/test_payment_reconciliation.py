@@ -0,0 +1,111 @@
+"""
+Testes - Conciliação de pagamentos (payment_reconciliation)
+MockDatabase em memória e um MercadoPago local (httpx.MockTransport)
+"""
+
+import asyncio
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+
+import httpx
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mercadopago_client import MercadoPagoClient
+from payment_reconciliation import PaymentReconciler
+
+NOW = datetime(2024, 6, 1, 12, 0, 0)
+
+
+class FakeMercadoPago:
+    """Stand-in for the payments API: GET/PUT /v1/payments/{id}"""
+
+    def __init__(self, statuses):
+        self.statuses = dict(statuses)
+        self.calls = []
+        self.active = 0
+        self.max_active = 0
+
+    async def __call__(self, request):
+        mp_id = request.url.path.rsplit("/", 1)[-1]
+        self.calls.append((request.method, mp_id))
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(0.01)
+        self.active -= 1
+
+        if mp_id not in self.statuses:
+            return httpx.Response(404, json={"message": "not found"})
+        if request.method == "PUT":
+            self.statuses[mp_id] = json.loads(request.content)["status"]
+        status = self.statuses[mp_id]
+        if status == "down":
+            return httpx.Response(503)
+        return httpx.Response(200, json={
+            "id": mp_id, "status": status, "status_detail": f"{status}_detail",
+            "date_approved": "2024-06-01T11:59:00" if status == "approved" else None,
+        })
+
+    def client(self):
+        return MercadoPagoClient("TEST-token", base_url="https://mp.test", backoff=0, max_retries=1,
+                                 transport=httpx.MockTransport(self))
+
+
+def _payment(i, minutes_ago, real=True, status="pending"):
+    return {
+        "id": f"pay{i}", "request_id": f"req{i}", "patient_id": "p1", "amount": 50.0,
+        "status": status, "external_id": f"mp{i}", "is_real_payment": real,
+        "created_at": (NOW - timedelta(minutes=minutes_ago)).isoformat(),
+    }
+
+
+class TestPaymentReconciliation:
+
+    def test_pending_payments_follow_mercadopago(self, mock_db):
+        mock_db.tables["payments"] = [
+            _payment(1, 5),                   # aprovado
+            _payment(2, 5),                   # recusado
+            _payment(3, 5),                   # ainda pendente, recente
+            _payment(4, 90),                  # pendente e vencido
+            _payment(5, 5),                   # MercadoPago fora do ar
+            _payment(6, 5, real=False),       # simulado: ignorado
+            _payment(7, 5, status="completed"),
+        ]
+        mp = FakeMercadoPago({
+            "mp1": "approved", "mp2": "rejected", "mp3": "pending",
+            "mp4": "pending", "mp5": "down", "mp6": "approved", "mp7": "approved",
+        })
+        completed = []
+
+        async def complete(approved):
+            completed.extend((payment["id"], mp_status["date_approved"]) for payment, mp_status in approved)
+
+        async def run():
+            client = mp.client()
+            reconciler = PaymentReconciler(client, complete, concurrency=2, page_size=2)
+            result = await reconciler.run(now=NOW)
+            await client.close()
+            return result
+
+        result = asyncio.run(run())
+        payments = {p["id"]: p for p in mock_db.tables["payments"]}
+
+        assert result == {"checked": 4, "completed": 1, "failed": 1, "cancelled": 0, "expired": 1}
+        assert completed == [("pay1", "2024-06-01T11:59:00")]
+        assert (payments["pay2"]["status"], payments["pay2"]["mp_status"]) == ("failed", "rejected")
+        assert payments["pay3"]["status"] == payments["pay5"]["status"] == "pending"
+        assert (payments["pay4"]["status"], payments["pay4"]["mp_status_detail"]) == ("cancelled", "expired")
+        assert ("PUT", "mp4") in mp.calls and mp.statuses["mp4"] == "cancelled"
+        assert not any(mp_id in ("mp6", "mp7") for _, mp_id in mp.calls)
+        assert mp.max_active <= 2
+
+    def test_disabled_without_access_token(self, mock_db):
+        mock_db.tables["payments"] = [_payment(1, 5)]
+        reconciler = PaymentReconciler(MercadoPagoClient(""), complete=None)
+
+        result = asyncio.run(reconciler.run(now=NOW))
+
+        assert result["checked"] == 0
+        assert mock_db.tables["payments"][0]["status"] == "pending"
@@ -0,0 +1,201 @@
+"""
+Testes - Distribuição da fila de médicos (queue_manager)
+Usa o MockDatabase em memória, sem Supabase
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+from queue_manager import DoctorLoadIndex, QueueManager
+
+
+def _profile(user_id: str, specialty: str, rating: float = 5.0, max_cases: int = 2, available: bool = True) -> dict:
+    return {
+        "user_id": user_id, "specialty": specialty, "rating": rating,
+        "total_consultations": 0, "available": available, "max_concurrent_cases": max_cases,
+    }
+
+
+class TestDoctorLoadIndex:
+    """find_best follows load, rating and capacity without any query"""
+
+    def test_least_loaded_then_best_rated(self):
+        index = DoctorLoadIndex()
+        index.load(
+            [_profile("d1", "Cardiologia", 4.0), _profile("d2", "Cardiologia", 4.8), _profile("d3", "Pediatria", 5.0)],
+            {"d1": "Dr. Um", "d2": "Dr. Dois", "d3": "Dr. Três"},
+            {"d2": 1},
+        )
+
+        assert index.find_best("Cardiologia")["user_id"] == "d1"
+        assert index.find_best()["user_id"] == "d3"
+
+        index.on_assigned("d1")
+        index.on_assigned("d1")  # d1 at capacity
+        assert index.find_best("Cardiologia")["user_id"] == "d2"
+
+        index.on_assigned("d2")  # everyone in Cardiologia full
+        assert index.find_best("Cardiologia") is None
+
+        index.on_transition("analyzing", "completed", "d1", "d1")
+        assert index.find_best("Cardiologia")["user_id"] == "d1"
+
+        index.set_available("d1", False)
+        assert index.find_best("Cardiologia") is None
+        assert index.find_best("Dermatologia") is None
+
+    def test_availability_events_from_any_worker(self):
+        index = DoctorLoadIndex()
+        index.load([_profile("d1", "Cardiologia")], {"d1": "Dr. Um"}, {})
+
+        index.on_doctor_event({"type": "doctor.availability", "key": "d1", "payload": {"doctor_id": "d1", "available": False}})
+        assert index.find_best("Cardiologia") is None
+        index.on_doctor_event({"type": "doctor.availability", "key": "d1", "payload": {"doctor_id": "d1", "available": True}})
+        assert index.find_best("Cardiologia")["user_id"] == "d1"
+
+    def test_heaps_stay_bounded(self):
+        index = DoctorLoadIndex()
+        index.load([_profile("d1", "Clínico Geral", max_cases=10)], {"d1": "Dr. Um"}, {})
+        for _ in range(1000):
+            index.on_assigned("d1")
+            index.on_released("d1")
+        assert len(index._heaps[None]) < 100
+        assert index.find_best()["active_cases"] == 0
+
+
+class TestQueueManager:
+    """QueueManager runs on the storage helpers"""
+
+    def test_refresh_and_auto_assign(self, monkeypatch):
+        mock = database.MockDatabase()
+        monkeypatch.setattr(database, "db", mock)
+        mock.tables["users"] = [
+            {"id": "d1", "name": "Dr. Um", "role": "doctor", "active": True, "created_at": "2024-01-01"},
+            {"id": "d2", "name": "Dr. Dois", "role": "doctor", "active": True, "created_at": "2024-01-02"},
+        ]
+        mock.tables["doctor_profiles"] = [
+            {**_profile("d1", "Cardiologia", max_cases=1), "id": "p1", "created_at": "2024-01-01"},
+            {**_profile("d2", "Pediatria", max_cases=1), "id": "p2", "created_at": "2024-01-02"},
+        ]
+        mock.tables["requests"] = [
+            {"id": "r1", "patient_id": "u1", "request_type": "consultation", "specialty": "Cardiologia",
+             "status": "submitted", "doctor_id": None, "created_at": "2024-05-01T10:00:00"},
+            {"id": "r2", "patient_id": "u1", "request_type": "consultation", "specialty": "Cardiologia",
+             "status": "submitted", "doctor_id": None, "created_at": "2024-05-01T10:01:00"},
+            {"id": "r3", "patient_id": "u1", "request_type": "exam",
+             "status": "submitted", "doctor_id": None, "created_at": "2024-05-01T10:02:00"},
+        ]
+
+        manager = QueueManager()
+        result = asyncio.run(manager.auto_assign_pending_requests())
+
+        assert result["assigned"] == 1
+        assert result["failed"] == 1
+        assert mock.tables["requests"][0]["doctor_id"] == "d1"
+        assert mock.tables["requests"][2]["doctor_id"] is None  # exames vão para a enfermagem
+        assert {n["user_id"] for n in mock.tables["notifications"]} == {"u1", "d1"}
+
+        # A carga muda pelo evento publicado (deste ou de outro worker), uma vez só
+        assert manager.index.doctors["d1"]["active_cases"] == 0
+        assignment = result["assignments"][0]
+        manager.index.on_request_event({"payload": {
+            "request": {**assignment["request"], "status": "analyzing", "doctor_id": "d1"},
+            "previous": assignment["request"],
+        }})
+        assert manager.index.doctors["d1"]["active_cases"] == 1
+
+    def test_batch_skips_requests_taken_meanwhile(self, monkeypatch):
+        mock = database.MockDatabase()
+        monkeypatch.setattr(database, "db", mock)
+        mock.tables["requests"] = [
+            {"id": "r1", "patient_id": "u1", "request_type": "prescription", "status": "submitted",
+             "doctor_id": None, "created_at": "2024-05-01T10:00:00"},
+        ]
+        manager = QueueManager()
+        manager.index.load([_profile("d1", "Clínico Geral")], {"d1": "Dr. Um"}, {})
+        manager.index.loaded_at = float("inf")
+
+        original = database.find_many
+
+        async def find_then_race(*args, **kwargs):
+            rows = await original(*args, **kwargs)
+            mock.tables["requests"][0].update({"status": "in_review", "doctor_id": "d9"})
+            return rows
+
+        monkeypatch.setattr("queue_manager.find_many", find_then_race)
+        result = asyncio.run(manager.auto_assign_pending_requests())
+
+        assert result["assigned"] == 0
+        assert mock.tables["requests"][0]["doctor_id"] == "d9"
+        assert manager.index.doctors["d1"]["active_cases"] == 0
+
+
+    def test_bulk_update_enforces_capacity_from_database(self, monkeypatch):
+        mock = database.MockDatabase()
+        monkeypatch.setattr(database, "db", mock)
+        mock.tables["doctor_profiles"] = [{**_profile("d1", "Clínico Geral", max_cases=2), "id": "p1"}]
+        mock.tables["requests"] = [
+            # caso aceito por d1 em outro worker: o índice deste worker não sabe
+            {"id": "r0", "patient_id": "u0", "request_type": "prescription", "status": "analyzing",
+             "doctor_id": "d1", "created_at": "2024-05-01T09:00:00"},
+        ] + [
+            {"id": f"r{i}", "patient_id": "u1", "request_type": "prescription", "status": "submitted",
+             "doctor_id": None, "created_at": f"2024-05-01T10:0{i}:00"}
+            for i in range(1, 3)
+        ]
+        manager = QueueManager()
+        manager.index.load([_profile("d1", "Clínico Geral")], {"d1": "Dr. Um"}, {})
+        manager.index.loaded_at = float("inf")
+
+        result = asyncio.run(manager.auto_assign_pending_requests())
+
+        assert result["assigned"] == 1
+        assert [r["doctor_id"] for r in mock.tables["requests"]] == ["d1", "d1", None]
+
+    def test_bulk_update_skips_doctors_marked_unavailable(self, monkeypatch):
+        mock = database.MockDatabase()
+        monkeypatch.setattr(database, "db", mock)
+        # d1 ficou indisponível em outro worker: o índice deste ainda o acha livre
+        mock.tables["doctor_profiles"] = [{**_profile("d1", "Clínico Geral", available=False), "id": "p1"}]
+        mock.tables["requests"] = [
+            {"id": "r1", "patient_id": "u1", "request_type": "prescription", "status": "submitted",
+             "doctor_id": None, "created_at": "2024-05-01T10:00:00"},
+        ]
+        manager = QueueManager()
+        manager.index.load([_profile("d1", "Clínico Geral")], {"d1": "Dr. Um"}, {})
+        manager.index.loaded_at = float("inf")
+
+        result = asyncio.run(manager.auto_assign_pending_requests())
+
+        assert result["assigned"] == 0
+        assert mock.tables["requests"][0]["doctor_id"] is None
+
+class TestAssignmentEngine:
+    """plan_assignments solves the batch as a weighted matching"""
+
+    def test_specialty_capacity_and_wait(self):
+        from datetime import datetime
+        from assignment_engine import plan_assignments
+
+        now = datetime(2024, 5, 1, 12, 0, 0)
+        doctors = [
+            {"user_id": "cardio", "specialty": "Cardiologia", "rating": 5.0, "active_cases": 0, "max_concurrent_cases": 1},
+            {"user_id": "geral", "specialty": "Clínico Geral", "rating": 4.0, "active_cases": 1, "max_concurrent_cases": 2},
+        ]
+        requests = [
+            {"id": "receita-nova", "request_type": "prescription", "created_at": "2024-05-01T11:00:00"},
+            {"id": "receita-antiga", "request_type": "prescription", "created_at": "2024-05-01T02:00:00"},
+            {"id": "cardio", "request_type": "consultation", "specialty": "Cardiologia", "created_at": "2024-05-01T11:30:00"},
+            {"id": "neuro", "request_type": "consultation", "specialty": "Neurologia", "created_at": "2024-05-01T01:00:00"},
+        ]
+
+        plan = {r["id"]: d["user_id"] for r, d in plan_assignments(requests, doctors, now)}
+
+        # O cardiologista fica com a consulta (não com a receita), o clínico com a receita mais antiga
+        assert plan == {"cardio": "cardio", "receita-antiga": "geral"}
@@ -0,0 +1,73 @@
+"""
+Testes - Avaliações e médias incrementais dos médicos (ratings)
+Usa o MockDatabase em memória, sem Supabase
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ratings
+
+
+@pytest.fixture
+def mock_db(mock_db):
+    mock_db.tables["doctor_profiles"] = [{"id": "dp1", "user_id": "d1", "rating": 5.0}]
+    for i in range(3):
+        mock_db.tables["requests"].append({
+            "id": f"r{i}", "doctor_id": "d1", "patient_id": "p1", "patient_name": "Paciente",
+            "request_type": "prescription", "status": "completed", "created_at": f"2024-05-0{i + 1}T10:00:00",
+        })
+    return mock_db
+
+
+def _profile(mock_db) -> dict:
+    return mock_db.tables["doctor_profiles"][0]
+
+
+class TestIncrementalRatings:
+    """Each review adjusts the doctor's aggregates without rescanning"""
+
+    def test_reviews_update_aggregates(self, mock_db):
+        async def scenario():
+            requests = mock_db.tables["requests"]
+            await ratings.submit_review(requests[0], 5, ["atencioso", "rápido"])
+            await ratings.submit_review(requests[1], 2, ["rápido"])
+            result = await ratings.submit_review(requests[1], 4, ["atencioso"], "Mudei de ideia")
+            return result, await ratings.get_doctor_reviews("d1")
+
+        result, reviews = asyncio.run(scenario())
+        profile = _profile(mock_db)
+
+        assert result["previous_rating"] == 2
+        assert (profile["rating_sum"], profile["rating_count"], profile["rating"]) == (9, 2, 4.5)
+        assert profile["tag_counts"] == {"atencioso": 2, "rápido": 1}
+        assert [r["rating"] for r in reviews] == [4, 5]
+        assert mock_db.tables["requests"][1]["review"]["comment"] == "Mudei de ideia"
+
+    def test_recompute_repairs_drift(self, mock_db):
+        async def scenario():
+            await ratings.submit_review(mock_db.tables["requests"][0], 3, ["pontual"])
+            _profile(mock_db).update({"rating_sum": 99, "rating_count": 7, "tag_counts": {}})
+            mock_db.tables["requests"][2]["review"] = {"rating": 5, "tags": ["pontual"]}
+            return await ratings.recompute(page_size=1)
+
+        assert asyncio.run(scenario()) == 2
+        profile = _profile(mock_db)
+        assert (profile["rating_sum"], profile["rating_count"], profile["rating"]) == (8, 2, 4.0)
+        assert profile["tag_counts"] == {"pontual": 2}
+        assert len(mock_db.tables["reviews"]) == 2
+
+    def test_recompute_clears_rating_without_reviews(self, mock_db):
+        async def scenario():
+            await ratings.submit_review(mock_db.tables["requests"][0], 1)
+            mock_db.tables["requests"][0].pop("review")
+            return await ratings.recompute()
+
+        asyncio.run(scenario())
+        profile = _profile(mock_db)
+        assert (profile["rating_count"], profile["rating"]) == (0, None)
@@ -0,0 +1,93 @@
+"""
+Testes - Filas em tempo real (realtime)
+Usa o MockDatabase em memória, sem Supabase
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import realtime
+
+
+@pytest.fixture
+def mock_db(mock_db, monkeypatch):
+    monkeypatch.setattr(realtime, "hub", realtime.QueueHub())
+    mock_db.tables["requests"] = [
+        {"id": "r1", "request_type": "prescription", "status": "submitted", "doctor_id": None, "created_at": "2024-05-01T10:00:00"},
+        {"id": "r2", "request_type": "exam", "status": "submitted", "nurse_id": None, "created_at": "2024-05-01T10:01:00"},
+    ]
+    return mock_db
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = asyncio.Queue()
+
+    async def send_json(self, message):
+        await self.sent.put(message)
+
+
+class TestQueueHub:
+
+    def test_topics_and_event_kinds(self, mock_db):
+        hub = realtime.hub
+        doctors = hub.subscribe({"doctor"})
+        nurses = hub.subscribe({"nursing"})
+        mine = hub.subscribe({"user:d1"})
+
+        request = mock_db.tables["requests"][0]
+        hub.publish(request)
+        hub.publish({**request, "status": "in_review", "doctor_id": "d1"}, previous=request)
+
+        assert [doctors.queue.get_nowait()["event"] for _ in range(2)] == ["added", "claimed"]
+        assert nurses.queue.empty()
+        assert mine.queue.get_nowait()["event"] == "claimed"
+
+        hub.unsubscribe(doctors)
+        hub.publish(request)
+        assert doctors.queue.empty()
+
+    def test_overflow_requests_resync(self):
+        subscription = realtime.Subscription({"doctor"}, max_buffer=2)
+        for i in range(5):
+            subscription.push({"seq": i})
+
+        assert asyncio.run(subscription.get()) is None
+        subscription.push({"seq": 6})
+        assert asyncio.run(subscription.get())["seq"] == 6
+
+
+class TestQueueStream:
+
+    def test_snapshot_then_deltas(self, mock_db):
+        view = realtime.QUEUE_VIEWS["doctor"]
+        ctx = {"user_id": "d2", "specialties": []}
+
+        async def run():
+            websocket = FakeWebSocket()
+            task = asyncio.ensure_future(realtime.stream_queue(websocket, view, ctx, ping_interval=5))
+            snapshot = await websocket.sent.get()
+
+            request = mock_db.tables["requests"][0]
+            realtime.hub.publish({**request, "status": "in_review", "doctor_id": "d1"}, previous=request)
+            realtime.hub.publish({**mock_db.tables["requests"][1], "status": "in_nursing_review"}, previous=mock_db.tables["requests"][1])
+            delta = await websocket.sent.get()
+
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            return snapshot, delta, websocket.sent.empty()
+
+        snapshot, delta, nothing_else = asyncio.run(run())
+
+        assert snapshot["type"] == "snapshot"
+        assert [r["id"] for r in snapshot["queue"]["pending"]] == ["r1"]
+        assert delta["type"] == "delta" and delta["event"] == "claimed"
+        # Assumido por outro médico: sai da fila deste
+        assert delta["request"]["id"] == "r1" and delta["bucket"] is None
+        assert nothing_else
+        assert not realtime.hub._subscribers
@@ -0,0 +1,102 @@
+"""
+Testes - Relatórios administrativos por período (reports)
+Usa o MockDatabase em memória, sem Supabase
+"""
+
+import asyncio
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import reports
+
+NOW = datetime(2024, 5, 15, 12, 0, 0)  # quarta-feira
+
+
+class TestWindows:
+    """Period names resolve to [start, end) windows"""
+
+    def test_named_periods(self):
+        assert reports.resolve_window("today", now=NOW).start == datetime(2024, 5, 15)
+        week = reports.resolve_window("week", now=NOW)
+        assert (week.start, week.end) == (datetime(2024, 5, 13), datetime(2024, 5, 20))
+        month = reports.resolve_window("month", now=NOW)
+        assert (month.start, month.end) == (datetime(2024, 5, 1), datetime(2024, 6, 1))
+
+    def test_custom_period_is_end_inclusive_and_validated(self):
+        window = reports.resolve_window("custom", "2024-01-01", "2024-01-31")
+        assert window.end == datetime(2024, 2, 1)
+        with pytest.raises(ValueError):
+            reports.resolve_window("custom", "2024-02-01", "2024-01-01")
+        with pytest.raises(ValueError):
+            reports.resolve_window("quarter")
+
+
+class TestReport:
+    """admin_report aggregates only the rows inside the window"""
+
+    def test_report_for_window(self, mock_db):
+        async def scenario():
+            rows = [
+                ("r1", "prescription", "completed", "2024-05-02T10:00:00", 5),
+                ("r2", "prescription", "completed", "2024-05-03T10:00:00", 3),
+                ("r3", "exam", "submitted", "2024-05-03T11:00:00", None),
+                ("r4", "consultation", "completed", "2024-04-20T10:00:00", 1),  # fora da janela
+            ]
+            for request_id, request_type, status, created_at, rating in rows:
+                await database.insert_one("requests", {
+                    "id": request_id, "request_type": request_type, "status": status,
+                    "doctor_id": "d1" if status == "completed" else None, "doctor_name": "Dr. Um",
+                    "created_at": created_at, "review": {"rating": rating} if rating else None,
+                })
+            await database.insert_one("payments", {"id": "p1", "amount": 29.9, "status": "completed", "paid_at": "2024-05-02T10:05:00"})
+            await database.insert_one("payments", {"id": "p2", "amount": 50.0, "status": "completed", "paid_at": "2024-04-20T10:05:00"})
+            await database.insert_one("payments", {"id": "p3", "amount": 99.0, "status": "pending", "created_at": "2024-05-02T10:05:00"})
+
+            window = reports.resolve_window("custom", "2024-05-01", "2024-05-07")
+            return await reports.build_report(window, now=NOW)
+
+        report = asyncio.run(scenario())
+        assert report["totalRequests"] == 3
+        assert report["completedRequests"] == 2
+        assert report["totalRevenue"] == pytest.approx(29.9)
+        assert report["monthlyRevenue"] == pytest.approx(29.9)
+        assert report["averageRating"] == 4.0
+        assert report["topDoctors"] == [{"name": "Dr. Um", "consultations": 2, "rating": 4.0}]
+        assert report["requestsByType"][0] == {"type": "Receitas", "count": 2, "percentage": 67}
+        assert [d["date"] for d in report["daily_data"]] == ["2024-05-02", "2024-05-03"]
+
+    def test_reports_are_cached_per_window(self, mock_db, monkeypatch):
+        calls = []
+        original = database.call_rpc
+
+        async def counting_rpc(name, params=None):
+            calls.append(name)
+            return await original(name, params)
+
+        monkeypatch.setattr(reports, "call_rpc", counting_rpc)
+
+        async def scenario():
+            await reports.get_report("week")
+            await reports.get_report("week")
+            await reports.get_report("month")
+
+        asyncio.run(scenario())
+        assert calls == ["admin_report", "admin_report"]
+
+    def test_cache_is_bounded_for_custom_windows(self, mock_db, monkeypatch):
+        monkeypatch.setattr(reports, "_cache", reports.TTLCache(maxsize=3, ttl=60))
+
+        async def scenario():
+            for day in range(1, 8):
+                await reports.get_report("custom", f"2024-05-0{day}", f"2024-05-0{day}")
+
+        asyncio.run(scenario())
+        assert len(reports._cache) == 3
+        assert reports._cache.get(reports.resolve_window("custom", "2024-05-07", "2024-05-07").cache_key)
+        assert reports._cache.get(reports.resolve_window("custom", "2024-05-01", "2024-05-01").cache_key) is None
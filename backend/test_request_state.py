@@ -0,0 +1,101 @@
+"""
+Testes - Transições de status com concorrência otimista (request_state)
+Usa o MockDatabase em memória, sem Supabase
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+from request_state import transition, TransitionError
+
+
+@pytest.fixture
+def mock_db(mock_db):
+    mock_db.tables["requests"].append({
+        "id": "r1", "patient_id": "p1", "doctor_id": None, "request_type": "prescription",
+        "status": "submitted", "created_at": "2024-05-01T10:00:00",
+    })
+    return mock_db
+
+
+def _request(mock_db) -> dict:
+    return mock_db.tables["requests"][-1]
+
+
+class TestTransitions:
+
+    def test_concurrent_accept_has_one_winner(self, mock_db):
+        async def accept(doctor_id):
+            try:
+                return await transition("r1", "doctor_accept", actor_id=doctor_id, patch={"doctor_id": doctor_id})
+            except TransitionError as e:
+                return e
+
+        async def run():
+            return await asyncio.gather(accept("d1"), accept("d2"))
+
+        first, second = asyncio.run(run())
+
+        assert first.request["status"] == "in_review"
+        assert first.previous_status == "submitted"
+        assert first.previous["doctor_id"] is None
+        assert isinstance(second, TransitionError) and second.status_code == 409
+        assert _request(mock_db)["doctor_id"] == "d1"
+
+    def test_owner_and_status_checks(self, mock_db):
+        async def run():
+            await transition("r1", "doctor_accept", actor_id="d1", patch={"doctor_id": "d1"})
+
+            with pytest.raises(TransitionError) as owner:
+                await transition("r1", "doctor_approve", actor_id="d2")
+            assert owner.value.status_code == 403
+
+            with pytest.raises(TransitionError) as wrong_status:
+                await transition("r1", "doctor_sign", actor_id="d1")
+            assert wrong_status.value.status_code == 409
+
+            with pytest.raises(TransitionError) as missing:
+                await transition("nope", "doctor_accept", actor_id="d1")
+            assert missing.value.status_code == 404
+
+            return await transition("r1", "doctor_approve", actor_id="d1", patch={"price": 59.9})
+
+        result = asyncio.run(run())
+
+        assert result.previous_status == "in_review"
+        assert _request(mock_db)["status"] == "approved_pending_payment"
+        assert _request(mock_db)["price"] == 59.9
+
+    def test_conditional_update(self, mock_db):
+        filters = {"id": "r1", "status": {"in": ["submitted", "pending"]}, "doctor_id": {"is": "null"}}
+
+        async def run():
+            first = await database.update_where("requests", filters, {"doctor_id": "d1", "status": "analyzing"})
+            second = await database.update_where("requests", filters, {"doctor_id": "d2", "status": "analyzing"})
+            return first, second
+
+        first, second = asyncio.run(run())
+
+        assert len(first) == 1 and first[0]["doctor_id"] == "d1"
+        assert second == []
+
+    def test_end_consultation_sets_duration_in_the_same_transition(self, mock_db):
+        mock_db.tables["doctor_profiles"] = [{"user_id": "d1", "total_consultations": 4}]
+        _request(mock_db).update(status="in_consultation", doctor_id="d1", consultation_started_at="2024-05-01T10:00:00Z")
+
+        async def run():
+            result = await transition("r1", "end_consultation", patch={"consultation_ended_at": "2024-05-01T10:42:30"})
+            await asyncio.gather(*(
+                database.call_rpc("increment_doctor_consultations", {"p_doctor_id": "d1"}) for _ in range(3)
+            ))
+            return result
+
+        result = asyncio.run(run())
+        assert result.request["consultation_duration_minutes"] == 42
+        assert mock_db.tables["doctor_profiles"][0]["total_consultations"] == 7
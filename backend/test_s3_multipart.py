@@ -0,0 +1,189 @@
+"""
+Testes - Upload multipart para S3 (s3_multipart + backup_manager)
+Bucket local em memória com a mesma API do cliente boto3
+"""
+
+import base64
+import hashlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+
+import httpx
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import s3_multipart
+from backup_format import read_index
+from backup_manager import BackupManager, read_backup
+from s3_multipart import S3MultipartWriter, S3UploadError
+
+
+class LocalS3:
+    """In-memory S3 stand-in: multipart uploads, Content-MD5 checks, MD5 ETags"""
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.aborted = []
+        self.fail_parts = {}  # part number -> failures left
+        self.corrupt_parts = set()
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        upload_id = f"up{len(self.uploads) + 1}"
+        self.uploads[upload_id] = {"key": (Bucket, Key), "parts": {}, "args": kwargs}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, ContentMD5):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            failures = self.fail_parts.get(PartNumber, 0)
+            if failures:
+                self.fail_parts[PartNumber] = failures - 1
+        time.sleep(0.01)
+        with self.lock:
+            self.active -= 1
+        if failures:
+            raise ConnectionError("connection reset")
+        if PartNumber in self.corrupt_parts:
+            Body = Body[:-1] + b"?"  # bytes alterados no caminho
+        if base64.b64encode(hashlib.md5(Body).digest()).decode() != ContentMD5:
+            raise ValueError("BadDigest")
+        etag = hashlib.md5(Body).hexdigest()
+        with self.lock:
+            self.uploads[UploadId]["parts"][PartNumber] = (etag, Body)
+        return {"ETag": f'"{etag}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        upload = self.uploads.pop(UploadId)
+        numbers = [p["PartNumber"] for p in MultipartUpload["Parts"]]
+        assert numbers == sorted(upload["parts"])
+        for part in MultipartUpload["Parts"]:
+            assert part["ETag"].strip('"') == upload["parts"][part["PartNumber"]][0]
+        self.objects[(Bucket, Key)] = b"".join(upload["parts"][n][1] for n in numbers)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId)
+        self.aborted.append(Key)
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[(Bucket, Key)] = Body
+
+    def get_object(self, Bucket, Key):
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)])}
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(s3_multipart, "S3_RETRY_BACKOFF_SECONDS", 0)
+    monkeypatch.setattr(s3_multipart, "S3_PART_RETRIES", 2)
+
+
+class TestS3MultipartWriter:
+
+    def test_parts_upload_in_parallel_and_retry(self):
+        s3 = LocalS3()
+        s3.fail_parts = {2: 2}
+        data = os.urandom(1000)
+
+        with S3MultipartWriter(s3, "bucket", "k", part_size=64, concurrency=4) as out:
+            for i in range(0, len(data), 100):
+                out.write(data[i:i + 100])
+
+        assert s3.objects[("bucket", "k")] == data
+        assert out.size == 1000 and out.sha256.hexdigest() == hashlib.sha256(data).hexdigest()
+        assert s3.max_active > 1
+
+    def test_failed_or_corrupted_part_aborts_upload(self):
+        for setup in ({"fail_parts": {3: 5}}, {"corrupt_parts": {1}}):
+            s3 = LocalS3()
+            for attr, value in setup.items():
+                setattr(s3, attr, value)
+
+            with pytest.raises(S3UploadError):
+                with S3MultipartWriter(s3, "bucket", "k", part_size=10, concurrency=2) as out:
+                    out.write(b"x" * 100)
+
+            assert s3.aborted == ["k"] and s3.objects == {} and s3.uploads == {}
+
+
+class TestBackupToS3:
+
+    @pytest.fixture
+    def manager(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("SUPABASE_URL", "https://db.test")
+        monkeypatch.setenv("SUPABASE_SERVICE_ROLE_KEY", "service-key")
+        monkeypatch.setenv("BACKUP_DIR", str(tmp_path))
+        monkeypatch.setenv("BACKUP_S3_BUCKET", "backups")
+        monkeypatch.setenv("AWS_ACCESS_KEY_ID", "key")
+        monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "secret")
+        rows = [{"id": f"u{i:03d}", "bio": os.urandom(40).hex(), "created_at": "2024-06-01T10:00:00Z"} for i in range(300)]
+        restored = []
+
+        def handler(request):
+            if request.method == "POST":
+                restored.extend(json.loads(request.content))
+                return httpx.Response(201)
+            after = request.url.params.get("or")
+            page = [r for r in rows if not after or r["id"] > after.rsplit('"', 2)[-2]]
+            return httpx.Response(200, json=page[:int(request.url.params["limit"])])
+
+        s3 = LocalS3()
+        m = BackupManager(transport=httpx.MockTransport(handler))
+        m.tables = ["users"]
+        m.s3_part_size = 4096
+        monkeypatch.setattr(m, "_s3_client", lambda: s3)
+        m.restored = restored
+        yield m, s3, rows
+        m.close()
+
+    def test_streamed_backup_has_no_local_copy(self, manager, tmp_path):
+        m, s3, rows = manager
+        m.keep_local = False
+
+        location = m.backup_database()
+
+        name = location.rsplit("/", 1)[-1]
+        assert location == f"s3://backups/renoveja-backups/{name}"
+        assert not (m.backup_dir / name).exists()
+        body = s3.objects[("backups", f"renoveja-backups/{name}")]
+        manifest = json.loads(s3.objects[("backups", f"renoveja-backups/{name.split('.')[0]}.manifest.json")])
+        assert manifest["size"] == len(body) and manifest["sha256"] == hashlib.sha256(body).hexdigest()
+        downloaded = tmp_path / "download" / name
+        downloaded.parent.mkdir()
+        downloaded.write_bytes(body)
+        assert read_index(downloaded)["tables"] == manifest["tables"]
+        assert [r["id"] for _, r in read_backup(downloaded)] == [r["id"] for r in rows]
+        assert m.catalog.entries()[0]["remote"] == f"renoveja-backups/{name}"
+        assert not list(m.backup_dir.glob(".*.part"))
+
+    def test_local_backup_upload_is_multipart(self, manager):
+        m, s3, rows = manager
+
+        path = m.backup_database()
+        assert m.upload_to_s3(path)
+
+        name = os.path.basename(path)
+        with open(path, "rb") as f:
+            assert s3.objects[("backups", f"renoveja-backups/{name}")] == f.read()
+        assert os.path.getsize(path) > 2 * m.s3_part_size
+
+    def test_chain_restore_downloads_remote_only_backups(self, manager):
+        m, s3, rows = manager
+        m.keep_local = False
+
+        m.backup_database("full")
+        assert m.restore_chain()
+
+        assert sorted(r["id"] for r in m.restored) == [r["id"] for r in rows]
+        # As cópias baixadas saem depois da restauração; o catálogo continua apontando para o S3
+        assert list(m.backup_dir.glob("renoveja_backup_*")) == []
+
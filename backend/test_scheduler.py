@@ -0,0 +1,66 @@
+"""
+Testes - Jobs periódicos (scheduler + job_locks)
+Usa o MockDatabase em memória, sem Supabase
+"""
+
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scheduler import PeriodicTask
+
+
+class TestPeriodicTask:
+
+    def test_only_one_worker_runs_a_locked_job(self, mock_db):
+        runs = []
+
+        async def reconcile():
+            runs.append(1)
+            await asyncio.sleep(0.05)
+            return {"checked": len(runs)}
+
+        async def run():
+            # Dois workers com o mesmo job ao mesmo tempo
+            workers = [PeriodicTask(reconcile, interval=20, name="Reconcile", lock="reconcile") for _ in range(2)]
+            concurrent = await asyncio.gather(*[w.run_once() for w in workers])
+            after = await workers[1].run_once()
+            return concurrent, after
+
+        concurrent, after = asyncio.run(run())
+
+        assert sorted(concurrent, key=str) == [None, {"checked": 1}]
+        assert after == {"checked": 2}  # a trava foi liberada ao terminar
+        assert mock_db.tables["job_locks"] == []
+
+    def test_expired_lock_is_taken_over(self, mock_db):
+        mock_db.tables["job_locks"] = [{
+            "name": "reconcile", "holder": "dead-worker",
+            "expires_at": (datetime.utcnow() - timedelta(seconds=1)).isoformat(),
+        }]
+
+        async def reconcile():
+            return "ok"
+
+        task = PeriodicTask(reconcile, interval=20, name="Reconcile", lock="reconcile")
+        assert asyncio.run(task.run_once()) == "ok"
+
+    def test_loop_keeps_running_after_errors(self, mock_db):
+        calls = []
+
+        async def flaky():
+            calls.append(1)
+            if len(calls) == 1:
+                raise RuntimeError("boom")
+
+        async def run():
+            task = PeriodicTask(flaky, interval=0.01, name="Flaky")
+            task.start()
+            await asyncio.sleep(0.1)
+            await task.stop()
+
+        asyncio.run(run())
+        assert len(calls) >= 2
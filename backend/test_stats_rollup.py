@@ -0,0 +1,97 @@
+"""
+Testes - Estatísticas pré-agregadas (stats_rollup)
+Usa o MockDatabase em memória, sem Supabase
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import stats_rollup
+
+
+def _request(request_id: str, request_type: str, status: str = "submitted", doctor_id: str = None) -> dict:
+    return {
+        "id": request_id,
+        "request_type": request_type,
+        "status": status,
+        "doctor_id": doctor_id,
+        "doctor_name": "Dr. Teste" if doctor_id else None,
+        "created_at": "2024-05-01T10:00:00",
+    }
+
+
+class TestIncrementalRollups:
+    """Rollups are maintained from events"""
+
+    def test_transitions_and_revenue(self, mock_db):
+        async def scenario():
+            r1 = _request("r1", "prescription")
+            r2 = _request("r2", "consultation")
+            await stats_rollup.record_request_created(r1)
+            await stats_rollup.record_request_created(r2)
+
+            await stats_rollup.record_transition(r2, "completed")
+            await stats_rollup.apply_deltas(stats_rollup.payment_deltas(59.90, "consultation"))
+            return await stats_rollup.get_dashboard()
+
+        dashboard = asyncio.run(scenario())
+        statuses = dashboard["all"]["status"]
+
+        assert stats_rollup.total(statuses, buckets=["submitted"]) == 1
+        assert stats_rollup.total(statuses, buckets=["completed"]) == 1
+        assert stats_rollup.total(dashboard["today"]["completed"]) == 1
+        assert stats_rollup.total(dashboard["all"]["revenue"], "amount") == pytest.approx(59.90)
+        assert set(dashboard["all"]) == {"status", "completed", "revenue"}
+
+
+class TestRebuild:
+    """rebuild() recomputes the rollups from the source tables"""
+
+    def test_rebuild_matches_source_tables(self, mock_db):
+        async def scenario():
+            for i in range(25):
+                status = "completed" if i % 5 == 0 else "submitted"
+                await database.insert_one("requests", {
+                    **_request(f"r{i:02d}", "exam" if i % 2 else "prescription", status, "d1" if status == "completed" else None),
+                    "completed_at": "2024-05-02T12:00:00" if status == "completed" else None,
+                })
+            await database.insert_one("payments", {"id": "p1", "request_id": "r00", "amount": 39.9, "status": "completed"})
+            await database.insert_one("payments", {"id": "p2", "request_id": "r01", "amount": 10.0, "status": "pending"})
+
+            await stats_rollup.rebuild(page_size=10)
+            return await stats_rollup.get_dashboard()
+
+        dashboard = asyncio.run(scenario())
+        assert stats_rollup.total(dashboard["all"]["status"]) == 25
+        assert stats_rollup.total(dashboard["all"]["status"], buckets=["completed"]) == 5
+        assert stats_rollup.total(dashboard["all"]["completed"]) == 5
+        assert dashboard["all"]["revenue"]["prescription"]["amount"] == pytest.approx(39.9)
+
+    def test_rebuild_reads_request_types_in_short_id_lists(self, mock_db, monkeypatch):
+        monkeypatch.setattr(database, "MAX_IN_FILTER_VALUES", 3)
+        lookups = []
+        find_many = stats_rollup.find_many
+
+        async def recording(table, filters=None, **kw):
+            if table == "requests":
+                lookups.append(len(filters["id"]["in"]))
+            return await find_many(table, filters, **kw)
+
+        monkeypatch.setattr(stats_rollup, "find_many", recording)
+
+        async def scenario():
+            for i in range(7):
+                await database.insert_one("requests", _request(f"r{i}", "exam", "paid"))
+                await database.insert_one("payments", {"id": f"p{i}", "request_id": f"r{i}", "amount": 10.0, "status": "completed"})
+            await stats_rollup.rebuild(page_size=100)
+            return await stats_rollup.get_dashboard()
+
+        dashboard = asyncio.run(scenario())
+        assert lookups == [3, 3, 1]
+        assert dashboard["all"]["revenue"]["exam"]["amount"] == pytest.approx(70.0)
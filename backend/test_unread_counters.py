@@ -0,0 +1,61 @@
+"""
+Testes - Contadores de não lidas (unread_counters)
+Usa o MockDatabase em memória, sem Supabase
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import unread_counters
+from notifications_helper import notify_user, notify_users
+
+
+REQUEST = {"id": "r1", "patient_id": "p1", "doctor_id": "d1", "nurse_id": None}
+
+
+class TestUnreadCounters:
+
+    def test_chat_counters_bump_and_reset(self, mock_db):
+        async def run():
+            await unread_counters.record_chat_message(REQUEST, sender_id="p1")
+            await unread_counters.record_chat_message(REQUEST, sender_id="p1")
+            await unread_counters.record_chat_message({**REQUEST, "id": "r2"}, sender_id="p1")
+            await unread_counters.record_chat_message(REQUEST, sender_id="d1")
+            doctor = await unread_counters.get_chat_unread("d1")
+            patient = await unread_counters.get_chat_unread("p1")
+
+            await unread_counters.reset("d1", unread_counters.CHAT, "r1")
+            after_read = await unread_counters.get_chat_unread("d1")
+            unread_counters.clear_cache()
+            reloaded = await unread_counters.get_chat_unread("d1")
+            return doctor, patient, after_read, reloaded
+
+        doctor, patient, after_read, reloaded = asyncio.run(run())
+
+        assert doctor == {"unread_count": 3, "by_request": {"r1": 2, "r2": 1}}
+        assert patient == {"unread_count": 1, "by_request": {"r1": 1}}
+        assert after_read == reloaded == {"unread_count": 1, "by_request": {"r2": 1}}
+
+    def test_notification_badge(self, mock_db):
+        async def run():
+            first = await unread_counters.get_notifications_unread("p1")  # entra no cache
+            await notify_user(database.insert_one, "p1", "prescription_accepted", {"doctor_name": "Um"})
+            await notify_users(database.insert_one, ["p1", "p2"], "prescription_signed", {"doctor_name": "Um"})
+            cached = await unread_counters.get_notifications_unread("p1")
+
+            await unread_counters.notification_read("p1")
+            one_read = await unread_counters.get_notifications_unread("p1")
+            await unread_counters.reset("p1", unread_counters.NOTIFICATIONS)
+            await unread_counters.notification_read("p1")  # nunca fica negativo
+            unread_counters.clear_cache()
+            return first, cached, one_read, await unread_counters.get_notifications_unread("p1"), \
+                await unread_counters.get_notifications_unread("p2")
+
+        first, cached, one_read, cleared, other = asyncio.run(run())
+
+        assert (first, cached, one_read, cleared, other) == (0, 2, 1, 0, 1)
+        assert len(mock_db.tables["notifications"]) == 3
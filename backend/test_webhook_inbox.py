@@ -0,0 +1,151 @@
+"""
+Testes - Caixa de entrada de webhooks (webhook_inbox)
+Usa o MockDatabase em memória, sem Supabase
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import webhook_inbox
+from webhook_inbox import WebhookInbox
+
+
+def _events(mock_db):
+    return {e["id"]: e for e in mock_db.tables["webhook_inbox"]}
+
+
+class TestWebhookInbox:
+
+    def test_duplicates_are_ignored_and_coalesced(self, mock_db):
+        processed = []
+
+        async def handler(mp_payment_id):
+            processed.append(mp_payment_id)
+
+        async def run():
+            inbox = WebhookInbox(handler)
+            queued = [
+                await inbox.enqueue("111", "req-a", "payment.created"),
+                await inbox.enqueue("111", "req-a", "payment.created"),  # reentrega
+                await inbox.enqueue("111", "req-b", "payment.updated"),
+                await inbox.enqueue("222", "req-c", "payment.created"),
+            ]
+            return queued, await inbox.drain(), await inbox.drain()
+
+        queued, first, second = asyncio.run(run())
+
+        assert queued == [True, False, True, True]
+        assert sorted(processed) == ["111", "222"]
+        assert (first, second) == (2, 0)
+        assert {e["status"] for e in _events(mock_db).values()} == {"done"}
+        assert len(mock_db.tables["webhook_inbox"]) == 3
+
+    def test_failures_retry_then_give_up(self, mock_db, monkeypatch):
+        monkeypatch.setattr(webhook_inbox, "WEBHOOK_MAX_ATTEMPTS", 2)
+        monkeypatch.setattr(webhook_inbox, "retry_delay", lambda attempts: 0)
+        calls = []
+
+        async def handler(mp_payment_id):
+            calls.append(mp_payment_id)
+            if mp_payment_id == "bad" or len(calls) == 1:
+                raise RuntimeError("MercadoPago indisponível")
+
+        async def run():
+            inbox = WebhookInbox(handler)
+            await inbox.enqueue("ok", "r1")
+            await inbox.drain()  # primeira tentativa falha e volta para a fila
+            await inbox.enqueue("bad", "r2")
+            await inbox.drain()
+            return inbox
+
+        asyncio.run(run())
+        events = _events(mock_db)
+
+        ok, bad = events["mercadopago:ok:r1"], events["mercadopago:bad:r2"]
+        assert (ok["status"], ok["attempts"], ok["last_error"]) == ("done", 2, None)
+        assert (bad["status"], bad["attempts"]) == ("failed", 2)
+        assert "indisponível" in bad["last_error"]
+
+    def test_stale_worker_cannot_overwrite_new_claim(self, mock_db):
+        async def handler(mp_payment_id):
+            pass
+
+        async def run():
+            inbox = WebhookInbox(handler)
+            await inbox.enqueue("444", "r1")
+            stale = await inbox.claim()
+            # O lease do primeiro worker expira e outro worker reivindica o evento
+            mock_db.tables["webhook_inbox"][0]["locked_until"] = "2000-01-01T00:00:00"
+            fresh = await inbox.claim()
+            await inbox.process_claimed(stale)
+            after_stale = dict(mock_db.tables["webhook_inbox"][0])
+            await inbox.process_claimed(fresh)
+            return after_stale
+
+        after_stale = asyncio.run(run())
+        event = mock_db.tables["webhook_inbox"][0]
+
+        # O resultado do worker atrasado é descartado; a expiração contou uma tentativa
+        assert (after_stale["status"], after_stale["attempts"]) == ("processing", 2)
+        assert (event["status"], event["attempts"]) == ("done", 2)
+
+    def test_expired_leases_count_as_attempts(self, mock_db, monkeypatch):
+        monkeypatch.setattr(webhook_inbox, "WEBHOOK_MAX_ATTEMPTS", 2)
+        calls = []
+
+        async def handler(mp_payment_id):
+            calls.append(mp_payment_id)
+
+        async def run():
+            inbox = WebhookInbox(handler)
+            await inbox.enqueue("555", "r1")
+            for _ in range(2):  # o worker morre antes de gravar o resultado
+                await inbox.claim()
+                mock_db.tables["webhook_inbox"][0]["locked_until"] = "2000-01-01T00:00:00"
+            await inbox.drain()
+
+        asyncio.run(run())
+        event = mock_db.tables["webhook_inbox"][0]
+
+        assert calls == []
+        assert (event["status"], event["attempts"]) == ("failed", 3)
+
+    def test_slow_handler_times_out_within_the_lease(self, mock_db, monkeypatch):
+        monkeypatch.setattr(webhook_inbox, "retry_delay", lambda attempts: 60)
+
+        async def handler(mp_payment_id):
+            await asyncio.sleep(10)
+
+        async def run():
+            inbox = WebhookInbox(handler, batch_size=5, handler_timeout=0.05)
+            await inbox.enqueue("666", "r1")
+            return inbox.lease_seconds, await inbox.drain()
+
+        lease, processed = asyncio.run(run())
+        event = mock_db.tables["webhook_inbox"][0]
+
+        assert lease >= 5 * 0.05 and processed == 1
+        assert (event["status"], event["attempts"], event["last_error"]) == ("pending", 1, "TimeoutError")
+
+    def test_workers_pick_up_new_events(self, mock_db):
+        done = []
+
+        async def run():
+            event = asyncio.Event()
+
+            async def handler(mp_payment_id):
+                done.append(mp_payment_id)
+                event.set()
+
+            inbox = WebhookInbox(handler, workers=2, poll_interval=5)
+            inbox.start()
+            await asyncio.sleep(0)
+            await inbox.enqueue("333", "r1")
+            await asyncio.wait_for(event.wait(), timeout=1)
+            await inbox.stop()
+
+        asyncio.run(run())
+        assert done == ["333"]
@@ -0,0 +1,140 @@
+"""
+Unread Counters for RenoveJá+
+Contadores de não lidas do chat e das notificações (badge do app)
+
+Em vez de varrer solicitações + mensagens a cada consulta, cada usuário tem
+linhas compactas em `unread_counters`:
+
+- scope="chat",          key=<request_id>  → mensagens não lidas naquele chat
+- scope="notifications", key=""            → notificações não lidas
+
+Os contadores são incrementados ao gravar uma mensagem/notificação (função
+SQL `bump_unread_counters`, supabase/unread-counters.sql) e zerados ao marcar
+como lido. A leitura é uma consulta por usuário, guardada em cache no processo
+por UNREAD_CACHE_SECONDS; as escritas deste worker atualizam o cache na hora,
+as de outros workers aparecem quando ele expira.
+"""
+
+import os
+import time
+from typing import List, Dict, Any, Optional, Tuple
+
+from database import find_many, update_where, call_rpc
+
+COUNTER_TABLE = "unread_counters"
+CHAT = "chat"
+NOTIFICATIONS = "notifications"
+
+UNREAD_CACHE_SECONDS = float(os.getenv("UNREAD_CACHE_SECONDS", "30"))
+
+
+# ============== CACHE ==============
+
+# user_id -> (expira_em, {(scope, key): count})
+_cache: Dict[str, Tuple[float, Dict[Tuple[str, str], int]]] = {}
+
+
+def clear_cache():
+    _cache.clear()
+
+
+def _apply_to_cache(user_id: str, scope: str, key: str, delta: int = 0, reset: bool = False):
+    entry = _cache.get(user_id)
+    if not entry:
+        return
+    counters = entry[1]
+    if reset:
+        for counter in [c for c in counters if c[0] == scope and (key is None or c[1] == key)]:
+            del counters[counter]
+    else:
+        counters[(scope, key)] = max(0, counters.get((scope, key), 0) + delta)
+
+
+# ============== ESCRITA ==============
+
+async def bump(deltas: List[Dict[str, Any]]):
+    """
+    Increment counters atomically: [{user_id, scope, key, delta}, ...].
+    Failures are logged; a missed bump only leaves a badge short.
+    """
+    deltas = [d for d in deltas if d.get("user_id")]
+    if not deltas:
+        return
+    try:
+        await call_rpc("bump_unread_counters", {"p_deltas": deltas})
+    except Exception as e:
+        print(f"Unread counters error: {e}")
+        return
+    record_bumped(deltas)
+
+
+def record_bumped(deltas: List[Dict[str, Any]]):
+    """Reflect deltas already applied in the database (e.g. by finish_payment_outbox) in this worker's cache"""
+    for d in deltas:
+        _apply_to_cache(d["user_id"], d["scope"], d.get("key", ""), d.get("delta", 1))
+
+
+async def reset(user_id: str, scope: str, key: Optional[str] = ""):
+    """Zero one counter, or every counter of the scope when key is None"""
+    filters = {"user_id": user_id, "scope": scope, "count": {"gt": 0}}
+    if key is not None:
+        filters["key"] = key
+    await update_where(COUNTER_TABLE, filters, {"count": 0})
+    _apply_to_cache(user_id, scope, key, reset=True)
+
+
+async def record_chat_message(request: Dict[str, Any], sender_id: str):
+    """One more unread message for every participant except the sender"""
+    participants = {request.get(f) for f in ("patient_id", "doctor_id", "nurse_id")}
+    await bump([
+        {"user_id": user_id, "scope": CHAT, "key": request["id"], "delta": 1}
+        for user_id in participants
+        if user_id and user_id != sender_id
+    ])
+
+
+def notification_deltas(notifications: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Badge increments for newly stored notifications"""
+    per_user: Dict[str, int] = {}
+    for notification in notifications:
+        if not notification.get("read"):
+            per_user[notification["user_id"]] = per_user.get(notification["user_id"], 0) + 1
+    return [
+        {"user_id": user_id, "scope": NOTIFICATIONS, "key": "", "delta": count}
+        for user_id, count in per_user.items()
+    ]
+
+
+async def record_notifications(notifications: List[Dict[str, Any]]):
+    """Count newly stored notifications towards their users' badges"""
+    await bump(notification_deltas(notifications))
+
+
+async def notification_read(user_id: str):
+    """One notification went from unread to read"""
+    await bump([{"user_id": user_id, "scope": NOTIFICATIONS, "key": "", "delta": -1}])
+
+
+# ============== LEITURA ==============
+
+async def get_counters(user_id: str) -> Dict[Tuple[str, str], int]:
+    """All non-zero counters of a user, {(scope, key): count}"""
+    entry = _cache.get(user_id)
+    if entry and entry[0] > time.monotonic():
+        return entry[1]
+
+    rows = await find_many(COUNTER_TABLE, filters={"user_id": user_id, "count": {"gt": 0}}, limit=1000)
+    counters = {(r["scope"], r["key"]): int(r["count"]) for r in rows}
+    _cache[user_id] = (time.monotonic() + UNREAD_CACHE_SECONDS, counters)
+    return counters
+
+
+async def get_chat_unread(user_id: str) -> Dict[str, Any]:
+    counters = await get_counters(user_id)
+    by_request = {key: count for (scope, key), count in counters.items() if scope == CHAT and count > 0}
+    return {"unread_count": sum(by_request.values()), "by_request": by_request}
+
+
+async def get_notifications_unread(user_id: str) -> int:
+    counters = await get_counters(user_id)
+    return counters.get((NOTIFICATIONS, ""), 0)
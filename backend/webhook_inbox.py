@@ -0,0 +1,199 @@
+"""
+Webhook Inbox for RenoveJá+
+Recebimento assíncrono e idempotente dos webhooks do MercadoPago
+
+O endpoint só verifica a assinatura, grava o evento em `webhook_inbox` e
+responde 200; o processamento (consultar o MercadoPago, atualizar pagamento
+e solicitação, notificar) acontece depois, em um pool de workers:
+
+    POST /api/webhooks/mercadopago ──► enqueue() ──► webhook_inbox (pending)
+                                                          │ claim_webhook_events
+                                                   workers ◄┘  (SKIP LOCKED)
+
+- Chave do evento: (data.id, x-request-id). Reentregas do mesmo evento pelo
+  MercadoPago são ignoradas na gravação.
+- Eventos diferentes do mesmo pagamento (payment.created + payment.updated,
+  reenvios com outro request id) são reivindicados juntos e processados uma
+  única vez.
+- Falhas voltam para a fila com backoff; após WEBHOOK_MAX_ATTEMPTS o evento
+  fica como `failed` para análise. Um worker que morre no meio libera o
+  evento quando o lease expira.
+- Cada claim conta uma tentativa e grava um claim_token; o resultado só é
+  gravado se o token ainda for o mesmo, então um worker atrasado cujo lease
+  expirou não sobrescreve o estado de quem reivindicou o evento depois.
+  O handler tem WEBHOOK_HANDLER_TIMEOUT_SECONDS por recurso e o lease cobre
+  o lote inteiro com folga.
+
+SQL em supabase/webhook-inbox.sql.
+"""
+
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional, Callable, Awaitable
+
+from database import call_rpc, update_many, delete_many
+
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+WEBHOOK_POLL_SECONDS = float(os.getenv("WEBHOOK_POLL_SECONDS", "2"))
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "10"))
+# Tempo máximo do handler por recurso; o lease é batch_size x isso + folga
+WEBHOOK_HANDLER_TIMEOUT_SECONDS = float(os.getenv("WEBHOOK_HANDLER_TIMEOUT_SECONDS", "30"))
+WEBHOOK_LEASE_MARGIN_SECONDS = int(os.getenv("WEBHOOK_LEASE_MARGIN_SECONDS", "30"))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))
+WEBHOOK_INBOX_RETENTION_DAYS = int(os.getenv("WEBHOOK_INBOX_RETENTION_DAYS", "7"))
+
+Handler = Callable[[str], Awaitable[Any]]
+
+
+def event_key(provider: str, resource_id: str, request_id: str) -> str:
+    return f"{provider}:{resource_id}:{request_id}"
+
+
+def retry_delay(attempts: int) -> int:
+    """Seconds before the next attempt: 5s, 10s, 20s... capped at 15 minutes"""
+    return min(5 * 2 ** max(attempts - 1, 0), 900)
+
+
+class WebhookInbox:
+    """Durable inbox plus the worker pool that drains it"""
+
+    def __init__(
+        self,
+        handler: Handler,
+        provider: str = "mercadopago",
+        workers: int = WEBHOOK_WORKERS,
+        poll_interval: float = WEBHOOK_POLL_SECONDS,
+        batch_size: int = WEBHOOK_BATCH_SIZE,
+        handler_timeout: float = WEBHOOK_HANDLER_TIMEOUT_SECONDS
+    ):
+        self.handler = handler
+        self.provider = provider
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.handler_timeout = handler_timeout
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._last_prune = 0.0
+
+    # ============== RECEBIMENTO ==============
+
+    async def enqueue(self, resource_id: str, request_id: str, topic: str = None, payload: Dict[str, Any] = None) -> bool:
+        """
+        Store an event; returns False when it was already in the inbox.
+        Cheap enough to run inside the webhook request.
+        """
+        inserted = await call_rpc("enqueue_webhook_event", {"p_event": {
+            "id": event_key(self.provider, resource_id, request_id),
+            "provider": self.provider,
+            "resource_id": str(resource_id),
+            "request_id": request_id,
+            "topic": topic,
+            "payload": payload or {},
+        }})
+        if inserted and self._wakeup is not None:
+            self._wakeup.set()
+        return bool(inserted)
+
+    # ============== PROCESSAMENTO ==============
+
+    @property
+    def lease_seconds(self) -> int:
+        """Long enough for the handler to run, one resource after another, over a full batch"""
+        return int(self.batch_size * self.handler_timeout) + WEBHOOK_LEASE_MARGIN_SECONDS
+
+    async def claim(self) -> List[Dict[str, Any]]:
+        return await call_rpc("claim_webhook_events", {
+            "p_provider": self.provider,
+            "p_limit": self.batch_size,
+            "p_lease_seconds": self.lease_seconds,
+            "p_token": str(uuid.uuid4()),
+        }) or []
+
+    async def _settle(self, group: List[Dict[str, Any]], data: Dict[str, Any]) -> bool:
+        """Record the outcome of a claim, unless another worker has claimed the events since"""
+        updated = await update_many("webhook_inbox", {
+            "id": {"in": [e["id"] for e in group]},
+            "claim_token": group[0]["claim_token"],
+        }, {**data, "locked_until": None})
+        if updated == 0:
+            print(f"Webhook {self.provider} {group[0]['resource_id']}: lease lost, result discarded")
+        return updated > 0
+
+    async def process_claimed(self, events: List[Dict[str, Any]]) -> int:
+        """Run the handler once per resource; returns how many resources were processed"""
+        by_resource: Dict[str, List[Dict[str, Any]]] = {}
+        for event in events:
+            by_resource.setdefault(event["resource_id"], []).append(event)
+
+        for resource_id, group in by_resource.items():
+            # A tentativa já foi contada no claim (inclusive as de leases que expiraram)
+            attempts = max(int(e.get("attempts") or 0) for e in group)
+            if attempts > WEBHOOK_MAX_ATTEMPTS:
+                await self._settle(group, {"status": "failed", "last_error": "lease expired on every attempt"})
+                continue
+            try:
+                await asyncio.wait_for(self.handler(resource_id), timeout=self.handler_timeout)
+            except Exception as e:
+                error = str(e) or type(e).__name__
+                print(f"Webhook {self.provider} {resource_id} failed (attempt {attempts}): {error}")
+                failed = attempts >= WEBHOOK_MAX_ATTEMPTS
+                await self._settle(group, {
+                    "status": "failed" if failed else "pending",
+                    "last_error": error[:1000],
+                    "available_at": (datetime.utcnow() + timedelta(seconds=retry_delay(attempts))).isoformat(),
+                })
+                continue
+            await self._settle(group, {
+                "status": "done",
+                "last_error": None,
+                "processed_at": datetime.utcnow().isoformat(),
+            })
+        return len(by_resource)
+
+    async def drain(self) -> int:
+        """Process claimable events until none is left (used by workers and tests)"""
+        processed = 0
+        while True:
+            events = await self.claim()
+            if not events:
+                return processed
+            processed += await self.process_claimed(events)
+
+    async def prune(self, days: int = WEBHOOK_INBOX_RETENTION_DAYS) -> int:
+        """Delete processed events older than `days` (failed ones are kept)"""
+        cutoff = (datetime.utcnow() - timedelta(days=days)).isoformat()
+        return await delete_many("webhook_inbox", {"status": "done", "received_at": {"lt": cutoff}})
+
+    # ============== WORKERS ==============
+
+    def start(self):
+        if self.workers > 0 and not self._tasks:
+            self._wakeup = asyncio.Event()
+            self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._wakeup = None
+
+    async def _worker(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            self._wakeup.clear()
+            try:
+                await self.drain()
+                if loop.time() - self._last_prune > 3600:
+                    self._last_prune = loop.time()
+                    await self.prune()
+            except Exception as e:
+                print(f"Webhook worker error: {e}")
+            # Acorda com um novo evento deste processo ou, no máximo, a cada poll_interval
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
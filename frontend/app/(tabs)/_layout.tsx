@@ -1,10 +1,29 @@
-import React from 'react';
+import React, { useEffect, useState } from 'react';
 import { Tabs } from 'expo-router';
 import { Ionicons } from '@expo/vector-icons';
 import { Platform, View } from 'react-native';
 import { COLORS, SIZES } from '../../src/utils/constants';
+import { api } from '../../src/services/api';
+
+const BADGE_REFRESH_INTERVAL = 60000;
 
 export default function TabLayout() {
+  const [unreadNotifications, setUnreadNotifications] = useState(0);
+
+  useEffect(() => {
+    const loadBadge = async () => {
+      try {
+        const data = await api.getUnreadNotificationCount();
+        setUnreadNotifications(data?.unread_count || 0);
+      } catch {
+        // Badge é opcional; tenta de novo no próximo ciclo
+      }
+    };
+    loadBadge();
+    const interval = setInterval(loadBadge, BADGE_REFRESH_INTERVAL);
+    return () => clearInterval(interval);
+  }, []);
+
   return (
     <Tabs
       screenOptions={{
@@ -72,6 +91,7 @@ export default function TabLayout() {
         name="notifications"
         options={{
           title: 'Alertas',
+          tabBarBadge: unreadNotifications > 0 ? (unreadNotifications > 99 ? '99+' : unreadNotifications) : undefined,
           tabBarIcon: ({ color, focused }) => (
             <View style={{
               backgroundColor: focused ? COLORS.primary + '15' : 'transparent',
@@ -22,6 +22,8 @@ import { Ionicons } from '@expo/vector-icons';
 import { useAuth } from '@/contexts/AuthContext'
 import { useColors } from '@/contexts/ThemeContext';;
 import { api } from '@/services/api';
+import { mergeMessages, lastCursor } from '@/utils/chat';
+import { useChatSocket } from '@/hooks/useChatSocket';
 import { format } from 'date-fns';
 import { ptBR } from 'date-fns/locale';
 
@@ -32,6 +34,7 @@ interface ChatMessage {
   sender_type?: string;
   message: string;
   created_at: string;
+  cursor?: string;
 }
 
 export default function ChatScreen() {
@@ -47,12 +50,43 @@ export default function ChatScreen() {
   const [loading, setLoading] = useState(true);
   const [sending, setSending] = useState(false);
   const [request, setRequest] = useState<any>(null);
+  const messagesRef = useRef<ChatMessage[]>([]);
+  messagesRef.current = messages;
+
+  // Tempo real: mensagens, presença e digitação; polling só sem WebSocket
+  const chat = useChatSocket(requestId, {
+    onMessage: (message) => setMessages((prev) => mergeMessages(prev, [message])),
+    getLastCursor: () => lastCursor(messagesRef.current),
+  });
+  const lastTypingRef = useRef(0);
+  const otherOnline = chat.online.some((u) => u.user_id !== user?.id);
+
+  const handleChangeText = (text: string) => {
+    setNewMessage(text);
+    const now = Date.now();
+    if (text && now - lastTypingRef.current > 3000) {
+      lastTypingRef.current = now;
+      chat.sendTyping(true);
+    }
+  };
+
+  // Zera o contador de não lidas ao abrir o chat e a cada mensagem recebida
+  const lastMessage = messages[messages.length - 1];
+  useEffect(() => {
+    if (lastMessage && lastMessage.sender_id !== user?.id) {
+      api.markChatAsRead(requestId!).catch(() => {});
+    }
+  }, [lastMessage?.id]);
 
   useEffect(() => {
     loadData();
+  }, [requestId]);
+
+  useEffect(() => {
+    if (chat.connected) return;
     const interval = setInterval(loadMessages, 5000);
     return () => clearInterval(interval);
-  }, [requestId]);
+  }, [requestId, chat.connected]);
 
   const loadData = async () => {
     try {
@@ -71,8 +105,10 @@ export default function ChatScreen() {
 
   const loadMessages = async () => {
     try {
-      const data = await api.getChatMessages(requestId!);
-      setMessages(data || []);
+      // Só as mensagens novas desde a última recebida
+      const after = lastCursor(messagesRef.current);
+      const data = await api.getChatMessages(requestId!, after ? { after } : undefined);
+      setMessages((prev) => (after ? mergeMessages(prev, data || []) : data || []));
     } catch (error) {
       console.error('Error refreshing messages:', error);
     }
@@ -83,9 +119,13 @@ export default function ChatScreen() {
 
     setSending(true);
     try {
-      await api.sendChatMessage(requestId!, newMessage.trim());
+      if (chat.connected) {
+        await chat.sendMessage(newMessage.trim());
+      } else {
+        await api.sendChatMessage(requestId!, newMessage.trim());
+        await loadMessages();
+      }
       setNewMessage('');
-      await loadMessages();
       scrollViewRef.current?.scrollToEnd({ animated: true });
     } catch (error) {
       console.error('Error sending message:', error);
@@ -122,7 +162,9 @@ export default function ChatScreen() {
           <Text style={styles.headerName}>{getOtherPartyName()}</Text>
           <View style={styles.statusBadge}>
             <View style={styles.statusDot} />
-            <Text style={styles.statusText}>Online</Text>
+            <Text style={styles.statusText}>
+              {chat.typing.length > 0 ? 'digitando...' : otherOnline ? 'Online' : 'Offline'}
+            </Text>
           </View>
         </View>
         {request?.video_room && (
@@ -199,7 +241,7 @@ export default function ChatScreen() {
             placeholder="Digite sua mensagem..."
             placeholderTextColor="#9BA7AF"
             value={newMessage}
-            onChangeText={setNewMessage}
+            onChangeText={handleChangeText}
             multiline
             maxLength={1000}
           />
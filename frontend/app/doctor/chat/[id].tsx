@@ -22,6 +22,8 @@ import { Ionicons } from '@expo/vector-icons';
 import { useAuth } from '@/contexts/AuthContext';
 import { useColors } from '@/contexts/ThemeContext';
 import { api } from '@/services/api';
+import { mergeMessages, lastCursor } from '@/utils/chat';
+import { useChatSocket } from '@/hooks/useChatSocket';
 import { format } from 'date-fns';
 import { ptBR } from 'date-fns/locale';
 
@@ -32,6 +34,7 @@ interface ChatMessage {
   sender_type?: string;
   message: string;
   created_at: string;
+  cursor?: string;
 }
 
 export default function DoctorChatScreen() {
@@ -47,17 +50,47 @@ export default function DoctorChatScreen() {
   const [loading, setLoading] = useState(true);
   const [sending, setSending] = useState(false);
   const patientName = patient ? decodeURIComponent(patient) : 'Paciente';
+  const messagesRef = useRef<ChatMessage[]>([]);
+  messagesRef.current = messages;
+
+  // Tempo real: mensagens, presença e digitação; polling só sem WebSocket
+  const chat = useChatSocket(id, {
+    onMessage: (message) => setMessages((prev) => mergeMessages(prev, [message])),
+    getLastCursor: () => lastCursor(messagesRef.current),
+  });
+  const lastTypingRef = useRef(0);
+  const otherOnline = chat.online.some((u) => u.user_id !== user?.id);
+
+  const handleChangeText = (text: string) => {
+    setNewMessage(text);
+    const now = Date.now();
+    if (text && now - lastTypingRef.current > 3000) {
+      lastTypingRef.current = now;
+      chat.sendTyping(true);
+    }
+  };
+
+  // Zera o contador de não lidas ao abrir o chat e a cada mensagem recebida
+  const lastMessage = messages[messages.length - 1];
+  useEffect(() => {
+    if (lastMessage && lastMessage.sender_id !== user?.id) {
+      api.markChatAsRead(id!).catch(() => {});
+    }
+  }, [lastMessage?.id]);
 
   useEffect(() => {
     loadMessages();
+    if (chat.connected) return;
     const interval = setInterval(loadMessages, 5000);
     return () => clearInterval(interval);
-  }, [id]);
+  }, [id, chat.connected]);
 
   const loadMessages = async () => {
     try {
-      const data = await api.getChatMessages(id!);
-      setMessages(data || []);
+      // Só as mensagens novas desde a última recebida
+      const after = lastCursor(messagesRef.current);
+      const data = await api.getChatMessages(id!, after ? { after } : undefined);
+      setMessages((prev) => (after ? mergeMessages(prev, data || []) : data || []));
     } catch (error) {
       console.error('Error loading messages:', error);
     } finally {
@@ -70,9 +103,13 @@ export default function DoctorChatScreen() {
 
     setSending(true);
     try {
-      await api.sendChatMessage(id!, newMessage.trim());
+      if (chat.connected) {
+        await chat.sendMessage(newMessage.trim());
+      } else {
+        await api.sendChatMessage(id!, newMessage.trim());
+        await loadMessages();
+      }
       setNewMessage('');
-      await loadMessages();
       scrollViewRef.current?.scrollToEnd({ animated: true });
     } catch (error) {
       console.error('Error sending message:', error);
@@ -102,7 +139,9 @@ export default function DoctorChatScreen() {
         </TouchableOpacity>
         <View style={styles.headerInfo}>
           <Text style={styles.headerName}>{patientName}</Text>
-          <Text style={styles.headerSubtitle}>Paciente</Text>
+          <Text style={styles.headerSubtitle}>
+            {chat.typing.length > 0 ? 'digitando...' : otherOnline ? 'Paciente · online' : 'Paciente'}
+          </Text>
         </View>
         <TouchableOpacity style={styles.videoButton} onPress={() => router.push(`/video/${id}`)}>
           <Ionicons name="videocam" size={22} color="#FFFFFF" />
@@ -173,7 +212,7 @@ export default function DoctorChatScreen() {
             placeholder="Digite sua mensagem..."
             placeholderTextColor="#9BA7AF"
             value={newMessage}
-            onChangeText={setNewMessage}
+            onChangeText={handleChangeText}
             multiline
             maxLength={1000}
           />
@@ -23,6 +23,7 @@ import { Ionicons } from '@expo/vector-icons';
 import { useAuth } from '@/contexts/AuthContext';
 import { useColors } from '@/contexts/ThemeContext';
 import { api } from '@/services/api';
+import { useQueueStream } from '@/hooks/useQueueStream';
 
 type ConsultationType = {
   id: string;
@@ -58,12 +59,23 @@ export default function DoctorConsultationsScreen() {
   const [activeTab, setActiveTab] = useState<'waiting' | 'inProgress' | 'completed'>('waiting');
   const [actionLoading, setActionLoading] = useState<string | null>(null);
 
+  // Atualizações em tempo real; polling só enquanto o WebSocket estiver fora
+  const { connected } = useQueueStream('consultation', (data) => {
+    setConsultations({
+      waiting: data.waiting || [],
+      inProgress: data.in_progress || [],
+      completed: data.completed || []
+    });
+    setLoading(false);
+  });
+
   useEffect(() => {
     loadConsultations();
+    if (connected) return;
     // Auto-refresh a cada 30 segundos
     const interval = setInterval(loadConsultations, 30000);
     return () => clearInterval(interval);
-  }, []);
+  }, [connected]);
 
   const loadConsultations = async () => {
     try {
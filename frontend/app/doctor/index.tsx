@@ -28,6 +28,7 @@ import { Ionicons } from '@expo/vector-icons';
 import { useAuth } from '@/contexts/AuthContext';
 import { useColors } from '@/contexts/ThemeContext';
 import { api } from '@/services/api';
+import { useQueueStream } from '@/hooks/useQueueStream';
 import { COLORS } from '@/utils/constants';
 
 interface DashboardData {
@@ -93,12 +94,34 @@ export default function DoctorDashboardScreen() {
     }
   };
 
+  // Atualizações em tempo real das duas filas
+  const { connected: queueLive } = useQueueStream('doctor', (queue) => {
+    setData((prev) => prev && {
+      ...prev,
+      pending: queue.pending || [],
+      analyzing: queue.analyzing || [],
+      awaiting_payment: queue.awaiting_payment || [],
+      awaiting_signature: queue.awaiting_signature || [],
+      forwarded_from_nursing: queue.forwarded_from_nursing || [],
+    });
+  });
+  const { connected: consultationsLive } = useQueueStream('consultation', (queue) => {
+    setData((prev) => prev && {
+      ...prev,
+      consultations_waiting: queue.waiting || [],
+      consultations_in_progress: queue.in_progress || [],
+      consultations_completed: queue.completed || [],
+      today_completed: (queue.completed || []).length,
+    });
+  });
+
   useEffect(() => {
     loadDashboard();
-    // Auto-refresh a cada 30 segundos
+    if (queueLive && consultationsLive) return;
+    // Auto-refresh a cada 30 segundos enquanto o WebSocket estiver fora
     const interval = setInterval(loadDashboard, 30000);
     return () => clearInterval(interval);
-  }, []);
+  }, [queueLive && consultationsLive]);
 
   const onRefresh = useCallback(() => {
     setRefreshing(true);
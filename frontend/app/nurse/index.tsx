@@ -20,6 +20,7 @@ import { Ionicons } from '@expo/vector-icons';
 import { useAuth } from '@/contexts/AuthContext';
 import { useColors } from '@/contexts/ThemeContext';
 import { api } from '@/services/api';
+import { useQueueStream } from '@/hooks/useQueueStream';
 import { COLORS } from '@/utils/constants';
 
 export default function NurseDashboardScreen() {
@@ -44,11 +45,18 @@ export default function NurseDashboardScreen() {
     }
   };
 
+  // Atualizações em tempo real; polling só enquanto o WebSocket estiver fora
+  const { connected } = useQueueStream('nursing', (data) => {
+    setQueue(data.pending || []);
+    setLoading(false);
+  });
+
   useEffect(() => {
     loadQueue();
+    if (connected) return;
     const interval = setInterval(loadQueue, 30000);
     return () => clearInterval(interval);
-  }, []);
+  }, [connected]);
 
   const onRefresh = () => {
     setRefreshing(true);
@@ -161,6 +161,10 @@ export default function PaymentScreen() {
             [{ text: 'OK', onPress: () => router.replace('/(tabs)') }]
           );
         }, 500);
+      } else if (response.status === 'cancelled' || response.status === 'failed') {
+        // PIX vencido ou recusado no MercadoPago
+        stopPolling();
+        setPaymentStatus('expired');
       } else {
         setPaymentStatus('pending');
       }
@@ -98,10 +98,13 @@ export default function PatientRequestDetailScreen() {
     setCheckingPayment(true);
     try {
       const response = await api.checkPaymentStatus(payment.payment_id);
-      if (response.status === 'approved') {
+      if (response.status === 'approved' || response.status === 'completed') {
         Alert.alert('✅ Pagamento Confirmado!', 'Seu pagamento foi aprovado.');
         loadRequest();
         setPayment({ ...payment, status: 'approved' });
+      } else if (response.status === 'cancelled' || response.status === 'failed') {
+        // PIX vencido ou recusado: para de consultar
+        setPayment({ ...payment, status: response.status });
       }
     } catch (error) {
       console.error('Error checking payment:', error);
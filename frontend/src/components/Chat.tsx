@@ -16,6 +16,7 @@ import { ptBR } from 'date-fns/locale';
 import { COLORS, SIZES } from '../utils/constants';
 import { ChatMessage } from '../types';
 import { chatAPI } from '../services/api';
+import { mergeMessages, lastCursor } from '../utils/chat';
 import { useAuth } from '../contexts/AuthContext';
 
 interface ChatProps {
@@ -33,7 +34,8 @@ export function Chat({ requestId, patientName, doctorName, onBack }: ChatProps)
   const [isSending, setIsSending] = useState(false);
   const flatListRef = useRef<FlatList>(null);
   const pollIntervalRef = useRef<ReturnType<typeof setInterval> | null>(null);
-  const lastMessageCountRef = useRef<number>(0);
+  const messagesRef = useRef<ChatMessage[]>([]);
+  messagesRef.current = messages;
   const pollIntervalMs = useRef<number>(3000); // Start with 3 seconds
 
   useEffect(() => {
@@ -57,19 +59,20 @@ export function Chat({ requestId, patientName, doctorName, onBack }: ChatProps)
 
   const loadMessages = async () => {
     try {
-      const data = await chatAPI.getMessages(requestId);
+      // Only messages newer than the last one received
+      const after = lastCursor(messagesRef.current);
+      const data: ChatMessage[] = (await chatAPI.getMessages(requestId, after ? { after } : undefined)) || [];
       
       // Adaptive polling: slow down if no new messages
-      if (data.length === lastMessageCountRef.current) {
+      if (data.length === 0) {
         // No new messages, slow down polling (max 10 seconds)
         pollIntervalMs.current = Math.min(pollIntervalMs.current + 1000, 10000);
       } else {
         // New messages arrived, speed up polling
         pollIntervalMs.current = 3000;
-        lastMessageCountRef.current = data.length;
       }
       
-      setMessages(data);
+      setMessages((prev) => (after ? mergeMessages(prev, data) : data));
       // Mark messages as read
       if (data.length > 0) {
         await chatAPI.markAsRead(requestId).catch(() => {});
@@ -6,3 +6,5 @@
 export { useBiometrics } from './useBiometrics';
 export { usePushNotifications, scheduleLocalNotification, NotificationTemplates } from './usePushNotifications';
 export { useAudioRecorder, useAudioPlayer } from './useAudioRecorder';
+export { useQueueStream } from './useQueueStream';
+export { useChatSocket } from './useChatSocket';
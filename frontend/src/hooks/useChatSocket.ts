@@ -0,0 +1,126 @@
+/**
+ * 💬 Chat Socket Hook
+ * Chat em tempo real via WebSocket (/api/ws/chat/{requestId})
+ *
+ * Entrega mensagens, confirmação de envio, presença e "digitando...".
+ * Ao reconectar, pede as mensagens perdidas a partir do último cursor.
+ * Enquanto `connected` for false a tela continua no polling/HTTP.
+ */
+
+import { useCallback, useEffect, useRef, useState } from 'react';
+import { getToken } from '@/services/api';
+
+const API_URL = process.env.EXPO_PUBLIC_API_URL || 'http://localhost:8001';
+const WS_URL = API_URL.replace(/^http/, 'ws');
+const MAX_RECONNECT_DELAY = 30000;
+const TYPING_TIMEOUT = 5000;
+
+type PresenceUser = { user_id: string; name?: string };
+
+interface ChatSocketOptions {
+  onMessage: (message: any) => void;
+  getLastCursor?: () => string | undefined;
+}
+
+export function useChatSocket(requestId: string | undefined, { onMessage, getLastCursor }: ChatSocketOptions) {
+  const [connected, setConnected] = useState(false);
+  const [online, setOnline] = useState<PresenceUser[]>([]);
+  const [typing, setTyping] = useState<PresenceUser[]>([]);
+  const socketRef = useRef<WebSocket | null>(null);
+  const pendingRef = useRef<Map<string, { resolve: (m: any) => void; reject: (e: Error) => void }>>(new Map());
+  const optionsRef = useRef({ onMessage, getLastCursor });
+  optionsRef.current = { onMessage, getLastCursor };
+
+  useEffect(() => {
+    if (!requestId) return;
+    let retryDelay = 1000;
+    let retryTimer: ReturnType<typeof setTimeout> | null = null;
+    const typingTimers = new Map<string, ReturnType<typeof setTimeout>>();
+    let closed = false;
+
+    const connect = async () => {
+      const token = await getToken();
+      if (!token || closed) return;
+
+      const after = optionsRef.current.getLastCursor?.();
+      const query = `token=${encodeURIComponent(token)}${after ? `&after=${encodeURIComponent(after)}` : ''}`;
+      const socket = new WebSocket(`${WS_URL}/api/ws/chat/${requestId}?${query}`);
+      socketRef.current = socket;
+
+      socket.onopen = () => {
+        retryDelay = 1000;
+        setConnected(true);
+      };
+
+      socket.onmessage = (event) => {
+        const data = JSON.parse(event.data);
+        if (data.type === 'message') {
+          optionsRef.current.onMessage(data.message);
+        } else if (data.type === 'ack' || data.type === 'error') {
+          const pending = pendingRef.current.get(data.client_id);
+          pendingRef.current.delete(data.client_id);
+          if (data.type === 'ack') {
+            optionsRef.current.onMessage(data.message);
+            pending?.resolve(data.message);
+          } else {
+            pending?.reject(new Error(data.detail));
+          }
+        } else if (data.type === 'presence') {
+          setOnline(data.users || []);
+        } else if (data.type === 'typing') {
+          clearTimeout(typingTimers.get(data.user_id));
+          setTyping((prev) => prev.filter((u) => u.user_id !== data.user_id).concat(data.typing ? [data] : []));
+          if (data.typing) {
+            // Sem atualização em alguns segundos, considera que parou
+            typingTimers.set(data.user_id, setTimeout(() => {
+              setTyping((prev) => prev.filter((u) => u.user_id !== data.user_id));
+            }, TYPING_TIMEOUT));
+          }
+        }
+      };
+
+      socket.onclose = (event) => {
+        setConnected(false);
+        socketRef.current = null;
+        pendingRef.current.forEach((p) => p.reject(new Error('Conexão encerrada')));
+        pendingRef.current.clear();
+        // 4401/4403: sem acesso ao chat, não reconectar
+        if (closed || event.code === 4401 || event.code === 4403) return;
+        retryTimer = setTimeout(connect, retryDelay);
+        retryDelay = Math.min(retryDelay * 2, MAX_RECONNECT_DELAY);
+      };
+    };
+
+    connect();
+
+    return () => {
+      closed = true;
+      if (retryTimer) clearTimeout(retryTimer);
+      typingTimers.forEach((timer) => clearTimeout(timer));
+      socketRef.current?.close();
+    };
+  }, [requestId]);
+
+  /** Envia pelo socket; resolve com a mensagem gravada (ack do servidor) */
+  const sendMessage = useCallback((message: string) => {
+    return new Promise<any>((resolve, reject) => {
+      const socket = socketRef.current;
+      if (!socket || socket.readyState !== WebSocket.OPEN) {
+        reject(new Error('Chat desconectado'));
+        return;
+      }
+      const clientId = `tmp-${Date.now()}-${Math.random().toString(36).slice(2, 8)}`;
+      pendingRef.current.set(clientId, { resolve, reject });
+      socket.send(JSON.stringify({ type: 'message', client_id: clientId, message }));
+    });
+  }, []);
+
+  const sendTyping = useCallback((isTyping: boolean) => {
+    const socket = socketRef.current;
+    if (socket && socket.readyState === WebSocket.OPEN) {
+      socket.send(JSON.stringify({ type: 'typing', typing: isTyping }));
+    }
+  }, []);
+
+  return { connected, online, typing, sendMessage, sendTyping };
+}
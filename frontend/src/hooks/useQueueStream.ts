@@ -0,0 +1,82 @@
+/**
+ * 📡 Queue Stream Hook
+ * Filas de médico/enfermagem em tempo real via WebSocket (/api/ws/queue)
+ *
+ * Recebe um snapshot ao conectar e depois apenas deltas: cada delta remove
+ * o pedido de todas as listas e, se `bucket` vier preenchido, o insere nela.
+ * Enquanto desconectado, `connected` fica false e a tela volta ao polling.
+ */
+
+import { useEffect, useRef, useState } from 'react';
+import { getToken } from '@/services/api';
+
+const API_URL = process.env.EXPO_PUBLIC_API_URL || 'http://localhost:8001';
+const WS_URL = API_URL.replace(/^http/, 'ws');
+const MAX_RECONNECT_DELAY = 30000;
+
+export type QueueName = 'doctor' | 'nursing' | 'consultation';
+export type QueueBuckets = Record<string, any[]>;
+
+function applyDelta(queue: QueueBuckets, request: any, bucket: string | null): QueueBuckets {
+  const next: QueueBuckets = {};
+  for (const [name, items] of Object.entries(queue)) {
+    next[name] = items.filter((item) => item.id !== request.id);
+  }
+  if (bucket) {
+    next[bucket] = [...(next[bucket] || []), request];
+  }
+  return next;
+}
+
+export function useQueueStream(queue: QueueName, onChange: (buckets: QueueBuckets) => void) {
+  const [connected, setConnected] = useState(false);
+  const onChangeRef = useRef(onChange);
+  onChangeRef.current = onChange;
+
+  useEffect(() => {
+    let socket: WebSocket | null = null;
+    let buckets: QueueBuckets = {};
+    let retryDelay = 1000;
+    let retryTimer: ReturnType<typeof setTimeout> | null = null;
+    let closed = false;
+
+    const connect = async () => {
+      const token = await getToken();
+      if (!token || closed) return;
+
+      socket = new WebSocket(`${WS_URL}/api/ws/queue?token=${encodeURIComponent(token)}&queue=${queue}`);
+
+      socket.onmessage = (message) => {
+        const data = JSON.parse(message.data);
+        if (data.type === 'snapshot') {
+          buckets = data.queue;
+          retryDelay = 1000;
+          setConnected(true);
+        } else if (data.type === 'delta') {
+          buckets = applyDelta(buckets, data.request, data.bucket);
+        } else {
+          return;
+        }
+        onChangeRef.current(buckets);
+      };
+
+      socket.onclose = (event) => {
+        setConnected(false);
+        // 4401/4403: token inválido ou perfil sem acesso, não reconectar
+        if (closed || event.code === 4401 || event.code === 4403) return;
+        retryTimer = setTimeout(connect, retryDelay);
+        retryDelay = Math.min(retryDelay * 2, MAX_RECONNECT_DELAY);
+      };
+    };
+
+    connect();
+
+    return () => {
+      closed = true;
+      if (retryTimer) clearTimeout(retryTimer);
+      socket?.close();
+    };
+  }, [queue]);
+
+  return { connected };
+}
@@ -238,9 +238,10 @@ export const api = {
     return response.data;
   },
 
-  getChatMessages: async (requestId: string) => {
+  // Sem opções: página mais recente; `after` traz só as mensagens novas
+  getChatMessages: async (requestId: string, options?: { before?: string; after?: string; since?: string; limit?: number }) => {
     const params = await getAuthParams();
-    const response = await axiosInstance.get(`/chat/${requestId}`, { params });
+    const response = await axiosInstance.get(`/chat/${requestId}`, { params: { ...params, ...options } });
     return response.data;
   },
 
@@ -269,6 +270,13 @@ export const api = {
     return response.data;
   },
 
+  // Badge do app: { unread_count }
+  getUnreadNotificationCount: async () => {
+    const params = await getAuthParams();
+    const response = await axiosInstance.get('/notifications/unread-count', { params });
+    return response.data;
+  },
+
   markAllNotificationsAsRead: async () => {
     const params = await getAuthParams();
     const response = await axiosInstance.put('/notifications/read-all', null, { params });
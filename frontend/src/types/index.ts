@@ -140,6 +140,7 @@ export interface ChatMessage {
   message: string;
   read: boolean;
   created_at: string;
+  cursor?: string;
 }
 
 // Notification Types
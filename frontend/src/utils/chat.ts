@@ -0,0 +1,22 @@
+/**
+ * 💬 Chat helpers
+ * Sincronização incremental do histórico (GET /chat/{id}?after=<cursor>)
+ */
+
+type CursorMessage = { id: string; cursor?: string };
+
+/** Acrescenta mensagens novas sem duplicar (polls simultâneos, envio + poll) */
+export function mergeMessages<T extends CursorMessage>(current: T[], incoming: T[]): T[] {
+  if (!incoming?.length) return current;
+  const known = new Set(current.map((m) => m.id));
+  const fresh = incoming.filter((m) => !known.has(m.id));
+  return fresh.length ? [...current, ...fresh] : current;
+}
+
+/** Cursor da mensagem mais recente, para buscar só o que chegou depois */
+export function lastCursor<T extends CursorMessage>(messages: T[]): string | undefined {
+  for (let i = messages.length - 1; i >= 0; i--) {
+    if (messages[i].cursor) return messages[i].cursor;
+  }
+  return undefined;
+}
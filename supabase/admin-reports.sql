@@ -0,0 +1,78 @@
+-- ============================================
+-- RenoveJá+ - Relatórios administrativos por período
+-- Usado por backend/reports.py (/api/admin/reports)
+-- ============================================
+
+-- A avaliação é gravada pelo backend em requests.review ({rating, tags, comment})
+ALTER TABLE requests ADD COLUMN IF NOT EXISTS review JSONB;
+
+CREATE INDEX IF NOT EXISTS idx_payments_paid_at ON payments(paid_at) WHERE status = 'completed';
+
+-- Agrega solicitações criadas e pagamentos confirmados em [p_start, p_end).
+-- month_revenue usa a janela do mês corrente [p_month_start, p_month_end).
+CREATE OR REPLACE FUNCTION admin_report(
+    p_start TIMESTAMPTZ,
+    p_end TIMESTAMPTZ,
+    p_month_start TIMESTAMPTZ,
+    p_month_end TIMESTAMPTZ,
+    p_top_doctors INT DEFAULT 5
+)
+RETURNS JSONB AS $$
+WITH req AS (
+    SELECT request_type, status, doctor_id, doctor_name, created_at,
+           (review->>'rating')::NUMERIC AS rating
+    FROM requests
+    WHERE created_at >= p_start AND created_at < p_end
+),
+pay AS (
+    SELECT amount, COALESCE(paid_at, created_at) AS paid_at
+    FROM payments
+    WHERE status = 'completed'
+      AND COALESCE(paid_at, created_at) >= LEAST(p_start, p_month_start)
+      AND COALESCE(paid_at, created_at) < GREATEST(p_end, p_month_end)
+),
+daily AS (
+    SELECT day, SUM(requests) AS requests, SUM(revenue) AS revenue
+    FROM (
+        SELECT created_at::DATE AS day, COUNT(*) AS requests, 0::NUMERIC AS revenue
+        FROM req GROUP BY 1
+        UNION ALL
+        SELECT paid_at::DATE, 0, SUM(amount)
+        FROM pay WHERE paid_at >= p_start AND paid_at < p_end GROUP BY 1
+    ) d
+    GROUP BY day
+),
+doctors AS (
+    SELECT doctor_id, MAX(doctor_name) AS name, COUNT(*) AS consultations, AVG(rating) AS rating
+    FROM req
+    WHERE status = 'completed' AND doctor_id IS NOT NULL
+    GROUP BY doctor_id
+    ORDER BY consultations DESC
+    LIMIT p_top_doctors
+)
+SELECT jsonb_build_object(
+    'requests', jsonb_build_object(
+        'total', (SELECT COUNT(*) FROM req),
+        'by_type', COALESCE((SELECT jsonb_object_agg(request_type, n)
+                             FROM (SELECT request_type, COUNT(*) AS n FROM req GROUP BY 1) t), '{}'::JSONB),
+        'by_status', COALESCE((SELECT jsonb_object_agg(status, n)
+                               FROM (SELECT status, COUNT(*) AS n FROM req GROUP BY 1) s), '{}'::JSONB)
+    ),
+    'revenue', (SELECT jsonb_build_object('count', COUNT(*), 'amount', COALESCE(SUM(amount), 0))
+                FROM pay WHERE paid_at >= p_start AND paid_at < p_end),
+    'month_revenue', (SELECT COALESCE(SUM(amount), 0)
+                      FROM pay WHERE paid_at >= p_month_start AND paid_at < p_month_end),
+    'rating', (SELECT jsonb_build_object('count', COUNT(rating), 'sum', COALESCE(SUM(rating), 0)) FROM req),
+    'top_doctors', COALESCE((SELECT jsonb_agg(jsonb_build_object(
+                                 'doctor_id', doctor_id,
+                                 'name', name,
+                                 'consultations', consultations,
+                                 'rating', ROUND(COALESCE(rating, 0), 1)
+                             ) ORDER BY consultations DESC) FROM doctors), '[]'::JSONB),
+    'daily', COALESCE((SELECT jsonb_agg(jsonb_build_object(
+                           'date', to_char(day, 'YYYY-MM-DD'),
+                           'count', requests,
+                           'revenue', revenue
+                       ) ORDER BY day) FROM daily), '[]'::JSONB)
+);
+$$ LANGUAGE sql STABLE;
@@ -0,0 +1,40 @@
+-- ============================================
+-- RenoveJá+ - Rastreamento de alterações para backups incrementais
+-- Usado por backend/backup_manager.py (modos incremental e differential)
+-- ============================================
+
+-- Todas as tabelas do backup ganham updated_at mantido por trigger e um índice
+-- (updated_at, id), que é a chave de paginação do backup incremental.
+-- Tabelas que não existem neste banco são ignoradas.
+CREATE OR REPLACE FUNCTION update_updated_at_column()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.updated_at = NOW();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    v_table TEXT;
+BEGIN
+    FOREACH v_table IN ARRAY ARRAY[
+        'users', 'doctor_profiles', 'nurse_profiles',
+        'requests', 'payments', 'messages', 'notifications',
+        'ratings', 'prescriptions', 'exams', 'consultations'
+    ] LOOP
+        IF to_regclass('public.' || v_table) IS NULL THEN
+            CONTINUE;
+        END IF;
+
+        EXECUTE format('ALTER TABLE %I ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()', v_table);
+        EXECUTE format('CREATE INDEX IF NOT EXISTS %I ON %I (updated_at, id)', 'idx_' || v_table || '_updated_at_id', v_table);
+
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', 'update_' || v_table || '_updated_at', v_table);
+        EXECUTE format(
+            'CREATE TRIGGER %I BEFORE UPDATE ON %I FOR EACH ROW EXECUTE FUNCTION update_updated_at_column()',
+            'update_' || v_table || '_updated_at', v_table
+        );
+    END LOOP;
+END;
+$$;
@@ -0,0 +1,7 @@
+-- ============================================
+-- RenoveJá+ - Histórico do chat paginado por cursor
+-- Usado por backend/chat_history.py
+-- ============================================
+
+-- Páginas por (request_id, created_at, id) em qualquer direção são range scans
+CREATE INDEX IF NOT EXISTS idx_chat_request_created ON chat_messages(request_id, created_at, id);
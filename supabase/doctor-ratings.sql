@@ -0,0 +1,107 @@
+-- ============================================
+-- RenoveJá+ - Avaliações e médias incrementais dos médicos
+-- Usado por backend/ratings.py
+-- ============================================
+
+-- Agregados mantidos a cada avaliação (rating = rating_sum / rating_count)
+ALTER TABLE doctor_profiles ADD COLUMN IF NOT EXISTS rating_sum BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE doctor_profiles ADD COLUMN IF NOT EXISTS rating_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE doctor_profiles ADD COLUMN IF NOT EXISTS tag_counts JSONB NOT NULL DEFAULT '{}'::JSONB;
+
+-- Projeção das avaliações (uma por solicitação; id = request_id)
+CREATE TABLE IF NOT EXISTS reviews (
+    id UUID PRIMARY KEY REFERENCES requests(id) ON DELETE CASCADE,
+    doctor_id UUID REFERENCES users(id),
+    patient_id UUID REFERENCES users(id),
+    patient_name VARCHAR(255),
+    request_type VARCHAR(20),
+    rating SMALLINT NOT NULL CHECK (rating BETWEEN 1 AND 5),
+    tags JSONB NOT NULL DEFAULT '[]'::JSONB,
+    comment TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_reviews_doctor ON reviews(doctor_id, created_at DESC);
+
+-- Grava/substitui a avaliação de uma solicitação e ajusta os agregados do médico
+-- na mesma transação. Retorna a nota anterior (NULL se primeira avaliação).
+CREATE OR REPLACE FUNCTION apply_doctor_review(p_review JSONB)
+RETURNS JSONB AS $$
+DECLARE
+    v_previous reviews%ROWTYPE;
+    v_doctor_id UUID := NULLIF(p_review->>'doctor_id', '')::UUID;
+    v_rating INT := (p_review->>'rating')::INT;
+    v_tags JSONB := COALESCE(p_review->'tags', '[]'::JSONB);
+    v_tag_deltas JSONB;
+BEGIN
+    SELECT * INTO v_previous FROM reviews WHERE id = (p_review->>'id')::UUID FOR UPDATE;
+
+    INSERT INTO reviews (id, doctor_id, patient_id, patient_name, request_type, rating, tags, comment, created_at, updated_at)
+    VALUES (
+        (p_review->>'id')::UUID, v_doctor_id, NULLIF(p_review->>'patient_id', '')::UUID,
+        p_review->>'patient_name', p_review->>'request_type', v_rating, v_tags,
+        p_review->>'comment', COALESCE((p_review->>'created_at')::TIMESTAMPTZ, NOW()), NOW()
+    )
+    ON CONFLICT (id) DO UPDATE SET
+        rating = EXCLUDED.rating, tags = EXCLUDED.tags, comment = EXCLUDED.comment, updated_at = NOW();
+
+    UPDATE requests SET review = jsonb_build_object(
+        'rating', v_rating, 'tags', v_tags, 'comment', p_review->>'comment',
+        'reviewed_at', COALESCE(p_review->>'created_at', NOW()::TEXT)
+    ) WHERE id = (p_review->>'id')::UUID;
+
+    IF v_doctor_id IS NOT NULL THEN
+        -- +1 para as novas tags, -1 para as da avaliação substituída
+        SELECT COALESCE(jsonb_object_agg(tag, delta), '{}'::JSONB) INTO v_tag_deltas
+        FROM (
+            SELECT tag, SUM(delta) AS delta FROM (
+                SELECT jsonb_array_elements_text(v_tags) AS tag, 1 AS delta
+                UNION ALL
+                SELECT jsonb_array_elements_text(COALESCE(v_previous.tags, '[]'::JSONB)), -1
+            ) t GROUP BY tag HAVING SUM(delta) <> 0
+        ) d;
+
+        UPDATE doctor_profiles SET
+            rating_sum = rating_sum + v_rating - COALESCE(v_previous.rating, 0),
+            rating_count = rating_count + CASE WHEN v_previous.id IS NULL THEN 1 ELSE 0 END,
+            tag_counts = (
+                SELECT COALESCE(jsonb_object_agg(key, total), '{}'::JSONB)
+                FROM (
+                    SELECT key, SUM(value::INT) AS total
+                    FROM (SELECT * FROM jsonb_each_text(tag_counts) UNION ALL SELECT * FROM jsonb_each_text(v_tag_deltas)) e
+                    GROUP BY key HAVING SUM(value::INT) > 0
+                ) s
+            ),
+            updated_at = NOW()
+        WHERE user_id = v_doctor_id;
+
+        UPDATE doctor_profiles SET rating = ROUND(rating_sum::NUMERIC / rating_count, 2)
+        WHERE user_id = v_doctor_id AND rating_count > 0;
+    END IF;
+
+    RETURN jsonb_build_object('previous_rating', v_previous.rating);
+END;
+$$ LANGUAGE plpgsql;
+
+-- Substitui os agregados recalculados: [{doctor_id, rating_sum, rating_count, tag_counts}, ...]
+-- Médicos ausentes da lista voltam a zero avaliações e ficam sem nota (rating NULL).
+CREATE OR REPLACE FUNCTION replace_doctor_ratings(p_rows JSONB)
+RETURNS VOID AS $$
+BEGIN
+    UPDATE doctor_profiles dp SET
+        rating_sum = COALESCE(r.rating_sum, 0),
+        rating_count = COALESCE(r.rating_count, 0),
+        tag_counts = COALESCE(r.tag_counts, '{}'::JSONB),
+        rating = CASE WHEN COALESCE(r.rating_count, 0) > 0
+                      THEN ROUND(r.rating_sum::NUMERIC / r.rating_count, 2) ELSE NULL END,
+        updated_at = NOW()
+    FROM doctor_profiles base
+    LEFT JOIN jsonb_to_recordset(p_rows) AS r(doctor_id UUID, rating_sum BIGINT, rating_count INT, tag_counts JSONB)
+        ON r.doctor_id = base.user_id
+    WHERE dp.id = base.id;
+END;
+$$ LANGUAGE plpgsql;
+
+ALTER TABLE reviews ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "Service role full access" ON reviews FOR ALL USING (true);
@@ -0,0 +1,44 @@
+-- ============================================
+-- RenoveJá+ - Barramento de eventos entre workers (LISTEN/NOTIFY)
+-- Usado por backend/event_bus.py (EVENT_BUS_URL=postgresql://...)
+-- ============================================
+
+-- Log ordenado dos eventos; o NOTIFY leva só o id (limite de 8000 bytes)
+CREATE TABLE IF NOT EXISTS event_log (
+    id BIGSERIAL PRIMARY KEY,
+    event JSONB NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_event_log_created ON event_log(created_at);
+
+CREATE OR REPLACE FUNCTION publish_event(p_event JSONB, p_channel TEXT DEFAULT 'renoveja_events')
+RETURNS BIGINT AS $$
+DECLARE
+    v_id BIGINT;
+BEGIN
+    INSERT INTO event_log (event) VALUES (p_event) RETURNING id INTO v_id;
+    PERFORM pg_notify(p_channel, v_id::TEXT);
+    RETURN v_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Eventos antigos não são mais relidos; limpeza periódica, chamada pelos
+-- workers (PostgresBus, EVENT_BUS_PRUNE_SECONDS). O advisory lock deixa
+-- só um deles podar por vez; os demais retornam 0 na hora.
+CREATE OR REPLACE FUNCTION prune_event_log(p_keep INTERVAL DEFAULT INTERVAL '1 day')
+RETURNS INTEGER AS $$
+DECLARE
+    v_deleted INTEGER;
+BEGIN
+    IF NOT pg_try_advisory_xact_lock(hashtext('prune_event_log')) THEN
+        RETURN 0;
+    END IF;
+    DELETE FROM event_log WHERE created_at < NOW() - p_keep;
+    GET DIAGNOSTICS v_deleted = ROW_COUNT;
+    RETURN v_deleted;
+END;
+$$ LANGUAGE plpgsql;
+
+ALTER TABLE event_log ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "Service role full access" ON event_log FOR ALL USING (true);
@@ -0,0 +1,43 @@
+-- ============================================
+-- RenoveJá+ - Trava de jobs em segundo plano
+-- Usado por backend/job_locks.py
+-- ============================================
+
+-- Uma linha por job; quem a detém até expires_at roda o job, os outros workers pulam
+CREATE TABLE IF NOT EXISTS job_locks (
+    name VARCHAR(100) PRIMARY KEY,
+    holder VARCHAR(100) NOT NULL,
+    acquired_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+-- TRUE quando p_holder ficou com a trava: ela estava livre, expirada ou já era dele.
+-- A trava expira sozinha (p_ttl_seconds) se o worker morrer sem liberá-la.
+CREATE OR REPLACE FUNCTION try_acquire_job_lock(p_name TEXT, p_holder TEXT, p_ttl_seconds INTEGER)
+RETURNS BOOLEAN AS $$
+DECLARE
+    v_acquired INTEGER;
+BEGIN
+    INSERT INTO job_locks (name, holder, acquired_at, expires_at)
+    VALUES (p_name, p_holder, NOW(), NOW() + make_interval(secs => p_ttl_seconds))
+    ON CONFLICT (name) DO UPDATE
+    SET holder = EXCLUDED.holder,
+        acquired_at = EXCLUDED.acquired_at,
+        expires_at = EXCLUDED.expires_at
+    WHERE job_locks.expires_at < NOW() OR job_locks.holder = EXCLUDED.holder;
+    GET DIAGNOSTICS v_acquired = ROW_COUNT;
+    RETURN v_acquired > 0;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Libera a trava, se ainda for de p_holder
+CREATE OR REPLACE FUNCTION release_job_lock(p_name TEXT, p_holder TEXT)
+RETURNS BOOLEAN AS $$
+    WITH released AS (
+        DELETE FROM job_locks WHERE name = p_name AND holder = p_holder RETURNING 1
+    )
+    SELECT EXISTS (SELECT 1 FROM released);
+$$ LANGUAGE sql;
+
+ALTER TABLE job_locks ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "Service role full access" ON job_locks FOR ALL USING (true);
@@ -0,0 +1,24 @@
+-- ============================================
+-- RenoveJá+ - Retenção de notificações
+-- Usado por backend/notification_retention.py
+-- ============================================
+
+-- Lista do usuário (GET /api/notifications: user_id + created_at desc)
+CREATE INDEX IF NOT EXISTS idx_notifications_user_created ON notifications(user_id, created_at DESC, id DESC);
+
+-- Varredura das lidas antigas, na ordem do keyset (created_at, id)
+CREATE INDEX IF NOT EXISTS idx_notifications_read_created ON notifications(created_at, id) WHERE read = true;
+
+-- Notificações de cada usuário além das p_max_per_user mais recentes (mais antigas primeiro)
+CREATE OR REPLACE FUNCTION notification_overflow(p_max_per_user INTEGER, p_limit INTEGER DEFAULT 1000)
+RETURNS SETOF notifications AS $$
+    SELECT n.*
+    FROM (
+        SELECT id, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY created_at DESC, id DESC) AS position
+        FROM notifications
+    ) ranked
+    JOIN notifications n ON n.id = ranked.id
+    WHERE ranked.position > p_max_per_user
+    ORDER BY n.created_at, n.id
+    LIMIT p_limit;
+$$ LANGUAGE sql STABLE;
@@ -0,0 +1,153 @@
+-- ============================================
+-- RenoveJá+ - Conclusão de pagamentos em uma única transação
+-- Usado por backend/payment_completion.py
+-- ============================================
+
+-- Efeitos de cada pagamento concluído (estatísticas, notificações, eventos),
+-- gravados na mesma transação que conclui o pagamento (transactional outbox).
+-- Os workers de backend/payment_completion.py (PaymentOutbox) aplicam cada
+-- linha uma vez, mesmo se o processo cair logo depois do COMMIT.
+CREATE TABLE IF NOT EXISTS payment_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    payment_id UUID NOT NULL,
+    event JSONB NOT NULL, -- {payment, request, previous_request}
+    status VARCHAR(20) NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'processing', 'done', 'failed')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    available_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    locked_until TIMESTAMP WITH TIME ZONE,
+    claim_token UUID,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    processed_at TIMESTAMP WITH TIME ZONE
+);
+
+CREATE INDEX IF NOT EXISTS idx_payment_outbox_open ON payment_outbox(available_at) WHERE status IN ('pending', 'processing');
+CREATE INDEX IF NOT EXISTS idx_payment_outbox_done ON payment_outbox(created_at) WHERE status = 'done';
+
+-- Conclui um lote de pagamentos: pagamento -> completed e solicitação -> paid.
+-- O UPDATE condicional (status <> 'completed') trava a linha do pagamento, então
+-- chamadas simultâneas (webhook + conciliação) não concluem o mesmo pagamento
+-- duas vezes: só quem concluiu recebe a linha de volta.
+-- Só solicitações em p_payable_statuses (origens da transição "pay" em
+-- backend/request_state.py) vão para 'paid'; as demais (rejeitada, cancelada,
+-- já assinada...) ficam como estão.
+--
+-- p_payments: [{payment_id, paid_at, mp_status, mp_status_detail}]
+-- Retorna [{payment, request, previous_request}] dos pagamentos concluídos agora;
+-- previous_request é NULL quando a solicitação não mudou de status. Cada item
+-- também vira uma linha de payment_outbox, na mesma transação.
+DROP FUNCTION IF EXISTS complete_payments(JSONB, TEXT[]);
+CREATE OR REPLACE FUNCTION complete_payments(
+    p_payments JSONB,
+    p_payable_statuses TEXT[] DEFAULT ARRAY[
+        'approved_pending_payment', 'approved_by_nursing_pending_payment', 'pending_payment', 'submitted', 'pending'
+    ]
+)
+RETURNS JSONB AS $$
+DECLARE
+    v_item RECORD;
+    v_payment payments%ROWTYPE;
+    v_previous requests%ROWTYPE;
+    v_request requests%ROWTYPE;
+    v_found BOOLEAN;
+    v_entry JSONB;
+    v_result JSONB := '[]'::JSONB;
+BEGIN
+    -- Ordem fixa de travas entre lotes concorrentes
+    FOR v_item IN
+        SELECT * FROM jsonb_to_recordset(p_payments)
+            AS x(payment_id UUID, paid_at TIMESTAMPTZ, mp_status TEXT, mp_status_detail TEXT)
+        ORDER BY payment_id
+    LOOP
+        UPDATE payments SET
+            status = 'completed',
+            paid_at = COALESCE(v_item.paid_at, NOW()),
+            mp_status = COALESCE(v_item.mp_status, mp_status),
+            mp_status_detail = COALESCE(v_item.mp_status_detail, mp_status_detail)
+        WHERE id = v_item.payment_id AND status <> 'completed'
+        RETURNING * INTO v_payment;
+        IF NOT FOUND THEN
+            CONTINUE;
+        END IF;
+
+        SELECT * INTO v_previous FROM requests WHERE id = v_payment.request_id FOR UPDATE;
+        v_found := FOUND;
+        IF v_found AND v_previous.status = ANY(p_payable_statuses) THEN
+            UPDATE requests SET status = 'paid', paid_at = NOW(), updated_at = NOW()
+            WHERE id = v_previous.id
+            RETURNING * INTO v_request;
+            v_entry := jsonb_build_object(
+                'payment', to_jsonb(v_payment),
+                'request', to_jsonb(v_request),
+                'previous_request', to_jsonb(v_previous)
+            );
+        ELSE
+            v_entry := jsonb_build_object(
+                'payment', to_jsonb(v_payment),
+                'request', CASE WHEN v_found THEN to_jsonb(v_previous) END,
+                'previous_request', NULL
+            );
+        END IF;
+        INSERT INTO payment_outbox (payment_id, event) VALUES (v_payment.id, v_entry);
+        v_result := v_result || jsonb_build_array(v_entry);
+    END LOOP;
+    RETURN v_result;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Reivindica até p_limit linhas do outbox (SKIP LOCKED: vários workers em paralelo).
+-- Cada claim conta uma tentativa e grava p_token, como em claim_webhook_events.
+CREATE OR REPLACE FUNCTION claim_payment_outbox(p_token UUID, p_limit INTEGER DEFAULT 20, p_lease_seconds INTEGER DEFAULT 120)
+RETURNS SETOF payment_outbox AS $$
+BEGIN
+    RETURN QUERY
+    WITH available AS (
+        SELECT id
+        FROM payment_outbox
+        WHERE (status = 'pending' AND available_at <= NOW())
+           OR (status = 'processing' AND locked_until < NOW())
+        ORDER BY id
+        LIMIT p_limit
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE payment_outbox o
+    SET status = 'processing',
+        locked_until = NOW() + make_interval(secs => p_lease_seconds),
+        claim_token = p_token,
+        attempts = o.attempts + 1
+    FROM available a
+    WHERE o.id = a.id
+    RETURNING o.*;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Aplica os efeitos de uma linha e a marca como done, tudo na mesma transação:
+-- notificações, deltas de estatística (apply_stats_deltas) e badges
+-- (bump_unread_counters). FALSE, sem aplicar nada, se o claim não é mais de p_token.
+CREATE OR REPLACE FUNCTION finish_payment_outbox(
+    p_id BIGINT,
+    p_token UUID,
+    p_notifications JSONB,
+    p_stats_deltas JSONB,
+    p_unread_deltas JSONB
+)
+RETURNS BOOLEAN AS $$
+BEGIN
+    UPDATE payment_outbox
+    SET status = 'done', processed_at = NOW(), locked_until = NULL, last_error = NULL
+    WHERE id = p_id AND claim_token = p_token AND status = 'processing';
+    IF NOT FOUND THEN
+        RETURN FALSE;
+    END IF;
+
+    INSERT INTO notifications
+    SELECT * FROM jsonb_populate_recordset(NULL::notifications, p_notifications)
+    ON CONFLICT (id) DO NOTHING;
+    PERFORM apply_stats_deltas(p_stats_deltas);
+    PERFORM bump_unread_counters(p_unread_deltas);
+    RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql;
+
+ALTER TABLE payment_outbox ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "Service role full access" ON payment_outbox FOR ALL USING (true);
@@ -0,0 +1,12 @@
+-- ============================================
+-- RenoveJá+ - Conciliação de pagamentos com o MercadoPago
+-- Usado por backend/payment_reconciliation.py
+-- ============================================
+
+-- Último status visto no MercadoPago (webhook ou conciliação)
+ALTER TABLE payments ADD COLUMN IF NOT EXISTS mp_status VARCHAR(30);
+ALTER TABLE payments ADD COLUMN IF NOT EXISTS mp_status_detail VARCHAR(100);
+
+-- Varredura dos PIX reais pendentes, na ordem do keyset (created_at, id)
+CREATE INDEX IF NOT EXISTS idx_payments_pending_real ON payments(created_at, id)
+    WHERE status = 'pending' AND is_real_payment = true;
@@ -0,0 +1,70 @@
+-- ============================================
+-- RenoveJá+ - Distribuição automática da fila em lote
+-- Usado por backend/queue_manager.py (assignment_engine)
+-- ============================================
+
+CREATE INDEX IF NOT EXISTS idx_requests_unassigned ON requests(created_at)
+    WHERE doctor_id IS NULL AND status IN ('submitted', 'pending');
+
+-- Aplica um lote de atribuições [{request_id, doctor_id, doctor_name}, ...] em um UPDATE.
+-- Só atribui pedidos que continuam sem médico e em um dos p_from_statuses;
+-- pedidos bloqueados por outra transação são ignorados (entram no próximo lote).
+-- A capacidade é conferida aqui, não no índice em memória de cada worker: os
+-- perfis dos médicos do lote ficam travados (FOR UPDATE) enquanto os casos em
+-- p_active_statuses são contados, e cada médico recebe no máximo
+-- max_concurrent_cases - ativos pedidos, na ordem do lote. Médicos marcados
+-- como indisponíveis não recebem nenhum, mesmo que o índice ainda não saiba.
+DROP FUNCTION IF EXISTS assign_requests_bulk(JSONB, TEXT[]);
+
+CREATE OR REPLACE FUNCTION assign_requests_bulk(p_assignments JSONB, p_from_statuses TEXT[], p_active_statuses TEXT[])
+RETURNS TABLE(request_id UUID, doctor_id UUID, previous_status TEXT) AS $$
+#variable_conflict use_column
+BEGIN
+    -- Serializa lotes concorrentes (outros workers/agendadores) para os mesmos médicos
+    PERFORM 1 FROM doctor_profiles dp
+    WHERE dp.user_id IN (SELECT (a->>'doctor_id')::UUID FROM jsonb_array_elements(p_assignments) a)
+    ORDER BY dp.user_id
+    FOR UPDATE;
+
+    -- Nova instrução, novo snapshot: a contagem já vê o que os lotes anteriores gravaram
+    RETURN QUERY
+    WITH batch AS (
+        SELECT * FROM jsonb_to_recordset(p_assignments) WITH ORDINALITY
+            AS a(request_id UUID, doctor_id UUID, doctor_name TEXT, ord BIGINT)
+    ),
+    locked AS (
+        SELECT r.id, r.status, b.doctor_id, b.ord
+        FROM requests r
+        JOIN batch b ON b.request_id = r.id
+        WHERE r.doctor_id IS NULL AND r.status = ANY(p_from_statuses)
+        FOR UPDATE OF r SKIP LOCKED
+    ),
+    free AS (
+        SELECT dp.user_id, COALESCE(dp.max_concurrent_cases, 5) - (
+            SELECT COUNT(*) FROM requests a
+            WHERE a.doctor_id = dp.user_id AND a.status = ANY(p_active_statuses)
+        ) AS slots
+        FROM doctor_profiles dp
+        WHERE dp.user_id IN (SELECT doctor_id FROM batch)
+          AND COALESCE(dp.available, TRUE)
+    ),
+    allowed AS (
+        SELECT l.id, l.status
+        FROM (
+            SELECT locked.*, ROW_NUMBER() OVER (PARTITION BY locked.doctor_id ORDER BY locked.ord) AS n
+            FROM locked
+        ) l
+        JOIN free f ON f.user_id = l.doctor_id
+        WHERE l.n <= f.slots
+    )
+    UPDATE requests r SET
+        doctor_id = b.doctor_id,
+        doctor_name = b.doctor_name,
+        status = 'analyzing',
+        assigned_at = NOW(),
+        updated_at = NOW()
+    FROM batch b, allowed l
+    WHERE r.id = b.request_id AND l.id = r.id
+    RETURNING r.id, r.doctor_id, l.status;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,79 @@
+-- ============================================
+-- RenoveJá+ - Transições de status com concorrência otimista
+-- Usado por backend/request_state.py
+-- ============================================
+
+-- Aplica uma transição em uma única instrução: trava a linha, confere o status
+-- de origem e o responsável (p_owner_field = 'doctor_id' / 'nurse_id') e grava
+-- p_patch + status. Quem chegar depois recebe matched = false.
+-- Um patch com consultation_ended_at ganha consultation_duration_minutes,
+-- calculado com o consultation_started_at da linha travada.
+--
+-- Retorna {matched, reason ('not_found' | 'status' | 'owner'),
+--          previous_status, previous_doctor_id, request (linha atualizada)}.
+CREATE OR REPLACE FUNCTION transition_request(
+    p_request_id UUID,
+    p_to_status TEXT,
+    p_from_statuses TEXT[] DEFAULT NULL,
+    p_patch JSONB DEFAULT '{}'::JSONB,
+    p_owner_field TEXT DEFAULT NULL,
+    p_owner_id UUID DEFAULT NULL,
+    p_allow_unassigned BOOLEAN DEFAULT FALSE
+)
+RETURNS JSONB AS $$
+DECLARE
+    v_previous requests%ROWTYPE;
+    v_updated requests%ROWTYPE;
+    v_owner TEXT;
+    v_patch JSONB;
+    v_sets TEXT;
+BEGIN
+    SELECT * INTO v_previous FROM requests WHERE id = p_request_id FOR UPDATE;
+    IF NOT FOUND THEN
+        RETURN jsonb_build_object('matched', FALSE, 'reason', 'not_found');
+    END IF;
+
+    IF p_from_statuses IS NOT NULL AND NOT (v_previous.status = ANY(p_from_statuses)) THEN
+        RETURN jsonb_build_object('matched', FALSE, 'reason', 'status', 'current_status', v_previous.status);
+    END IF;
+
+    IF p_owner_field IS NOT NULL THEN
+        v_owner := to_jsonb(v_previous) ->> p_owner_field;
+        IF v_owner IS DISTINCT FROM p_owner_id::TEXT AND NOT (p_allow_unassigned AND v_owner IS NULL) THEN
+            RETURN jsonb_build_object('matched', FALSE, 'reason', 'owner', 'current_status', v_previous.status);
+        END IF;
+    END IF;
+
+    -- Só as colunas presentes no patch são gravadas (chaves desconhecidas são ignoradas)
+    v_patch := COALESCE(p_patch, '{}'::JSONB) || jsonb_build_object('status', p_to_status, 'updated_at', NOW());
+    IF v_patch ? 'consultation_ended_at' AND v_previous.consultation_started_at IS NOT NULL THEN
+        v_patch := v_patch || jsonb_build_object('consultation_duration_minutes', GREATEST(0, FLOOR(
+            EXTRACT(EPOCH FROM (v_patch->>'consultation_ended_at')::TIMESTAMPTZ - v_previous.consultation_started_at) / 60
+        ))::INT);
+    END IF;
+    SELECT string_agg(format('%I = ($1).%I', c.column_name, c.column_name), ', ') INTO v_sets
+    FROM information_schema.columns c
+    WHERE c.table_schema = 'public' AND c.table_name = 'requests' AND v_patch ? c.column_name;
+
+    EXECUTE format('UPDATE requests SET %s WHERE id = $2 RETURNING *', v_sets)
+        INTO v_updated
+        USING jsonb_populate_record(v_previous, v_patch), p_request_id;
+
+    RETURN jsonb_build_object(
+        'matched', TRUE,
+        'previous_status', v_previous.status,
+        'previous_doctor_id', v_previous.doctor_id,
+        'request', to_jsonb(v_updated)
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+-- Soma uma consulta concluída ao perfil do médico sem ler-modificar-gravar
+CREATE OR REPLACE FUNCTION increment_doctor_consultations(p_doctor_id UUID)
+RETURNS INTEGER AS $$
+    UPDATE doctor_profiles SET
+        total_consultations = COALESCE(total_consultations, 0) + 1,
+        updated_at = NOW()
+    WHERE user_id = p_doctor_id
+    RETURNING total_consultations;
+$$ LANGUAGE sql;
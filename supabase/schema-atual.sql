@@ -204,6 +204,7 @@ CREATE TABLE IF NOT EXISTS public.chat_messages (
 );
 
 CREATE INDEX IF NOT EXISTS idx_chat_messages_request_id ON public.chat_messages(request_id);
+CREATE INDEX IF NOT EXISTS idx_chat_request_created ON public.chat_messages(request_id, created_at, id);
 CREATE INDEX IF NOT EXISTS idx_chat_messages_sender_id ON public.chat_messages(sender_id);
 
 ALTER TABLE public.chat_messages ENABLE ROW LEVEL SECURITY;
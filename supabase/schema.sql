@@ -183,6 +183,7 @@ CREATE TABLE IF NOT EXISTS chat_messages (
 );
 
 CREATE INDEX IF NOT EXISTS idx_chat_request ON chat_messages(request_id);
+CREATE INDEX IF NOT EXISTS idx_chat_request_created ON chat_messages(request_id, created_at, id);
 CREATE INDEX IF NOT EXISTS idx_chat_sender ON chat_messages(sender_id);
 CREATE INDEX IF NOT EXISTS idx_chat_created ON chat_messages(created_at);
 
@@ -257,6 +257,7 @@ CREATE TABLE chat_messages (
 
 -- Índices
 CREATE INDEX idx_chat_request ON chat_messages(request_id);
+CREATE INDEX idx_chat_request_created ON chat_messages(request_id, created_at, id);
 CREATE INDEX idx_chat_sender ON chat_messages(sender_id);
 CREATE INDEX idx_chat_created ON chat_messages(created_at DESC);
 
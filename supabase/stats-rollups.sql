@@ -0,0 +1,52 @@
+-- ============================================
+-- RenoveJá+ - Estatísticas pré-agregadas (rollups)
+-- Usado por backend/stats_rollup.py
+-- ============================================
+
+-- Uma linha por (dia, dimensão, bucket). day = 'YYYY-MM-DD' ou 'all'
+CREATE TABLE IF NOT EXISTS stats_rollups (
+    id VARCHAR(300) PRIMARY KEY, -- "<day>|<dimension>|<bucket>"
+    day VARCHAR(10) NOT NULL,
+    dimension VARCHAR(20) NOT NULL,
+    bucket VARCHAR(255) NOT NULL,
+    label VARCHAR(255),
+    count BIGINT NOT NULL DEFAULT 0,
+    amount DECIMAL(14,2) NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_stats_rollups_day ON stats_rollups(day, dimension);
+
+-- Aplica deltas de forma atômica: [{day, dimension, bucket, count, amount, label}, ...]
+CREATE OR REPLACE FUNCTION apply_stats_deltas(p_deltas JSONB)
+RETURNS VOID AS $$
+BEGIN
+    INSERT INTO stats_rollups AS s (id, day, dimension, bucket, label, count, amount, updated_at)
+    SELECT
+        d.day || '|' || d.dimension || '|' || d.bucket,
+        d.day, d.dimension, d.bucket,
+        MAX(d.label),
+        SUM(d.count),
+        SUM(d.amount),
+        NOW()
+    FROM jsonb_to_recordset(p_deltas) AS d(day TEXT, dimension TEXT, bucket TEXT, label TEXT, count BIGINT, amount DECIMAL)
+    GROUP BY d.day, d.dimension, d.bucket
+    ON CONFLICT (id) DO UPDATE SET
+        count = s.count + EXCLUDED.count,
+        amount = s.amount + EXCLUDED.amount,
+        label = COALESCE(EXCLUDED.label, s.label),
+        updated_at = NOW();
+END;
+$$ LANGUAGE plpgsql;
+
+-- Substitui todos os rollups (usado pela reconstrução periódica)
+CREATE OR REPLACE FUNCTION replace_stats_rollups(p_rows JSONB)
+RETURNS VOID AS $$
+BEGIN
+    DELETE FROM stats_rollups WHERE TRUE;
+    PERFORM apply_stats_deltas(p_rows);
+END;
+$$ LANGUAGE plpgsql;
+
+ALTER TABLE stats_rollups ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "Service role full access" ON stats_rollups FOR ALL USING (true);
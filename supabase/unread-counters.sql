@@ -0,0 +1,46 @@
+-- ============================================
+-- RenoveJá+ - Contadores de não lidas (chat e notificações)
+-- Usado por backend/unread_counters.py
+-- ============================================
+
+-- Uma linha por (usuário, escopo, chave): scope 'chat' + request_id, ou 'notifications' + ''
+CREATE TABLE IF NOT EXISTS unread_counters (
+    user_id UUID NOT NULL,
+    scope VARCHAR(20) NOT NULL,
+    key VARCHAR(255) NOT NULL DEFAULT '',
+    count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (user_id, scope, key)
+);
+
+-- Aplica incrementos (ou decrementos) de forma atômica: [{user_id, scope, key, delta}, ...]
+CREATE OR REPLACE FUNCTION bump_unread_counters(p_deltas JSONB)
+RETURNS VOID AS $$
+DECLARE
+    d RECORD;
+BEGIN
+    FOR d IN
+        SELECT x.user_id, x.scope, COALESCE(x.key, '') AS key, SUM(COALESCE(x.delta, 1)) AS delta
+        FROM jsonb_to_recordset(p_deltas) AS x(user_id UUID, scope TEXT, key TEXT, delta INTEGER)
+        GROUP BY x.user_id, x.scope, COALESCE(x.key, '')
+        ORDER BY 1, 2, 3  -- ordem fixa de bloqueio entre chamadas concorrentes
+    LOOP
+        INSERT INTO unread_counters AS u (user_id, scope, key, count, updated_at)
+        VALUES (d.user_id, d.scope, d.key, GREATEST(0, d.delta), NOW())
+        ON CONFLICT (user_id, scope, key) DO UPDATE SET
+            count = GREATEST(0, u.count + d.delta),
+            updated_at = NOW();
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Contagem inicial a partir das notificações existentes (o chat começa zerado)
+INSERT INTO unread_counters (user_id, scope, key, count)
+SELECT user_id, 'notifications', '', COUNT(*)
+FROM notifications
+WHERE read = false
+GROUP BY user_id
+ON CONFLICT (user_id, scope, key) DO UPDATE SET count = EXCLUDED.count;
+
+ALTER TABLE unread_counters ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "Service role full access" ON unread_counters FOR ALL USING (true);
@@ -0,0 +1,84 @@
+-- ============================================
+-- RenoveJá+ - Caixa de entrada de webhooks (MercadoPago)
+-- Usado por backend/webhook_inbox.py
+-- ============================================
+
+-- Um evento por (provedor, data.id, x-request-id)
+CREATE TABLE IF NOT EXISTS webhook_inbox (
+    id VARCHAR(300) PRIMARY KEY, -- "<provider>:<resource_id>:<request_id>"
+    provider VARCHAR(30) NOT NULL,
+    resource_id VARCHAR(100) NOT NULL,
+    request_id VARCHAR(200) NOT NULL,
+    topic VARCHAR(50),
+    payload JSONB DEFAULT '{}',
+    status VARCHAR(20) NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'processing', 'done', 'failed')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    received_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    available_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    locked_until TIMESTAMP WITH TIME ZONE,
+    claim_token UUID, -- muda a cada claim; o resultado só é gravado com o token atual
+    processed_at TIMESTAMP WITH TIME ZONE
+);
+
+ALTER TABLE webhook_inbox ADD COLUMN IF NOT EXISTS claim_token UUID;
+
+-- Só os eventos ainda em aberto entram no índice da fila
+CREATE INDEX IF NOT EXISTS idx_webhook_inbox_open ON webhook_inbox(provider, available_at) WHERE status IN ('pending', 'processing');
+CREATE INDEX IF NOT EXISTS idx_webhook_inbox_resource ON webhook_inbox(provider, resource_id) WHERE status IN ('pending', 'processing');
+CREATE INDEX IF NOT EXISTS idx_webhook_inbox_done ON webhook_inbox(received_at) WHERE status = 'done';
+
+-- Grava o evento; FALSE quando ele já estava na caixa (reentrega)
+CREATE OR REPLACE FUNCTION enqueue_webhook_event(p_event JSONB)
+RETURNS BOOLEAN AS $$
+DECLARE
+    v_inserted INTEGER;
+BEGIN
+    INSERT INTO webhook_inbox (id, provider, resource_id, request_id, topic, payload)
+    VALUES (
+        p_event->>'id', p_event->>'provider', p_event->>'resource_id',
+        p_event->>'request_id', p_event->>'topic', COALESCE(p_event->'payload', '{}')
+    )
+    ON CONFLICT (id) DO NOTHING;
+    GET DIAGNOSTICS v_inserted = ROW_COUNT;
+    RETURN v_inserted > 0;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Reivindica até p_limit recursos (pagamentos) com todos os seus eventos disponíveis.
+-- SKIP LOCKED deixa vários workers drenarem a fila sem pegar o mesmo evento.
+-- Cada claim conta uma tentativa (também quando o lease anterior expirou) e grava
+-- p_token: o worker só grava o resultado WHERE claim_token = p_token.
+DROP FUNCTION IF EXISTS claim_webhook_events(TEXT, INTEGER, INTEGER);
+CREATE OR REPLACE FUNCTION claim_webhook_events(p_provider TEXT, p_token UUID, p_limit INTEGER DEFAULT 10, p_lease_seconds INTEGER DEFAULT 60)
+RETURNS SETOF webhook_inbox AS $$
+BEGIN
+    RETURN QUERY
+    WITH available AS (
+        SELECT id, resource_id, received_at
+        FROM webhook_inbox
+        WHERE provider = p_provider
+          AND ((status = 'pending' AND available_at <= NOW())
+               OR (status = 'processing' AND locked_until < NOW()))
+        FOR UPDATE SKIP LOCKED
+    ),
+    resources AS (
+        SELECT resource_id
+        FROM available
+        GROUP BY resource_id
+        ORDER BY MIN(received_at)
+        LIMIT p_limit
+    )
+    UPDATE webhook_inbox w
+    SET status = 'processing',
+        locked_until = NOW() + make_interval(secs => p_lease_seconds),
+        claim_token = p_token,
+        attempts = w.attempts + 1
+    FROM available a
+    WHERE w.id = a.id AND a.resource_id IN (SELECT resource_id FROM resources)
+    RETURNING w.*;
+END;
+$$ LANGUAGE plpgsql;
+
+ALTER TABLE webhook_inbox ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "Service role full access" ON webhook_inbox FOR ALL USING (true);